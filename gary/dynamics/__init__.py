@@ -4,3 +4,5 @@ from .actionangle import *
 from .nonlinear import *
 from .plot import *
 from .naff import *
+from .mockstream import *
+from .perturbers import *
@@ -0,0 +1,153 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Leapfrog integration of tidal stream particles released from a progenitor. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+from libc.stdlib cimport malloc, free
+
+# Project
+from ..potential.cpotential cimport _CPotential
+from ..integrate.core import _run_threaded
+
+cdef extern from "math.h":
+    double sqrt(double x) nogil
+
+cdef void c_stream_gradient(_CPotential p, int ndim, double *x, double *x_prog,
+                            double Gm, double b2, double *grad) nogil:
+    """ Gradient of the external potential plus the potential of the
+        progenitor, a Plummer sphere with mass ``Gm/G`` and scale radius
+        ``sqrt(b2)`` at ``x_prog``.
+    """
+    cdef:
+        int k
+        double r2 = b2
+        double fac
+
+    for k in range(ndim):
+        grad[k] = 0.
+    p._gradient(x, grad)
+
+    if Gm == 0.:
+        return
+
+    for k in range(ndim):
+        r2 += (x[k] - x_prog[k])*(x[k] - x_prog[k])
+
+    fac = Gm / (r2*sqrt(r2))
+    for k in range(ndim):
+        grad[k] += fac * (x[k] - x_prog[k])
+
+cdef int c_stream_orbits(_CPotential p, int ndim, int nsteps, double dt,
+                         double[:,::1] w0, int[::1] release_step,
+                         double[:,::1] prog_x, double Gm, double b2,
+                         int i1, int i2, double[:,::1] out_w) nogil:
+    """ Leapfrog integrate each particle in ``w0[i1:i2]`` from the step at
+        which it is released to the last step, in the same way as
+        `~gary.integrate._leapfrog.cy_leapfrog_run`, and save its final state
+        to ``out_w``. The progenitor positions at every step are ``prog_x``.
+        Returns -1 if the scratch space couldn't be allocated.
+    """
+    cdef:
+        int i,j,k
+        double *x = <double*>malloc(ndim*sizeof(double))
+        double *v = <double*>malloc(ndim*sizeof(double))
+        double *v_jm1_2 = <double*>malloc(ndim*sizeof(double))
+        double *grad = <double*>malloc(ndim*sizeof(double))
+
+    if x == NULL or v == NULL or v_jm1_2 == NULL or grad == NULL:
+        free(x)
+        free(v)
+        free(v_jm1_2)
+        free(grad)
+        return -1
+
+    for i in range(i1, i2):
+        for k in range(ndim):
+            x[k] = w0[i,k]
+            v[k] = w0[i,ndim+k]
+
+        # half step the velocities
+        c_stream_gradient(p, ndim, x, &prog_x[release_step[i],0], Gm, b2, grad)
+        for k in range(ndim):
+            v_jm1_2[k] = v[k] - grad[k] * dt/2.
+
+        for j in range(release_step[i]+1, nsteps+1):
+            for k in range(ndim):
+                x[k] = x[k] + v_jm1_2[k] * dt
+
+            c_stream_gradient(p, ndim, x, &prog_x[j,0], Gm, b2, grad)
+
+            for k in range(ndim):
+                v[k] = v_jm1_2[k] - grad[k] * dt/2.
+                v_jm1_2[k] = v_jm1_2[k] - grad[k] * dt
+
+        for k in range(ndim):
+            out_w[i,k] = x[k]
+            out_w[i,ndim+k] = v[k]
+
+    free(x)
+    free(v)
+    free(v_jm1_2)
+    free(grad)
+    return 0
+
+def cy_stream_run(_CPotential potential, double[:,::1] w0, int[::1] release_step,
+                  double[:,::1] prog_x, double dt, double Gm=0., double prog_b=0.,
+                  int nthreads=1):
+    """
+    cy_stream_run(potential, w0, release_step, prog_x, dt, Gm=0., prog_b=0., nthreads=1)
+
+    Leapfrog integrate stream particles with initial conditions ``w0`` in the
+    given C potential. Particle ``i`` starts at step ``release_step[i]`` of a
+    time grid with step ``dt`` and is integrated to the last step of the
+    progenitor orbit ``prog_x`` (positions, shape ``(nsteps+1, ndim)``), so
+    all particles end at the same time. Only the final states are returned.
+
+    If ``Gm`` is nonzero, the particles also feel the progenitor as a
+    Plummer sphere with mass ``Gm/G`` and scale radius ``prog_b``
+    that moves along ``prog_x``.
+
+    Each particle is integrated separately, so the particles can be split
+    between ``nthreads`` threads (0 means the number of CPUs).
+    """
+    cdef:
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+        int nsteps = prog_x.shape[0] - 1
+        double b2 = prog_b*prog_b
+        double[:,::1] out_w = np.zeros((n, 2*ndim))
+
+    if prog_x.shape[1] != ndim:
+        raise ValueError("Progenitor positions must have shape (nsteps+1, {0}).".format(ndim))
+
+    if release_step.shape[0] != n:
+        raise ValueError("There must be one release step per particle.")
+
+    if n > 0 and (np.min(release_step) < 0 or np.max(release_step) > nsteps):
+        raise ValueError("Release steps must be between 0 and {0}.".format(nsteps))
+
+    def worker(int b, int i1, int i2):
+        cdef int res
+        with nogil:
+            res = c_stream_orbits(potential, ndim, nsteps, dt, w0, release_step,
+                                  prog_x, Gm, b2, i1, i2, out_w)
+        return res
+
+    results = _run_threaded(worker, n, nthreads)
+    if min(results) < 0:
+        raise MemoryError("Not enough free memory for the integrator state.")
+
+    return np.array(out_w)
@@ -0,0 +1,325 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Leapfrog integration of massive perturbers and test particles in a host potential. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+from libc.stdlib cimport malloc, free
+
+# Project
+from ..potential.cpotential cimport _CPotential
+from ..integrate.core import _run_threaded
+
+cdef extern from "math.h":
+    double sqrt(double x) nogil
+    double exp(double x) nogil
+    double erf(double x) nogil
+    double fabs(double x) nogil
+
+# density profiles of the perturbers
+cdef enum:
+    PLUMMER = 0
+    HERNQUIST = 1
+
+cdef double SQRT_PI = 1.7724538509055159
+
+cdef void c_bodies_gradient(int nbodies, double *x, double *body_w, double *Gm,
+                            double *b, int *profile, int skip, double *grad) nogil:
+    """ Add the gradient of the potentials of the perturbers (except
+        perturber ``skip``) at ``x`` to ``grad``. The phase-space positions
+        of the perturbers are the rows of ``body_w`` (stride 6).
+    """
+    cdef:
+        int i,k
+        double dx[3]
+        double r, r2, fac
+
+    for i in range(nbodies):
+        if i == skip or Gm[i] == 0.:
+            continue
+
+        r2 = 0.
+        for k in range(3):
+            dx[k] = x[k] - body_w[6*i+k]
+            r2 += dx[k]*dx[k]
+
+        if profile[i] == PLUMMER:
+            r2 = r2 + b[i]*b[i]
+            fac = Gm[i] / (r2*sqrt(r2))
+        else:
+            if r2 == 0.:
+                continue
+            r = sqrt(r2)
+            fac = Gm[i] / (r*(r + b[i])*(r + b[i]))
+
+        for k in range(3):
+            grad[k] += fac * dx[k]
+
+cdef void c_friction_gradient(_CPotential p, double *x, double *v, double Gm,
+                              double ln_lambda, double max_rate, double *hess,
+                              double *grad) nogil:
+    """ Add the Chandrasekhar dynamical friction on a body with mass ``Gm/G``
+        at ``x`` moving with velocity ``v`` to ``grad`` (so that the
+        acceleration ``-grad`` opposes the velocity). The density of the host
+        is estimated from the Laplacian of its potential (``4 pi G rho``) and
+        its velocity dispersion from the circular velocity at the same radius
+        (``v_c / sqrt(2)``, as for an isothermal sphere). The deceleration
+        rate is limited to ``max_rate``: where the host is dense and cold
+        (e.g., near the center of a cusp) the friction is stiff, and an
+        explicit step would otherwise reverse the velocity.
+    """
+    cdef:
+        int k
+        double lap = 0.
+        double vc2 = 0.
+        double v2 = 0.
+        double vmag, X, fac
+        double grad_host[3]
+
+    for k in range(9):
+        hess[k] = 0.
+    p._hessian(x, hess)
+    lap = hess[0] + hess[4] + hess[8]
+    if lap <= 0.:
+        return
+
+    for k in range(3):
+        grad_host[k] = 0.
+        v2 += v[k]*v[k]
+    if v2 == 0.:
+        return
+    vmag = sqrt(v2)
+
+    p._gradient(x, grad_host)
+    for k in range(3):
+        vc2 += x[k]*grad_host[k]
+
+    if vc2 > 0.:
+        X = vmag / sqrt(vc2)  # v / (sqrt(2) sigma)
+        fac = erf(X) - 2.*X/SQRT_PI*exp(-X*X)
+    else:
+        fac = 1.
+
+    fac = Gm * lap * ln_lambda * fac / (v2*vmag)
+    if fac > max_rate:
+        fac = max_rate
+    for k in range(3):
+        grad[k] += fac * v[k]
+
+cdef void c_perturber_gradient(_CPotential p, int nbodies, double *body_w, double *v,
+                               double *Gm, double *b, int *profile, int friction,
+                               double ln_lambda, double max_rate, double *hess,
+                               double *grad) nogil:
+    """ Gradient of the host potential and all other perturbers (plus the
+        dynamical friction, if ``friction`` is nonzero) at the position of
+        each perturber. ``v`` are the velocities used for the friction, and
+        ``grad`` has shape ``(nbodies,3)``.
+    """
+    cdef int i,k
+
+    for i in range(nbodies):
+        for k in range(3):
+            grad[3*i+k] = 0.
+        p._gradient(&body_w[6*i], &grad[3*i])
+        c_bodies_gradient(nbodies, &body_w[6*i], body_w, Gm, b, profile, i, &grad[3*i])
+
+        if friction and Gm[i] != 0.:
+            c_friction_gradient(p, &body_w[6*i], &v[3*i], Gm[i], ln_lambda,
+                                max_rate, hess, &grad[3*i])
+
+cdef int c_perturber_orbits(_CPotential p, int nbodies, int nsteps, double dt,
+                            double[:,::1] w0, double *Gm, double *b, int *profile,
+                            int friction, double ln_lambda, double[:,:,::1] out_w) nogil:
+    """ Leapfrog integrate the perturbers in the host potential and under
+        their mutual gravity, in the same way as
+        `~gary.integrate._leapfrog.cy_leapfrog_run`, and save their
+        phase-space positions at every step to ``out_w``. The dynamical
+        friction is evaluated with the velocities at the previous half step.
+        Returns -1 if the scratch space couldn't be allocated.
+    """
+    cdef:
+        int i,j,k
+        double *v_jm1_2 = <double*>malloc(3*nbodies*sizeof(double))
+        double *grad = <double*>malloc(3*nbodies*sizeof(double))
+        double hess[9]
+        double max_rate = 1. / fabs(dt)
+
+    if v_jm1_2 == NULL or grad == NULL:
+        free(v_jm1_2)
+        free(grad)
+        return -1
+
+    for i in range(nbodies):
+        for k in range(6):
+            out_w[0,i,k] = w0[i,k]
+
+    # half step the velocities
+    for i in range(nbodies):
+        for k in range(3):
+            v_jm1_2[3*i+k] = w0[i,3+k]
+    c_perturber_gradient(p, nbodies, &out_w[0,0,0], v_jm1_2, Gm, b, profile,
+                         friction, ln_lambda, max_rate, hess, grad)
+    for i in range(nbodies):
+        for k in range(3):
+            v_jm1_2[3*i+k] = w0[i,3+k] - grad[3*i+k] * dt/2.
+
+    for j in range(1, nsteps+1):
+        for i in range(nbodies):
+            for k in range(3):
+                out_w[j,i,k] = out_w[j-1,i,k] + v_jm1_2[3*i+k] * dt
+
+        c_perturber_gradient(p, nbodies, &out_w[j,0,0], v_jm1_2, Gm, b, profile,
+                             friction, ln_lambda, max_rate, hess, grad)
+
+        for i in range(nbodies):
+            for k in range(3):
+                out_w[j,i,3+k] = v_jm1_2[3*i+k] - grad[3*i+k] * dt/2.
+                v_jm1_2[3*i+k] = v_jm1_2[3*i+k] - grad[3*i+k] * dt
+
+    free(v_jm1_2)
+    free(grad)
+    return 0
+
+cdef void c_particle_gradient(_CPotential p, int nbodies, double *x, double *body_w,
+                              double *Gm, double *b, int *profile, double *grad) nogil:
+    cdef int k
+    for k in range(3):
+        grad[k] = 0.
+    p._gradient(x, grad)
+    c_bodies_gradient(nbodies, x, body_w, Gm, b, profile, -1, grad)
+
+cdef void c_particle_orbits(_CPotential p, int nbodies, int nsteps, double dt,
+                           double[:,::1] w0, double[:,:,::1] body_w, double *Gm,
+                           double *b, int *profile, int i1, int i2,
+                           double[:,::1] out_w) nogil:
+    """ Leapfrog integrate each test particle in ``w0[i1:i2]`` in the host
+        potential plus the potentials of the perturbers, which move along
+        ``body_w``, and save its final state to ``out_w``.
+    """
+    cdef:
+        int i,j,k
+        double x[3]
+        double v[3]
+        double v_jm1_2[3]
+        double grad[3]
+
+    for i in range(i1, i2):
+        for k in range(3):
+            x[k] = w0[i,k]
+            v[k] = w0[i,3+k]
+
+        # half step the velocities
+        c_particle_gradient(p, nbodies, x, &body_w[0,0,0], Gm, b, profile, grad)
+        for k in range(3):
+            v_jm1_2[k] = v[k] - grad[k] * dt/2.
+
+        for j in range(1, nsteps+1):
+            for k in range(3):
+                x[k] = x[k] + v_jm1_2[k] * dt
+
+            c_particle_gradient(p, nbodies, x, &body_w[j,0,0], Gm, b, profile, grad)
+
+            for k in range(3):
+                v[k] = v_jm1_2[k] - grad[k] * dt/2.
+                v_jm1_2[k] = v_jm1_2[k] - grad[k] * dt
+
+        for k in range(3):
+            out_w[i,k] = x[k]
+            out_w[i,3+k] = v[k]
+
+def cy_perturber_run(_CPotential potential, double[:,::1] w0, double[:,::1] pert_w0,
+                     double[::1] pert_Gm, double[::1] pert_b, int[::1] pert_profile,
+                     double dt, int nsteps, int dynamical_friction=0,
+                     double ln_lambda=3., int nthreads=1):
+    """
+    cy_perturber_run(potential, w0, pert_w0, pert_Gm, pert_b, pert_profile, dt, nsteps, dynamical_friction=0, ln_lambda=3., nthreads=1)
+
+    Leapfrog integrate massive perturbers, with initial conditions
+    ``pert_w0``, and test particles, with initial conditions ``w0``, in the
+    given (3D) C potential for ``nsteps`` steps of ``dt``.
+
+    The perturbers feel the host potential and each other. Perturber ``i``
+    is a Plummer sphere (``pert_profile[i] == 0``) or a Hernquist sphere
+    (``pert_profile[i] == 1``) with mass ``pert_Gm[i]/G`` and scale radius
+    ``pert_b[i]``. If ``dynamical_friction`` is nonzero, the perturbers are
+    also slowed by Chandrasekhar dynamical friction with Coulomb logarithm
+    ``ln_lambda``. The test particles feel the host potential and all
+    perturbers, but don't act on anything.
+
+    Because the perturbers don't depend on the test particles, the
+    perturbers are advanced first and the test particles are then stepped
+    through the same time grid, split between ``nthreads`` threads (0 means
+    the number of CPUs). The result is the same as advancing everything in
+    a single loop.
+
+    Returns the perturber orbits, shape ``(nsteps+1,nperturbers,6)``, and
+    the final states of the test particles, shape ``(nparticles,6)``.
+    """
+    cdef:
+        int n = w0.shape[0]
+        int nbodies = pert_w0.shape[0]
+        int res = 0
+        double[:,:,::1] body_w = np.zeros((nsteps+1, nbodies, 6))
+        double[:,::1] out_w = np.zeros((n, 6))
+
+    if w0.shape[1] != 6 or pert_w0.shape[1] != 6:
+        raise ValueError("Perturbers and test particles must have 6D phase-space positions.")
+
+    if (pert_Gm.shape[0] != nbodies or pert_b.shape[0] != nbodies
+            or pert_profile.shape[0] != nbodies):
+        raise ValueError("There must be one mass, scale radius, and profile per perturber.")
+
+    if nbodies > 0 and (np.min(pert_profile) < PLUMMER or np.max(pert_profile) > HERNQUIST):
+        raise ValueError("Unknown perturber profile.")
+
+    if nsteps < 0:
+        raise ValueError("Number of steps must be non-negative.")
+
+    # the perturbers use pointers into their parameters, so they need at
+    #   least one element each
+    Gm_arr = np.zeros(max(nbodies,1))
+    b_arr = np.zeros(max(nbodies,1))
+    profile_arr = np.zeros(max(nbodies,1), dtype=np.intc)
+    Gm_arr[:nbodies] = pert_Gm
+    b_arr[:nbodies] = pert_b
+    profile_arr[:nbodies] = pert_profile
+
+    cdef:
+        double[::1] Gm = Gm_arr
+        double[::1] b = b_arr
+        int[::1] profile = profile_arr
+
+    if nbodies > 0:
+        with nogil:
+            res = c_perturber_orbits(potential, nbodies, nsteps, dt, pert_w0, &Gm[0], &b[0],
+                                     &profile[0], dynamical_friction, ln_lambda, body_w)
+        if res < 0:
+            raise MemoryError("Not enough free memory for the integrator state.")
+
+    if n == 0:
+        return np.array(body_w), np.array(out_w)
+
+    if nbodies == 0:
+        # a dummy perturber without mass, so the particles have positions to point to
+        body_w = np.zeros((nsteps+1, 1, 6))
+
+    def worker(int k, int i1, int i2):
+        with nogil:
+            c_particle_orbits(potential, nbodies, nsteps, dt, w0, body_w,
+                              &Gm[0], &b[0], &profile[0], i1, i2, out_w)
+
+    _run_threaded(worker, n, nthreads)
+
+    return np.array(body_w)[:,:nbodies], np.array(out_w)
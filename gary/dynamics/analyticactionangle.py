@@ -3,7 +3,8 @@
 from __future__ import division, print_function
 
 """
-Analytic transformations to action-angle coordinates.
+Analytic transformations to action-angle coordinates, and analytic orbits in
+integrable potentials.
 """
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
@@ -19,7 +20,8 @@ from ..coordinates import cartesian_to_physicsspherical, physicsspherical_to_car
 from .core import angular_momentum
 
 __all__ = ['isochrone_xv_to_aa', 'isochrone_aa_to_xv',
-           'harmonic_oscillator_xv_to_aa', 'harmonic_oscillator_aa_to_xv']
+           'harmonic_oscillator_xv_to_aa', 'harmonic_oscillator_aa_to_xv',
+           'isochrone_orbit', 'kepler_orbit', 'harmonic_oscillator_orbit']
 
 def isochrone_xv_to_aa(x, v, potential):
     """
@@ -349,3 +351,171 @@ def harmonic_oscillator_aa_to_xv(actions, angles, potential):
     v = np.sqrt(2*actions*omega[None]) * np.cos(angles)
 
     return x,v
+
+def _solve_kepler(M, k, tol=1E-15, maxiter=32):
+    r"""
+    Solve the (generalized) Kepler equation :math:`\eta - k\sin\eta = M` for
+    :math:`\eta` with Halley's method, for mean anomalies ``M`` in
+    :math:`[-\pi,\pi)` and ``0 <= k < 1``. With the starting guess of Danby
+    (1988), this converges in a few iterations for all ``k``.
+    """
+    eta = M + 0.85*k*np.sign(np.sin(M))
+    for i in range(maxiter):
+        k_sin = k*np.sin(eta)
+        f = eta - k_sin - M
+        fp = 1. - k*np.cos(eta)
+        d = f / (fp - 0.5*f*k_sin/fp)
+        eta -= d
+        if np.all(np.abs(d) < tol):
+            break
+    return eta
+
+def _isochrone_orbit(w0, t, t0, GM, b):
+    """ Orbits in an isochrone potential with parameters ``GM`` and ``b``
+        (a Kepler potential if ``b`` is zero). See `isochrone_orbit`.
+    """
+    w0 = np.atleast_2d(np.asarray(w0, dtype=np.float64))
+    t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+    if w0.shape[-1] != 6:
+        raise ValueError("Phase-space positions must have shape (norbits,6).")
+    if t0 is None:
+        t0 = t[0]
+
+    x0 = w0[:,:3]
+    v0 = w0[:,3:]
+    r0 = np.sqrt(np.sum(x0**2, axis=-1))
+    L_vec = np.cross(x0, v0)
+    L = np.sqrt(np.sum(L_vec**2, axis=-1))
+    E = 0.5*np.sum(v0**2, axis=-1) - GM / (b + np.sqrt(b*b + r0*r0))
+
+    if np.any(E >= 0.):
+        raise ValueError("Analytic orbits are only available for bound orbits.")
+    if np.any(L == 0.):
+        raise ValueError("Analytic orbits are not available for radial orbits.")
+
+    # orbital elements (Binney & Tremaine 2008, Section 3.5.2)
+    c = GM / (-2*E) - b
+    e = np.sqrt(np.clip(1 - L*L*(1 + b/c) / GM / c, 0., 1.))
+    k = e*c / (c + b)
+    Omega_r = (-2*E)**1.5 / GM
+    s = np.sqrt(1 + 4*GM*b/L/L)
+    omega = 0.5*(1 + 1/s)  # ratio of the azimuthal and radial frequencies
+    a = np.sqrt((1+e) / (1-e))
+    ap = np.sqrt((1 + e + 2*b/c) / (1 - e + 2*b/c))
+
+    def psi_eta(eta):
+        """ Azimuth in the orbital plane, up to a constant, as a function of
+            the eccentric anomaly in [-pi,pi), minus the secular part.
+        """
+        tan_eta2 = np.tan(eta/2.)
+        return np.arctan(a*tan_eta2) + np.arctan(ap*tan_eta2)/s
+
+    # initial eccentric anomaly and radial angle
+    vr0 = np.sum(x0*v0, axis=-1) / r0
+    eta0 = np.arctan2(r0*vr0 / np.sqrt(-2*E), b + c - np.sqrt(b*b + r0*r0))
+    theta_r0 = eta0 - k*np.sin(eta0)
+
+    # advance the radial angle linearly, and count the radial periods so that
+    #   the azimuth accumulates its secular part
+    theta_r = theta_r0[None] + Omega_r[None]*(t[:,None] - t0)
+    nperiods = np.floor((theta_r + np.pi) / (2*np.pi))
+    M = theta_r - 2*np.pi*nperiods
+    k2 = np.broadcast_to(k[None], M.shape)
+    eta = _solve_kepler(M, k2)
+
+    r = c*np.sqrt((1 - e*np.cos(eta)) * (1 - e*np.cos(eta) + 2*b/c))
+    vr = np.sqrt(GM/(b + c)) * c*e*np.sin(eta) / r
+    psi = psi_eta(eta) + 2*np.pi*omega*nperiods - psi_eta(eta0)[None]
+
+    # unit vectors in the orbital plane, with psi = 0 at the initial position
+    e1 = x0 / r0[:,None]
+    e2 = np.cross(L_vec / L[:,None], e1)
+
+    cos_psi = np.cos(psi)[...,None]
+    sin_psi = np.sin(psi)[...,None]
+    r_hat = cos_psi*e1[None] + sin_psi*e2[None]
+    psi_hat = -sin_psi*e1[None] + cos_psi*e2[None]
+
+    w = np.empty(t.shape + w0.shape)
+    w[...,:3] = r[...,None] * r_hat
+    w[...,3:] = vr[...,None] * r_hat + (L[None]/r)[...,None] * psi_hat
+    return w
+
+def isochrone_orbit(w0, t, potential, t0=None):
+    """
+    Analytic orbits in the Isochrone potential. The radial angle advances
+    linearly in time, and the eccentric anomaly at each time is found by
+    solving the generalized Kepler equation, so the cost only depends on the
+    number of output times (not on any time step) and the orbits are exact
+    to round-off. See Section 3.5.2 in Binney & Tremaine (2008).
+
+    Parameters
+    ----------
+    w0 : array_like
+        Phase-space positions at time ``t0``, shape ``(norbits,6)``. The
+        orbits must be bound and have nonzero angular momentum.
+    t : array_like
+        Output times.
+    potential : :class:`gary.potential.IsochronePotential`
+    t0 : numeric (optional)
+        Time of the initial conditions. Defaults to the first output time.
+
+    Returns
+    -------
+    w : :class:`numpy.ndarray`
+        Phase-space positions, shape ``(ntimes,norbits,6)``.
+    """
+    _G = G.decompose(potential.units).value
+    return _isochrone_orbit(w0, t, t0, _G*potential.parameters['m'],
+                            potential.parameters['b'])
+
+def kepler_orbit(w0, t, potential, t0=None):
+    """
+    Analytic orbits in the Kepler potential, from the solution of Kepler's
+    equation. See `isochrone_orbit` for a description of the parameters.
+    """
+    _G = G.decompose(potential.units).value
+    return _isochrone_orbit(w0, t, t0, _G*potential.parameters['m'], 0.)
+
+def harmonic_oscillator_orbit(w0, t, potential, t0=None):
+    """
+    Analytic orbits in the Harmonic Oscillator potential. Each dimension is
+    an independent oscillator whose angle advances linearly in time.
+
+    Parameters
+    ----------
+    w0 : array_like
+        Phase-space positions at time ``t0``, shape ``(norbits,2*ndim)``.
+    t : array_like
+        Output times.
+    potential : :class:`gary.potential.HarmonicOscillatorPotential`
+    t0 : numeric (optional)
+        Time of the initial conditions. Defaults to the first output time.
+
+    Returns
+    -------
+    w : :class:`numpy.ndarray`
+        Phase-space positions, shape ``(ntimes,norbits,2*ndim)``.
+    """
+    w0 = np.atleast_2d(np.asarray(w0, dtype=np.float64))
+    t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+    if t0 is None:
+        t0 = t[0]
+
+    ndim = w0.shape[-1] // 2
+    omega = np.broadcast_to(np.asarray(potential.parameters['omega'],
+                                       dtype=np.float64), (ndim,))
+    x0 = w0[None,:,:ndim]
+    v0 = w0[None,:,ndim:]
+
+    # free particles in dimensions without a restoring force
+    wt = omega[None,None] * (t - t0)[:,None,None]
+    cos_wt = np.cos(wt)
+    sin_wt = np.sin(wt)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sinc = np.where(omega == 0., (t - t0)[:,None,None], sin_wt / omega)
+
+    w = np.empty(t.shape + w0.shape)
+    w[...,:ndim] = x0*cos_wt + v0*sinc
+    w[...,ndim:] = v0*cos_wt - x0*omega*sin_wt
+    return w
@@ -0,0 +1,240 @@
+# coding: utf-8
+
+""" Generate mock tidal streams by releasing particles near the Lagrange points. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+from astropy.constants import G
+from astropy import log as logger
+import numpy as np
+
+__all__ = ['SprayModel', 'StreaklineSpray', 'FardalSpray', 'mock_stream']
+
+def _stream_frame(w):
+    """ Unit vectors of the frame that rotates with the progenitor -- radial,
+        azimuthal, and along the angular momentum -- and the angular
+        velocity, for an array of phase-space positions with shape (n,6).
+    """
+    x = w[:,:3]
+    v = w[:,3:]
+    r = np.sqrt(np.sum(x**2, axis=-1))
+    L = np.cross(x, v)
+    Lmag = np.sqrt(np.sum(L**2, axis=-1))
+
+    r_hat = x / r[:,None]
+    z_hat = L / Lmag[:,None]
+    phi_hat = np.cross(z_hat, r_hat)
+    Omega = Lmag / r**2
+
+    return r_hat, phi_hat, z_hat, Omega
+
+class SprayModel(object):
+    """
+    Base class for models of the phase-space positions at which stream
+    particles are released from a progenitor. Subclasses implement
+    `sample`.
+    """
+
+    def sample(self, prog_w, r_tide):
+        """
+        Phase-space positions of released particles.
+
+        Parameters
+        ----------
+        prog_w : :class:`numpy.ndarray`
+            Phase-space positions of the progenitor at the release times,
+            shape ``(n,6)``.
+        r_tide : :class:`numpy.ndarray`
+            Tidal radius of the progenitor at the release times, shape ``(n,)``.
+
+        Returns
+        -------
+        w : :class:`numpy.ndarray`
+            Phase-space positions of the released particles, shape
+            ``(n,2,6)``: the leading particle (released near the inner
+            Lagrange point) first, then the trailing particle.
+        """
+        raise NotImplementedError()
+
+class StreaklineSpray(SprayModel):
+    """
+    Release particles exactly at the inner and outer Lagrange points, with
+    the same angular velocity as the progenitor (the "streakline" model of
+    Kupper et al. 2012).
+    """
+
+    def sample(self, prog_w, r_tide):
+        r_hat, phi_hat, z_hat, Omega = _stream_frame(prog_w)
+
+        w = np.zeros((len(prog_w),2,6))
+        for i,sign in enumerate([-1., 1.]):
+            w[:,i,:3] = prog_w[:,:3] + sign * r_tide[:,None] * r_hat
+            w[:,i,3:] = prog_w[:,3:] + sign * (Omega * r_tide)[:,None] * phi_hat
+
+        return w
+
+class FardalSpray(SprayModel):
+    """
+    Release particles with random offsets from the Lagrange points, drawn
+    from the distributions calibrated against N-body simulations by Fardal
+    et al. (2015). In units of the tidal radius, the radial offset is
+    ``k_r`` and the offset out of the orbital plane is ``k_z``. The
+    azimuthal velocity offset is ``k_vt`` times the velocity of co-rotation
+    with the progenitor at the radial offset, and the velocity out of the
+    orbital plane is ``k_vz`` times the angular velocity times the tidal
+    radius.
+
+    Parameters
+    ----------
+    k_r : tuple (optional)
+        Mean and standard deviation of ``k_r``.
+    k_vt : tuple (optional)
+        Mean and standard deviation of ``k_vt``.
+    k_z : tuple (optional)
+        Mean and standard deviation of ``k_z``.
+    k_vz : tuple (optional)
+        Mean and standard deviation of ``k_vz``.
+    seed : int (optional)
+        Seed for the random number generator.
+    """
+
+    def __init__(self, k_r=(2., 0.5), k_vt=(0.3, 0.5), k_z=(0., 0.5), k_vz=(0., 0.5),
+                 seed=None):
+        self.k_r = k_r
+        self.k_vt = k_vt
+        self.k_z = k_z
+        self.k_vz = k_vz
+        self._rnd = np.random.RandomState(seed)
+
+    def sample(self, prog_w, r_tide):
+        r_hat, phi_hat, z_hat, Omega = _stream_frame(prog_w)
+        n = len(prog_w)
+
+        w = np.zeros((n,2,6))
+        for i,sign in enumerate([-1., 1.]):
+            k_r = self._rnd.normal(*self.k_r, size=n)
+            k_vt = self._rnd.normal(*self.k_vt, size=n)
+            k_z = self._rnd.normal(*self.k_z, size=n)
+            k_vz = self._rnd.normal(*self.k_vz, size=n)
+
+            w[:,i,:3] = prog_w[:,:3] + r_tide[:,None] * (sign*k_r[:,None]*r_hat +
+                                                          k_z[:,None]*z_hat)
+            w[:,i,3:] = prog_w[:,3:] + (Omega*r_tide)[:,None] * (sign*(k_vt*k_r)[:,None]*phi_hat +
+                                                                  k_vz[:,None]*z_hat)
+
+        return w
+
+def mock_stream(potential, prog_w0, prog_mass, dt, nsteps, t2=0., spray=None,
+                release_every=1, n_particles=1, prog_b=None, nthreads=1):
+    r"""
+    Generate a mock tidal stream. The orbit of the progenitor is integrated
+    backwards from its present-day phase-space position ``prog_w0`` at time
+    ``t2`` for ``nsteps`` steps, and then forwards again. Every
+    ``release_every`` steps, ``n_particles`` particles are released near
+    each of the two Lagrange points with the given spray model, and all
+    particles are then integrated to ``t2`` with a compiled leapfrog
+    integrator -- on the same time grid as the progenitor, and in parallel
+    over ``nthreads`` threads.
+
+    The tidal radius at each release time is the Jacobi radius
+    :math:`r_t = r\,(m / 3M(<r))^{1/3}`, with the enclosed mass of the
+    potential estimated with `~gary.potential.PotentialBase.mass_enclosed`.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.PotentialBase`
+        A potential with a C implementation.
+    prog_w0 : array_like
+        Present-day phase-space position of the progenitor, shape ``(6,)``.
+    prog_mass : numeric, :class:`~astropy.units.Quantity`
+        Mass of the progenitor.
+    dt : numeric
+        Time step (positive).
+    nsteps : int
+        Number of steps.
+    t2 : numeric (optional)
+        The present-day time.
+    spray : `SprayModel` (optional)
+        Model for the phase-space positions of the released particles.
+        Defaults to `StreaklineSpray`.
+    release_every : int (optional)
+        Release particles every this many steps.
+    n_particles : int (optional)
+        Number of particles released at each Lagrange point per release.
+    prog_b : numeric (optional)
+        If specified, the particles feel the gravity of the progenitor,
+        modeled as a Plummer sphere with this scale radius.
+    nthreads : int (optional)
+        Number of threads to integrate the particles with (0 means the
+        number of CPUs).
+
+    Returns
+    -------
+    prog_t : :class:`numpy.ndarray`
+        Times of the progenitor orbit, shape ``(nsteps+1,)``.
+    prog_w : :class:`numpy.ndarray`
+        Progenitor orbit, shape ``(nsteps+1,6)``.
+    stream_w : :class:`numpy.ndarray`
+        Phase-space positions of the stream particles at time ``t2``, shape
+        ``(nparticles,6)``. Particles released at the same time are
+        consecutive, alternating between leading and trailing particles.
+    release_t : :class:`numpy.ndarray`
+        Release time of each stream particle.
+    """
+    from ..integrate._leapfrog import cy_leapfrog_run
+    from ._mockstream import cy_stream_run
+
+    if not hasattr(potential, 'c_instance'):
+        raise ValueError("Mock streams can only be generated in potentials with "
+                         "a C implementation.")
+
+    if dt <= 0:
+        raise ValueError("Time step must be positive.")
+
+    if release_every < 1 or n_particles < 1:
+        raise ValueError("release_every and n_particles must be positive.")
+
+    prog_w0 = np.atleast_2d(np.array(prog_w0, dtype=np.float64))
+    if prog_w0.shape != (1,6):
+        raise ValueError("Progenitor phase-space position must have shape (6,).")
+
+    if spray is None:
+        spray = StreaklineSpray()
+
+    if hasattr(prog_mass, 'unit'):
+        prog_mass = prog_mass.decompose(potential.units).value
+
+    # integrate the progenitor backwards, then forwards on the same time grid
+    #   that the particles are integrated on
+    t1 = t2 - nsteps*dt
+    back_t,back_w = cy_leapfrog_run(potential.c_instance, prog_w0, -dt, nsteps, t2)
+    prog_t,prog_w = cy_leapfrog_run(potential.c_instance,
+                                    np.ascontiguousarray(back_w[-1]), dt, nsteps, t1)
+    prog_w = prog_w[:,0]
+
+    # seed particles in batches at the release steps
+    release_step = np.arange(0, nsteps, release_every)
+    x = prog_w[release_step,:3]
+    r = np.sqrt(np.sum(x**2, axis=-1))
+    r_tide = r * (prog_mass / (3.*potential.mass_enclosed(x)))**(1/3.)
+
+    w0 = spray.sample(np.repeat(prog_w[release_step], n_particles, axis=0),
+                      np.repeat(r_tide, n_particles))
+    w0 = np.ascontiguousarray(w0.reshape(-1,6))
+    release_step = np.repeat(release_step, 2*n_particles).astype(np.intc)
+    logger.debug("Integrating {0} stream particles".format(len(w0)))
+
+    Gm = 0.
+    b = 0.
+    if prog_b is not None:
+        Gm = G.decompose(potential.units).value * prog_mass
+        b = prog_b
+
+    stream_w = cy_stream_run(potential.c_instance, w0, release_step,
+                             np.ascontiguousarray(prog_w[:,:3]), dt,
+                             Gm=Gm, prog_b=b, nthreads=nthreads)
+
+    return prog_t, prog_w, stream_w, prog_t[release_step]
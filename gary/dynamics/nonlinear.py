@@ -15,7 +15,8 @@ import numpy as np
 # Project
 from ..util import gram_schmidt
 
-__all__ = ['lyapunov_spectrum', 'fast_lyapunov_max', 'lyapunov_max']
+__all__ = ['lyapunov_spectrum', 'fast_lyapunov_spectrum', 'fast_lyapunov_max', 'lyapunov_max',
+           'fast_chaos_indicator', 'sali']
 
 # Create logger
 logger = logging.getLogger(__name__)
@@ -37,7 +38,12 @@ def lyapunov_spectrum(w0, integrator, dt, nsteps, t1=0., deviation_vecs=None):
         t1 : numeric (optional)
             Time of initial conditions. Assumed to be t=0.
         deviation_vecs : array_like (optional)
-            Specify your own initial deviation vectors.
+            Specify your own initial deviation vectors, shape
+            ``(ndim, ndim)``. They are normalized to unit length.
+
+        See Also
+        --------
+        fast_lyapunov_spectrum : Compiled version for potentials implemented in C.
 
     """
 
@@ -56,7 +62,8 @@ def lyapunov_spectrum(w0, integrator, dt, nsteps, t1=0., deviation_vecs=None):
             A[ii] /= np.linalg.norm(A[ii])
 
     else:
-        raise NotImplementedError()
+        A = np.array(deviation_vecs, dtype=np.float64).reshape(ndim_ps,ndim_ps)
+        A = A / np.linalg.norm(A, axis=1)[:,None]
 
     all_w0 = np.zeros((ndim_ps,ndim_ps*2))
     for ii in range(ndim_ps):
@@ -89,6 +96,68 @@ def lyapunov_spectrum(w0, integrator, dt, nsteps, t1=0., deviation_vecs=None):
 
     return lyap, full_ts, full_w
 
+def fast_lyapunov_spectrum(w0, potential, dt, nsteps, t1=0., nsteps_per_reorth=10,
+                           nvecs=6, deviation_vecs=None, atol=1E-10, rtol=1E-10):
+    """ Compute the spectrum of Lyapunov exponents of an orbit in a potential
+        implemented in C. The linearized equations of motion for the deviation
+        vectors are integrated alongside the orbit with the DOP853 integrator
+        in a compiled loop, and the deviation vectors are re-orthonormalized
+        every ``nsteps_per_reorth`` steps.
+
+        Parameters
+        ----------
+        w0 : array_like
+            Initial conditions for all phase-space coordinates.
+        potential : gary.potential.CPotentialBase
+            A potential with a C implementation.
+        dt : numeric
+            Timestep.
+        nsteps : int
+            Number of steps to run for.
+        t1 : numeric (optional)
+            Time of initial conditions. Assumed to be t=0.
+        nsteps_per_reorth : int (optional)
+            Number of steps between re-orthonormalizations of the deviation
+            vectors.
+        nvecs : int (optional)
+            Number of deviation vectors, i.e. the number of exponents to
+            compute, starting from the largest.
+        deviation_vecs : array_like (optional)
+            Specify your own initial deviation vectors.
+        atol : numeric (optional)
+            Absolute tolerance for the integrator.
+        rtol : numeric (optional)
+            Relative tolerance for the integrator.
+
+        Returns
+        -------
+        lyap : :class:`numpy.ndarray`
+            Estimates of the Lyapunov exponents at each time.
+        ts : :class:`numpy.ndarray`
+            Array of times.
+        ws : :class:`numpy.ndarray`
+            The orbit.
+
+        Notes
+        -----
+        The exponents are normalized by the elapsed time, ``|t - t1|``.
+        `lyapunov_spectrum` divides by the absolute time ``t`` instead, so the
+        two only agree for ``t1 = 0``.
+
+    """
+    from ..integrate._dop853 import dop853_variational
+
+    if not hasattr(potential, 'c_instance'):
+        raise TypeError("Input potential must be a CPotential subclass.")
+
+    w0 = np.array(w0, dtype=np.float64).reshape(-1)
+    t,w,lyap = dop853_variational(potential.c_instance, w0, dt, nsteps, t1,
+                                  atol, rtol, nvecs=nvecs,
+                                  nsteps_per_reorth=nsteps_per_reorth,
+                                  deviation_vecs=deviation_vecs)
+
+    return lyap, t, w
+
 def fast_lyapunov_max(w0, potential, dt, nsteps, d0=1e-5,
                       nsteps_per_pullback=10, noffset_orbits=2, t1=0.,
                       atol=1E-9, rtol=1E-8):
@@ -103,6 +172,114 @@ def fast_lyapunov_max(w0, potential, dt, nsteps, d0=1e-5,
 
     return l,t,w
 
+def fast_chaos_indicator(w0, potential, dt, nsteps, indicator='megno', t1=0.,
+                         time_series=False, nthreads=1, atol=1E-10, rtol=1E-10,
+                         **kwargs):
+    """ Compute a chaos indicator (MEGNO, FLI, SALI or GALI) for many orbits
+        in a potential implemented in C. The variational equations are
+        integrated alongside each orbit with the DOP853 integrator in a
+        compiled loop, and the orbits can be split between threads. Orbits
+        can be stopped early once they are clearly chaotic or regular. See
+        `~gary.integrate._dop853.dop853_chaos_indicator` for a description of
+        the indicators and the additional keyword arguments (``k``,
+        ``deviation_vecs``, ``chaotic``, ``regular``, ``min_steps``).
+
+        Parameters
+        ----------
+        w0 : array_like
+            Initial conditions for all phase-space coordinates, shape
+            ``(norbits, 6)``.
+        potential : gary.potential.CPotentialBase
+            A potential with a C implementation.
+        dt : numeric
+            Timestep.
+        nsteps : int
+            Number of steps to run for.
+        indicator : str (optional)
+            One of ``'megno'``, ``'fli'``, ``'sali'``, ``'gali'``.
+        t1 : numeric (optional)
+            Time of initial conditions. Assumed to be t=0.
+        time_series : bool (optional)
+            Return the indicator at all times instead of only the final value.
+        nthreads : int (optional)
+            Number of threads (0 means the number of CPUs).
+        atol : numeric (optional)
+            Absolute tolerance for the integrator.
+        rtol : numeric (optional)
+            Relative tolerance for the integrator.
+
+        Returns
+        -------
+        values : :class:`numpy.ndarray`
+            Final values of the indicator, shape ``(norbits,)``, or the values
+            at each time, shape ``(nsteps+1,norbits)``.
+        ts : :class:`numpy.ndarray`
+            Time of the final value for each orbit, or the array of times.
+        status : :class:`numpy.ndarray`
+            1 for orbits stopped as chaotic, 2 for orbits stopped as regular,
+            0 for orbits integrated for all steps, negative if the integration
+            failed.
+
+    """
+    from ..integrate._dop853 import dop853_chaos_indicator
+
+    if not hasattr(potential, 'c_instance'):
+        raise TypeError("Input potential must be a CPotential subclass.")
+
+    w0 = np.array(np.atleast_2d(w0), dtype=np.float64)
+    return dop853_chaos_indicator(potential.c_instance, w0, dt, nsteps, t1,
+                                  atol, rtol, indicator=indicator,
+                                  time_series=time_series, nthreads=nthreads,
+                                  **kwargs)
+
+def sali(w0, potential, dt, nsteps, t1=0., time_series=False, nthreads=1,
+         atol=1E-10, rtol=1E-10, **kwargs):
+    """ Compute the Smaller Alignment Index (SALI) for many orbits in a
+        potential implemented in C. This is a shortcut for
+        `fast_chaos_indicator` with ``indicator='sali'``, and takes the same
+        arguments. The SALI goes to zero exponentially for chaotic orbits
+        and stays roughly constant for regular orbits.
+
+        See: Skokos, Ch. 2001, J. Phys. A: Math. Gen., 34, 10029-10043
+
+        Parameters
+        ----------
+        w0 : array_like
+            Initial conditions for all phase-space coordinates, shape
+            ``(norbits, 6)``.
+        potential : gary.potential.CPotentialBase
+            A potential with a C implementation.
+        dt : numeric
+            Timestep.
+        nsteps : int
+            Number of steps to run for.
+        t1 : numeric (optional)
+            Time of initial conditions. Assumed to be t=0.
+        time_series : bool (optional)
+            Return the SALI at all times instead of only the final value.
+        nthreads : int (optional)
+            Number of threads (0 means the number of CPUs).
+        atol : numeric (optional)
+            Absolute tolerance for the integrator.
+        rtol : numeric (optional)
+            Relative tolerance for the integrator.
+
+        Returns
+        -------
+        sali : :class:`numpy.ndarray`
+            Final values of the SALI, shape ``(norbits,)``, or the values
+            at each time, shape ``(nsteps+1,norbits)``.
+        ts : :class:`numpy.ndarray`
+            Time of the final value for each orbit, or the array of times.
+        status : :class:`numpy.ndarray`
+            See `fast_chaos_indicator`.
+
+    """
+    return fast_chaos_indicator(w0, potential, dt, nsteps, indicator='sali',
+                                t1=t1, time_series=time_series,
+                                nthreads=nthreads, atol=atol, rtol=rtol,
+                                **kwargs)
+
 def lyapunov_max(w0, integrator, dt, nsteps, d0=1e-5, nsteps_per_pullback=10,
                  noffset=8, t1=0.):
     """
@@ -188,80 +365,3 @@ def lyapunov_max(w0, integrator, dt, nsteps, d0=1e-5, nsteps_per_pullback=10,
     LEs = np.array([LEs[:ii].sum(axis=0)/ts[ii-1] for ii in range(1,niter)])
 
     return LEs, full_ts, full_w
-
-# def sali(w0, integrator, dt, nsteps, t1=0., deviation_vecs=None):
-#     """ Compute the Smaller Alignment Index (SALI)
-#         See: Skokos, Ch. 2001, J. Phys. A: Math. Gen., 34, 10029-10043
-
-#         Parameters
-#         ----------
-#         w0 : array_like
-#             Initial conditions for all phase-space coordinates.
-#         integrator : gary.Integrator
-#             An instantiated Integrator object. Must have a run() method.
-#         dt : numeric
-#             Timestep.
-#         nsteps : int
-#             Number of steps to run for.
-#         d0 : numeric (optional)
-#             The initial separation.
-#         nsteps_per_pullback : int (optional)
-#             Number of steps to run before re-normalizing the offset vectors.
-#         noffset : int (optional)
-#             Number of offset orbits to run.
-#         t1 : numeric (optional)
-#             Time of initial conditions. Assumed to be t=0.
-
-#     """
-
-#     w0 = np.atleast_2d(w0)
-
-#     # phase-space dimensionality
-#     if w0.shape[0] > 1:
-#         raise ValueError("Initial condition vector ")
-#     ndim_ps = w0.shape[1]
-
-#     if deviation_vecs is None:
-#         # initialize (ndim_ps) deviation vectors
-#         A = np.zeros((ndim_ps,ndim_ps))
-#         for ii in range(ndim_ps):
-#             A[ii] = np.random.normal(0.,1.,size=ndim_ps)
-#             A[ii] /= np.linalg.norm(A[ii])
-
-#         vec = gram_schmidt(A)
-#         A = A[:2]
-
-#     else:
-#         raise NotImplementedError()
-
-#     all_w0 = np.zeros((2,ndim_ps*2))
-#     for ii in range(2):
-#         all_w0[ii] = np.append(w0,A[ii])
-
-#     # array to store the full, main orbit
-#     full_w = np.zeros((nsteps+1,ndim_ps))
-#     full_w[0] = w0
-#     full_ts = np.zeros((nsteps+1,))
-#     full_ts[0] = t1
-
-#     # arrays to store the sali
-#     sali = np.zeros((nsteps+1,))
-
-#     time = t1
-#     for ii in range(1,nsteps+1):
-#         tt,ww = integrator.run(all_w0, dt=dt, nsteps=1, t1=time)
-#         time += dt
-
-#         dm = np.sqrt(np.sum((ww[-1,0,ndim_ps:] - ww[-1,1,ndim_ps:])**2))
-#         dq = np.sqrt(np.sum((ww[-1,0,ndim_ps:] + ww[-1,1,ndim_ps:])**2))
-#         sali[ii] = min(dm, dq)
-
-#         # renormalize
-#         ww[-1,0,ndim_ps:] = ww[-1,0,ndim_ps:] / np.linalg.norm(ww[-1,0,ndim_ps:])
-#         ww[-1,1,ndim_ps:] = ww[-1,1,ndim_ps:] / np.linalg.norm(ww[-1,1,ndim_ps:])
-
-#         full_w[ii:ii+1] = ww[-1,0,:ndim_ps]
-#         full_ts[ii:ii+1] = time
-#         all_w0 = ww[-1].copy()
-
-#     return sali, full_ts, full_w
@@ -0,0 +1,148 @@
+# coding: utf-8
+
+""" Integrate test particles together with massive perturbers, e.g., satellites. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+from astropy.constants import G
+from astropy import log as logger
+import numpy as np
+
+__all__ = ['Perturber', 'integrate_with_perturbers']
+
+_profiles = {'plummer': 0, 'hernquist': 1}
+
+class Perturber(object):
+    """
+    A massive body -- a Plummer or Hernquist sphere -- that moves through a
+    host potential, for `integrate_with_perturbers`.
+
+    Parameters
+    ----------
+    w0 : array_like
+        Initial phase-space position, shape ``(6,)``.
+    m : numeric, :class:`~astropy.units.Quantity`
+        Mass.
+    b : numeric, :class:`~astropy.units.Quantity`
+        Scale radius.
+    profile : str (optional)
+        Density profile, either ``'plummer'`` or ``'hernquist'``.
+    """
+    def __init__(self, w0, m, b, profile='plummer'):
+        self.w0 = np.array(w0, dtype=np.float64)
+        if self.w0.shape != (6,):
+            raise ValueError("Perturber phase-space position must have shape (6,).")
+
+        if profile not in _profiles:
+            raise ValueError("Unknown profile '{0}' -- must be one of: {1}"
+                             .format(profile, ", ".join(sorted(_profiles.keys()))))
+
+        self.m = m
+        self.b = b
+        self.profile = profile
+
+    def __repr__(self):
+        return "<Perturber {0} m={1} b={2}>".format(self.profile, self.m, self.b)
+
+def integrate_with_perturbers(potential, w0, perturbers, dt, nsteps, t1=0.,
+                              dynamical_friction=False, ln_lambda=3., nthreads=1):
+    r"""
+    Integrate test particles together with a few massive perturbers (e.g.,
+    satellites like the LMC or Sagittarius) in a host potential, with a
+    compiled leapfrog integrator.
+
+    The perturbers move under the host potential and each other's gravity,
+    and optionally feel Chandrasekhar dynamical friction,
+
+    .. math::
+
+        \frac{d\boldsymbol{v}}{dt} = -\frac{4\pi G^2 M \rho \ln\Lambda}{v^3}
+        \left[{\rm erf}(X) - \frac{2X}{\sqrt{\pi}}e^{-X^2}\right]\boldsymbol{v},
+        \quad X = \frac{v}{\sqrt{2}\sigma}
+
+    where the density of the host :math:`\rho` is estimated from the
+    Laplacian of the potential and the velocity dispersion as
+    :math:`\sigma = v_c/\sqrt{2}`, from the circular velocity at the same
+    radius. The host itself is fixed (there is no reflex motion). The test
+    particles feel the host and all perturbers, but don't act on anything,
+    so millions of them can be integrated in parallel over ``nthreads``
+    threads.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.PotentialBase`
+        A 3D potential with a C implementation.
+    w0 : array_like
+        Initial conditions of the test particles, shape ``(nparticles,6)``.
+    perturbers : iterable
+        `Perturber` instances.
+    dt : numeric
+        Time step (negative to integrate backwards).
+    nsteps : int
+        Number of steps.
+    t1 : numeric (optional)
+        Initial time.
+    dynamical_friction : bool (optional)
+        Include dynamical friction on the perturbers.
+    ln_lambda : numeric (optional)
+        Coulomb logarithm for the dynamical friction.
+    nthreads : int (optional)
+        Number of threads to integrate the test particles with (0 means the
+        number of CPUs).
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+        Times, shape ``(nsteps+1,)``.
+    pert_w : :class:`numpy.ndarray`
+        Orbits of the perturbers, shape ``(nsteps+1,nperturbers,6)``.
+    w : :class:`numpy.ndarray`
+        Phase-space positions of the test particles at the final time, shape
+        ``(nparticles,6)``.
+    """
+    from ._perturbers import cy_perturber_run
+
+    if not hasattr(potential, 'c_instance'):
+        raise ValueError("Perturbers can only be integrated in potentials with "
+                         "a C implementation.")
+
+    if dt == 0:
+        raise ValueError("Time step must be nonzero.")
+
+    w0 = np.array(w0, dtype=np.float64)
+    if w0.ndim == 1 and len(w0) == 0:
+        w0 = w0.reshape(0,6)
+    w0 = np.ascontiguousarray(np.atleast_2d(w0))
+    if w0.shape[1] != 6:
+        raise ValueError("Test particle phase-space positions must have shape (nparticles,6).")
+
+    perturbers = list(perturbers)
+    Gee = G.decompose(potential.units).value
+
+    def _value(q):
+        if hasattr(q, 'unit'):
+            return q.decompose(potential.units).value
+        return q
+
+    pert_w0 = np.zeros((len(perturbers),6))
+    pert_Gm = np.zeros(len(perturbers))
+    pert_b = np.zeros(len(perturbers))
+    pert_profile = np.zeros(len(perturbers), dtype=np.intc)
+    for i,p in enumerate(perturbers):
+        pert_w0[i] = p.w0
+        pert_Gm[i] = Gee * _value(p.m)
+        pert_b[i] = _value(p.b)
+        pert_profile[i] = _profiles[p.profile]
+
+    logger.debug("Integrating {0} test particles with {1} perturbers"
+                 .format(len(w0), len(perturbers)))
+    pert_w,w = cy_perturber_run(potential.c_instance, w0, pert_w0, pert_Gm, pert_b,
+                                pert_profile, float(dt), int(nsteps),
+                                dynamical_friction=int(bool(dynamical_friction)),
+                                ln_lambda=float(ln_lambda), nthreads=nthreads)
+
+    t = t1 + dt*np.arange(nsteps+1)
+    return t, pert_w, w
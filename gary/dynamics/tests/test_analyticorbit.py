@@ -0,0 +1,123 @@
+# coding: utf-8
+
+""" Test analytic orbits in integrable potentials. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from ..analyticactionangle import isochrone_orbit, kepler_orbit, harmonic_oscillator_orbit
+from ...integrate import DOPRI853Integrator, IntegrationStats
+from ...potential import (IsochronePotential, KeplerPotential, HarmonicOscillatorPotential,
+                          HernquistPotential)
+from ...units import galactic
+
+def _bound_orbits(potential, n=32):
+    np.random.seed(42)
+    w0 = np.hstack((np.random.uniform(-10., 10., size=(4*n,3)),
+                    np.random.normal(0., 0.1, size=(4*n,3))))
+    E = 0.5*np.sum(w0[:,3:]**2, axis=-1) + potential.value(w0[:,:3])
+    return w0[E < 0][:n]
+
+def _energy(potential, w):
+    shape = w.shape[:-1]
+    return (0.5*np.sum(w[...,3:]**2, axis=-1) +
+            potential.value(np.ascontiguousarray(w[...,:3].reshape(-1,3))).reshape(shape))
+
+@pytest.mark.parametrize("potential,orbit_func", [
+    (IsochronePotential(m=1E11, b=2., units=galactic), isochrone_orbit),
+    (KeplerPotential(m=1E11, units=galactic), kepler_orbit),
+])
+def test_spherical(potential, orbit_func):
+    w0 = _bound_orbits(potential)
+    t = np.linspace(3., 1003., 1001)
+
+    w = orbit_func(w0, t, potential)
+    assert w.shape == (len(t),) + w0.shape
+    np.testing.assert_allclose(w[0], w0, atol=1E-12)
+
+    # conserves energy and angular momentum
+    E = _energy(potential, w)
+    np.testing.assert_allclose(E, np.repeat(E[:1], len(t), axis=0), rtol=1E-11)
+    L = np.cross(w[...,:3], w[...,3:])
+    np.testing.assert_allclose(L, np.repeat(L[:1], len(t), axis=0), atol=1E-12)
+
+    # agrees with a precise numerical integration
+    t_num,w_num = potential.integrate_orbit(w0, Integrator=DOPRI853Integrator,
+                                            Integrator_kwargs=dict(atol=1E-14, rtol=1E-14),
+                                            t=t)
+    np.testing.assert_allclose(w, w_num, atol=1E-5)
+
+    # the initial conditions can be at any time
+    w2 = orbit_func(w[500], t, potential, t0=t[500])
+    np.testing.assert_allclose(w2, w, atol=1E-8)
+
+def test_isochrone_gradient():
+    # the analytic orbits rely on the gradient matching the potential
+    potential = IsochronePotential(m=1E11, b=2., units=galactic)
+    x = np.array([[3., 1., -2.]])
+    h = 1E-5
+    grad = np.array([(potential.value(x + h*e) - potential.value(x - h*e)) / (2*h)
+                     for e in np.eye(3)]).T
+    np.testing.assert_allclose(potential.gradient(x), grad, rtol=1E-7)
+
+def test_harmonic_oscillator():
+    potential = HarmonicOscillatorPotential(omega=[0.1, 0.2, 0.], units=galactic)
+    np.random.seed(42)
+    w0 = np.random.normal(0., 1., size=(8,6))
+    t = np.linspace(0., 100., 101)
+
+    w = harmonic_oscillator_orbit(w0, t, potential)
+    t_num,w_num = potential.integrate_orbit(w0, Integrator=DOPRI853Integrator,
+                                            Integrator_kwargs=dict(atol=1E-13, rtol=1E-13),
+                                            t=t)
+    np.testing.assert_allclose(w, w_num, atol=1E-10)
+
+    # free motion without a restoring force
+    np.testing.assert_allclose(w[:,:,2], w0[None,:,2] + t[:,None]*w0[None,:,5])
+
+def test_integrate_orbit():
+    potential = IsochronePotential(m=1E11, b=2., units=galactic)
+    w0 = _bound_orbits(potential)
+
+    # any output times, with the same time specification as for integrators
+    t,w = potential.integrate_orbit(w0, dt=0.5, nsteps=1000, t1=10., analytic=True)
+    np.testing.assert_allclose(t, 10. + 0.5*np.arange(1001))
+    np.testing.assert_allclose(w, isochrone_orbit(w0, t, potential))
+
+    t_uneven = np.sort(np.random.uniform(0., 1E4, size=100))
+    t2,w2 = potential.integrate_orbit(w0, t=t_uneven, analytic=True)
+    assert w2.shape == (100,) + w0.shape
+
+    stats = IntegrationStats()
+    potential.integrate_orbit(w0, dt=0.5, nsteps=1000, analytic=True, stats=stats)
+    assert np.all(np.abs(stats.energy_drift) < 1E-11)
+
+    # output to a memory-mapped file in chunks of output times
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "w.mmap"), mode='w+', dtype=np.float64,
+                         shape=(3001,) + w0.shape)
+        t3,w3 = potential.integrate_orbit(w0, dt=0.5, nsteps=3000, t1=10., mmap=mmap,
+                                          analytic=True)
+        np.testing.assert_allclose(np.asarray(w3)[:1001], w, atol=1E-12)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    with pytest.raises(ValueError):  # not integrable
+        HernquistPotential(m=1E11, c=1., units=galactic).integrate_orbit(w0, dt=0.5,
+                                                                           nsteps=10,
+                                                                           analytic=True)
+
+    with pytest.raises(ValueError):  # unbound
+        potential.integrate_orbit([[10., 0, 0, 1., 0, 0]], dt=0.5, nsteps=10, analytic=True)
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+""" Test generating mock streams. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import astropy.units as u
+import numpy as np
+import pytest
+
+# Project
+from ..mockstream import mock_stream, StreaklineSpray, FardalSpray
+from .._mockstream import cy_stream_run
+from ...integrate._leapfrog import cy_leapfrog_run
+from ...potential import HernquistPotential, HarmonicOscillatorPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E12, c=10., units=galactic)
+prog_w0 = [20., 0., 0., 0., 0.15, 0.05]
+
+def test_cy_stream_run():
+    # without the progenitor, each particle follows the same orbit as from
+    #   the leapfrog integrator, starting at its release step
+    np.random.seed(42)
+    nsteps = 500
+    w0 = np.hstack((np.random.uniform(10., 20., size=(8,3)),
+                    np.random.normal(0., 0.1, size=(8,3))))
+    release_step = np.array([0,0,10,100,250,499,500,300], dtype=np.intc)
+    prog_x = np.zeros((nsteps+1,3))
+
+    w = cy_stream_run(pot.c_instance, w0, release_step, prog_x, 0.5)
+    for i in range(len(w0)):
+        t,orbit = cy_leapfrog_run(pot.c_instance, w0[i:i+1].copy(), 0.5,
+                                  nsteps-release_step[i], release_step[i]*0.5)
+        np.testing.assert_allclose(w[i], orbit[-1,0], rtol=1E-12)
+
+    w_threads = cy_stream_run(pot.c_instance, w0, release_step, prog_x, 0.5, nthreads=3)
+    np.testing.assert_array_equal(w_threads, w)
+
+    with pytest.raises(ValueError):
+        cy_stream_run(pot.c_instance, w0, release_step + 1, prog_x, 0.5)
+
+def test_mock_stream():
+    prog_t,prog_w,stream_w,release_t = mock_stream(pot, prog_w0, 1E8*u.Msun, dt=1.,
+                                                   nsteps=2000, release_every=4)
+
+    assert prog_t[-1] == 0.
+    np.testing.assert_allclose(prog_w[-1], prog_w0, atol=1E-10)
+    assert stream_w.shape == (1000,6)
+    np.testing.assert_array_equal(release_t[::2], prog_t[:-1:4])
+
+    # leading particles are more bound than the progenitor, trailing less
+    E = 0.5*np.sum(stream_w[:,3:]**2, axis=-1) + pot.value(stream_w[:,:3])
+    E_prog = 0.5*np.sum(prog_w[-1,3:]**2) + pot.value(prog_w[-1:,:3])[0]
+    assert np.all(E[0::2] < E_prog)
+    assert np.all(E[1::2] > E_prog)
+
+    # same stream with any number of threads
+    stream_w2 = mock_stream(pot, prog_w0, 1E8, dt=1., nsteps=2000, release_every=4,
+                            nthreads=4)[2]
+    np.testing.assert_array_equal(stream_w2, stream_w)
+
+def test_spray_models():
+    r_tide = np.array([0.5, 1.])
+    w = np.array([[10.,0,0,0,0.2,0], [0,20.,0,-0.1,0,0]])
+
+    sw = StreaklineSpray().sample(w, r_tide)
+    assert sw.shape == (2,2,6)
+    np.testing.assert_allclose(np.sqrt(np.sum((sw[:,:,:3] - w[:,None,:3])**2, axis=-1)),
+                               np.vstack((r_tide,r_tide)).T)
+
+    # particles co-rotate with the progenitor
+    Lz = np.cross(sw[...,:3], sw[...,3:])[...,2]
+    r2 = np.sum(sw[...,:3]**2, axis=-1)
+    Omega = np.cross(w[:,:3], w[:,3:])[:,2] / np.sum(w[:,:3]**2, axis=-1)
+    np.testing.assert_allclose(Lz / r2, np.vstack((Omega,Omega)).T)
+
+    sw1 = FardalSpray(seed=42).sample(w, r_tide)
+    sw2 = FardalSpray(seed=42).sample(w, r_tide)
+    np.testing.assert_array_equal(sw1, sw2)
+
+    prog_t,prog_w,stream_w,release_t = mock_stream(pot, prog_w0, 1E8, dt=1., nsteps=1000,
+                                                   spray=FardalSpray(seed=42), n_particles=3,
+                                                   prog_b=0.05, nthreads=2)
+    assert stream_w.shape == (6000,6)
+    assert np.all(np.isfinite(stream_w))
+
+def test_errors():
+    with pytest.raises(ValueError):
+        mock_stream(HarmonicOscillatorPotential(omega=[1.,1.,1.], units=galactic),
+                    prog_w0, 1E8, dt=1., nsteps=100)
+
+    with pytest.raises(ValueError):
+        mock_stream(pot, prog_w0, 1E8, dt=-1., nsteps=100)
+
+    with pytest.raises(ValueError):
+        mock_stream(pot, prog_w0[:4], 1E8, dt=1., nsteps=100)
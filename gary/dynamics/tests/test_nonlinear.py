@@ -6,18 +6,19 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 import os, sys
-import cStringIO as stringio
 
 # Third-party
-from astropy.utils.data import get_pkg_data_fileobj
 import astropy.units as u
 import matplotlib.pyplot as plt
 import numpy as np
 import pytest
 
 # Project
-from ..nonlinear import lyapunov_max, lyapunov_spectrum, sali, fft_orbit
+from ..nonlinear import (lyapunov_max, lyapunov_spectrum, sali,
+                         fast_chaos_indicator)
 from ...integrate import DOPRI853Integrator
+from ...potential import LogarithmicPotential
+from ...units import galactic
 from ...util import gram_schmidt
 
 plot_path = "plots/tests/dynamics"
@@ -95,7 +96,10 @@ class TestForcedPendulum(object):
         plt.plot(t, chaotic_ws[:,0], marker=None)
         plt.savefig(os.path.join(plot_path,"pend_orbit_chaotic.png"))
 
+    @pytest.mark.skipif(True, reason="fft_orbit hasn't been implemented.")
     def test_frequency(self):
+        from ..nonlinear import fft_orbit
+
         import scipy.signal as ss
         nsteps = 10000
         dt = 0.1
@@ -224,24 +228,21 @@ class TestHenonHeiles(object):
             plt.plot(ws[...,0], ws[...,1], marker=None)
             plt.savefig(os.path.join(plot_path,"hh_orbit_lyap_spec_{}.png".format(ii)))
 
-    def test_sali(self):
-        tbls = []
-        with get_pkg_data_fileobj('hh.sali') as f:
-            d = f.read()
-            blocks = d.split("\n\n")
-
-            for block in blocks:
-                tbls.append(np.loadtxt(stringio.StringIO(block)))
-
-        integrator = DOPRI853Integrator(self.F_spec, func_args=self.par)
-        for ii,w0 in enumerate(self.w0s):
-            s, t, ws = sali(w0, integrator, dt=self.dt, nsteps=self.nsteps)
-
-            plt.clf()
-            plt.loglog(t, s, marker=None)
-            plt.loglog(tbls[ii][:,0], tbls[ii][:,1], marker=None, alpha=0.4)
-            plt.savefig(os.path.join(plot_path,"hh_sali_{}.png".format(ii)))
+# --------------------------------------------------------------------
 
-            plt.clf()
-            plt.plot(ws[...,0], ws[...,1], marker=None)
-            plt.savefig(os.path.join(plot_path,"hh_orbit_sali_{}.png".format(ii)))
+def test_sali():
+    # there's no C implementation of the Henon-Heiles potential, so the SALI
+    # values in hh.sali can't be compared against here
+    pot = LogarithmicPotential(v_c=0.2, r_h=0.1, q1=1., q2=0.8, q3=0.6,
+                               units=galactic)
+    w0 = np.array([[1.,1.5,2., 0.,0.,0.],  # chaotic
+                   [5.,0.,0., 0.,0.2,0.05]]) # regular
+    nsteps = 5000
+
+    s,t,status = sali(w0, pot, dt=1., nsteps=nsteps)
+    np.testing.assert_equal(status, [0,0])
+    np.testing.assert_allclose(t, nsteps)
+    assert s[0] < s[1] / 5.
+
+    s2,t2,status2 = fast_chaos_indicator(w0, pot, 1., nsteps, 'sali')
+    np.testing.assert_allclose(s, s2)
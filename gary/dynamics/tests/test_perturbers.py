@@ -0,0 +1,116 @@
+# coding: utf-8
+
+""" Test integrating test particles with massive perturbers. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import astropy.units as u
+import numpy as np
+import pytest
+
+# Project
+from ..perturbers import Perturber, integrate_with_perturbers
+from .._perturbers import cy_perturber_run
+from .._mockstream import cy_stream_run
+from ...integrate._leapfrog import cy_leapfrog_run
+from ...potential import HernquistPotential, HarmonicOscillatorPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E12, c=10., units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(10., 30., size=(64,3)),
+                np.random.normal(0., 0.1, size=(64,3))))
+lmc_w0 = np.array([50., 0., 0., 0., 0.15, 0.05])
+
+def test_massless():
+    # perturbers and particles without any perturber mass follow the same
+    #   orbits as from the leapfrog integrator
+    nsteps = 1000
+    t,pert_w,w = integrate_with_perturbers(pot, w0, [Perturber(lmc_w0, 0., 1.)],
+                                           dt=0.5, nsteps=nsteps, t1=10.)
+    t_lf,w_lf = cy_leapfrog_run(pot.c_instance, np.vstack((w0,lmc_w0)), 0.5, nsteps, 10.)
+
+    np.testing.assert_allclose(t, t_lf)
+    assert pert_w.shape == (nsteps+1,1,6)
+    np.testing.assert_allclose(pert_w[:,0], w_lf[:,-1], rtol=1E-12)
+    np.testing.assert_allclose(w, w_lf[-1,:-1], rtol=1E-12)
+
+    # no perturbers at all
+    t,pert_w,w2 = integrate_with_perturbers(pot, w0, [], dt=0.5, nsteps=nsteps)
+    assert pert_w.shape == (nsteps+1,0,6)
+    np.testing.assert_array_equal(w2, w)
+
+def test_single_perturber():
+    # the test particles feel a single Plummer perturber in the same way as
+    #   stream particles feel their progenitor
+    nsteps = 1000
+    Gm = 1E-3 * pot.G * 1E12
+    pert_w,w = cy_perturber_run(pot.c_instance, w0, lmc_w0[None], np.array([Gm]),
+                                np.array([5.]), np.array([0], dtype=np.intc), 0.5, nsteps)
+
+    stream_w = cy_stream_run(pot.c_instance, w0, np.zeros(len(w0), dtype=np.intc),
+                             np.ascontiguousarray(pert_w[:,0,:3]), 0.5, Gm=Gm, prog_b=5.)
+    np.testing.assert_allclose(w, stream_w, rtol=1E-12)
+
+    # same result with any number of threads
+    pert_w2,w2 = cy_perturber_run(pot.c_instance, w0, lmc_w0[None], np.array([Gm]),
+                                  np.array([5.]), np.array([0], dtype=np.intc), 0.5, nsteps,
+                                  nthreads=3)
+    np.testing.assert_array_equal(w2, w)
+
+def test_mutual_gravity():
+    # two perturbers in a host without mass conserve total momentum
+    host = HernquistPotential(m=0., c=10., units=galactic)
+    perturbers = [Perturber([5.,0,0,0,0.05,0], 1E10*u.Msun, 0.5, profile='hernquist'),
+                  Perturber([-5.,0,0,0,-0.05,0], 1E10*u.Msun, 500*u.pc, profile='hernquist')]
+    t,pert_w,w = integrate_with_perturbers(host, np.zeros((0,6)), perturbers,
+                                           dt=0.1, nsteps=5000)
+
+    p = pert_w[:,:,3:].sum(axis=1)
+    np.testing.assert_allclose(p, 0., atol=1E-12)
+
+    # ...and stay bound
+    r = np.sqrt(np.sum((pert_w[:,0,:3] - pert_w[:,1,:3])**2, axis=-1))
+    assert r.max() < 20.
+
+def test_dynamical_friction():
+    # the orbit of a massive perturber decays with dynamical friction, until
+    #   it sinks to the center of the host
+    perturbers = [Perturber(lmc_w0, 1E10*u.Msun, 5*u.kpc)]
+    kw = dict(dt=1., nsteps=4000)
+    t,pert_w,w = integrate_with_perturbers(pot, w0, perturbers, **kw)
+    t,pert_w_df,w_df = integrate_with_perturbers(pot, w0, perturbers,
+                                                 dynamical_friction=True, **kw)
+
+    def energy(w):
+        return 0.5*np.sum(w[:,3:]**2, axis=-1) + pot.value(np.ascontiguousarray(w[:,:3]))
+
+    E = energy(pert_w[:,0])
+    E_df = energy(pert_w_df[:,0])
+    assert abs(E[-1] - E[0]) < 1E-3*abs(E[0])
+    assert np.all(np.diff(E_df[:3000:100]) < 0.)
+
+    r_df = np.sqrt(np.sum(pert_w_df[:,0,:3]**2, axis=-1))
+    assert np.all(r_df[-100:] < 0.5)
+    assert np.all(np.isfinite(w_df))
+
+def test_errors():
+    with pytest.raises(ValueError):
+        integrate_with_perturbers(HarmonicOscillatorPotential(omega=[1.,1.,1.], units=galactic),
+                                  w0, [], dt=1., nsteps=10)
+
+    with pytest.raises(ValueError):
+        integrate_with_perturbers(pot, w0[:,:4], [], dt=1., nsteps=10)
+
+    with pytest.raises(ValueError):
+        integrate_with_perturbers(pot, w0, [], dt=0., nsteps=10)
+
+    with pytest.raises(ValueError):
+        Perturber(lmc_w0, 1E10, 1., profile='nfw')
+
+    with pytest.raises(ValueError):
+        Perturber(lmc_w0[:3], 1E10, 1.)
@@ -1,3 +1,11 @@
 from .leapfrog import *
 from .rk5 import *
-from .dopri853 import *
\ No newline at end of file
+from .dopri853 import *
+from .symplectic import *
+from .denseorbit import *
+from .stats import *
+from .parallel import *
+from .service import *
+from .cache import *
+from ._events import *
+from ._reducers import *
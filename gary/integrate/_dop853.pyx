@@ -11,77 +11,310 @@ from __future__ import division, print_function
 
 __author__ = "adrn <adrn@astro.columbia.edu>"
 
+# Standard library
+import sys
+
 # Third-party
 import numpy as np
 cimport numpy as np
 np.import_array()
 
 from libc.stdio cimport printf
+from libc.stdlib cimport malloc, realloc, free
 
-from ..potential.cpotential cimport _CPotential
+from ..potential.cpotential cimport (_CPotential, gradientfunc, hessianfunc,
+                                     c_hessian_fd)
+from ._events cimport (CEvent, EventLog, EventSet, interpfunc,
+                       init_events, detect_events)
+from ._reducers cimport CReducer, ReducerSet, init_reducers, update_reducers
+from .core import (_validate_output_array, _flush_output_array,
+                   _save_checkpoint, _load_checkpoint, _checkpoint_id,
+                   _get_rng_state, _set_rng_state, _num_threads, _run_threaded)
+from .stats import _Phase, _reset_stats, _record_energy_drift
 
 cdef extern from "math.h":
     double sqrt(double x) nogil
+    double NAN
+    double INFINITY
     double log(double x) nogil
+    double fabs(double x) nogil
+
+cdef extern from "stdio.h":
+    ctypedef struct FILE
+    FILE *stdout
 
 cdef extern from "dopri/dop853.h":
+    ctypedef struct Dop853Work:
+        unsigned nrds
+        long nfcn, nstep, naccpt, nrejct
+        double hout, xold, xout
+        double *rcont1
+        double *rcont2
+        double *rcont3
+        double *rcont4
+        double *rcont5
+        double *rcont6
+        double *rcont7
+        double *rcont8
+        void *soldata
+
     ctypedef void (*GradFn)(double *pars, double *q, double *grad) nogil
-    ctypedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn)
+    ctypedef void (*SolTrait)(Dop853Work *work, long nr, double xold, double x, double* y, unsigned n, int* irtrn) nogil
     ctypedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits) nogil
-    double contd8 (unsigned ii, double x)
+
+    Dop853Work *dop853_alloc (unsigned n, unsigned nrdens) nogil
+    void dop853_free (Dop853Work *work) nogil
+    double contd8 (Dop853Work *work, unsigned ii, double x) nogil
 
     # See dop853.h for full description of all input parameters
-    int dop853 (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+    int dop853 (Dop853Work *work, unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
                 double x, double* y, double xend,
                 double* rtoler, double* atoler, int itoler, SolTrait solout,
                 int iout, FILE* fileout, double uround, double safe, double fac1,
                 double fac2, double beta, double hmax, double h, long nmax, int meth,
-                long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
+                long nstiff, unsigned nrdens, unsigned* icont, unsigned licont) nogil
 
     void Fwrapper (unsigned ndim, double t, double *w, double *f,
-                   GradFn func, double *pars, unsigned norbits)
-    double six_norm (double *x)
+                   GradFn func, double *pars, unsigned norbits) nogil
+    double six_norm (double *x) nogil
 
-cdef extern from "stdio.h":
-    ctypedef struct FILE
-    FILE *stdout
+ctypedef struct StepStats:
+    long nfcn, nstep, naccpt, nrejct
+    double h_min, h_max
+
+cdef void init_step_stats(StepStats *s) nogil:
+    s.nfcn = s.nstep = s.naccpt = s.nrejct = 0
+    s.h_min = INFINITY
+    s.h_max = 0.
+
+ctypedef struct DenseOutput:
+    double *t           # requested output times
+    int nt              # number of output times
+    int j               # index of the next output time to fill
+    double *out         # output buffer, shape (nrows, nw), or NULL to only update reducers
+    int nrows           # number of rows (time steps) in the output buffer
+    int row_offset      # index of the output time stored in the first row
+    int nw              # total number of phase-space values per row
+    int w_offset        # index of the first phase-space value for these orbits
+    void *flush         # Python callable to empty a full buffer, or NULL
+    CEvent *events      # events to detect, or NULL
+    int nevents
+    int iorbit          # orbit index reported for detected events
+    double *g           # values of the event functions at the previous step
+    double *tmp         # scratch space for root finding
+    EventLog *log
+    StepStats *stats    # step statistics to accumulate, or NULL
+    CReducer *reducers  # reducers to update at the output times if out is NULL
+    int nreducers
+    double *acc         # accumulators of the current orbit
+
+cdef void dop853_interp(void *data, double t, double *w) nogil:
+    cdef:
+        Dop853Work *work = <Dop853Work*>data
+        unsigned k
+
+    for k in range(work.nrds):
+        w[k] = contd8(work, k, t)
+
+cdef void solout(Dop853Work *work, long nr, double xold, double x, double* y, unsigned n, int* irtrn) nogil:
+    """ Called by ``dop853()`` after every accepted step -- uses the dense
+        output interpolant to fill in all requested output times that fall
+        in the interval ``[xold, x]``.
+    """
+    cdef:
+        DenseOutput *d = <DenseOutput*>work.soldata
+        double sign = 1. if x >= xold else -1.
+        double *row
+        int k, ok
+        int stop = 0
+        double t_stop
+
+    if nr == 1:  # initial call, no interpolant yet
+        return
+
+    if d.stats != NULL:
+        d.stats.h_min = min(d.stats.h_min, fabs(x - xold))
+        d.stats.h_max = max(d.stats.h_max, fabs(x - xold))
 
-cdef void solout(long nr, double xold, double x, double* y, unsigned n, int* irtrn):
-    # TODO: see here for example in FORTRAN:
-    #   http://www.unige.ch/~hairer/prog/nonstiff/dr_dop853.f
-    pass
-    # cdef double xout, dx
+    if d.nevents > 0:
+        stop = detect_events(d.events, d.nevents, n, d.iorbit, d.g, xold, x, y,
+                             <interpfunc>dop853_interp, work, d.log, &t_stop, d.tmp)
+        if stop < 0:  # out of memory for the event log
+            irtrn[0] = -1
+            return
+        elif stop:
+            # only fill in output times up to the terminal event
+            irtrn[0] = -1
+            x = t_stop
 
-    # if xold == x:
-    #     return
+    while d.j < d.nt and (sign*(d.t[d.j] - x) <= 0.):
+        if d.out == NULL:
+            for k in range(n):
+                d.tmp[k] = contd8(work, k, d.t[d.j])
+            if update_reducers(d.reducers, d.nreducers, n, d.t[d.j], d.tmp, d.acc) < 0:
+                irtrn[0] = -1
+                return
+            d.j += 1
+            continue
 
-    # print("nr={} xold={} x={} y={} n={}".format(nr, xold, x, y[0], n))
+        if (d.j - d.row_offset) >= d.nrows:
+            if d.flush == NULL:
+                irtrn[0] = -1
+                return
 
-    # # TODO: this is bad - should use a fixed size?
-    # dx = (x - xold) / 10.
-    # xout = xold + dx
-    # while xout <= x:
-    #     print("{0:.5f} {1:.5f} {2:.5f} {3:.3f}".format(contd8(0, xout),
-    #                                                    contd8(1, xout),
-    #                                                    contd8(2, xout),
-    #                                                    dx))
-    #     xout += dx
+            with gil:
+                ok = (<object>d.flush)(d.row_offset, d.nrows)
+            if not ok:
+                irtrn[0] = -1
+                return
+            d.row_offset += d.nrows
+
+        row = d.out + (d.j - d.row_offset)*d.nw + d.w_offset
+        for k in range(n):
+            row[k] = contd8(work, k, d.t[d.j])
+        d.j += 1
+
+class _ChunkWriter(object):
+    """ Empties the output buffer of a chunked integration into ``mmap``. """
+
+    def __init__(self, mmap, buf, stats=None):
+        self.mmap = mmap
+        self.buf = buf
+        self.stats = stats
+        self.seconds = 0.
+        self.exc_info = None
+
+    def __call__(self, j0, nrows):
+        try:
+            with _Phase(self.stats, 'output') as phase:
+                self.mmap[j0:j0+nrows] = self.buf[:nrows]
+                _flush_output_array(self.mmap)
+        except:
+            self.exc_info = sys.exc_info()
+            return False
+        self.seconds += phase.seconds
+        return True
+
+cdef Dop853Work* _alloc_work(unsigned n, unsigned nrdens) except NULL:
+    cdef Dop853Work *work = dop853_alloc(n, nrdens)
+    if work == NULL:
+        raise MemoryError("Not enough free memory for the DOP853 workspace.")
+    return work
+
+# return codes of dop853()
+STATUS_MESSAGES = {
+    1: "Computation successful.",
+    2: "Computation stopped by a terminal event.",
+    -1: "Input is not consistent.",
+    -2: "Larger nmax is needed.",
+    -3: "Step size becomes too small.",
+    -4: "The problem is probably stff (interrupted).",
+}
+
+cdef _check_result(int res):
+    if res < 0:
+        raise RuntimeError(STATUS_MESSAGES[res])
+
+cdef int _dop853_run(Dop853Work *work, _CPotential cpotential, unsigned ndim, unsigned norbits,
+                     double *w, DenseOutput *d, double dt0, double atol, double rtol, int nmax) nogil:
+    """ Integrate the ``norbits`` orbits in ``w`` from time ``d.t[0]`` to
+        ``d.t[d.nt-1]`` in a single call to ``dop853()``. The state at all
+        other output times is filled in by ``solout()`` from the dense output.
+        Returns the return code of ``dop853()``.
+    """
+    if d.nt < 2:
+        return 1
+
+    return _dop853_run_interval(work, cpotential, ndim, norbits, w, d, d.t[0], d.t[d.nt-1],
+                                dt0, atol, rtol, nmax)
+
+cdef int _dop853_run_interval(Dop853Work *work, _CPotential cpotential, unsigned ndim,
+                              unsigned norbits, double *w, DenseOutput *d, double t1, double t2,
+                              double dt0, double atol, double rtol, int nmax) nogil:
+    """ Integrate the ``norbits`` orbits in ``w`` from time ``t1`` to ``t2``,
+        filling in the output times ``d.t[d.j:]`` that fall in the interval.
+        Returns the return code of ``dop853()``.
+    """
+    cdef int res
+
+    work.soldata = d
+    res = dop853(work, ndim*norbits, <FcnEqDiff> Fwrapper,
+                 <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
+                 t1, w, t2, &rtol, &atol, 0, solout, 2,
+                 NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, ndim*norbits, NULL, 0)
+
+    if d.stats != NULL:
+        d.stats.nfcn += work.nfcn * norbits
+        d.stats.nstep += work.nstep
+        d.stats.naccpt += work.naccpt
+        d.stats.nrejct += work.nrejct
+
+    return res
+
+cdef _add_step_stats(stats, StepStats s):
+    if stats is not None:
+        stats._add_steps(s.nfcn, s.nstep, s.naccpt, s.nrejct, s.h_min, s.h_max)
 
 cpdef dop853_integrate_potential(_CPotential cpotential, double[:,::1] w0,
                                  double dt0, int nsteps, double t0,
-                                 double atol, double rtol, int nmax):
+                                 double atol, double rtol, int nmax,
+                                 mmap=None, int chunksize=1024, checkpoint=None,
+                                 stats=None):
+    """
+    dop853_integrate_potential(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax, mmap=None, chunksize=1024, checkpoint=None, stats=None)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with the DOP853 integrator. The GIL is released while integrating. If
+    ``mmap`` is specified, it should be a writeable array-like object (e.g.,
+    a `numpy.memmap` or an HDF5 dataset) with shape ``(nsteps, norbits, ndim)``.
+    Output is then buffered in chunks of ``chunksize`` time steps that are
+    written to and flushed from the output array as the integration proceeds.
+
+    ``checkpoint`` is an optional filename to save the state of the
+    integrator (the orbits and the current step size) to after every chunk.
+    This requires an ``mmap`` output array. The integrator is then restarted
+    at the end of every chunk, with the step size it predicted for the next
+    step. If the file already exists, the integration is resumed from the
+    saved state, so an interrupted integration can be restarted by calling
+    this function again with the same arguments, and gives bit-for-bit the
+    same result as if it had never been interrupted.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance to
+    store the number of force evaluations and steps, the range of step
+    sizes, the energy drift, and the time spent in each phase in.
+    """
     # TODO: add option for a callback function to be called at each step
     cdef:
-        int i, j, k
-        int res, iout
+        int i, k
+        int res = 1
         unsigned norbits = w0.shape[0]
         unsigned ndim = w0.shape[1]
-        double[::1] t = np.empty(nsteps)
+        double[::1] t = t0 + dt0*np.arange(nsteps, dtype=np.float64)
         double[::1] w = np.empty(norbits*ndim)
+        double[:,:,::1] all_w
+        DenseOutput d
+        StepStats step_stats
+        Dop853Work *work
 
-        # Note: icont not needed because nrdens == ndim
-        double t_end = (<double>nsteps) * dt0
-        double[:,:,::1] all_w = np.empty((nsteps,norbits,ndim))
+    stats = _reset_stats(stats)
+    init_step_stats(&step_stats)
+
+    if checkpoint is not None:
+        if mmap is None:
+            raise ValueError("Checkpointing requires an output array (mmap) that "
+                             "persists between restarts.")
+        t,w_out = _dop853_checkpointed(cpotential, w0, t, dt0, atol, rtol, nmax,
+                                       mmap, chunksize, checkpoint, stats)
+        _record_energy_drift(stats, (<object>cpotential).value, w_out)
+        return t,w_out
+
+    writer = None
+    if mmap is None:
+        chunksize = nsteps
+    else:
+        _validate_output_array(mmap, (nsteps,norbits,ndim))
+        chunksize = max(min(chunksize, nsteps), 1)
+    all_w = np.empty((chunksize,norbits,ndim))
 
     # store initial conditions
     for i in range(norbits):
@@ -89,43 +322,629 @@ cpdef dop853_integrate_potential(_CPotential cpotential, double[:,::1] w0,
             w[i*ndim + k] = w0[i,k]
             all_w[0,i,k] = w0[i,k]
 
-    # TODO: dense output?
-    iout = 0  # no solout calls
-    # iout = 2  # dense output
+    if mmap is not None:
+        writer = _ChunkWriter(mmap, np.asarray(all_w), stats)
 
-    # F(ndim, 0., &w[0], &f[0],
-    #   <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]))
+    d.t = &t[0]
+    d.nt = nsteps
+    d.j = 1
+    d.out = &all_w[0,0,0]
+    d.nrows = chunksize
+    d.row_offset = 0
+    d.nw = norbits*ndim
+    d.w_offset = 0
+    d.flush = <void*>writer if writer is not None else NULL
+    d.nevents = 0
+    d.stats = &step_stats if stats is not None else NULL
 
-    # define full array of times
-    t = np.linspace(t0, t_end, nsteps)
-    for j in range(1,nsteps,1):
-        res = dop853(ndim*norbits, <FcnEqDiff> Fwrapper,
-                     <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
-                     t[j-1], &w[0], t[j], &rtol, &atol, 0, solout, iout,
-                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, 0, NULL, 0);
+    work = _alloc_work(ndim*norbits, ndim*norbits)
+    try:
+        with _Phase(stats, 'integrate') as phase:
+            with nogil:
+                res = _dop853_run(work, cpotential, ndim, norbits, &w[0], &d,
+                                  dt0, atol, rtol, nmax)
+            if writer is not None:
+                phase.exclude(writer.seconds)
+    finally:
+        dop853_free(work)
 
-        for i in range(norbits):
-            for k in range(ndim):
-                all_w[j,i,k] = w[i*ndim + k]
+    if writer is not None and writer.exc_info is not None:
+        raise writer.exc_info[0], writer.exc_info[1], writer.exc_info[2]
+    _check_result(res)
+    _add_step_stats(stats, step_stats)
+
+    if mmap is None:
+        _record_energy_drift(stats, (<object>cpotential).value, np.asarray(all_w))
+        return np.asarray(t), np.asarray(all_w)
+
+    # write out whatever is left in the buffer
+    if not writer(d.row_offset, d.j - d.row_offset):
+        raise writer.exc_info[0], writer.exc_info[1], writer.exc_info[2]
+
+    _record_energy_drift(stats, (<object>cpotential).value, mmap)
+    return np.asarray(t), mmap
+
+cdef _dop853_checkpointed(_CPotential cpotential, double[:,::1] w0, double[::1] t,
+                          double dt0, double atol, double rtol, int nmax,
+                          mmap, int chunksize, checkpoint, stats):
+    """ Integrate in separate calls to ``dop853()`` for each chunk of output
+        times, and save the state after each chunk.
+    """
+    cdef:
+        int j, nchunk
+        int res = 1
+        int nsteps = t.shape[0]
+        unsigned norbits = w0.shape[0]
+        unsigned ndim = w0.shape[1]
+        double h = dt0
+        double[::1] w = np.array(w0).ravel()
+        double[:,:,::1] all_w
+        DenseOutput d
+        StepStats step_stats
+        Dop853Work *work
+
+    _validate_output_array(mmap, (nsteps,norbits,ndim))
+    chunksize = max(min(chunksize, nsteps-1), 1)
+    all_w = np.empty((chunksize,norbits,ndim))
+
+    j = 0
+    ckpt_id = _checkpoint_id(cpotential, integrator='dop853', w0=np.asarray(w0),
+                             dt=dt0, nsteps=nsteps, t1=t[0], atol=atol, rtol=rtol)
+    state = _load_checkpoint(checkpoint, **ckpt_id)
+    if state is not None:
+        j = int(state['j'])
+        h = float(state['h'])
+        np.asarray(w)[:] = state['w']
+
+    # store initial conditions
+    if j == 0:
+        mmap[0] = np.asarray(w0)
+
+    # output time t[j+jj] goes in row jj-1 of the buffer
+    d.out = &all_w[0,0,0]
+    d.nrows = chunksize
+    d.row_offset = 1
+    d.nw = norbits*ndim
+    d.w_offset = 0
+    d.flush = NULL
+    d.nevents = 0
+    d.stats = &step_stats if stats is not None else NULL
+    init_step_stats(&step_stats)
+
+    work = _alloc_work(ndim*norbits, ndim*norbits)
+    try:
+        while j < nsteps-1:
+            nchunk = min(chunksize, nsteps-1-j)
+            d.t = &t[j]
+            d.nt = nchunk + 1
+            d.j = 1
+
+            with _Phase(stats, 'integrate'):
+                with nogil:
+                    res = _dop853_run(work, cpotential, ndim, norbits, &w[0], &d,
+                                      h, atol, rtol, nmax)
+            _check_result(res)
+            h = work.hout
+
+            with _Phase(stats, 'output'):
+                mmap[j+1:j+1+nchunk] = np.asarray(all_w[:nchunk])
+                _flush_output_array(mmap)
+            j += nchunk
+
+            with _Phase(stats, 'checkpoint'):
+                _save_checkpoint(checkpoint, j=j, h=h, w=np.asarray(w), **ckpt_id)
+
+    finally:
+        dop853_free(work)
+
+    _add_step_stats(stats, step_stats)
+    return np.asarray(t), mmap
+
+cdef int _dop853_block(_CPotential cpotential, double[:,::1] w0, double[::1] t,
+                       double[:,:,::1] all_w, int i1, int i2,
+                       double dt0, double atol, double rtol, int nmax,
+                       StepStats *stats) nogil:
+    """ Integrate the block of orbits ``w0[i1:i2]`` with its own workspace. """
+    cdef:
+        int i, k, res
+        unsigned norbits = i2 - i1
+        unsigned ndim = w0.shape[1]
+        Dop853Work *work = dop853_alloc(ndim*norbits, ndim*norbits)
+        double *w
+        DenseOutput d
+
+    if work == NULL:
+        return -1
+
+    w = <double*>malloc(ndim*norbits*sizeof(double))
+    if w == NULL:
+        dop853_free(work)
+        return -1
+
+    for i in range(norbits):
+        for k in range(ndim):
+            w[i*ndim + k] = w0[i1+i,k]
+            all_w[0,i1+i,k] = w0[i1+i,k]
+
+    d.t = &t[0]
+    d.nt = t.shape[0]
+    d.j = 1
+    d.out = &all_w[0,0,0]
+    d.nrows = t.shape[0]
+    d.row_offset = 0
+    d.nw = all_w.shape[1]*ndim
+    d.w_offset = i1*ndim
+    d.flush = NULL
+    d.nevents = 0
+    d.stats = stats
+
+    res = _dop853_run(work, cpotential, ndim, norbits, w, &d, dt0, atol, rtol, nmax)
+
+    free(w)
+    dop853_free(work)
+    return res
+
+def dop853_integrate_potential_parallel(_CPotential cpotential, double[:,::1] w0,
+                                        double dt0, int nsteps, double t0,
+                                        double atol, double rtol, int nmax,
+                                        int nthreads=0, stats=None):
+    """
+    dop853_integrate_potential_parallel(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax, nthreads=0, stats=None)
 
-        if res == -1:
-            raise RuntimeError("Input is not consistent.")
-        elif res == -2:
-            raise RuntimeError("Larger nmax is needed.")
-        elif res == -3:
-            raise RuntimeError("Step size becomes too small.")
-        elif res == -4:
-            raise RuntimeError("The problem is probably stff (interrupted).")
+    Same as `dop853_integrate_potential`, but the orbits are split into
+    ``nthreads`` blocks that are integrated at the same time in separate
+    threads (each with its own DOP853 workspace). If ``nthreads`` is 0, the
+    number of CPUs is used. Note that the step size is chosen independently
+    for each block, so the output is not identical to the serial version.
+    The step counts in ``stats`` are summed over the blocks.
+    """
+    cdef:
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        double[::1] t = t0 + dt0*np.arange(nsteps, dtype=np.float64)
+        double[:,:,::1] all_w = np.empty((nsteps,norbits,ndim))
+
+    stats = _reset_stats(stats)
+    thread_stats = [None]*_num_threads(nthreads, norbits)
+
+    def worker(int b, int i1, int i2):
+        cdef int res
+        cdef StepStats s
+        init_step_stats(&s)
+        with nogil:
+            res = _dop853_block(cpotential, w0, t, all_w, i1, i2,
+                                dt0, atol, rtol, nmax, &s)
+        thread_stats[b] = s
+        return res
+
+    with _Phase(stats, 'integrate'):
+        results = _run_threaded(worker, norbits, nthreads)
+
+    for res in results:
+        _check_result(res)
+
+    if stats is not None:
+        for s in thread_stats:
+            stats._add_steps(**s)
+        _record_energy_drift(stats, (<object>cpotential).value, np.asarray(all_w))
 
     return np.asarray(t), np.asarray(all_w)
 
+cdef void _dop853_orbits(_CPotential cpotential, double[:,::1] w0, double[::1] t,
+                         double[:,:,::1] all_w, double[::1] atol, double[::1] rtol,
+                         int[::1] status, int i1, int i2, double dt0, int nmax,
+                         CEvent *events, int nevents, EventLog *log,
+                         StepStats *stats) nogil:
+    """ Integrate each orbit in ``w0[i1:i2]`` separately, with its own step
+        size control and tolerances. The return code of ``dop853()`` for each
+        orbit is stored in ``status``. Output times after a failure or a
+        terminal event are set to NaN.
+    """
+    cdef:
+        int i, j, k
+        unsigned ndim = w0.shape[1]
+        Dop853Work *work = dop853_alloc(ndim, ndim)
+        double *w = <double*>malloc(ndim*sizeof(double))
+        double *tmp = <double*>malloc(ndim*sizeof(double))
+        double *g = <double*>malloc((nevents+1)*sizeof(double))
+        DenseOutput d
+
+    if work == NULL or w == NULL or tmp == NULL or g == NULL:
+        for i in range(i1, i2):
+            status[i] = -1
+        free(w)
+        free(tmp)
+        free(g)
+        dop853_free(work)
+        return
+
+    d.t = &t[0]
+    d.nt = t.shape[0]
+    d.out = &all_w[0,0,0]
+    d.nrows = t.shape[0]
+    d.nw = all_w.shape[1]*ndim
+    d.flush = NULL
+    d.events = events
+    d.nevents = nevents
+    d.g = g
+    d.tmp = tmp
+    d.log = log
+    d.stats = stats
+
+    for i in range(i1, i2):
+        for k in range(ndim):
+            w[k] = w0[i,k]
+            all_w[0,i,k] = w0[i,k]
+
+        d.iorbit = i
+        init_events(events, nevents, ndim, t[0], w, g)
+
+        d.j = 1
+        d.row_offset = 0
+        d.w_offset = i*ndim
+        status[i] = _dop853_run(work, cpotential, ndim, 1, w, &d,
+                                dt0, atol[i], rtol[i], nmax)
+
+        for j in range(d.j, d.nt):
+            for k in range(ndim):
+                all_w[j,i,k] = NAN
+
+    free(w)
+    free(tmp)
+    free(g)
+    dop853_free(work)
+
+def dop853_integrate_potential_independent(_CPotential cpotential, double[:,::1] w0,
+                                           double dt0, int nsteps, double t0,
+                                           atol, rtol, int nmax, int nthreads=1,
+                                           events=None, stats=None):
+    """
+    dop853_integrate_potential_independent(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax, nthreads=1, events=None, stats=None)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with the DOP853 integrator, treating each orbit as an independent system
+    with its own adaptive step size. ``atol`` and ``rtol`` may be scalars or
+    arrays with one tolerance per orbit. A failure for one orbit does not
+    stop the integration of the others; instead, the return code for every
+    orbit is returned in the ``status`` array (see ``STATUS_MESSAGES``) and
+    the output for a failed orbit is NaN after the time of failure. If
+    ``nthreads`` is not 1, the orbits are split between that many threads
+    (0 means the number of CPUs).
+
+    ``events`` is an optional list of `~gary.integrate.Event` instances.
+    The events are located with the dense output interpolant, and the times
+    and states at which they occurred are stored on the event objects. An
+    orbit stopped by a terminal event has status 2.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance
+    (see `dop853_integrate_potential`). The step counts are summed over all
+    orbits.
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+    w : :class:`numpy.ndarray`
+    status : :class:`numpy.ndarray`
+    """
+    cdef:
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        double[::1] t = t0 + dt0*np.arange(nsteps, dtype=np.float64)
+        double[:,:,::1] all_w = np.empty((nsteps,norbits,ndim))
+        double[::1] _atol = np.array(np.broadcast_to(atol, (norbits,)), dtype=np.float64)
+        double[::1] _rtol = np.array(np.broadcast_to(rtol, (norbits,)), dtype=np.float64)
+        int[::1] status = np.zeros(norbits, dtype=np.intc)
+        EventSet evset
+
+    stats = _reset_stats(stats)
+
+    nthreads = _num_threads(nthreads, norbits)
+    evset = EventSet(events if events is not None else [], ndim, nthreads)
+    thread_stats = [None]*nthreads
+
+    def worker(int b, int i1, int i2):
+        cdef StepStats s
+        init_step_stats(&s)
+        with nogil:
+            _dop853_orbits(cpotential, w0, t, all_w, _atol, _rtol,
+                           status, i1, i2, dt0, nmax,
+                           evset.c_events, evset.nevents, &evset.logs[b], &s)
+        thread_stats[b] = s
+
+    with _Phase(stats, 'integrate'):
+        _run_threaded(worker, norbits, nthreads)
+
+    with _Phase(stats, 'events'):
+        evset.collect()
+
+    if stats is not None:
+        for s in thread_stats:
+            stats._add_steps(**s)
+        _record_energy_drift(stats, (<object>cpotential).value, np.asarray(all_w))
+
+    return np.asarray(t), np.asarray(all_w), np.asarray(status)
+
+cdef void _dop853_window_orbits(_CPotential cpotential, double[:,::1] w0, double[::1] t,
+                                double[::1] t_start, double[::1] t_end, double[::1] dt0,
+                                double[:,:,::1] all_w, double[::1] atol, double[::1] rtol,
+                                int[::1] status, int i1, int i2, int nmax,
+                                StepStats *stats) nogil:
+    """ Integrate each orbit in ``w0[i1:i2]`` separately from ``t_start[i]``
+        to ``t_end[i]``, and store the state at the output times ``t`` that
+        fall in that window in ``all_w``. All other output times, and output
+        times after a failure, are set to NaN.
+    """
+    cdef:
+        int i, j, k, j1, j2
+        int nt = t.shape[0]
+        unsigned ndim = w0.shape[1]
+        double sign = 1. if t[nt-1] >= t[0] else -1.
+        double tol
+        Dop853Work *work = dop853_alloc(ndim, ndim)
+        double *w = <double*>malloc(ndim*sizeof(double))
+        DenseOutput d
+
+    if work == NULL or w == NULL:
+        for i in range(i1, i2):
+            status[i] = -1
+        free(w)
+        dop853_free(work)
+        return
+
+    d.out = &all_w[0,0,0]
+    d.nrows = nt
+    d.nw = all_w.shape[1]*ndim
+    d.flush = NULL
+    d.events = NULL
+    d.nevents = 0
+    d.stats = stats
+
+    for i in range(i1, i2):
+        tol = 1E-8 * fabs(dt0[i])
+        for j in range(nt):
+            for k in range(ndim):
+                all_w[j,i,k] = NAN
+
+        # output times in the window: j1 is the first one after the start
+        j1 = 0
+        while j1 < nt and sign*(t[j1] - t_start[i]) < -tol:
+            j1 += 1
+
+        if j1 < nt and fabs(t[j1] - t_start[i]) <= tol:
+            for k in range(ndim):
+                all_w[j1,i,k] = w0[i,k]
+            j1 += 1
+
+        j2 = j1
+        while j2 < nt and sign*(t[j2] - t_end[i]) <= tol:
+            j2 += 1
+
+        status[i] = 1
+        if j2 == j1:
+            continue
+
+        for k in range(ndim):
+            w[k] = w0[i,k]
+
+        # output row (j - row_offset) for the j-th time after the start
+        d.t = &t[j1]
+        d.nt = j2 - j1
+        d.j = 0
+        d.row_offset = -j1
+        d.w_offset = i*ndim
+        d.iorbit = i
+        status[i] = _dop853_run_interval(work, cpotential, ndim, 1, w, &d,
+                                         t_start[i], max(t_end[i], t[j2-1]) if sign > 0
+                                         else min(t_end[i], t[j2-1]),
+                                         dt0[i], atol[i], rtol[i], nmax)
+
+        for j in range(j1 + d.j, j2):
+            for k in range(ndim):
+                all_w[j,i,k] = NAN
+
+    free(w)
+    dop853_free(work)
+
+def dop853_integrate_windows(_CPotential cpotential, double[:,::1] w0, t,
+                             t_start, t_end, atol, rtol, int nmax, dt0=None,
+                             int nthreads=1, stats=None):
+    """
+    dop853_integrate_windows(cpotential, w0, t, t_start, t_end, atol, rtol, nmax, dt0=None, nthreads=1, stats=None)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with the DOP853 integrator, where each orbit has its own integration
+    window: orbit ``i`` starts from ``w0[i]`` at time ``t_start[i]`` and is
+    integrated until ``t_end[i]``, with its own adaptive step size and
+    tolerances. All orbits are output on the common grid of times ``t``
+    (monotonic, but not necessarily evenly spaced) using the dense output
+    interpolant; the output is NaN at times outside of an orbit's window.
+
+    ``t_start``, ``t_end``, ``atol``, ``rtol``, and the initial step sizes
+    ``dt0`` (by default, the spacing of the first two output times) may be
+    scalars or arrays with one value per orbit. As for
+    `dop853_integrate_potential_independent`, a failure for one orbit does
+    not stop the others: the return code for every orbit is returned in the
+    ``status`` array. The orbits are split between ``nthreads`` threads (0
+    means the number of CPUs). ``stats`` is an optional
+    `~gary.integrate.IntegrationStats` instance.
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+    w : :class:`numpy.ndarray`
+    status : :class:`numpy.ndarray`
+    """
+    cdef:
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        double[::1] _t = np.array(t, dtype=np.float64).ravel()
+        double[::1] _t_start = np.array(np.broadcast_to(t_start, (norbits,)), dtype=np.float64)
+        double[::1] _t_end = np.array(np.broadcast_to(t_end, (norbits,)), dtype=np.float64)
+        double[::1] _dt0
+        double[::1] _atol = np.array(np.broadcast_to(atol, (norbits,)), dtype=np.float64)
+        double[::1] _rtol = np.array(np.broadcast_to(rtol, (norbits,)), dtype=np.float64)
+        double[:,:,::1] all_w
+        int[::1] status = np.zeros(norbits, dtype=np.intc)
+        double sign
+
+    if _t.shape[0] < 1:
+        raise ValueError("At least one output time is required.")
+
+    diff = np.diff(_t)
+    if not (np.all(diff > 0) or np.all(diff < 0)):
+        raise ValueError("Output times must be strictly increasing or decreasing.")
+    sign = 1. if _t[_t.shape[0]-1] >= _t[0] else -1.
+
+    if dt0 is None:
+        if _t.shape[0] < 2:
+            raise ValueError("An initial step size is required with a single output time.")
+        dt0 = _t[1] - _t[0]
+    _dt0 = sign*np.abs(np.array(np.broadcast_to(dt0, (norbits,)), dtype=np.float64))
+
+    if np.any(sign*(np.asarray(_t_end) - np.asarray(_t_start)) < 0):
+        raise ValueError("End times must not be before the start times (in the "
+                         "direction of the output times).")
+
+    all_w = np.empty((_t.shape[0],norbits,ndim))
+    stats = _reset_stats(stats)
+    thread_stats = [None]*_num_threads(nthreads, norbits)
+
+    def worker(int b, int i1, int i2):
+        cdef StepStats s
+        init_step_stats(&s)
+        with nogil:
+            _dop853_window_orbits(cpotential, w0, _t, _t_start, _t_end, _dt0, all_w,
+                                  _atol, _rtol, status, i1, i2, nmax, &s)
+        thread_stats[b] = s
+
+    with _Phase(stats, 'integrate'):
+        _run_threaded(worker, norbits, nthreads)
+
+    if stats is not None:
+        for s in thread_stats:
+            stats._add_steps(**s)
+        _record_energy_drift(stats, (<object>cpotential).value, np.asarray(all_w))
+
+    return np.asarray(_t), np.asarray(all_w), np.asarray(status)
+
+cdef void _dop853_reduce_orbits(_CPotential cpotential, double[:,::1] w0, double[::1] t,
+                                double[::1] atol, double[::1] rtol, int[::1] status,
+                                int i1, int i2, double dt0, int nmax,
+                                CReducer *reducers, int nreducers, double[:,::1] acc) nogil:
+    """ Integrate each orbit in ``w0[i1:i2]`` separately, updating its
+        accumulators in ``acc`` at the output times ``t`` instead of storing
+        the orbit. The return code of ``dop853()`` for each orbit is stored in
+        ``status``. Stops early if a reducer fails.
+    """
+    cdef:
+        int i, k
+        unsigned ndim = w0.shape[1]
+        Dop853Work *work = dop853_alloc(ndim, ndim)
+        double *w = <double*>malloc(ndim*sizeof(double))
+        double *tmp = <double*>malloc(ndim*sizeof(double))
+        DenseOutput d
+
+    if work == NULL or w == NULL or tmp == NULL:
+        for i in range(i1, i2):
+            status[i] = -1
+        free(w)
+        free(tmp)
+        dop853_free(work)
+        return
+
+    d.t = &t[0]
+    d.nt = t.shape[0]
+    d.out = NULL
+    d.flush = NULL
+    d.nevents = 0
+    d.tmp = tmp
+    d.stats = NULL
+    d.reducers = reducers
+    d.nreducers = nreducers
+
+    for i in range(i1, i2):
+        for k in range(ndim):
+            w[k] = w0[i,k]
+
+        # stop if a reducer failed (in any thread)
+        d.acc = &acc[i,0]
+        if init_reducers(reducers, nreducers, ndim, t[0], w, d.acc) < 0:
+            break
+
+        d.j = 1
+        status[i] = _dop853_run(work, cpotential, ndim, 1, w, &d,
+                                dt0, atol[i], rtol[i], nmax)
+
+    free(w)
+    free(tmp)
+    dop853_free(work)
+
+def dop853_reduce(_CPotential cpotential, double[:,::1] w0,
+                  double dt0, int nsteps, double t0,
+                  atol, rtol, int nmax, reducers, int nthreads=1):
+    """
+    dop853_reduce(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax, reducers, nthreads=1)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    like `dop853_integrate_potential_independent`, but instead of storing
+    the orbits at the output times, update the per-orbit summary statistics
+    computed by ``reducers`` (a list of `~gary.integrate.Reducer`
+    instances) with the dense output at these times. Only the current state
+    and the accumulators of each orbit are kept in memory, so the memory
+    usage doesn't depend on the number of steps. The results are stored on
+    the reducer objects.
+
+    Returns
+    -------
+    status : :class:`numpy.ndarray`
+        The return code of the integration of each orbit (see
+        ``STATUS_MESSAGES``). For a failed orbit, the statistics only cover
+        the times before the failure.
+    """
+    cdef:
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        double[::1] t = t0 + dt0*np.arange(nsteps, dtype=np.float64)
+        double[::1] _atol = np.array(np.broadcast_to(atol, (norbits,)), dtype=np.float64)
+        double[::1] _rtol = np.array(np.broadcast_to(rtol, (norbits,)), dtype=np.float64)
+        int[::1] status = np.zeros(norbits, dtype=np.intc)
+        ReducerSet rset = ReducerSet(reducers, norbits, ndim)
+        double[:,::1] acc = rset.acc
+
+    rset.set_potential(cpotential.c_value, cpotential._parameters)
+
+    def worker(int b, int i1, int i2):
+        with nogil:
+            _dop853_reduce_orbits(cpotential, w0, t, _atol, _rtol, status, i1, i2,
+                                  dt0, nmax, rset.c_reducers, rset.nreducers, acc)
+
+    _run_threaded(worker, norbits, nthreads)
+    rset.finalize()
+    return np.asarray(status)
+
 cpdef dop853_lyapunov(_CPotential cpotential, double[::1] w0,
                       double dt0, int nsteps, double t0,
                       double atol, double rtol,
-                      double d0, int nsteps_per_pullback, int noffset_orbits):
+                      double d0, int nsteps_per_pullback, int noffset_orbits,
+                      checkpoint=None, int checkpoint_every=1000):
+    """
+    dop853_lyapunov(cpotential, w0, dt0, nsteps, t0, atol, rtol, d0, nsteps_per_pullback, noffset_orbits, checkpoint=None, checkpoint_every=1000)
+
+    Estimate the maximal Lyapunov exponent of an orbit by integrating
+    ``noffset_orbits`` nearby orbits, initially offset by ``d0`` in random
+    directions, and renormalizing the offsets every ``nsteps_per_pullback``
+    steps.
+
+    ``checkpoint`` is an optional filename to save the state of the
+    integration (all orbits, the output so far, and the state of the NumPy
+    random number generator) to every ``checkpoint_every`` pullbacks. If the
+    file already exists, the integration is resumed from the saved state and
+    gives bit-for-bit the same result as an uninterrupted integration.
+    """
     # TODO: add option for a callback function to be called at each step
     cdef:
         int i, j, k, jj
+        int j_start = 0
         int res
         unsigned ndim = w0.size
         unsigned norbits = noffset_orbits + 1
@@ -140,6 +959,7 @@ cpdef dop853_lyapunov(_CPotential cpotential, double[::1] w0,
 
         # temp stuff
         double[:,::1] d0_vec = np.random.uniform(size=(noffset_orbits,ndim))
+        Dop853Work *work
 
     # store initial conditions for parent orbit
     for k in range(ndim):
@@ -156,43 +976,885 @@ cpdef dop853_lyapunov(_CPotential cpotential, double[::1] w0,
 
     # define full array of times
     time = t0
-    for j in range(niter):
-        res = dop853(ndim*norbits, <FcnEqDiff> Fwrapper,
-                     <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
-                     time, &w[0], time + dt0*nsteps_per_pullback,
-                     &rtol, &atol, 0, solout, 0,
-                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     dt0, 0, 0, 1, 0, NULL, 0);
-
-        if res == -1:
-            raise RuntimeError("Input is not consistent.")
-        elif res == -2:
-            raise RuntimeError("Larger nmax is needed.")
-        elif res == -3:
-            raise RuntimeError("Step size becomes too small.")
-        elif res == -4:
-            raise RuntimeError("The problem is probably stff (interrupted).")
-
-        # store position of main orbit
 
-        for k in range(ndim):
-            main_w[j+1,k] = w[k]
+    if checkpoint is not None:
+        ckpt_id = _checkpoint_id(cpotential, integrator='dop853_lyapunov',
+                                 w0=np.asarray(w0), dt=dt0, nsteps=nsteps, t1=t0,
+                                 atol=atol, rtol=rtol, d0=d0,
+                                 nsteps_per_pullback=nsteps_per_pullback,
+                                 noffset_orbits=noffset_orbits)
+        state = _load_checkpoint(checkpoint, **ckpt_id)
+        if state is None:
+            # random state after drawing the offset vectors
+            rng_state = _get_rng_state()
+        else:
+            j_start = int(state['j'])
+            time = float(state['time'])
+            np.asarray(w)[:] = state['w']
+            np.asarray(t)[:] = state['t']
+            np.asarray(main_w)[...] = state['main_w']
+            np.asarray(LEs)[...] = state['LEs']
+            rng_state = _set_rng_state(state)
 
-        # get magnitude of deviation vector
-        for i in range(1,norbits):
-            for k in range(ndim):
-                d1[i,k] = w[i*ndim + k] - w[k]
+    work = _alloc_work(ndim*norbits, 0)
+    try:
+        for j in range(j_start, niter):
+            res = dop853(work, ndim*norbits, <FcnEqDiff> Fwrapper,
+                         <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), norbits,
+                         time, &w[0], time + dt0*nsteps_per_pullback,
+                         &rtol, &atol, 0, solout, 0,
+                         NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                         dt0, 0, 0, 1, 0, NULL, 0);
 
-            d1_mag = six_norm(&d1[i,0])
-            LEs[j,i-1] = log(d1_mag / d0)
+            _check_result(res)
+
+            # store position of main orbit
 
-            # renormalize offset orbits
             for k in range(ndim):
-                w[i*ndim + k] = w[k] + d0 * d1[i,k] / d1_mag
+                main_w[j+1,k] = w[k]
+
+            # get magnitude of deviation vector
+            for i in range(1,norbits):
+                for k in range(ndim):
+                    d1[i,k] = w[i*ndim + k] - w[k]
+
+                d1_mag = six_norm(&d1[i,0])
+                LEs[j,i-1] = log(d1_mag / d0)
+
+                # renormalize offset orbits
+                for k in range(ndim):
+                    w[i*ndim + k] = w[k] + d0 * d1[i,k] / d1_mag
 
-        # advance time
-        time += dt0*nsteps_per_pullback
-        t[j] = time
+            # advance time
+            time += dt0*nsteps_per_pullback
+            t[j] = time
+
+            if checkpoint is not None and ((j+1) % checkpoint_every == 0 or j == niter-1):
+                _save_checkpoint(checkpoint, j=j+1, time=time, w=np.asarray(w),
+                                 t=np.asarray(t), main_w=np.asarray(main_w),
+                                 LEs=np.asarray(LEs), **dict(ckpt_id, **rng_state))
+    finally:
+        dop853_free(work)
 
     LEs = np.array([np.sum(LEs[:j],axis=0)/t[j-1] for j in range(1,niter)])
     return np.array(t), np.array(main_w), np.array(LEs)
+
+# ==============================================================================
+# Variational equations
+#
+ctypedef struct Variational:
+    gradientfunc gradient
+    hessianfunc hessian     # NULL to use finite differences of the gradient
+    double *pars
+    unsigned nvec           # number of tangent vectors
+
+    # output
+    double *t               # all output times
+    int nt                  # index of the last output time for this call + 1
+    int j                   # index of the next output time to fill
+    double t0
+    double *out_w           # orbit, shape (ntimes, 6)
+    double *lyap            # Lyapunov exponent estimates, shape (ntimes, nvec)
+    double *lnsum           # accumulated log stretching at the last re-orthonormalization
+    double *tmp             # scratch space, size 6*(nvec+1)
+    double *norms           # scratch space, size nvec
+
+cdef void Fvariational(unsigned n, double t, double *y, double *f,
+                       GradFn gradfunc, double *gpars, unsigned norbits) nogil:
+    """ Equations of motion of the orbit (first 6 elements of ``y``) together
+        with the linearized equations for the tangent vectors that follow.
+    """
+    cdef:
+        Variational *v = <Variational*>gpars
+        double hess[9]
+        double *dw
+        double *df
+        unsigned i, k, l
+
+    for k in range(3):
+        f[k] = y[3+k]
+        f[3+k] = 0.
+    v.gradient(v.pars, y, &f[3])
+    for k in range(3):
+        f[3+k] = -f[3+k]
+
+    if v.hessian != NULL:
+        v.hessian(v.pars, y, hess)
+    else:
+        c_hessian_fd(v.gradient, v.pars, y, hess)
+
+    for i in range(1,v.nvec+1):
+        dw = &y[6*i]
+        df = &f[6*i]
+        for k in range(3):
+            df[k] = dw[3+k]
+            df[3+k] = 0.
+            for l in range(3):
+                df[3+k] = df[3+k] - hess[3*k+l] * dw[l]
+
+cdef void orthonormalize(double *vecs, unsigned nvec, unsigned ndim, double *norms) nogil:
+    """ Modified Gram-Schmidt orthonormalization (QR decomposition) of the
+        ``nvec`` vectors in ``vecs``, in place. The norms of the vectors after
+        removing the projections on to the previous vectors (the diagonal of R)
+        are stored in ``norms``.
+    """
+    cdef:
+        unsigned i, j, k
+        double dot
+
+    for i in range(nvec):
+        for j in range(i):
+            dot = 0.
+            for k in range(ndim):
+                dot += vecs[i*ndim+k] * vecs[j*ndim+k]
+            for k in range(ndim):
+                vecs[i*ndim+k] -= dot * vecs[j*ndim+k]
+
+        norms[i] = 0.
+        for k in range(ndim):
+            norms[i] += vecs[i*ndim+k] * vecs[i*ndim+k]
+        norms[i] = sqrt(norms[i])
+
+        for k in range(ndim):
+            vecs[i*ndim+k] /= norms[i]
+
+cdef void variational_solout(Dop853Work *work, long nr, double xold, double x,
+                             double* y, unsigned n, int* irtrn) nogil:
+    """ Fill in the orbit and the Lyapunov exponent estimates at all output
+        times in ``[xold, x]``. The exponents are computed from the QR
+        decomposition of the interpolated tangent vectors, so they are the
+        same as if the vectors were re-orthonormalized at every output time.
+    """
+    cdef:
+        Variational *v = <Variational*>work.soldata
+        double sign = 1. if v.t[v.nt-1] >= v.t[v.j-1] else -1.
+        unsigned k
+
+    if nr == 1:
+        return
+
+    while v.j < v.nt and (sign*(v.t[v.j] - x) <= 0.):
+        for k in range(n):
+            v.tmp[k] = contd8(work, k, v.t[v.j])
+
+        for k in range(6):
+            v.out_w[6*v.j + k] = v.tmp[k]
+
+        orthonormalize(&v.tmp[6], v.nvec, 6, v.norms)
+        for k in range(v.nvec):
+            v.lyap[v.nvec*v.j + k] = ((v.lnsum[k] + log(v.norms[k])) /
+                                      fabs(v.t[v.j] - v.t0))
+        v.j += 1
+
+cdef int _variational_run(Dop853Work *work, Variational *v, double *y, int nsteps,
+                          int nsteps_per_reorth, double dt0, double atol, double rtol,
+                          int nmax) nogil:
+    """ Integrate the orbit and tangent vectors in ``y`` over all output times,
+        re-orthonormalizing the tangent vectors every ``nsteps_per_reorth``
+        steps. Returns the return code of ``dop853()``.
+    """
+    cdef:
+        int j0, j1, k
+        int res = 1
+        unsigned n = 6*(v.nvec+1)
+
+    work.soldata = v
+    j0 = 0
+    while j0 < nsteps:
+        j1 = min(j0 + nsteps_per_reorth, nsteps)
+        v.j = j0 + 1
+        v.nt = j1 + 1
+
+        res = dop853(work, n, <FcnEqDiff> Fvariational, NULL, <double*>v, 1,
+                     v.t[j0], y, v.t[j1], &rtol, &atol, 0, variational_solout, 2,
+                     NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, n, NULL, 0)
+        if res < 0:
+            return res
+
+        orthonormalize(&y[6], v.nvec, 6, v.norms)
+        for k in range(v.nvec):
+            v.lnsum[k] += log(v.norms[k])
+        j0 = j1
+
+    return res
+
+cpdef dop853_variational(_CPotential cpotential, double[::1] w0,
+                         double dt0, int nsteps, double t0,
+                         double atol, double rtol, int nmax=0,
+                         int nvecs=6, int nsteps_per_reorth=10,
+                         deviation_vecs=None):
+    """
+    dop853_variational(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax=0, nvecs=6, nsteps_per_reorth=10, deviation_vecs=None)
+
+    Compute Lyapunov exponents of the orbit with initial conditions ``w0`` by
+    integrating the linearized equations of motion (the variational
+    equations) for ``nvecs`` tangent vectors alongside the orbit with the
+    DOP853 integrator. This uses the Hessian of the potential, or finite
+    differences of the gradient if the potential doesn't implement it. The
+    tangent vectors are re-orthonormalized every ``nsteps_per_reorth`` steps,
+    and the logarithms of the stretching factors (the diagonal of the R
+    matrix of the QR decomposition) are accumulated to estimate the
+    exponents. With ``nvecs=1`` this gives the maximal exponent, with
+    ``nvecs=6`` the full spectrum.
+
+    Parameters
+    ----------
+    cpotential : `~gary.potential.cpotential._CPotential`
+    w0 : array_like
+        Initial conditions, shape ``(6,)``.
+    dt0 : numeric
+        Time step between outputs (and initial integrator step size).
+    nsteps : int
+        Number of steps.
+    t0 : numeric
+        Initial time.
+    atol, rtol : numeric
+        Absolute and relative tolerance for the integrator.
+    nmax : int (optional)
+        Maximum number of integrator steps between re-orthonormalizations
+        (0 for the default).
+    nvecs : int (optional)
+        Number of tangent vectors / exponents.
+    nsteps_per_reorth : int (optional)
+        Number of steps between re-orthonormalizations of the tangent vectors.
+    deviation_vecs : array_like (optional)
+        Initial tangent vectors, shape ``(nvecs, 6)``. Defaults to the unit
+        vectors along the first ``nvecs`` phase-space coordinates.
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+        Times, shape ``(nsteps+1,)``.
+    w : :class:`numpy.ndarray`
+        The orbit, shape ``(nsteps+1, 6)``.
+    lyap : :class:`numpy.ndarray`
+        Estimates of the Lyapunov exponents at each time, shape
+        ``(nsteps+1, nvecs)``. Once converged, these are ordered from the
+        largest to the smallest. The first row,
+        at the initial time, is zero.
+    """
+    cdef:
+        int k
+        int res
+        unsigned n = 6*(nvecs+1)
+        double[::1] t = t0 + dt0*np.arange(nsteps+1, dtype=np.float64)
+        double[::1] y = np.zeros(n)
+        double[:,::1] all_w = np.zeros((nsteps+1,6))
+        double[:,::1] lyap = np.zeros((nsteps+1,nvecs))
+        double[::1] lnsum = np.zeros(nvecs)
+        double[::1] tmp = np.zeros(n)
+        double[::1] norms = np.zeros(nvecs)
+        double[:,::1] vecs
+        Variational v
+        Dop853Work *work
+
+    if w0.shape[0] != 6:
+        raise ValueError("Initial conditions must be a single, 6D phase-space position.")
+    if nvecs < 1 or nvecs > 6:
+        raise ValueError("Number of tangent vectors must be between 1 and 6.")
+    if nsteps_per_reorth < 1:
+        raise ValueError("nsteps_per_reorth must be >= 1.")
+
+    if deviation_vecs is None:
+        vecs = np.eye(6)[:nvecs].copy()
+    else:
+        vecs = np.array(deviation_vecs, dtype=np.float64).reshape(nvecs,6)
+
+    for k in range(6):
+        y[k] = w0[k]
+        all_w[0,k] = w0[k]
+    for k in range(6*nvecs):
+        y[6+k] = vecs[k // 6, k % 6]
+    orthonormalize(&y[6], nvecs, 6, &norms[0])
+
+    v.gradient = cpotential.c_gradient
+    v.hessian = cpotential.c_hessian
+    v.pars = cpotential._parameters
+    v.nvec = nvecs
+    v.t = &t[0]
+    v.t0 = t0
+    v.out_w = &all_w[0,0]
+    v.lyap = &lyap[0,0]
+    v.lnsum = &lnsum[0]
+    v.tmp = &tmp[0]
+    v.norms = &norms[0]
+
+    work = _alloc_work(n, n)
+    try:
+        with nogil:
+            res = _variational_run(work, &v, &y[0], nsteps, nsteps_per_reorth,
+                                   dt0, atol, rtol, nmax)
+    finally:
+        dop853_free(work)
+    _check_result(res)
+
+    return np.asarray(t), np.asarray(all_w), np.asarray(lyap)
+
+# ==============================================================================
+# Chaos indicators
+#
+cdef enum:
+    MEGNO = 0
+    FLI = 1
+    SALI = 2
+    GALI = 3
+
+# name : (indicator, number of tangent vectors, large values are chaotic)
+INDICATORS = {
+    'megno': (MEGNO, 1, True),
+    'fli': (FLI, 1, True),
+    'sali': (SALI, 2, False),
+    'gali': (GALI, None, False),
+}
+
+# classification of the orbits
+cdef enum:
+    ORBIT_UNCLASSIFIED = 0
+    ORBIT_CHAOTIC = 1
+    ORBIT_REGULAR = 2
+
+UNCLASSIFIED = ORBIT_UNCLASSIFIED
+CHAOTIC = ORBIT_CHAOTIC
+REGULAR = ORBIT_REGULAR
+
+ctypedef struct ChaosIndicator:
+    Variational v           # variational equations, must be the first member
+    int indicator
+    int megno               # integrate the MEGNO integrals (last 2 elements of the state)
+    int use_chaotic         # stop when the indicator crosses the chaotic threshold
+    double chaotic
+    int use_regular         # stop when the indicator has been within the regular
+    double regular          #   threshold for the last half of the integration
+    int min_steps           # don't classify orbits as regular before this step
+
+cdef void Fchaos(unsigned n, double t, double *y, double *f,
+                 GradFn gradfunc, double *gpars, unsigned norbits) nogil:
+    """ Variational equations, plus (for MEGNO) the time-weighted integral of
+        the logarithmic growth rate of the tangent vector, ``Ytilde``, and the
+        integral of ``Y = Ytilde / t``.
+    """
+    cdef:
+        ChaosIndicator *c = <ChaosIndicator*>gpars
+        double s = t - c.v.t0
+        double dd = 0.
+        double ddot = 0.
+        unsigned k
+
+    Fvariational(n, t, y, f, gradfunc, gpars, norbits)
+
+    if c.megno:
+        for k in range(6):
+            dd += y[6+k] * y[6+k]
+            ddot += y[6+k] * f[6+k]
+        f[n-2] = 2. * s * ddot / dd
+        f[n-1] = y[n-2] / s if s != 0. else 0.
+
+cdef double chaos_value(ChaosIndicator *c, double *y, unsigned n, double s,
+                        double *lnnorm, double value) nogil:
+    """ Renormalize the tangent vectors and return the current value of the
+        indicator (``value`` is the previous value).
+    """
+    cdef:
+        unsigned i, k
+        double norm, plus, minus
+
+    for i in range(c.v.nvec):
+        norm = 0.
+        for k in range(6):
+            norm += y[6*(i+1)+k] * y[6*(i+1)+k]
+        norm = sqrt(norm)
+        lnnorm[i] += log(norm)
+        for k in range(6):
+            y[6*(i+1)+k] /= norm
+
+    if c.indicator == MEGNO:
+        return y[n-1] / s if s != 0. else 0.
+
+    elif c.indicator == FLI:
+        return lnnorm[0] if lnnorm[0] > value else value
+
+    elif c.indicator == SALI:
+        plus = 0.
+        minus = 0.
+        for k in range(6):
+            plus += (y[6+k] + y[12+k])**2
+            minus += (y[6+k] - y[12+k])**2
+        return sqrt(plus) if plus < minus else sqrt(minus)
+
+    else:  # GALI: volume spanned by the normalized tangent vectors
+        for k in range(6*c.v.nvec):
+            c.v.tmp[k] = y[6+k]
+        orthonormalize(c.v.tmp, c.v.nvec, 6, c.v.norms)
+        value = 1.
+        for i in range(c.v.nvec):
+            value *= c.v.norms[i]
+        return value
+
+cdef void _chaos_orbits(ChaosIndicator c, double[:,::1] w0, double[:,::1] vecs,
+                        double[::1] t, double[:,::1] series, double[::1] final,
+                        double[::1] t_end, int[::1] status, int i1, int i2,
+                        double dt0, double atol, double rtol, int nmax,
+                        int large_is_chaotic) nogil:
+    """ Compute the chaos indicator for each orbit in ``w0[i1:i2]`` separately.
+        If ``series`` has any rows, the value at every time is stored there.
+    """
+    cdef:
+        int i, j, k
+        int res, j_regular, stop
+        int nsteps = t.shape[0] - 1
+        int save = series.shape[0] > 0
+        unsigned n = 6*(c.v.nvec+1) + 2*c.megno
+        double value, s
+        Dop853Work *work = dop853_alloc(n, 0)
+        double *y = <double*>malloc(n*sizeof(double))
+        double *lnnorm = <double*>malloc(c.v.nvec*sizeof(double))
+        double *tmp = <double*>malloc(6*c.v.nvec*sizeof(double))
+        double *norms = <double*>malloc(c.v.nvec*sizeof(double))
+
+    if work == NULL or y == NULL or lnnorm == NULL or tmp == NULL or norms == NULL:
+        for i in range(i1, i2):
+            status[i] = -1
+            final[i] = NAN
+            t_end[i] = t[0]
+        free(y)
+        free(lnnorm)
+        free(tmp)
+        free(norms)
+        dop853_free(work)
+        return
+
+    c.v.tmp = tmp
+    c.v.norms = norms
+    c.v.t0 = t[0]
+
+    for i in range(i1, i2):
+        for k in range(n):
+            y[k] = 0.
+        for k in range(6):
+            y[k] = w0[i,k]
+        for k in range(6*c.v.nvec):
+            y[6+k] = vecs[k // 6, k % 6]
+
+        # normalize the initial tangent vectors
+        for k in range(c.v.nvec):
+            lnnorm[k] = 0.
+        value = chaos_value(&c, y, n, 0., lnnorm, -INFINITY)
+        for k in range(c.v.nvec):
+            lnnorm[k] = 0.
+        if c.indicator == FLI:
+            value = 0.
+        if save:
+            series[0,i] = value
+
+        res = 1
+        stop = 0
+        j_regular = -1
+        for j in range(nsteps):
+            res = dop853(work, n, <FcnEqDiff> Fchaos, NULL, <double*>&c, 1,
+                         t[j], y, t[j+1], &rtol, &atol, 0, NULL, 0,
+                         NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, 0, NULL, 0)
+            if res < 0:
+                status[i] = res
+                value = NAN
+                stop = 1
+            else:
+                s = t[j+1] - t[0]
+                value = chaos_value(&c, y, n, s, lnnorm, value)
+
+                if c.use_chaotic and ((large_is_chaotic and value > c.chaotic) or
+                                      (not large_is_chaotic and value < c.chaotic)):
+                    status[i] = ORBIT_CHAOTIC
+                    stop = 1
+
+                elif c.use_regular and ((large_is_chaotic and value < c.regular) or
+                                        (not large_is_chaotic and value > c.regular)):
+                    if j_regular < 0:
+                        j_regular = j+1
+                    if (j+1) >= c.min_steps and j_regular <= (j+1) // 2:
+                        status[i] = ORBIT_REGULAR
+                        stop = 1
+
+                else:
+                    j_regular = -1
+
+            if save:
+                series[j+1,i] = value
+
+            if stop:
+                break
+
+        if not stop:
+            status[i] = ORBIT_UNCLASSIFIED
+        final[i] = value
+        t_end[i] = t[j+1]
+
+        if save:
+            for k in range(j+2, nsteps+1):
+                series[k,i] = NAN
+
+    free(y)
+    free(lnnorm)
+    free(tmp)
+    free(norms)
+    dop853_free(work)
+
+def dop853_chaos_indicator(_CPotential cpotential, double[:,::1] w0,
+                           double dt0, int nsteps, double t0,
+                           double atol, double rtol, int nmax=0,
+                           indicator='megno', int k=3, deviation_vecs=None,
+                           chaotic=None, regular=None, int min_steps=0,
+                           time_series=False, int nthreads=1):
+    """
+    dop853_chaos_indicator(cpotential, w0, dt0, nsteps, t0, atol, rtol, nmax=0, indicator='megno', k=3, deviation_vecs=None, chaotic=None, regular=None, min_steps=0, time_series=False, nthreads=1)
+
+    Compute a chaos indicator for each of the orbits with initial conditions
+    ``w0`` by integrating the variational equations alongside each orbit
+    with the DOP853 integrator. The tangent vectors are renormalized after
+    every step. Available indicators:
+
+        - ``'megno'``: the time-averaged Mean Exponential Growth factor of
+          Nearby Orbits, ``<Y>`` (Cincotta & Simo 2000). Tends to 2 for
+          quasi-periodic orbits, 0 for stable periodic orbits, and grows
+          linearly with time (as ``lambda t / 2``) for chaotic orbits.
+        - ``'fli'``: the Fast Lyapunov Indicator (Froeschle et al. 1997), the
+          maximum over time of the log of the length of a tangent vector.
+          Grows logarithmically in time for regular orbits, and linearly for
+          chaotic orbits.
+        - ``'sali'``: the Smaller Alignment Index (Skokos 2001) of two
+          tangent vectors. Tends to zero exponentially fast for chaotic
+          orbits and fluctuates around a positive value for regular orbits.
+        - ``'gali'``: the Generalized Alignment Index (Skokos et al. 2007),
+          the volume spanned by ``k`` normalized tangent vectors. Tends to
+          zero exponentially fast for chaotic orbits.
+
+    Orbits can be classified early. If ``chaotic`` is specified, an orbit is
+    stopped once the indicator crosses this value (is larger for MEGNO and
+    FLI, smaller for SALI and GALI). If ``regular`` is specified, an orbit is
+    stopped once the indicator has been on the other side of this value for
+    the last half of the integration (and at least ``min_steps`` steps).
+
+    Parameters
+    ----------
+    cpotential : `~gary.potential.cpotential._CPotential`
+    w0 : array_like
+        Initial conditions, shape ``(norbits, 6)``.
+    dt0 : numeric
+        Time step between outputs (and initial integrator step size).
+    nsteps : int
+        Number of steps.
+    t0 : numeric
+        Initial time.
+    atol, rtol : numeric
+        Absolute and relative tolerance for the integrator.
+    nmax : int (optional)
+        Maximum number of integrator steps per output step (0 for the default).
+    indicator : str (optional)
+        Name of the indicator (see above).
+    k : int (optional)
+        Number of tangent vectors for GALI, between 2 and 6.
+    deviation_vecs : array_like (optional)
+        Initial tangent vectors, shape ``(nvecs, 6)``. The default is a fixed,
+        random set of orthonormal vectors.
+    chaotic : numeric (optional)
+        Threshold for stopping chaotic orbits.
+    regular : numeric (optional)
+        Threshold for stopping regular orbits.
+    min_steps : int (optional)
+        Minimum number of steps before an orbit can be classified as regular.
+    time_series : bool (optional)
+        Return the value of the indicator at each time instead of only the
+        final value.
+    nthreads : int (optional)
+        Number of threads to split the orbits between (0 means the number of
+        CPUs).
+
+    Returns
+    -------
+    values : :class:`numpy.ndarray`
+        The final value of the indicator for each orbit, shape ``(norbits,)``,
+        or if ``time_series`` is set, the value at each time, shape
+        ``(nsteps+1, norbits)`` (NaN after an orbit is stopped).
+    t : :class:`numpy.ndarray`
+        The time of the final value for each orbit, or if ``time_series`` is
+        set, the array of times.
+    status : :class:`numpy.ndarray`
+        Classification of each orbit: ``CHAOTIC`` (1) or ``REGULAR`` (2) if it
+        was stopped early, ``UNCLASSIFIED`` (0) if it was integrated for all
+        steps, or the (negative) return code of ``dop853()`` if the
+        integration failed.
+    """
+    cdef:
+        int norbits = w0.shape[0]
+        double[::1] t = t0 + dt0*np.arange(nsteps+1, dtype=np.float64)
+        double[:,::1] series = np.zeros((nsteps+1 if time_series else 0, norbits))
+        double[::1] final = np.zeros(norbits)
+        double[::1] t_end = np.zeros(norbits)
+        int[::1] status = np.zeros(norbits, dtype=np.intc)
+        double[:,::1] vecs
+        ChaosIndicator c
+
+    try:
+        c.indicator, nvecs, large_is_chaotic = INDICATORS[indicator.lower()]
+    except KeyError:
+        raise ValueError("Unknown chaos indicator '{0}' -- must be one of: {1}"
+                         .format(indicator, ", ".join(sorted(INDICATORS.keys()))))
+
+    if nvecs is None:
+        if k < 2 or k > 6:
+            raise ValueError("GALI_k is defined for k between 2 and 6.")
+        nvecs = k
+
+    if w0.shape[1] != 6:
+        raise ValueError("Initial conditions must be 6D phase-space positions.")
+    if nsteps < 1:
+        raise ValueError("Number of steps must be >= 1.")
+
+    if deviation_vecs is None:
+        # fixed so that the results are reproducible
+        q,r = np.linalg.qr(np.random.RandomState(42).normal(size=(6,6)))
+        vecs = np.ascontiguousarray(q.T[:nvecs])
+    else:
+        vecs = np.array(deviation_vecs, dtype=np.float64).reshape(nvecs,6)
+
+    c.v.gradient = cpotential.c_gradient
+    c.v.hessian = cpotential.c_hessian
+    c.v.pars = cpotential._parameters
+    c.v.nvec = nvecs
+    c.megno = c.indicator == MEGNO
+    c.use_chaotic = chaotic is not None
+    c.chaotic = chaotic if chaotic is not None else 0.
+    c.use_regular = regular is not None
+    c.regular = regular if regular is not None else 0.
+    c.min_steps = min_steps
+
+    def worker(int b, int i1, int i2):
+        cdef int _large = large_is_chaotic
+        with nogil:
+            _chaos_orbits(c, w0, vecs, t, series, final, t_end, status, i1, i2,
+                          dt0, atol, rtol, nmax, _large)
+
+    _run_threaded(worker, norbits, nthreads)
+
+    if time_series:
+        return np.asarray(series), np.asarray(t), np.asarray(status)
+    return np.asarray(final), np.asarray(t_end), np.asarray(status)
+
+# ==============================================================================
+# Dense output orbits
+#
+# number of dense output coefficients per phase-space coordinate in each step
+DEF NCOEFF = 8
+
+ctypedef struct SegmentRecord:
+    double *data        # (nseg, 2 + NCOEFF*ndim) -- step start, step size, coefficients
+    long nseg
+    long capacity
+    unsigned ndim
+    int failed          # memory allocation failed
+
+cdef void record_solout(Dop853Work *work, long nr, double xold, double x,
+                        double* y, unsigned n, int* irtrn) nogil:
+    """ Called by ``dop853()`` after every accepted step -- store the dense
+        output polynomial coefficients of the step.
+    """
+    cdef:
+        SegmentRecord *rec = <SegmentRecord*>work.soldata
+        unsigned k, nrow = 2 + NCOEFF*n
+        double *row
+        double *tmp
+
+    if nr == 1:
+        return
+
+    if rec.nseg == rec.capacity:
+        tmp = <double*>realloc(rec.data, 2*rec.capacity*nrow*sizeof(double))
+        if tmp == NULL:
+            rec.failed = 1
+            irtrn[0] = -1
+            return
+        rec.data = tmp
+        rec.capacity = 2*rec.capacity
+
+    row = rec.data + rec.nseg*nrow
+    row[0] = work.xold
+    row[1] = work.hout
+    for k in range(n):
+        row[2 + k] = work.rcont1[k]
+        row[2 + n + k] = work.rcont2[k]
+        row[2 + 2*n + k] = work.rcont3[k]
+        row[2 + 3*n + k] = work.rcont4[k]
+        row[2 + 4*n + k] = work.rcont5[k]
+        row[2 + 5*n + k] = work.rcont6[k]
+        row[2 + 6*n + k] = work.rcont7[k]
+        row[2 + 7*n + k] = work.rcont8[k]
+    rec.nseg += 1
+
+cdef void _dop853_record(_CPotential cpotential, double[:,::1] w0, double t1, double t2,
+                         double atol, double rtol, int nmax, double dt0,
+                         SegmentRecord *rec, long[::1] nseg, int[::1] status,
+                         int i1, int i2) nogil:
+    """ Integrate each orbit in ``w0[i1:i2]`` separately from ``t1`` to
+        ``t2``, appending the dense output of every step to ``rec``. The number
+        of steps for each orbit is stored in ``nseg``.
+    """
+    cdef:
+        int i, k
+        long nseg0
+        unsigned ndim = w0.shape[1]
+        Dop853Work *work = dop853_alloc(ndim, ndim)
+        double *w = <double*>malloc(ndim*sizeof(double))
+
+    rec.ndim = ndim
+    rec.nseg = 0
+    rec.capacity = 1024
+    rec.failed = 0
+    rec.data = <double*>malloc(rec.capacity*(2 + NCOEFF*ndim)*sizeof(double))
+
+    if work == NULL or w == NULL or rec.data == NULL:
+        for i in range(i1, i2):
+            status[i] = -1
+        rec.failed = 1
+        free(w)
+        dop853_free(work)
+        return
+
+    work.soldata = rec
+    for i in range(i1, i2):
+        for k in range(ndim):
+            w[k] = w0[i,k]
+
+        nseg0 = rec.nseg
+        status[i] = dop853(work, ndim, <FcnEqDiff> Fwrapper,
+                           <GradFn>cpotential.c_gradient, &(cpotential._parameters[0]), 1,
+                           t1, w, t2, &rtol, &atol, 0, record_solout, 2,
+                           NULL, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, dt0, nmax, 0, 1, ndim, NULL, 0)
+        nseg[i] = rec.nseg - nseg0
+
+        if rec.failed:
+            status[i] = -1
+            for k in range(i+1, i2):
+                status[k] = -1
+            break
+
+    free(w)
+    dop853_free(work)
+
+def dop853_dense_orbit(_CPotential cpotential, double[:,::1] w0, double t1, double t2,
+                       double atol, double rtol, int nmax=0, double dt0=0.,
+                       int nthreads=1):
+    """
+    dop853_dense_orbit(cpotential, w0, t1, t2, atol, rtol, nmax=0, dt0=0., nthreads=1)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    from time ``t1`` to ``t2`` with the DOP853 integrator, and return a
+    `~gary.integrate.DenseOrbit` that stores the 7th order dense output
+    polynomials of every integration step instead of the orbits at fixed
+    times. The orbits can then be evaluated at any time. Each orbit is
+    integrated with its own adaptive step size, so the size of the
+    representation is set by the tolerances ``atol`` and ``rtol``. ``dt0`` is
+    the initial step size (0 to choose it automatically). If ``nthreads`` is
+    not 1, the orbits are split between that many threads (0 means the
+    number of CPUs).
+    """
+    from .denseorbit import DenseOrbit
+
+    cdef:
+        int b
+        int norbits = w0.shape[0]
+        int ndim = w0.shape[1]
+        int nrow = 2 + NCOEFF*ndim
+        long[::1] nseg = np.zeros(norbits, dtype=np.int_)
+        int[::1] status = np.zeros(norbits, dtype=np.intc)
+        SegmentRecord *recs
+
+    if t2 == t1:
+        raise ValueError("Start and end times must be different.")
+
+    nthreads = _num_threads(nthreads, norbits)
+    recs = <SegmentRecord*>malloc(nthreads*sizeof(SegmentRecord))
+    if recs == NULL:
+        raise MemoryError("Not enough free memory for the dense output.")
+    for b in range(nthreads):
+        recs[b].data = NULL
+        recs[b].nseg = 0
+        recs[b].failed = 0
+
+    def worker(int b, int i1, int i2):
+        with nogil:
+            _dop853_record(cpotential, w0, t1, t2, atol, rtol, nmax, dt0,
+                           &recs[b], nseg, status, i1, i2)
+
+    try:
+        _run_threaded(worker, norbits, nthreads)
+
+        for b in range(nthreads):
+            if recs[b].failed:
+                raise MemoryError("Not enough free memory for the dense output.")
+
+        for i in range(norbits):
+            if status[i] < 0:
+                raise RuntimeError("Integration failed for orbit {0}: {1}"
+                                   .format(i, STATUS_MESSAGES.get(status[i])))
+
+        # the threads integrate contiguous blocks of orbits, so the segments are
+        #   in the order of the orbits
+        segments = np.concatenate([np.array(<double[:recs[b].nseg,:nrow]>recs[b].data)
+                                   if recs[b].nseg > 0 else np.zeros((0,nrow))
+                                   for b in range(nthreads)])
+    finally:
+        for b in range(nthreads):
+            free(recs[b].data)
+        free(recs)
+
+    offsets = np.concatenate(([0], np.cumsum(nseg)))
+    return DenseOrbit(t1, t2, segments[:,0], segments[:,1],
+                      segments[:,2:].reshape(-1,NCOEFF,ndim), offsets)
+
+def dense_orbit_eval(double[::1] t_start, double[::1] h, double[:,:,::1] coeffs,
+                     long[::1] offsets, double[::1] t, long[::1] orbits):
+    """
+    dense_orbit_eval(t_start, h, coeffs, offsets, t, orbits)
+
+    Evaluate the dense output polynomials stored in a
+    `~gary.integrate.DenseOrbit` for the given orbits at times ``t``. Returns
+    an array with shape ``(len(t), len(orbits), ndim)``.
+    """
+    cdef:
+        int i, j, k, c
+        long lo, hi, mid, seg
+        int ntimes = t.shape[0]
+        int norbits = orbits.shape[0]
+        int ndim = coeffs.shape[2]
+        double sign, s, s1, val
+        double[:,:,::1] w = np.empty((ntimes, norbits, ndim))
+
+    with nogil:
+        for i in range(norbits):
+            lo = offsets[orbits[i]]
+            hi = offsets[orbits[i]+1]
+            sign = 1. if h[lo] > 0 else -1.
+
+            for j in range(ntimes):
+                # last step that starts before the time t[j]
+                seg = lo
+                mid = hi
+                while mid - seg > 1:
+                    k = <int>((mid - seg) // 2)
+                    if sign*(t[j] - t_start[seg+k]) >= 0.:
+                        seg = seg + k
+                    else:
+                        mid = seg + k
+
+                s = (t[j] - t_start[seg]) / h[seg]
+                s1 = 1. - s
+                for c in range(ndim):
+                    val = coeffs[seg,7,c]
+                    val = coeffs[seg,6,c] + s*val
+                    val = coeffs[seg,5,c] + s1*val
+                    val = coeffs[seg,4,c] + s*val
+                    val = coeffs[seg,3,c] + s1*val
+                    val = coeffs[seg,2,c] + s*val
+                    val = coeffs[seg,1,c] + s1*val
+                    w[j,i,c] = coeffs[seg,0,c] + s*val
+
+    return np.asarray(w)
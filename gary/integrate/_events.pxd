@@ -0,0 +1,41 @@
+cdef struct CEvent
+
+ctypedef double (*eventfunc)(CEvent *event, double t, double *w, int ndim) nogil
+ctypedef void (*interpfunc)(void *data, double t, double *w) nogil
+
+cdef struct CEvent:
+    eventfunc func
+    double pars[2]
+    int direction
+    int terminal
+    void *pyobj  # Python event object for user-supplied event functions
+    int error    # set if a user-supplied event function raised an exception
+
+ctypedef struct EventLog:
+    int n
+    int size
+    int ndim
+    int failed      # set if the log couldn't grow to add an event
+    int *event
+    int *orbit
+    double *t
+    double *w
+
+cdef void init_events(CEvent *events, int nevents, int ndim,
+                      double t, double *w, double *g) nogil
+
+cdef int detect_events(CEvent *events, int nevents, int ndim, int iorbit,
+                       double *g_prev, double t0, double t1, double *w1,
+                       interpfunc interp, void *interp_data,
+                       EventLog *log, double *t_stop, double *tmp) nogil
+
+cdef class EventSet:
+    cdef CEvent *c_events
+    cdef int nevents
+    cdef int ndim
+    cdef EventLog *logs
+    cdef int nlogs
+    cdef object events
+
+    cpdef check(self)
+    cpdef collect(self)
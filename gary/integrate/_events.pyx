@@ -0,0 +1,491 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Event detection for the Cython integrators. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import sys
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+from libc.stdlib cimport malloc, calloc, realloc, free
+from libc.string cimport memcpy
+
+cdef extern from "math.h":
+    double sqrt(double x) nogil
+    double fabs(double x) nogil
+
+__all__ = ['Event', 'Pericenter', 'Apocenter', 'PlaneCrossing',
+           'EscapeRadius', 'TargetTime', 'FunctionEvent']
+
+# ----------------------------------------------------------------------------
+# Built-in event functions
+#
+cdef double pericenter_func(CEvent *event, double t, double *w, int ndim) nogil:
+    """ Radial velocity, q.p """
+    cdef:
+        int k
+        int n = ndim // 2
+        double g = 0.
+
+    for k in range(n):
+        g += w[k]*w[n+k]
+    return g
+
+cdef double plane_func(CEvent *event, double t, double *w, int ndim) nogil:
+    return w[<int>event.pars[0]] - event.pars[1]
+
+cdef double radius_func(CEvent *event, double t, double *w, int ndim) nogil:
+    cdef:
+        int k
+        double r2 = 0.
+
+    for k in range(ndim // 2):
+        r2 += w[k]*w[k]
+    return sqrt(r2) - event.pars[0]
+
+cdef double time_func(CEvent *event, double t, double *w, int ndim) nogil:
+    return t - event.pars[0]
+
+cdef double python_func(CEvent *event, double t, double *w, int ndim) nogil:
+    """ Calls the function of a `FunctionEvent`. If it raises, the exception
+        is stored on the event object and ``event.error`` is set, so that
+        the integration can be stopped and the exception re-raised.
+    """
+    cdef:
+        int k
+        double g = 0.
+        double[::1] arr
+
+    if event.error:
+        return g
+
+    with gil:
+        arr = np.empty(ndim)
+        for k in range(ndim):
+            arr[k] = w[k]
+        try:
+            g = (<FunctionEvent>event.pyobj).func(t, np.asarray(arr))
+        except:
+            (<FunctionEvent>event.pyobj).exc_info = sys.exc_info()
+            event.error = 1
+    return g
+
+cdef int events_failed(CEvent *events, int nevents) nogil:
+    cdef int k
+    for k in range(nevents):
+        if events[k].error:
+            return 1
+    return 0
+
+# ----------------------------------------------------------------------------
+# Root finding and bookkeeping
+#
+cdef int event_log_append(EventLog *log, int ievent, int iorbit,
+                          double t, double *w) nogil:
+    """ Add an event to ``log``. Returns -1 (and sets ``log.failed``) if
+        the log couldn't grow -- the events already in it are kept.
+    """
+    cdef:
+        int size
+        int *event
+        int *orbit
+        double *tt
+        double *ww
+
+    if log.n == log.size:
+        size = max(2*log.size, 16)
+
+        # a successful realloc invalidates the old buffer, so keep each new
+        #   buffer, but only grow the log once all four succeeded
+        event = <int*>realloc(log.event, size*sizeof(int))
+        if event != NULL:
+            log.event = event
+        orbit = <int*>realloc(log.orbit, size*sizeof(int))
+        if orbit != NULL:
+            log.orbit = orbit
+        tt = <double*>realloc(log.t, size*sizeof(double))
+        if tt != NULL:
+            log.t = tt
+        ww = <double*>realloc(log.w, size*log.ndim*sizeof(double))
+        if ww != NULL:
+            log.w = ww
+
+        if event == NULL or orbit == NULL or tt == NULL or ww == NULL:
+            log.failed = 1
+            return -1
+        log.size = size
+
+    log.event[log.n] = ievent
+    log.orbit[log.n] = iorbit
+    log.t[log.n] = t
+    memcpy(log.w + log.n*log.ndim, w, log.ndim*sizeof(double))
+    log.n += 1
+    return 0
+
+cdef int crossed(CEvent *event, double g0, double g1) nogil:
+    if g0 < 0. and g1 >= 0.:
+        return event.direction >= 0
+    elif g0 > 0. and g1 <= 0.:
+        return event.direction <= 0
+    return 0
+
+cdef double find_root(CEvent *event, int ndim, double t0, double g0,
+                      double t1, double g1, interpfunc interp, void *interp_data,
+                      double *tmp) nogil:
+    """ Locate the root of the event function between ``t0`` and ``t1``
+        with the Illinois (modified regula falsi) method, using the
+        interpolant to evaluate the state.
+    """
+    cdef:
+        int i
+        int side = 0
+        double tc = t1
+        double gc
+        double tol = 1E-14 * max(max(fabs(t0), fabs(t1)), fabs(t1-t0))
+
+    if g1 == 0.:
+        return t1
+
+    for i in range(128):
+        tc = (g0*t1 - g1*t0) / (g0 - g1)
+        interp(interp_data, tc, tmp)
+        gc = event.func(event, tc, tmp, ndim)
+
+        if gc*g1 > 0.:
+            t1 = tc
+            g1 = gc
+            if side == -1:
+                g0 /= 2.
+            side = -1
+
+        elif gc*g0 > 0.:
+            t0 = tc
+            g0 = gc
+            if side == 1:
+                g1 /= 2.
+            side = 1
+
+        else:
+            break
+
+        if fabs(t1 - t0) < tol:
+            break
+
+    return tc
+
+cdef void init_events(CEvent *events, int nevents, int ndim,
+                      double t, double *w, double *g) nogil:
+    """ Evaluate the event functions at the initial conditions. """
+    cdef int k
+    for k in range(nevents):
+        g[k] = events[k].func(&events[k], t, w, ndim)
+
+cdef int detect_events(CEvent *events, int nevents, int ndim, int iorbit,
+                       double *g_prev, double t0, double t1, double *w1,
+                       interpfunc interp, void *interp_data,
+                       EventLog *log, double *t_stop, double *tmp) nogil:
+    """ Check for events over the step from ``t0`` to ``t1`` (the state at
+        ``t1`` is ``w1``), and add any that occurred to ``log``. If a
+        terminal event occurred, only events up to the earliest terminal
+        event are logged, its time is stored in ``t_stop``, and 1 is
+        returned. Returns -1 if an event couldn't be added to the log or an
+        event function raised an exception.
+        ``g_prev`` holds the values of the event functions at
+        ``t0`` and is updated to the values at ``t1``. ``tmp`` must hold
+        at least ``ndim`` values.
+    """
+    cdef:
+        int k
+        int stop = 0
+        double g1, te
+        double sign = 1. if t1 >= t0 else -1.
+
+    if events_failed(events, nevents):
+        return -1
+
+    # first pass: find the earliest terminal event
+    for k in range(nevents):
+        if not events[k].terminal:
+            continue
+
+        g1 = events[k].func(&events[k], t1, w1, ndim)
+        if crossed(&events[k], g_prev[k], g1):
+            te = find_root(&events[k], ndim, t0, g_prev[k], t1, g1,
+                           interp, interp_data, tmp)
+            if not stop or sign*(te - t_stop[0]) < 0:
+                t_stop[0] = te
+            stop = 1
+
+    # second pass: log all events up to the stopping time
+    for k in range(nevents):
+        g1 = events[k].func(&events[k], t1, w1, ndim)
+        if crossed(&events[k], g_prev[k], g1):
+            te = find_root(&events[k], ndim, t0, g_prev[k], t1, g1,
+                           interp, interp_data, tmp)
+            if not stop or sign*(te - t_stop[0]) <= 0:
+                interp(interp_data, te, tmp)
+                if event_log_append(log, k, iorbit, te, tmp) < 0:
+                    return -1
+        g_prev[k] = g1
+
+    if events_failed(events, nevents):
+        return -1
+    return stop
+
+# ----------------------------------------------------------------------------
+# Python interface
+#
+cdef class Event:
+    """
+    Base class for events that are detected while integrating orbits with
+    the Cython integrators. After an integration, the times, phase-space
+    positions, and orbit indices at which the event occurred are stored in
+    the attributes ``t``, ``w``, and ``orbit``.
+
+    Parameters
+    ----------
+    direction : int (optional)
+        Only detect zero crossings of the event function in this direction:
+        +1 for increasing, -1 for decreasing, 0 for both.
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    cdef CEvent c
+    cdef public object t, w, orbit
+
+    def __init__(self, direction=0, terminal=False):
+        self.c.direction = direction
+        self.c.terminal = terminal
+        self.t = self.w = self.orbit = None
+
+    property direction:
+        def __get__(self):
+            return self.c.direction
+
+    property terminal:
+        def __get__(self):
+            return bool(self.c.terminal)
+
+    def __repr__(self):
+        return "<{0} direction={1} terminal={2}>".format(self.__class__.__name__,
+                                                         self.direction, self.terminal)
+
+cdef class Pericenter(Event):
+    """
+    Pericentric passages, i.e. where the radial velocity changes sign from
+    negative to positive.
+
+    Parameters
+    ----------
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    def __init__(self, terminal=False):
+        super(Pericenter, self).__init__(direction=1, terminal=terminal)
+        self.c.func = pericenter_func
+
+cdef class Apocenter(Event):
+    """
+    Apocentric passages, i.e. where the radial velocity changes sign from
+    positive to negative.
+
+    Parameters
+    ----------
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    def __init__(self, terminal=False):
+        super(Apocenter, self).__init__(direction=-1, terminal=terminal)
+        self.c.func = pericenter_func
+
+cdef class PlaneCrossing(Event):
+    """
+    Crossings of the plane where the coordinate ``axis`` is equal to
+    ``value`` -- by default, crossings of the disk plane ``z=0``.
+
+    Parameters
+    ----------
+    axis : int (optional)
+        Index of the coordinate.
+    value : numeric (optional)
+    direction : int (optional)
+        +1 for upward crossings, -1 for downward crossings, 0 for both.
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    def __init__(self, axis=2, value=0., direction=0, terminal=False):
+        super(PlaneCrossing, self).__init__(direction=direction, terminal=terminal)
+        self.c.func = plane_func
+        self.c.pars[0] = axis
+        self.c.pars[1] = value
+
+cdef class EscapeRadius(Event):
+    """
+    The orbit moves beyond the radius ``r``. By default, integration of the
+    orbit is stopped when this happens.
+
+    Parameters
+    ----------
+    r : numeric
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    def __init__(self, r, terminal=True):
+        super(EscapeRadius, self).__init__(direction=1, terminal=terminal)
+        self.c.func = radius_func
+        self.c.pars[0] = r
+
+cdef class TargetTime(Event):
+    """
+    The integration reaches the time ``t`` (which doesn't have to be one of
+    the output times). By default, integration is stopped at this time.
+
+    Parameters
+    ----------
+    t : numeric
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    def __init__(self, t, terminal=True):
+        super(TargetTime, self).__init__(direction=0, terminal=terminal)
+        self.c.func = time_func
+        self.c.pars[0] = t
+
+cdef class FunctionEvent(Event):
+    """
+    A user-supplied event, defined as the zero crossings of the function
+    ``func(t, w)``, where ``w`` is the phase-space position of a single
+    orbit. Note that the function is called with the GIL held, so this is
+    much slower than the built-in events. If the function raises an
+    exception, the integration is stopped and the exception is re-raised.
+
+    Parameters
+    ----------
+    func : callable
+    direction : int (optional)
+        +1 for increasing, -1 for decreasing, 0 for both.
+    terminal : bool (optional)
+        Stop integrating an orbit when the event occurs.
+    """
+    cdef object func
+    cdef object exc_info
+
+    def __init__(self, func, direction=0, terminal=False):
+        super(FunctionEvent, self).__init__(direction=direction, terminal=terminal)
+        self.func = func
+        self.exc_info = None
+        self.c.func = python_func
+        self.c.pyobj = <void*>self
+
+cdef class EventSet:
+    """ C-level copy of a list of events, with one log of the detected
+        events per thread.
+    """
+
+    def __cinit__(self, events, int ndim, int nlogs=1):
+        cdef:
+            int k
+            Event event
+
+        self.events = list(events)
+        self.nevents = len(self.events)
+        self.ndim = ndim
+        self.nlogs = nlogs
+
+        self.c_events = <CEvent*>malloc(max(self.nevents,1)*sizeof(CEvent))
+        self.logs = <EventLog*>calloc(nlogs, sizeof(EventLog))
+        if self.c_events == NULL or self.logs == NULL:
+            raise MemoryError()
+
+        for k in range(nlogs):
+            self.logs[k].ndim = ndim
+
+        for k in range(self.nevents):
+            event = self.events[k]
+            if event.c.func == NULL:
+                raise TypeError("Event {0} does not define an event function.".format(event))
+            self.c_events[k] = event.c
+
+    def __dealloc__(self):
+        cdef int k
+        if self.logs != NULL:
+            for k in range(self.nlogs):
+                free(self.logs[k].event)
+                free(self.logs[k].orbit)
+                free(self.logs[k].t)
+                free(self.logs[k].w)
+        free(self.logs)
+        free(self.c_events)
+
+    cpdef check(self):
+        """ Re-raise the exception of an event function that failed, and
+            raise a `MemoryError` if any detected events were lost.
+        """
+        cdef int i
+
+        for i in range(self.nevents):
+            if self.c_events[i].error:
+                exc_info = (<FunctionEvent>self.events[i]).exc_info
+                (<FunctionEvent>self.events[i]).exc_info = None
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+        for i in range(self.nlogs):
+            if self.logs[i].failed:
+                raise MemoryError("Not enough free memory for the event log.")
+
+    cpdef collect(self):
+        """ Store the detected events, sorted by orbit and time, on the
+            Python event objects.
+        """
+        cdef:
+            int i, j, k, m
+            int n = 0
+            EventLog *log
+            int[::1] ev
+            int[::1] orbit
+            double[::1] t
+            double[:,::1] w
+
+        self.check()
+
+        for i in range(self.nlogs):
+            n += self.logs[i].n
+
+        ev = np.empty(n, dtype=np.intc)
+        orbit = np.empty(n, dtype=np.intc)
+        t = np.empty(n)
+        w = np.empty((n, self.ndim))
+
+        m = 0
+        for i in range(self.nlogs):
+            log = &self.logs[i]
+            for j in range(log.n):
+                ev[m] = log.event[j]
+                orbit[m] = log.orbit[j]
+                t[m] = log.t[j]
+                for k in range(self.ndim):
+                    w[m,k] = log.w[j*self.ndim + k]
+                m += 1
+
+        _ev = np.asarray(ev)
+        _orbit = np.asarray(orbit)
+        _t = np.asarray(t)
+        _w = np.asarray(w)
+        for k in range(self.nevents):
+            ix = np.where(_ev == k)[0]
+            ix = ix[np.lexsort((_t[ix], _orbit[ix]))]
+            self.events[k].orbit = _orbit[ix].astype(int)
+            self.events[k].t = _t[ix]
+            self.events[k].w = _w[ix]
@@ -16,11 +16,65 @@ import numpy as np
 cimport numpy as np
 np.import_array()
 
+from libc.stdlib cimport malloc, free
+
 # Project
 from ..potential.cpotential cimport _CPotential
+from ._events cimport (CEvent, EventLog, EventSet, interpfunc,
+                       init_events, detect_events)
+from ._reducers cimport CReducer, ReducerSet, init_reducers, update_reducers
+from .core import (_validate_output_array, _flush_output_array,
+                   _save_checkpoint, _load_checkpoint, _checkpoint_id,
+                   _run_threaded)
+from .stats import _Phase, _reset_stats, _fixed_step_stats
+
+cdef extern from "math.h":
+    double NAN
+    double sqrt(double x) nogil
+    double fabs(double x) nogil
+    double sin(double x) nogil
+    double cos(double x) nogil
+    double atan2(double y, double x) nogil
 
 # ctypedef void (*f_type)(int, double*, double*)
 
+ctypedef struct LeapfrogEvents:
+    CEvent *events
+    int nevents
+    EventLog *log
+    double *g           # event function values at the previous step, (n, nevents)
+    double *w_prev      # state at the previous step, (n, 2*ndim)
+    double *a_prev      # acceleration at the previous step, (n, ndim)
+    double *a           # scratch space for the current acceleration, (ndim,)
+    double *tmp         # scratch space for root finding, (2*ndim,)
+    int *stopped        # orbits stopped by a terminal event, (n,)
+
+ctypedef struct HermiteData:
+    int ndim
+    double t0, t1
+    double *w0
+    double *w1
+    double *a0
+    double *a1
+
+cdef void hermite_interp(void *data, double t, double *w) nogil:
+    """ Cubic Hermite interpolation of the phase-space position between
+        two steps, using the velocities and accelerations at both ends.
+    """
+    cdef:
+        HermiteData *hd = <HermiteData*>data
+        int k, ndim = hd.ndim
+        double h = hd.t1 - hd.t0
+        double s = (t - hd.t0) / h
+        double h00 = (1 + 2*s) * (1 - s)*(1 - s)
+        double h10 = s * (1 - s)*(1 - s)
+        double h01 = s*s * (3 - 2*s)
+        double h11 = s*s * (s - 1)
+
+    for k in range(ndim):
+        w[k] = h00*hd.w0[k] + h10*h*hd.w0[ndim+k] + h01*hd.w1[k] + h11*h*hd.w1[ndim+k]
+        w[ndim+k] = h00*hd.w0[ndim+k] + h10*h*hd.a0[k] + h01*hd.w1[ndim+k] + h11*h*hd.a1[k]
+
 cdef void c_init_velocity(_CPotential p, int ndim, double t, double dt,
                           double *x_jm1, double *v_jm1, double *v_jm1_2, double *grad) nogil:
     cdef int k
@@ -46,43 +100,1024 @@ cdef void c_leapfrog_step(_CPotential p, int ndim, double t, double dt,
         v_jm1[k] = v_jm1_2[k] - grad[k] * dt/2.
         v_jm1_2[k] = v_jm1_2[k] - grad[k] * dt
 
+cdef void c_leapfrog_steps_events(_CPotential p, int n, int ndim, int nsteps,
+                                  double t, double dt, double[:,::1] w, double[:,::1] v_jm1_2,
+                                  double[::1] grad, double[:,:,::1] out_w,
+                                  LeapfrogEvents *ev) nogil:
+    """ Same as ``c_leapfrog_steps``, but checks for events after every step.
+        Orbits stopped by a terminal event are no longer advanced and their
+        output is set to NaN. Returns early if the event log runs out of
+        memory (``ev.log.failed`` is set).
+    """
+    cdef:
+        int i,j,k,stop
+        double t_stop
+        HermiteData hd
+
+    hd.ndim = ndim
+    hd.a1 = ev.a
+
+    for j in range(nsteps):
+        t += dt
+        for i in range(n):
+            if ev.stopped[i]:
+                for k in range(2*ndim):
+                    out_w[j,i,k] = NAN
+                continue
+
+            for k in range(2*ndim):
+                ev.w_prev[i*2*ndim + k] = w[i,k]
+
+            for k in range(ndim):
+                grad[k] = 0.
+
+            c_leapfrog_step(p, ndim, t, dt,
+                            &w[i,0], &w[i,ndim], &v_jm1_2[i,0], &grad[0])
+
+            for k in range(ndim):
+                ev.a[k] = -grad[k]
+
+            hd.t0 = t - dt
+            hd.t1 = t
+            hd.w0 = &ev.w_prev[i*2*ndim]
+            hd.w1 = &w[i,0]
+            hd.a0 = &ev.a_prev[i*ndim]
+            stop = detect_events(ev.events, ev.nevents, 2*ndim, i, &ev.g[i*ev.nevents],
+                                 t - dt, t, &w[i,0], <interpfunc>hermite_interp, &hd,
+                                 ev.log, &t_stop, ev.tmp)
+            if stop < 0:  # out of memory for the event log
+                return
+            elif stop:
+                ev.stopped[i] = 1
+                for k in range(2*ndim):
+                    out_w[j,i,k] = NAN
+                continue
+
+            for k in range(ndim):
+                ev.a_prev[i*ndim + k] = ev.a[k]
+
+            for k in range(2*ndim):
+                out_w[j,i,k] = w[i,k]
+
+cdef void c_leapfrog_steps(_CPotential p, int n, int ndim, int nsteps,
+                           double t, double dt, double[:,::1] w, double[:,::1] v_jm1_2,
+                           double[::1] grad, double[:,:,::1] out_w,
+                           LeapfrogEvents *ev=NULL) nogil:
+    """ Advance the state ``w`` by ``nsteps`` steps, saving the state after
+        each step to ``out_w``.
+    """
+    cdef int i,j,k
+
+    if ev != NULL:
+        c_leapfrog_steps_events(p, n, ndim, nsteps, t, dt, w, v_jm1_2,
+                                grad, out_w, ev)
+        return
+
+    for j in range(nsteps):
+        t += dt
+        for i in range(n):
+            for k in range(ndim):
+                grad[k] = 0.
+
+            c_leapfrog_step(p, ndim, t, dt,
+                            &w[i,0], &w[i,ndim], &v_jm1_2[i,0], &grad[0])
+
+            for k in range(2*ndim):
+                out_w[j,i,k] = w[i,k]
+
 cpdef cy_leapfrog_run(_CPotential potential, double [:,::1] w0,
-                      double dt, int nsteps, double t1):
+                      double dt, int nsteps, double t1,
+                      mmap=None, int chunksize=1024, events=None,
+                      checkpoint=None, stats=None):
+    """
+    cy_leapfrog_run(potential, w0, dt, nsteps, t1, mmap=None, chunksize=1024, events=None, checkpoint=None, stats=None)
+
+    Leapfrog integrate orbits from initial conditions ``w0`` in the given
+    C potential. If ``mmap`` is specified, it should be a writeable array-like
+    object (e.g., a `numpy.memmap` or an HDF5 dataset) with shape
+    ``(nsteps+1, norbits, ndim)``. The orbits are then integrated in chunks of
+    ``chunksize`` steps, and each chunk is written to and flushed from the
+    output array before the next one is computed, so only the current chunk
+    is ever held in memory.
+
+    ``events`` is an optional list of `~gary.integrate.Event` instances. The
+    events are located by cubic Hermite interpolation between steps, and the
+    times and states at which they occurred are stored on the event objects.
+    The output for an orbit stopped by a terminal event is NaN after the
+    event.
+
+    ``checkpoint`` is an optional filename to save the state of the
+    integrator (the positions and the half-step velocities) to after every
+    chunk. This requires an ``mmap`` output array. If the file already exists,
+    the integration is resumed from the saved state, so an interrupted
+    integration can be restarted by calling this function again with the same
+    arguments, and gives bit-for-bit the same result as if it had never been
+    interrupted.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance to
+    store the number of force evaluations and steps, the energy drift, and
+    the time spent in each phase in.
+    """
     # temporary scalars
-    cdef int i,j,k
+    cdef int i,j,j0,nchunk
     cdef int n = w0.shape[0]
     cdef int ndim = w0.shape[1] // 2
-    cdef double t
 
     # temporary array containers
     cdef double[::1] grad = np.zeros(ndim)
     cdef double[:,::1] v_jm1_2 = np.zeros((n,ndim))
+    cdef double[:,::1] w = np.array(w0, copy=True)
 
     # return arrays
     cdef double[::1] all_t = np.zeros(nsteps+1)
-    cdef double[:,:,::1] all_w = np.zeros((nsteps+1,n,2*ndim))
+    cdef double[:,:,::1] all_w
 
-    # save initial conditions
-    all_w[0,:,:] = w0.copy()
+    # event detection
+    cdef EventSet evset = None
+    cdef LeapfrogEvents ev
+    cdef LeapfrogEvents *ev_ptr = NULL
+    cdef double[:,::1] ev_g, ev_w_prev, ev_a_prev
+    cdef double[::1] ev_a, ev_tmp
+    cdef int[::1] ev_stopped
 
-    with nogil:
-        # first initialize the velocities so they are evolved by a
-        #   half step relative to the positions
-        for i in range(n):
-            c_init_velocity(potential, ndim, t1, dt,
-                            &all_w[0,i,0], &all_w[0,i,ndim], &v_jm1_2[i,0], &grad[0])
-
-        t = t1  # initial time
-        all_t[0] = t
-        for j in range(1,nsteps+1):
-            t += dt
-            all_t[j] = t
+    if checkpoint is not None:
+        if mmap is None:
+            raise ValueError("Checkpointing requires an output array (mmap) that "
+                             "persists between restarts.")
+        if events:
+            raise ValueError("Checkpointing is not supported with event detection.")
+
+    stats = _reset_stats(stats)
+
+    # save initial times
+    for j in range(nsteps+1):
+        all_t[j] = t1 + j*dt
+
+    if events:
+        evset = EventSet(events, 2*ndim)
+        ev_g = np.zeros((n,evset.nevents))
+        ev_w_prev = np.zeros((n,2*ndim))
+        ev_a_prev = np.zeros((n,ndim))
+        ev_a = np.zeros(ndim)
+        ev_tmp = np.zeros(2*ndim)
+        ev_stopped = np.zeros(n, dtype=np.intc)
+
+        ev.events = evset.c_events
+        ev.nevents = evset.nevents
+        ev.log = &evset.logs[0]
+        ev.g = &ev_g[0,0]
+        ev.w_prev = &ev_w_prev[0,0]
+        ev.a_prev = &ev_a_prev[0,0]
+        ev.a = &ev_a[0]
+        ev.tmp = &ev_tmp[0]
+        ev.stopped = &ev_stopped[0]
+        ev_ptr = &ev
+
+    with _Phase(stats, 'integrate'):
+        with nogil:
+            # first initialize the velocities so they are evolved by a
+            #   half step relative to the positions
             for i in range(n):
+                c_init_velocity(potential, ndim, t1, dt,
+                                &w[i,0], &w[i,ndim], &v_jm1_2[i,0], &grad[0])
+
+                if ev_ptr != NULL:
+                    for j in range(ndim):
+                        ev.a_prev[i*ndim + j] = -grad[j]
+                    init_events(ev.events, ev.nevents, 2*ndim, t1,
+                                &w0[i,0], &ev.g[i*ev.nevents])
+
+    if mmap is None:
+        all_w = np.zeros((nsteps+1,n,2*ndim))
+
+        # save initial conditions
+        all_w[0,:,:] = w0
+
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_leapfrog_steps(potential, n, ndim, nsteps, t1, dt,
+                                 w, v_jm1_2, grad, all_w[1:], ev_ptr)
+
+        if evset is not None:
+            with _Phase(stats, 'events'):
+                evset.collect()
+
+        # one force evaluation per orbit and step, plus one to initialize
+        #   the velocities
+        _fixed_step_stats(stats, (<object>potential).value, n*(nsteps+1), nsteps, dt,
+                          np.asarray(all_w))
+        return np.array(all_t), np.array(all_w)
+
+    _validate_output_array(mmap, (nsteps+1,n,2*ndim))
+    chunksize = max(min(chunksize, nsteps), 1)
+    all_w = np.zeros((chunksize,n,2*ndim))
+
+    j = 0
+    if checkpoint is not None:
+        ckpt_id = _checkpoint_id(potential, integrator='leapfrog', w0=np.asarray(w0),
+                                 dt=dt, nsteps=nsteps, t1=t1)
+        state = _load_checkpoint(checkpoint, **ckpt_id)
+        if state is not None:
+            j = int(state['j'])
+            np.asarray(w)[...] = state['w']
+            np.asarray(v_jm1_2)[...] = state['v_jm1_2']
+
+    # save initial conditions
+    if j == 0:
+        mmap[0] = np.asarray(w0)
+
+    j0 = j
+    while j < nsteps:
+        nchunk = min(chunksize, nsteps - j)
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_leapfrog_steps(potential, n, ndim, nchunk, t1 + j*dt, dt,
+                                 w, v_jm1_2, grad, all_w, ev_ptr)
+        if evset is not None:
+            evset.check()
+
+        with _Phase(stats, 'output'):
+            mmap[j+1:j+1+nchunk] = np.asarray(all_w[:nchunk])
+            _flush_output_array(mmap)
+        j += nchunk
+
+        if checkpoint is not None:
+            with _Phase(stats, 'checkpoint'):
+                _save_checkpoint(checkpoint, j=j, w=np.asarray(w),
+                                 v_jm1_2=np.asarray(v_jm1_2), **ckpt_id)
+
+    if evset is not None:
+        with _Phase(stats, 'events'):
+            evset.collect()
+
+    _fixed_step_stats(stats, (<object>potential).value, n*(nsteps-j0+1), nsteps-j0,
+                      dt, mmap)
+    return np.array(all_t), mmap
+
+cdef int c_leapfrog_reduce_orbits(_CPotential p, int ndim, int nsteps, double t1, double dt,
+                                  double[:,::1] w0, int i1, int i2,
+                                  CReducer *reducers, int nreducers,
+                                  double[:,::1] acc) nogil:
+    """ Leapfrog integrate each orbit in ``w0[i1:i2]`` separately, updating
+        its accumulators in ``acc`` after every step. Returns -1 if the
+        scratch space couldn't be allocated. Stops early if a reducer fails.
+    """
+    cdef:
+        int i,j,k
+        double t
+        double *w = <double*>malloc(2*ndim*sizeof(double))
+        double *v_jm1_2 = <double*>malloc(ndim*sizeof(double))
+        double *grad = <double*>malloc(ndim*sizeof(double))
+
+    if w == NULL or v_jm1_2 == NULL or grad == NULL:
+        free(w)
+        free(v_jm1_2)
+        free(grad)
+        return -1
+
+    for i in range(i1, i2):
+        for k in range(2*ndim):
+            w[k] = w0[i,k]
+
+        # stop if a reducer failed (in any thread)
+        if init_reducers(reducers, nreducers, 2*ndim, t1, w, &acc[i,0]) < 0:
+            break
+        c_init_velocity(p, ndim, t1, dt, w, &w[ndim], v_jm1_2, grad)
+
+        for j in range(1, nsteps+1):
+            t = t1 + j*dt
+            c_leapfrog_step(p, ndim, t, dt, w, &w[ndim], v_jm1_2, grad)
+            if update_reducers(reducers, nreducers, 2*ndim, t, w, &acc[i,0]) < 0:
+                break
+
+    free(w)
+    free(v_jm1_2)
+    free(grad)
+    return 0
+
+def cy_leapfrog_reduce(_CPotential potential, double [:,::1] w0,
+                       double dt, int nsteps, double t1, reducers,
+                       int nthreads=1):
+    """
+    cy_leapfrog_reduce(potential, w0, dt, nsteps, t1, reducers, nthreads=1)
+
+    Leapfrog integrate orbits from initial conditions ``w0`` in the given
+    C potential like `cy_leapfrog_run`, but instead of storing the orbits,
+    update the per-orbit summary statistics computed by ``reducers`` (a list
+    of `~gary.integrate.Reducer` instances) after every step. Only the
+    current state and the accumulators of each orbit are kept in memory, so
+    the memory usage doesn't depend on the number of steps. The results are
+    stored on the reducer objects.
+
+    Each orbit is integrated separately, so the orbits can be split between
+    ``nthreads`` threads (0 means the number of CPUs).
+    """
+    cdef:
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+        ReducerSet rset = ReducerSet(reducers, n, 2*ndim)
+        double[:,::1] acc = rset.acc
+
+    rset.set_potential(potential.c_value, potential._parameters)
+
+    def worker(int b, int i1, int i2):
+        cdef int res
+        with nogil:
+            res = c_leapfrog_reduce_orbits(potential, ndim, nsteps, t1, dt, w0, i1, i2,
+                                           rset.c_reducers, rset.nreducers, acc)
+        return res
+
+    results = _run_threaded(worker, n, nthreads)
+    if min(results) < 0:
+        raise MemoryError("Not enough free memory for the integrator state.")
+
+    rset.finalize()
+
+cdef int c_leapfrog_window_orbits(_CPotential p, int ndim, double[::1] t,
+                                  double[:,::1] w0, double[::1] t_start, double[::1] t_end,
+                                  double[::1] dt, int i1, int i2,
+                                  double[:,:,::1] out_w) nogil:
+    """ Leapfrog integrate each orbit in ``w0[i1:i2]`` separately from
+        ``t_start[i]`` to ``t_end[i]`` with its own step ``dt[i]`` (the last
+        step is shortened to end at ``t_end[i]``), and store the state at the
+        output times ``t`` that fall in that window in ``out_w``. Output
+        times that coincide with a step are copied, the others are
+        interpolated with cubic Hermite polynomials. Returns -1 if the
+        scratch space couldn't be allocated.
+    """
+    cdef:
+        int i,j,k,nstep
+        int nt = t.shape[0]
+        double sign = 1. if t[nt-1] >= t[0] else -1.
+        double tol, h, h_prev, t_prev, t_cur, t_next
+        double *w = <double*>malloc(2*ndim*sizeof(double))
+        double *w_prev = <double*>malloc(2*ndim*sizeof(double))
+        double *v_jm1_2 = <double*>malloc(ndim*sizeof(double))
+        double *grad = <double*>malloc(ndim*sizeof(double))
+        double *a_prev = <double*>malloc(ndim*sizeof(double))
+        double *a = <double*>malloc(ndim*sizeof(double))
+        HermiteData hd
+
+    if (w == NULL or w_prev == NULL or v_jm1_2 == NULL or grad == NULL or
+        a_prev == NULL or a == NULL):
+        free(w)
+        free(w_prev)
+        free(v_jm1_2)
+        free(grad)
+        free(a_prev)
+        free(a)
+        return -1
+
+    hd.ndim = ndim
+    hd.w0 = w_prev
+    hd.w1 = w
+    hd.a0 = a_prev
+    hd.a1 = a
+
+    for i in range(i1, i2):
+        tol = 1E-8 * fabs(dt[i])
+
+        # output times before the window
+        j = 0
+        while j < nt and sign*(t[j] - t_start[i]) < -tol:
+            for k in range(2*ndim):
+                out_w[j,i,k] = NAN
+            j += 1
+
+        for k in range(2*ndim):
+            w[k] = w0[i,k]
+
+        if j < nt and fabs(t[j] - t_start[i]) <= tol:
+            for k in range(2*ndim):
+                out_w[j,i,k] = w[k]
+            j += 1
+
+        for k in range(ndim):
+            grad[k] = 0.
+        p._gradient(w, grad)
+
+        t_cur = t_start[i]
+        h_prev = 0.
+        nstep = 0
+        while j < nt and sign*(t_end[i] - t_cur) > tol and sign*(t[j] - t_end[i]) <= tol:
+            # step size -- shorten the last step to end exactly at t_end
+            nstep += 1
+            h = dt[i]
+            t_next = t_start[i] + nstep*dt[i]
+            if sign*(t_next - t_end[i]) > tol:
+                h = t_end[i] - t_cur
+                t_next = t_end[i]
+            elif fabs(t_next - t_end[i]) <= tol:
+                t_next = t_end[i]
+
+            if h != h_prev:
                 for k in range(ndim):
-                    all_w[j,i,k] = all_w[j-1,i,k]
-                    grad[k] = 0.
+                    v_jm1_2[k] = w[ndim+k] - grad[k] * h/2.
+                h_prev = h
+
+            for k in range(2*ndim):
+                w_prev[k] = w[k]
+            for k in range(ndim):
+                a_prev[k] = -grad[k]
+                grad[k] = 0.
+
+            t_prev = t_cur
+            t_cur = t_next
+
+            c_leapfrog_step(p, ndim, t_cur, h, w, &w[ndim], v_jm1_2, grad)
+
+            for k in range(ndim):
+                a[k] = -grad[k]
+
+            hd.t0 = t_prev
+            hd.t1 = t_cur
+            while j < nt and sign*(t[j] - t_cur) <= tol:
+                if fabs(t[j] - t_cur) <= tol:
+                    for k in range(2*ndim):
+                        out_w[j,i,k] = w[k]
+                else:
+                    hermite_interp(&hd, t[j], &out_w[j,i,0])
+                j += 1
+
+        # output times after the window
+        while j < nt:
+            for k in range(2*ndim):
+                out_w[j,i,k] = NAN
+            j += 1
+
+    free(w)
+    free(w_prev)
+    free(v_jm1_2)
+    free(grad)
+    free(a_prev)
+    free(a)
+    return 0
+
+def cy_leapfrog_run_windows(_CPotential potential, double[:,::1] w0, t,
+                            t_start, t_end, dt=None, int nthreads=1):
+    """
+    cy_leapfrog_run_windows(potential, w0, t, t_start, t_end, dt=None, nthreads=1)
+
+    Leapfrog integrate orbits from initial conditions ``w0`` in the given C
+    potential, where each orbit has its own integration window: orbit ``i``
+    starts from ``w0[i]`` at time ``t_start[i]`` and is integrated until
+    ``t_end[i]``. All orbits are output on the common grid of times ``t``
+    (monotonic, but not necessarily evenly spaced); the output is NaN at
+    times outside of an orbit's window. This replaces many small calls to
+    `cy_leapfrog_run` for ensembles in which orbits start at different times
+    (e.g., stream particles or accreted satellites).
+
+    If an orbit starts on the output grid and its step is the grid spacing,
+    its output is the same as from `cy_leapfrog_run`. Otherwise, the state
+    at output times between steps is interpolated with cubic Hermite
+    polynomials.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.cpotential._CPotential`
+    w0 : array_like
+        Initial conditions, shape ``(norbits, ndim)``.
+    t : array_like
+        Output times. If decreasing, the orbits are integrated backwards.
+    t_start, t_end : numeric, array_like
+        Start and end time of each orbit (scalars are used for all orbits).
+    dt : numeric, array_like (optional)
+        Step size of each orbit. The default is the spacing of the first two
+        output times.
+    nthreads : int (optional)
+        Number of threads to split the orbits between (0 means the number of
+        CPUs).
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+    w : :class:`numpy.ndarray`
+        Shape ``(ntimes, norbits, ndim)``.
+    """
+    cdef:
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+        double[::1] _t = np.array(t, dtype=np.float64).ravel()
+        double[::1] _t_start = np.array(np.broadcast_to(t_start, (n,)), dtype=np.float64)
+        double[::1] _t_end = np.array(np.broadcast_to(t_end, (n,)), dtype=np.float64)
+        double[::1] _dt
+        double[:,:,::1] all_w
+        double sign
+
+    if _t.shape[0] < 1:
+        raise ValueError("At least one output time is required.")
+
+    diff = np.diff(_t)
+    if not (np.all(diff > 0) or np.all(diff < 0)):
+        raise ValueError("Output times must be strictly increasing or decreasing.")
+    sign = 1. if _t[_t.shape[0]-1] >= _t[0] else -1.
+
+    if dt is None:
+        if _t.shape[0] < 2:
+            raise ValueError("A step size is required with a single output time.")
+        dt = _t[1] - _t[0]
+    _dt = sign*np.abs(np.array(np.broadcast_to(dt, (n,)), dtype=np.float64))
 
-                c_leapfrog_step(potential, ndim, t, dt,
-                                &all_w[j,i,0], &all_w[j,i,ndim], &v_jm1_2[i,0], &grad[0])
+    if np.any(np.asarray(_dt) == 0.):
+        raise ValueError("Step sizes must be nonzero.")
+
+    if np.any(sign*(np.asarray(_t_end) - np.asarray(_t_start)) < 0):
+        raise ValueError("End times must not be before the start times (in the "
+                         "direction of the output times).")
+
+    all_w = np.empty((_t.shape[0], n, 2*ndim))
+
+    def worker(int b, int i1, int i2):
+        cdef int res
+        with nogil:
+            res = c_leapfrog_window_orbits(potential, ndim, _t, w0, _t_start, _t_end,
+                                           _dt, i1, i2, all_w)
+        return res
+
+    results = _run_threaded(worker, n, nthreads)
+    if min(results) < 0:
+        raise MemoryError("Not enough free memory for the integrator state.")
+
+    return np.array(_t), np.array(all_w)
+
+cdef void c_meridional_gradient(_CPotential p, double Lz2, double R, double z,
+                                double *grad) nogil:
+    """ Gradient of the effective potential ``Phi(R,z) + Lz^2/(2 R^2)`` of an
+        axisymmetric potential in the meridional plane. The potential is
+        evaluated at ``(x,y,z) = (R,0,z)``, where its gradient along ``x`` is
+        the derivative with respect to ``R``.
+    """
+    cdef:
+        double q[3]
+        double grad3[3]
+
+    q[0] = R
+    q[1] = 0.
+    q[2] = z
+    grad3[0] = 0.
+    grad3[1] = 0.
+    grad3[2] = 0.
+    p._gradient(q, grad3)
+
+    grad[0] = grad3[0]
+    grad[1] = grad3[2]
+    if Lz2 != 0.:
+        grad[0] -= Lz2 / (R*R*R)
+
+cdef int c_leapfrog_meridional_orbits(_CPotential p, int nsteps, double dt,
+                                      double[:,::1] w0, int cartesian, int i1, int i2,
+                                      double[:,:,::1] out_w) nogil:
+    """ Leapfrog integrate the orbits in ``w0[i1:i2]`` (Cartesian initial
+        conditions) in the meridional plane, with the same scheme as
+        ``c_leapfrog_step``. If ``cartesian`` is nonzero, the azimuth is
+        integrated alongside with Simpson's rule over each drift, and the
+        output is Cartesian; otherwise the output is ``(R, z, v_R, v_z)``.
+        Returns -1 if the scratch space couldn't be allocated.
+    """
+    cdef:
+        int i,j,k
+        int n = i2 - i1
+        double x, y, vx, vy, vR, vz, R_prev, R_mid, vphi, cphi, sphi
+        double grad[2]
+        # state of each orbit: R, z, v_R and v_z at the half step, phi, L_z
+        double *state = <double*>malloc(6*n*sizeof(double))
+        double *s
+
+    if state == NULL:
+        return -1
+
+    for i in range(i1, i2):
+        s = &state[6*(i-i1)]
+        x = w0[i,0]
+        y = w0[i,1]
+        vx = w0[i,3]
+        vy = w0[i,4]
+
+        s[0] = sqrt(x*x + y*y)
+        s[1] = w0[i,2]
+        s[5] = x*vy - y*vx
+        if s[0] > 0.:
+            s[4] = atan2(y, x)
+            vR = (x*vx + y*vy) / s[0]
+        else:
+            # on the axis: the orbit moves in the plane of its velocity
+            s[4] = atan2(vy, vx)
+            vR = sqrt(vx*vx + vy*vy)
+        vz = w0[i,5]
+
+        if cartesian:
+            for k in range(6):
+                out_w[0,i,k] = w0[i,k]
+        else:
+            out_w[0,i,0] = s[0]
+            out_w[0,i,1] = s[1]
+            out_w[0,i,2] = vR
+            out_w[0,i,3] = vz
+
+        # half step the velocities
+        c_meridional_gradient(p, s[5]*s[5], s[0], s[1], grad)
+        s[2] = vR - grad[0] * dt/2.
+        s[3] = vz - grad[1] * dt/2.
+
+    for j in range(1, nsteps+1):
+        for i in range(i1, i2):
+            s = &state[6*(i-i1)]
+
+            R_prev = s[0]
+            s[0] = s[0] + s[2] * dt
+            s[1] = s[1] + s[3] * dt
+
+            c_meridional_gradient(p, s[5]*s[5], s[0], s[1], grad)
+
+            vR = s[2] - grad[0] * dt/2.
+            vz = s[3] - grad[1] * dt/2.
+            s[2] = s[2] - grad[0] * dt
+            s[3] = s[3] - grad[1] * dt
+
+            if not cartesian:
+                out_w[j,i,0] = s[0]
+                out_w[j,i,1] = s[1]
+                out_w[j,i,2] = vR
+                out_w[j,i,3] = vz
+                continue
+
+            vphi = 0.
+            if s[5] != 0.:
+                R_mid = (R_prev + s[0]) / 2.
+                s[4] = s[4] + s[5]*dt/6. * (1./(R_prev*R_prev) + 4./(R_mid*R_mid) +
+                                            1./(s[0]*s[0]))
+                vphi = s[5] / s[0]
+
+            cphi = cos(s[4])
+            sphi = sin(s[4])
+            out_w[j,i,0] = s[0]*cphi
+            out_w[j,i,1] = s[0]*sphi
+            out_w[j,i,2] = s[1]
+            out_w[j,i,3] = vR*cphi - vphi*sphi
+            out_w[j,i,4] = vR*sphi + vphi*cphi
+            out_w[j,i,5] = vz
+
+    free(state)
+    return 0
+
+def cy_leapfrog_run_meridional(_CPotential potential, double[:,::1] w0, double dt,
+                               int nsteps, double t1, cartesian=True, int nthreads=1,
+                               stats=None):
+    """
+    cy_leapfrog_run_meridional(potential, w0, dt, nsteps, t1, cartesian=True, nthreads=1, stats=None)
+
+    Leapfrog integrate orbits from the (3D, Cartesian) initial conditions
+    ``w0`` in an axisymmetric C potential. The angular momentum about the
+    z axis, :math:`L_z`, is conserved in an axisymmetric potential, so each
+    orbit is integrated in the meridional plane, :math:`(R, z)`, in the
+    effective potential :math:`\Phi(R,z) + L_z^2/(2R^2)`. This only
+    advances four phase-space coordinates instead of six and conserves
+    :math:`L_z` exactly.
+
+    If ``cartesian`` is True, the azimuth is reconstructed from
+    :math:`\dot{\phi} = L_z/R^2` (with Simpson's rule over each step) and
+    the output is Cartesian, like from `cy_leapfrog_run`, with shape
+    ``(nsteps+1, norbits, 6)``. Otherwise, the output is
+    :math:`(R, z, v_R, v_z)`, with shape ``(nsteps+1, norbits, 4)``.
+
+    The orbits are split between ``nthreads`` threads (0 means the number
+    of CPUs). ``stats`` is an optional `~gary.integrate.IntegrationStats`
+    instance to store the number of force evaluations and steps, the energy
+    drift, and the time spent in each phase in.
+    """
+    cdef:
+        int n = w0.shape[0]
+        int c = 1 if cartesian else 0
+        double[:,:,::1] all_w
+        double[::1] all_t = t1 + dt*np.arange(nsteps+1, dtype=np.float64)
+
+    if w0.shape[1] != 6:
+        raise ValueError("Meridional-plane integration requires 3D orbits.")
+
+    stats = _reset_stats(stats)
+    all_w = np.zeros((nsteps+1, n, 6 if c else 4))
+
+    def worker(int b, int i1, int i2):
+        cdef int res
+        with nogil:
+            res = c_leapfrog_meridional_orbits(potential, nsteps, dt, w0, c, i1, i2, all_w)
+        return res
+
+    with _Phase(stats, 'integrate'):
+        results = _run_threaded(worker, n, nthreads)
+
+    if min(results) < 0:
+        raise MemoryError("Not enough free memory for the integrator state.")
+
+    if c:
+        _fixed_step_stats(stats, (<object>potential).value, n*(nsteps+1), nsteps, dt,
+                          np.asarray(all_w))
+
+    else:
+        _fixed_step_stats(stats, None, n*(nsteps+1), nsteps, dt, None)
+        if stats is not None:
+            # energy in the meridional plane, including the azimuthal motion
+            Lz = np.asarray(w0[:,0])*np.asarray(w0[:,4]) - np.asarray(w0[:,1])*np.asarray(w0[:,3])
+            def energy(w):
+                x = np.zeros((n,3))
+                x[:,0] = w[:,0]
+                x[:,2] = w[:,1]
+                T = 0.5*(w[:,2]**2 + w[:,3]**2)
+                T[Lz != 0] += 0.5*Lz[Lz != 0]**2 / w[Lz != 0,0]**2
+                return T + np.asarray((<object>potential).value(x))
+            E0 = energy(np.asarray(all_w[0]))
+            stats.energy_drift = (energy(np.asarray(all_w[nsteps])) - E0) / np.abs(E0)
+
+    return np.array(all_t), np.array(all_w)
+
+cdef void c_drift(int n, int ndim, double dt, double[:,::1] w, double[:,::1] v_jm1_2) nogil:
+    cdef int i,k
+    for i in range(n):
+        for k in range(ndim):
+            w[i,k] = w[i,k] + v_jm1_2[i,k] * dt
+
+cdef void c_kick(int n, int ndim, double dt, double[:,::1] w, double[:,::1] v_jm1_2,
+                 double[:,::1] grad, double[:,:,::1] out_w, int j) nogil:
+    """ Kick the velocities and save the state to ``out_w[j]``. """
+    cdef int i,k
+    for i in range(n):
+        for k in range(ndim):
+            w[i,ndim+k] = v_jm1_2[i,k] - grad[i,k] * dt/2.
+            v_jm1_2[i,k] = v_jm1_2[i,k] - grad[i,k] * dt
+
+        for k in range(2*ndim):
+            out_w[j,i,k] = w[i,k]
+
+cpdef py_leapfrog_run(gradient, double [:,::1] w0, double dt, int nsteps, double t1,
+                      mmap=None, int chunksize=1024, stats=None):
+    """
+    py_leapfrog_run(gradient, w0, dt, nsteps, t1, mmap=None, chunksize=1024, stats=None)
+
+    Leapfrog integrate orbits from initial conditions ``w0`` in a potential
+    that is only implemented in Python. ``gradient`` is called exactly once
+    per step with the positions of all orbits, an array with shape
+    ``(norbits, ndim/2)``, and must return the gradient of the potential
+    at these positions with the same shape (e.g., the ``gradient`` method of
+    a potential class). The state is kept in preallocated buffers and the
+    drift and kick updates are compiled loops, so no temporary arrays are
+    created apart from the gradient itself. The output and the ``mmap`` and
+    ``chunksize`` arguments are the same as for `cy_leapfrog_run`.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance to
+    store the number of force evaluations and steps and the time spent in
+    each phase in. The ``'integrate'`` phase includes the time spent in
+    ``gradient``. The energy drift is not computed, because only the gradient
+    of the potential is known here.
+    """
+    cdef int j,jj,nchunk
+    cdef int n = w0.shape[0]
+    cdef int ndim = w0.shape[1] // 2
+
+    # state and temporary array containers
+    cdef double[:,::1] w = np.array(w0, copy=True)
+    cdef double[:,::1] v_jm1_2 = np.zeros((n,ndim))
+    cdef double[:,::1] grad
+    cdef double[::1] all_t = np.zeros(nsteps+1)
+    cdef double[:,:,::1] all_w
+
+    # view on the positions in the state array that is passed to the gradient,
+    #   and the array the gradient is copied in to
+    x = np.asarray(w)[:,:ndim]
+    grad_arr = np.zeros((n,ndim))
+    grad = grad_arr
+
+    stats = _reset_stats(stats)
+
+    for j in range(nsteps+1):
+        all_t[j] = t1 + j*dt
+
+    if mmap is None:
+        chunksize = nsteps
+        all_w = np.zeros((nsteps+1,n,2*ndim))
+        all_w[0,:,:] = w0
+    else:
+        _validate_output_array(mmap, (nsteps+1,n,2*ndim))
+        chunksize = max(min(chunksize, nsteps), 1)
+        all_w = np.zeros((chunksize,n,2*ndim))
+        mmap[0] = np.asarray(w0)
+
+    # initialize the velocities so they are evolved by a half step
+    #   relative to the positions
+    np.copyto(grad_arr, gradient(x))
+    for j in range(n):
+        for jj in range(ndim):
+            v_jm1_2[j,jj] = w[j,ndim+jj] - grad[j,jj] * dt/2.
+
+    j = 0
+    while j < nsteps:
+        nchunk = min(chunksize, nsteps - j)
+        with _Phase(stats, 'integrate'):
+            for jj in range(nchunk):
+                c_drift(n, ndim, dt, w, v_jm1_2)
+                np.copyto(grad_arr, gradient(x))
+                c_kick(n, ndim, dt, w, v_jm1_2, grad, all_w,
+                       j+jj+1 if mmap is None else jj)
+
+        if mmap is not None:
+            with _Phase(stats, 'output'):
+                mmap[j+1:j+1+nchunk] = np.asarray(all_w[:nchunk])
+                _flush_output_array(mmap)
+        j += nchunk
+
+    _fixed_step_stats(stats, None, n*(nsteps+1), nsteps, dt, None)
+
+    if mmap is None:
+        return np.array(all_t), np.array(all_w)
+    return np.array(all_t), mmap
+
+cdef double c_timestep(int ndim, double *x, double *a, double eta,
+                       double dt_min, double dt_max, double dt_default) nogil:
+    """ Step size from the local dynamical time, ``eta * sqrt(|x| / |a|)``.
+        Falls back to ``dt_default`` where this is undefined.
+    """
+    cdef:
+        int k
+        double r2 = 0.
+        double a2 = 0.
+        double h
+
+    for k in range(ndim):
+        r2 += x[k]*x[k]
+        a2 += a[k]*a[k]
+
+    if a2 > 0. and r2 > 0.:
+        h = eta * sqrt(sqrt(r2 / a2))
+    else:
+        h = dt_default
+
+    if dt_max > 0. and h > dt_max:
+        h = dt_max
+    if h < dt_min:
+        h = dt_min
+    return h
+
+cdef void c_kdk_step(_CPotential p, int ndim, double h,
+                     double *w0, double *a0, double *w1, double *a1) nogil:
+    """ Kick-drift-kick leapfrog step of size ``h`` from ``w0`` to ``w1``. """
+    cdef int k
+
+    for k in range(ndim):
+        w1[ndim+k] = w0[ndim+k] + a0[k] * h/2.
+        w1[k] = w0[k] + w1[ndim+k] * h
+        a1[k] = 0.
+
+    p._gradient(w1, a1)
+
+    for k in range(ndim):
+        a1[k] = -a1[k]  # acceleration is minus gradient
+        w1[ndim+k] = w1[ndim+k] + a1[k] * h/2.
+
+cdef long c_adaptive_leapfrog_orbit(_CPotential p, int ndim, int nsteps,
+                                    double t1, double dt, double *w0,
+                                    double eta, double dt_min, double dt_max, int maxiter,
+                                    double[:,:,::1] out_w, int i,
+                                    double *w, double *a, double *w_new, double *a_new,
+                                    long *nsteps_taken) nogil:
+    """ Integrate a single orbit with time-symmetric adaptive steps and fill
+        the output times ``t1 + j*dt`` by cubic Hermite interpolation.
+        Returns the number of force evaluations.
+    """
+    cdef:
+        int j, k, it
+        long nfev = 1
+        double sign = 1. if dt > 0 else -1.
+        double t = t1
+        double h, h_new, tau0
+        double *tmp
+        HermiteData hd
+
+    hd.ndim = ndim
+
+    for k in range(2*ndim):
+        w[k] = w0[k]
+        out_w[0,i,k] = w0[k]
+
+    for k in range(ndim):
+        a[k] = 0.
+    p._gradient(w, a)
+    for k in range(ndim):
+        a[k] = -a[k]
+
+    h = c_timestep(ndim, w, a, eta, dt_min, dt_max, fabs(dt))
+    nsteps_taken[0] = 0
+
+    j = 1
+    while j <= nsteps:
+        # iterate the step size to be the mean of the step sizes at the
+        #   beginning and end of the step -- this makes the step time symmetric
+        #   -- ``h`` is always the size of the step that gave ``w_new``
+        tau0 = c_timestep(ndim, w, a, eta, dt_min, dt_max, fabs(dt))
+        for it in range(maxiter):
+            c_kdk_step(p, ndim, sign*h, w, a, w_new, a_new)
+            nfev += 1
+
+            h_new = (tau0 + c_timestep(ndim, w_new, a_new, eta, dt_min, dt_max, fabs(dt))) / 2.
+            if fabs(h_new - h) <= 1E-6*h or it == maxiter-1:
+                break
+            h = h_new
+
+        nsteps_taken[0] += 1
+
+        # fill all output times within this step
+        hd.t0 = t
+        hd.t1 = t + sign*h
+        hd.w0 = w
+        hd.w1 = w_new
+        hd.a0 = a
+        hd.a1 = a_new
+        while j <= nsteps and sign*(t1 + j*dt - hd.t1) <= 0:
+            hermite_interp(&hd, t1 + j*dt, &out_w[j,i,0])
+            j += 1
+
+        t = hd.t1
+        tmp = w
+        w = w_new
+        w_new = tmp
+        tmp = a
+        a = a_new
+        a_new = tmp
+
+        # the last symmetrized step size is the first guess for the next step
+        h = h_new
+
+    return nfev
+
+cpdef cy_adaptive_leapfrog_run(_CPotential potential, double [:,::1] w0,
+                               double dt, int nsteps, double t1,
+                               double eta=0.02, double dt_min=0., double dt_max=0.,
+                               int maxiter=2, full_output=False):
+    """
+    cy_adaptive_leapfrog_run(potential, w0, dt, nsteps, t1, eta=0.02, dt_min=0., dt_max=0., maxiter=2, full_output=False)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with a time-symmetric, adaptive-timestep (kick-drift-kick) leapfrog.
+    Each orbit has its own step size, set to ``eta`` times the local
+    dynamical time, ``sqrt(|x|/|a|)``, and (iteratively) symmetrized as the
+    mean of the values at the beginning and end of the step (Hut, Makino &
+    McMillan 1995). This keeps the integration reversible, so there is no
+    secular energy drift, while taking long steps in the outer parts of
+    eccentric orbits and short steps near pericenter.
+
+    The output is returned at the times ``t1 + j*dt`` (``j = 0..nsteps``),
+    interpolated from the integration steps with cubic Hermite polynomials.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.cpotential._CPotential`
+    w0 : array_like
+        Initial conditions, shape ``(norbits, ndim)``.
+    dt : numeric
+        Output time step (can be negative to integrate backwards).
+    nsteps : int
+        Number of output steps.
+    t1 : numeric
+        Initial time.
+    eta : numeric (optional)
+        Accuracy parameter -- the fraction of the local dynamical time to step.
+    dt_min, dt_max : numeric (optional)
+        Limits on the step size (ignored if 0).
+    maxiter : int (optional)
+        Maximum number of trial steps to make the step size symmetric. The
+        default (one correction) is enough to remove the secular energy drift
+        of a non-symmetric adaptive step; 1 turns off the symmetrization.
+    full_output : bool (optional)
+        Also return a dictionary with the number of steps (``'nsteps'``) and
+        force evaluations (``'nfev'``) for each orbit.
+    """
+    cdef:
+        int i,j
+        int n = w0.shape[0]
+        int ndim = w0.shape[1] // 2
+        double[::1] all_t = np.zeros(nsteps+1)
+        double[:,:,::1] all_w = np.zeros((nsteps+1,n,2*ndim))
+        double[::1] w = np.zeros(2*ndim)
+        double[::1] w_new = np.zeros(2*ndim)
+        double[::1] a = np.zeros(ndim)
+        double[::1] a_new = np.zeros(ndim)
+        long[::1] nfev = np.zeros(n, dtype=int)
+        long[::1] nsteps_taken = np.zeros(n, dtype=int)
+
+    if eta <= 0.:
+        raise ValueError("eta must be positive.")
+    if maxiter < 1:
+        raise ValueError("maxiter must be at least 1.")
+
+    for j in range(nsteps+1):
+        all_t[j] = t1 + j*dt
+
+    with nogil:
+        for i in range(n):
+            nfev[i] = c_adaptive_leapfrog_orbit(potential, ndim, nsteps, t1, dt, &w0[i,0],
+                                                eta, fabs(dt_min), fabs(dt_max), maxiter,
+                                                all_w, i, &w[0], &a[0], &w_new[0], &a_new[0],
+                                                &nsteps_taken[i])
 
+    if full_output:
+        return np.array(all_t), np.array(all_w), dict(nsteps=np.array(nsteps_taken),
+                                                      nfev=np.array(nfev))
     return np.array(all_t), np.array(all_w)
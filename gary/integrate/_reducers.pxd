@@ -0,0 +1,34 @@
+# same as in gary/potential/cpotential.pxd -- not cimported from there, because
+#   that would import gary.potential when this module is imported
+ctypedef double (*valuefunc)(double *pars, double *q) nogil
+
+cdef struct CReducer
+
+ctypedef void (*reducefunc)(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil
+
+cdef struct CReducer:
+    reducefunc init     # set up the accumulators from the initial conditions
+    reducefunc update   # update the accumulators with the state at time t
+    int nacc            # number of accumulator values per orbit
+    int offset          # index of the first accumulator value in the per-orbit block
+    valuefunc value     # potential, for reducers that need the energy
+    double *pars
+    void *pyobj         # Python reducer object for user-supplied reduce functions
+    int error           # set if a user-supplied reduce function raised an exception
+
+cdef int init_reducers(CReducer *reducers, int nreducers, int ndim,
+                       double t, double *w, double *acc) nogil
+
+cdef int update_reducers(CReducer *reducers, int nreducers, int ndim,
+                         double t, double *w, double *acc) nogil
+
+cdef class ReducerSet:
+    cdef CReducer *c_reducers
+    cdef int nreducers
+    cdef int nacc
+    cdef object reducers
+    cdef public object acc
+
+    cdef void set_potential(self, valuefunc value, double *pars)
+    cpdef check(self)
+    cpdef finalize(self)
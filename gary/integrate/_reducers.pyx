@@ -0,0 +1,412 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Per-orbit summary statistics accumulated inside the Cython integrators. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import sys
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+from libc.stdlib cimport malloc, free
+
+cdef extern from "math.h":
+    double sqrt(double x) nogil
+    double fabs(double x) nogil
+
+__all__ = ['Reducer', 'PeriApo', 'ZMax', 'EnergyError',
+           'MeanAngularMomentum', 'Circulation', 'FunctionReducer']
+
+# ----------------------------------------------------------------------------
+# Built-in reducers
+#
+cdef double radius(double *w, int ndim) nogil:
+    cdef:
+        int k
+        double r2 = 0.
+
+    for k in range(ndim // 2):
+        r2 += w[k]*w[k]
+    return sqrt(r2)
+
+cdef double energy(CReducer *reducer, double *w, int ndim) nogil:
+    cdef:
+        int k
+        int n = ndim // 2
+        double T = 0.
+
+    for k in range(n):
+        T += w[n+k]*w[n+k]
+    return 0.5*T + reducer.value(reducer.pars, w)
+
+cdef inline int sign(double x) nogil:
+    return (x > 0.) - (x < 0.)
+
+cdef void angular_momentum(double *w, double *L) nogil:
+    L[0] = w[1]*w[5] - w[2]*w[4]
+    L[1] = w[2]*w[3] - w[0]*w[5]
+    L[2] = w[0]*w[4] - w[1]*w[3]
+
+# acc = (r_min, r_max)
+cdef void periapo_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    acc[0] = acc[1] = radius(w, ndim)
+
+cdef void periapo_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    cdef double r = radius(w, ndim)
+    acc[0] = min(acc[0], r)
+    acc[1] = max(acc[1], r)
+
+# acc = (max |z|,)
+cdef void zmax_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    acc[0] = 0.
+    zmax_update(reducer, t, w, ndim, acc)
+
+cdef void zmax_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    acc[0] = max(acc[0], fabs(w[2]))
+
+# acc = (E0, min dE/|E0|, max dE/|E0|)
+cdef void energy_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    acc[0] = energy(reducer, w, ndim)
+    acc[1] = acc[2] = 0.
+
+cdef void energy_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    cdef double dE = (energy(reducer, w, ndim) - acc[0]) / fabs(acc[0])
+    acc[1] = min(acc[1], dE)
+    acc[2] = max(acc[2], dE)
+
+# acc = (t0, t_prev, L_prev[3], integral of L dt[3])
+cdef void meanL_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    acc[0] = acc[1] = t
+    angular_momentum(w, &acc[2])
+    acc[5] = acc[6] = acc[7] = 0.
+
+cdef void meanL_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    cdef:
+        int k
+        double L[3]
+
+    # trapezoidal rule
+    angular_momentum(w, L)
+    for k in range(3):
+        acc[5+k] += 0.5*(t - acc[1])*(L[k] + acc[2+k])
+        acc[2+k] = L[k]
+    acc[1] = t
+
+# acc = (L0[3], circulation flags[3]), same criterion as classify_orbit()
+cdef void circulation_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    angular_momentum(w, acc)
+    acc[3] = acc[4] = acc[5] = 1.
+
+cdef void circulation_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    cdef:
+        int k
+        double L[3]
+
+    angular_momentum(w, L)
+    for k in range(3):
+        if (sign(acc[k]) != sign(L[k])) or fabs(L[k]) < 1E-14:
+            acc[3+k] = 0.
+
+# ----------------------------------------------------------------------------
+# Bookkeeping
+#
+cdef int init_reducers(CReducer *reducers, int nreducers, int ndim,
+                       double t, double *w, double *acc) nogil:
+    """ Initialize the accumulators of a single orbit, ``acc``, from the
+        initial conditions ``w``. Returns -1 if a reducer failed, in which
+        case the integration should be stopped.
+    """
+    cdef int k
+    for k in range(nreducers):
+        reducers[k].init(&reducers[k], t, w, ndim, acc + reducers[k].offset)
+        if reducers[k].error:
+            return -1
+    return 0
+
+cdef int update_reducers(CReducer *reducers, int nreducers, int ndim,
+                         double t, double *w, double *acc) nogil:
+    """ Update the accumulators of a single orbit, ``acc``, with the state
+        ``w`` at time ``t``. Returns -1 if a reducer failed, in which case
+        the integration should be stopped.
+    """
+    cdef int k
+    for k in range(nreducers):
+        reducers[k].update(&reducers[k], t, w, ndim, acc + reducers[k].offset)
+        if reducers[k].error:
+            return -1
+    return 0
+
+# ----------------------------------------------------------------------------
+# Python interface
+#
+cdef class Reducer:
+    """
+    Base class for per-orbit summary statistics that are accumulated while
+    integrating orbits with `~gary.integrate._leapfrog.cy_leapfrog_reduce`
+    or `~gary.integrate._dop853.dop853_reduce`, so that the orbits
+    themselves never have to be stored. After an integration, the results
+    are stored as attributes of the reducer, with one value (or row) per
+    orbit.
+    """
+    cdef CReducer c
+    cdef int needs_3d
+
+    def _finalize(self, acc):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "<{0}>".format(self.__class__.__name__)
+
+cdef class PeriApo(Reducer):
+    """
+    Smallest and largest radius reached by each orbit. After integrating,
+    the attributes ``pericenter``, ``apocenter``, and ``eccentricity``,
+    :math:`(r_{apo} - r_{peri}) / (r_{apo} + r_{peri})`, are set. Note that
+    these are the extremes over the times at which the reducer is updated,
+    so the accuracy depends on the output time step.
+    """
+    cdef public object pericenter, apocenter, eccentricity
+
+    def __init__(self):
+        self.c.init = periapo_init
+        self.c.update = periapo_update
+        self.c.nacc = 2
+        self.pericenter = self.apocenter = self.eccentricity = None
+
+    def _finalize(self, acc):
+        self.pericenter = acc[:,0].copy()
+        self.apocenter = acc[:,1].copy()
+        self.eccentricity = (self.apocenter - self.pericenter) / (self.apocenter + self.pericenter)
+
+cdef class ZMax(Reducer):
+    """
+    Largest distance of each orbit from the plane ``z=0``, stored in the
+    attribute ``zmax``.
+    """
+    cdef public object zmax
+
+    def __init__(self):
+        self.c.init = zmax_init
+        self.c.update = zmax_update
+        self.c.nacc = 1
+        self.needs_3d = 1
+        self.zmax = None
+
+    def _finalize(self, acc):
+        self.zmax = acc[:,0].copy()
+
+cdef class EnergyError(Reducer):
+    """
+    Smallest and largest relative energy error, :math:`(E - E_0) / |E_0|`,
+    of each orbit, stored in the attributes ``min_error`` and ``max_error``.
+    The initial energy is stored in ``E0``.
+    """
+    cdef public object E0, min_error, max_error
+
+    def __init__(self):
+        self.c.init = energy_init
+        self.c.update = energy_update
+        self.c.nacc = 3
+        self.E0 = self.min_error = self.max_error = None
+
+    def _finalize(self, acc):
+        self.E0 = acc[:,0].copy()
+        self.min_error = acc[:,1].copy()
+        self.max_error = acc[:,2].copy()
+
+cdef class MeanAngularMomentum(Reducer):
+    """
+    Time-averaged angular momentum vector of each orbit, an array with shape
+    ``(norbits, 3)`` stored in the attribute ``L``.
+    """
+    cdef public object L
+
+    def __init__(self):
+        self.c.init = meanL_init
+        self.c.update = meanL_update
+        self.c.nacc = 8
+        self.needs_3d = 1
+        self.L = None
+
+    def _finalize(self, acc):
+        T = acc[:,1] - acc[:,0]
+        self.L = acc[:,5:8] / T[:,None]
+
+cdef class Circulation(Reducer):
+    """
+    Circulation flags of each orbit, the same as returned by
+    `~gary.dynamics.classify_orbit`: an integer array with shape
+    ``(norbits, 3)`` stored in the attribute ``circulation`` that is 1 for
+    each axis about which the angular momentum never changes sign.
+    """
+    cdef public object circulation
+
+    def __init__(self):
+        self.c.init = circulation_init
+        self.c.update = circulation_update
+        self.c.nacc = 6
+        self.needs_3d = 1
+        self.circulation = None
+
+    def _finalize(self, acc):
+        self.circulation = acc[:,3:6].astype(int)
+
+cdef class FunctionReducer(Reducer):
+    """
+    A user-supplied reducer. ``update(acc, t, w)`` is called with the
+    accumulator array of a single orbit, ``acc`` (shape ``(nacc,)``), the
+    time, and the phase-space position of the orbit, and has to update
+    ``acc`` in place. The accumulators start at ``initial`` and are updated
+    with the initial conditions, unless a separate ``init(acc, t, w)`` is
+    given. After integrating, the accumulators of all orbits are stored in
+    the attribute ``result``, with shape ``(norbits, nacc)``.
+
+    Note that the functions are called with the GIL held, so this is much
+    slower than the built-in reducers (and doesn't gain anything from
+    threads). If one of the functions raises an exception, the integration
+    is stopped and the exception is re-raised. To write a fast reducer, subclass `Reducer` in Cython and set the
+    ``init`` and ``update`` functions of the ``CReducer`` struct (see
+    ``_reducers.pxd``) to ``nogil`` C functions, as the built-in reducers do.
+
+    Parameters
+    ----------
+    update : callable
+    nacc : int (optional)
+        Number of accumulator values per orbit.
+    init : callable (optional)
+    initial : numeric, array_like (optional)
+        Initial value of the accumulators, if ``init`` is not given.
+    """
+    cdef object update_func, init_func
+    cdef object initial
+    cdef object exc_info
+    cdef public object result
+
+    def __init__(self, update, nacc=1, init=None, initial=0.):
+        if nacc < 1:
+            raise ValueError("nacc must be at least 1.")
+
+        self.update_func = update
+        self.init_func = init
+        self.initial = np.array(np.broadcast_to(initial, (nacc,)), dtype=np.float64)
+        self.result = None
+
+        self.c.init = python_init
+        self.c.update = python_update
+        self.c.nacc = nacc
+        self.c.pyobj = <void*>self
+
+    cdef _call(self, int init, double *acc, int nacc, double t, double *w, int ndim):
+        acc_arr = np.asarray(<double[:nacc]> acc)
+        w_arr = np.array(<double[:ndim]> w)
+
+        if init and self.init_func is not None:
+            self.init_func(acc_arr, t, w_arr)
+        else:
+            if init:
+                acc_arr[:] = self.initial
+            self.update_func(acc_arr, t, w_arr)
+
+    def _finalize(self, acc):
+        self.result = acc.copy()
+
+cdef void python_reduce(CReducer *reducer, int init, double t, double *w, int ndim,
+                        double *acc) nogil:
+    """ Calls the functions of a `FunctionReducer`. If they raise, the
+        exception is stored on the reducer object and ``reducer.error`` is
+        set, so that the integration can be stopped and the exception
+        re-raised.
+    """
+    if reducer.error:
+        return
+
+    with gil:
+        try:
+            (<FunctionReducer>reducer.pyobj)._call(init, acc, reducer.nacc, t, w, ndim)
+        except:
+            (<FunctionReducer>reducer.pyobj).exc_info = sys.exc_info()
+            reducer.error = 1
+
+cdef void python_init(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    python_reduce(reducer, 1, t, w, ndim, acc)
+
+cdef void python_update(CReducer *reducer, double t, double *w, int ndim, double *acc) nogil:
+    python_reduce(reducer, 0, t, w, ndim, acc)
+
+cdef class ReducerSet:
+    """ C-level copy of a list of reducers, with the accumulators for all
+        orbits in the array ``acc`` with shape ``(norbits, nacc)``. The
+        integrator has to set the potential with `set_potential`.
+    """
+
+    def __cinit__(self, reducers, int norbits, int ndim):
+        cdef:
+            int k
+            int offset = 0
+            Reducer reducer
+
+        self.reducers = list(reducers)
+        self.nreducers = len(self.reducers)
+
+        if self.nreducers == 0:
+            raise ValueError("At least one reducer must be specified.")
+
+        self.c_reducers = <CReducer*>malloc(self.nreducers*sizeof(CReducer))
+        if self.c_reducers == NULL:
+            raise MemoryError()
+
+        for k in range(self.nreducers):
+            reducer = self.reducers[k]
+            if reducer.c.init == NULL or reducer.c.update == NULL:
+                raise TypeError("Reducer {0} does not define a reduce function.".format(reducer))
+            if reducer.needs_3d and ndim != 6:
+                raise ValueError("Reducer {0} is only defined for orbits in 3D.".format(reducer))
+
+            self.c_reducers[k] = reducer.c
+            self.c_reducers[k].offset = offset
+            self.c_reducers[k].error = 0
+            offset += reducer.c.nacc
+
+        self.nacc = offset
+        self.acc = np.zeros((norbits, self.nacc))
+
+    def __dealloc__(self):
+        free(self.c_reducers)
+
+    cdef void set_potential(self, valuefunc value, double *pars):
+        cdef int k
+        for k in range(self.nreducers):
+            self.c_reducers[k].value = value
+            self.c_reducers[k].pars = pars
+
+    cpdef check(self):
+        """ Re-raise the exception of a reduce function that failed. """
+        cdef int k
+
+        for k in range(self.nreducers):
+            if self.c_reducers[k].error:
+                exc_info = (<FunctionReducer>self.reducers[k]).exc_info
+                (<FunctionReducer>self.reducers[k]).exc_info = None
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    cpdef finalize(self):
+        """ Store the results on the Python reducer objects, or re-raise the
+            exception of a reduce function that failed.
+        """
+        cdef int k
+
+        self.check()
+        for k in range(self.nreducers):
+            off = self.c_reducers[k].offset
+            self.reducers[k]._finalize(self.acc[:,off:off+self.c_reducers[k].nacc])
@@ -0,0 +1,170 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Fixed-step Runge-Kutta integration in Cython. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+# Project
+from ..potential.cpotential cimport _CPotential
+from .core import _validate_output_array, _flush_output_array
+from .stats import _Phase, _reset_stats, _fixed_step_stats
+from . import rk5
+
+# Butcher tableaus: (B, C) -- the nodes (A) aren't needed because the
+#   potentials are time independent
+TABLEAUS = {
+    # classic 4th order Runge-Kutta
+    4: (np.array([[0., 0., 0.],
+                  [0.5, 0., 0.],
+                  [0., 0.5, 0.],
+                  [0., 0., 1.]]),
+        np.array([1/6., 1/3., 1/3., 1/6.])),
+
+    # same (Cash-Karp) coefficients as the pure-Python RK5Integrator
+    5: (rk5.B, rk5.C),
+}
+
+cdef void c_derivs(_CPotential p, int ndim, double *w, double *f) nogil:
+    """ Phase-space derivatives, (v, -grad) """
+    cdef int k
+
+    for k in range(ndim):
+        f[k] = w[ndim+k]
+        f[ndim+k] = 0.
+
+    p._gradient(w, &f[ndim])
+
+    for k in range(ndim):
+        f[ndim+k] = -f[ndim+k]
+
+cdef void c_rk_step(_CPotential p, int ndim, double dt, double *w,
+                    double[:,::1] B, double[::1] C,
+                    double[:,::1] K, double *tmp) nogil:
+    """ One explicit Runge-Kutta step with the tableau (B, C). """
+    cdef:
+        int s, l, k
+        int nstages = C.shape[0]
+
+    for s in range(nstages):
+        for k in range(2*ndim):
+            tmp[k] = w[k]
+            for l in range(s):
+                tmp[k] = tmp[k] + dt * B[s,l] * K[l,k]
+
+        c_derivs(p, ndim, tmp, &K[s,0])
+
+    for s in range(nstages):
+        if C[s] == 0.:
+            continue
+        for k in range(2*ndim):
+            w[k] = w[k] + dt * C[s] * K[s,k]
+
+cdef void c_rk_steps(_CPotential p, int n, int ndim, int nsteps,
+                     double dt, double[:,::1] w,
+                     double[:,::1] B, double[::1] C,
+                     double[:,::1] K, double[::1] tmp,
+                     double[:,:,::1] out_w) nogil:
+    """ Advance the state ``w`` by ``nsteps`` steps, saving the state after
+        each step to ``out_w``.
+    """
+    cdef int i,j,k
+
+    for j in range(nsteps):
+        for i in range(n):
+            c_rk_step(p, ndim, dt, &w[i,0], B, C, K, &tmp[0])
+
+            for k in range(2*ndim):
+                out_w[j,i,k] = w[i,k]
+
+cpdef cy_rk_run(_CPotential potential, double [:,::1] w0,
+                double dt, int nsteps, double t1, int order=5,
+                mmap=None, int chunksize=1024, stats=None):
+    """
+    cy_rk_run(potential, w0, dt, nsteps, t1, order=5, mmap=None, chunksize=1024, stats=None)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with a fixed-step, 4th (classic) or 5th (Cash-Karp, as in
+    `~gary.integrate.RK5Integrator`) order Runge-Kutta scheme. The ``mmap``
+    and ``chunksize`` arguments work as for `cy_leapfrog_run`.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance to
+    store the number of force evaluations and steps, the energy drift, and
+    the time spent in each phase in.
+    """
+    cdef int j,nchunk
+    cdef int n = w0.shape[0]
+    cdef int ndim = w0.shape[1] // 2
+
+    # temporary array containers
+    cdef double[:,::1] w = np.array(w0, copy=True)
+    cdef double[:,::1] B
+    cdef double[::1] C
+    cdef double[:,::1] K
+    cdef double[::1] tmp = np.zeros(2*ndim)
+
+    # return arrays
+    cdef double[::1] all_t = np.zeros(nsteps+1)
+    cdef double[:,:,::1] all_w
+
+    if order not in TABLEAUS:
+        raise ValueError("Runge-Kutta order must be one of: {0}"
+                         .format(", ".join(map(str, sorted(TABLEAUS.keys())))))
+
+    B = np.array(TABLEAUS[order][0], dtype=np.float64)
+    C = np.array(TABLEAUS[order][1], dtype=np.float64)
+    K = np.zeros((C.shape[0], 2*ndim))
+
+    stats = _reset_stats(stats)
+
+    # save initial times
+    for j in range(nsteps+1):
+        all_t[j] = t1 + j*dt
+
+    if mmap is None:
+        all_w = np.zeros((nsteps+1,n,2*ndim))
+
+        # save initial conditions
+        all_w[0,:,:] = w0
+
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_rk_steps(potential, n, ndim, nsteps, dt, w, B, C, K, tmp, all_w[1:])
+
+        _fixed_step_stats(stats, (<object>potential).value, n*nsteps*C.shape[0],
+                          nsteps, dt, np.asarray(all_w))
+        return np.array(all_t), np.array(all_w)
+
+    _validate_output_array(mmap, (nsteps+1,n,2*ndim))
+    chunksize = max(min(chunksize, nsteps), 1)
+    all_w = np.zeros((chunksize,n,2*ndim))
+
+    # save initial conditions
+    mmap[0] = np.asarray(w0)
+
+    j = 0
+    while j < nsteps:
+        nchunk = min(chunksize, nsteps - j)
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_rk_steps(potential, n, ndim, nchunk, dt, w, B, C, K, tmp, all_w)
+
+        with _Phase(stats, 'output'):
+            mmap[j+1:j+1+nchunk] = np.asarray(all_w[:nchunk])
+            _flush_output_array(mmap)
+        j += nchunk
+
+    _fixed_step_stats(stats, (<object>potential).value, n*nsteps*C.shape[0],
+                      nsteps, dt, mmap)
+    return np.array(all_t), mmap
@@ -0,0 +1,140 @@
+# coding: utf-8
+# cython: boundscheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+# cython: wraparound=False
+# cython: profile=False
+
+""" Higher-order symplectic integration in Cython. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+cimport numpy as np
+np.import_array()
+
+# Project
+from ..potential.cpotential cimport _CPotential
+from .core import _validate_output_array, _flush_output_array
+from .stats import _Phase, _reset_stats, _fixed_step_stats
+from .symplectic import _get_scheme
+
+cdef void c_symplectic_step(_CPotential p, int ndim, double dt,
+                            double *x, double *v, double *grad,
+                            double *drift, double *kick, int nkick) nogil:
+    """ One drift-kick-...-kick-drift step of a composition scheme. """
+    cdef int k, s
+
+    for s in range(nkick):
+        for k in range(ndim):
+            x[k] = x[k] + drift[s] * dt * v[k]
+
+        for k in range(ndim):
+            grad[k] = 0.
+        p._gradient(x, grad)
+
+        for k in range(ndim):
+            v[k] = v[k] - kick[s] * dt * grad[k]  # acceleration is minus gradient
+
+    for k in range(ndim):
+        x[k] = x[k] + drift[nkick] * dt * v[k]
+
+cdef void c_symplectic_steps(_CPotential p, int n, int ndim, int nsteps,
+                             double dt, double[:,::1] w, double[::1] grad,
+                             double[::1] drift, double[::1] kick,
+                             double[:,:,::1] out_w) nogil:
+    """ Advance the state ``w`` by ``nsteps`` steps, saving the state after
+        each step to ``out_w``.
+    """
+    cdef:
+        int i,j,k
+        int nkick = kick.shape[0]
+
+    for j in range(nsteps):
+        for i in range(n):
+            c_symplectic_step(p, ndim, dt, &w[i,0], &w[i,ndim], &grad[0],
+                              &drift[0], &kick[0], nkick)
+
+            for k in range(2*ndim):
+                out_w[j,i,k] = w[i,k]
+
+cpdef cy_symplectic_run(_CPotential potential, double [:,::1] w0,
+                        double dt, int nsteps, double t1, scheme='ruth4',
+                        mmap=None, int chunksize=1024, stats=None):
+    """
+    cy_symplectic_run(potential, w0, dt, nsteps, t1, scheme='ruth4', mmap=None, chunksize=1024, stats=None)
+
+    Integrate orbits from initial conditions ``w0`` in the given C potential
+    with a symplectic composition scheme (see
+    `~gary.integrate.SymplecticIntegrator` for the available schemes). The
+    ``mmap`` and ``chunksize`` arguments work as for `cy_leapfrog_run`.
+
+    ``stats`` is an optional `~gary.integrate.IntegrationStats` instance to
+    store the number of force evaluations and steps, the energy drift, and
+    the time spent in each phase in.
+    """
+    cdef int j,nchunk
+    cdef int n = w0.shape[0]
+    cdef int ndim = w0.shape[1] // 2
+
+    # temporary array containers
+    cdef double[::1] grad = np.zeros(ndim)
+    cdef double[:,::1] w = np.array(w0, copy=True)
+    cdef double[::1] drift
+    cdef double[::1] kick
+
+    # return arrays
+    cdef double[::1] all_t = np.zeros(nsteps+1)
+    cdef double[:,:,::1] all_w
+
+    _drift, _kick, order = _get_scheme(scheme)
+    drift = np.array(_drift, dtype=np.float64)
+    kick = np.array(_kick, dtype=np.float64)
+
+    stats = _reset_stats(stats)
+
+    # save initial times
+    for j in range(nsteps+1):
+        all_t[j] = t1 + j*dt
+
+    if mmap is None:
+        all_w = np.zeros((nsteps+1,n,2*ndim))
+
+        # save initial conditions
+        all_w[0,:,:] = w0
+
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_symplectic_steps(potential, n, ndim, nsteps, dt, w, grad,
+                                   drift, kick, all_w[1:])
+
+        _fixed_step_stats(stats, (<object>potential).value, n*nsteps*kick.shape[0],
+                          nsteps, dt, np.asarray(all_w))
+        return np.array(all_t), np.array(all_w)
+
+    _validate_output_array(mmap, (nsteps+1,n,2*ndim))
+    chunksize = max(min(chunksize, nsteps), 1)
+    all_w = np.zeros((chunksize,n,2*ndim))
+
+    # save initial conditions
+    mmap[0] = np.asarray(w0)
+
+    j = 0
+    while j < nsteps:
+        nchunk = min(chunksize, nsteps - j)
+        with _Phase(stats, 'integrate'):
+            with nogil:
+                c_symplectic_steps(potential, n, ndim, nchunk, dt, w, grad,
+                                   drift, kick, all_w)
+
+        with _Phase(stats, 'output'):
+            mmap[j+1:j+1+nchunk] = np.asarray(all_w[:nchunk])
+            _flush_output_array(mmap)
+        j += nchunk
+
+    _fixed_step_stats(stats, (<object>potential).value, n*nsteps*kick.shape[0],
+                      nsteps, dt, mmap)
+    return np.array(all_t), mmap
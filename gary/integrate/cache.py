@@ -0,0 +1,259 @@
+# coding: utf-8
+
+""" Content-addressed on-disk cache of integrated orbits. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+# Third-party
+import numpy as np
+import six
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+__all__ = ["OrbitCache"]
+
+# increment to invalidate all existing cache entries when the way orbits
+#   are integrated (or the key) changes
+_CACHE_VERSION = 1
+
+def _update_hash(h, obj):
+    """ Add a canonical representation of ``obj`` to the hash ``h``. Potentials
+        are described by their class, parameters, and units -- components of
+        composite potentials are hashed in the same way.
+    """
+    from ..potential import PotentialBase
+
+    if isinstance(obj, PotentialBase):
+        h.update("potential:{0}.{1}:{2}".format(obj.__class__.__module__,
+                                                obj.__class__.__name__,
+                                                obj.units).encode())
+        if isinstance(obj, dict):  # composite
+            _update_hash(h, dict(obj.items()))
+        else:
+            _update_hash(h, dict(obj.parameters))
+
+    elif isinstance(obj, dict):
+        h.update("dict:{0}".format(len(obj)).encode())
+        for k in sorted(obj.keys()):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+
+    elif isinstance(obj, (list, tuple)):
+        h.update("seq:{0}".format(len(obj)).encode())
+        for v in obj:
+            _update_hash(h, v)
+
+    elif hasattr(obj, 'unit') and hasattr(obj, 'value'):  # Quantity
+        h.update("quantity:{0}".format(obj.unit).encode())
+        _update_hash(h, obj.value)
+
+    elif isinstance(obj, np.generic):  # numpy scalars hash like Python scalars
+        _update_hash(h, obj.item())
+
+    elif isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        h.update("array:{0}:{1}".format(arr.dtype.str, arr.shape).encode())
+        h.update(arr.tobytes())
+
+    elif isinstance(obj, type):
+        h.update("class:{0}.{1}".format(obj.__module__, obj.__name__).encode())
+
+    elif isinstance(obj, bool) or obj is None:
+        h.update("{0!r}".format(obj).encode())
+
+    elif isinstance(obj, six.integer_types):
+        h.update("int:{0:d}".format(obj).encode())
+
+    elif isinstance(obj, float):
+        h.update("float:{0!r}".format(obj).encode())
+
+    elif isinstance(obj, six.string_types):
+        h.update("str:{0}".format(obj).encode("utf-8"))
+
+    else:
+        h.update("{0}:{1!r}".format(type(obj).__name__, obj).encode())
+
+class OrbitCache(object):
+    """
+    An opt-in cache of integrated orbits on disk, for repeated runs of
+    notebooks or pipelines that integrate the same orbits. Pass an instance
+    as the ``cache`` argument of
+    `~gary.potential.PotentialBase.integrate_orbit`.
+
+    Each result is stored under a hash of the potential (class, parameters,
+    and units), the initial conditions, the time specification, and the
+    integrator and its settings, as a pair of ``.npy`` files. Cached orbits
+    are returned as copy-on-write memory-mapped arrays, so a cache hit only
+    reads the parts of the orbits that are actually used. When the total
+    size of the cache exceeds ``max_size``, the least recently used entries
+    are deleted.
+
+    Parameters
+    ----------
+    path : str
+        Directory to store the cached orbits in. Created if it doesn't
+        exist. The same directory can be shared by several processes.
+    max_size : int (optional)
+        Maximum total size of the cache in bytes. Results that are larger
+        than this on their own are not cached.
+
+    Attributes
+    ----------
+    hits : int
+    misses : int
+    """
+    def __init__(self, path, max_size=2**30):
+        self.path = os.path.abspath(path)
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, potential, w0, Integrator, Integrator_kwargs=dict(), **settings):
+        """
+        The hash that identifies an integration. All extra keyword arguments
+        (e.g., the time specification) are included in the key.
+
+        Parameters
+        ----------
+        potential : `~gary.potential.PotentialBase`
+        w0 : array_like
+        Integrator : class
+        Integrator_kwargs : dict (optional)
+        **settings
+        """
+        h = hashlib.sha1()
+        _update_hash(h, _CACHE_VERSION)
+        _update_hash(h, potential)
+        _update_hash(h, np.asarray(w0, dtype=np.float64))
+        _update_hash(h, Integrator)
+        _update_hash(h, dict(Integrator_kwargs))
+        _update_hash(h, settings)
+        return h.hexdigest()
+
+    def _filenames(self, key):
+        return (os.path.join(self.path, "{0}_t.npy".format(key)),
+                os.path.join(self.path, "{0}_w.npy".format(key)))
+
+    def get(self, key):
+        """
+        Return the cached times and orbits, ``(t, w)``, for a key, or None if
+        they aren't in the cache. ``w`` is a copy-on-write memory-mapped
+        array: it can be modified without changing the cached file.
+        """
+        t_filename, w_filename = self._filenames(key)
+
+        try:
+            t = np.load(t_filename)
+            w = np.load(w_filename, mmap_mode='c')
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self._touch(key)
+        self.hits += 1
+        return t, w
+
+    def put(self, key, t, w):
+        """ Store the times and orbits for a key, then evict the least
+            recently used entries if the cache is too large.
+        """
+        w = np.asanyarray(w)
+        t = np.asarray(t)
+        if w.nbytes + t.nbytes > self.max_size:
+            logger.debug("Not caching orbits of {0} bytes -- larger than max_size"
+                         .format(w.nbytes + t.nbytes))
+            return
+
+        # write to temporary files first so that other processes never see
+        #   incomplete entries; the orbits are renamed last
+        for arr,filename in zip((t, w), self._filenames(key)):
+            fd,tmp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, arr)
+                os.rename(tmp_filename, filename)
+            except:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+
+        self._touch(key)
+        self._evict()
+
+    def _touch(self, key):
+        """ Mark an entry as recently used. The time is set explicitly because
+            file system timestamps of new files can be too coarse to order
+            entries that are written in quick succession.
+        """
+        now = time.time()
+        for filename in self._filenames(key):
+            try:
+                os.utime(filename, (now, now))
+            except OSError:
+                pass
+
+    def _entries(self):
+        """ List of ``(last access time, size, key)`` for all cached orbits. """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith("_w.npy"):
+                continue
+
+            key = name[:-len("_w.npy")]
+            try:
+                stat = [os.stat(filename) for filename in self._filenames(key)]
+            except OSError:  # incomplete, or deleted by another process
+                continue
+
+            entries.append((max(s.st_mtime for s in stat),
+                            sum(s.st_size for s in stat), key))
+        return entries
+
+    @property
+    def size(self):
+        """ Total size of the cached orbits in bytes. """
+        return sum(e[1] for e in self._entries())
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return all(os.path.exists(filename) for filename in self._filenames(key))
+
+    def _remove(self, key):
+        for filename in self._filenames(key):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        for mtime,size,key in entries:
+            if total <= self.max_size:
+                break
+            logger.debug("Evicting orbits {0} from the cache".format(key))
+            self._remove(key)
+            total -= size
+
+    def clear(self):
+        """ Delete all cached orbits. """
+        for mtime,size,key in self._entries():
+            self._remove(key)
+
+    def __repr__(self):
+        return "<OrbitCache {0} max_size={1}>".format(self.path, self.max_size)
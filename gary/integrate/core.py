@@ -8,6 +8,10 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 import logging
+import multiprocessing
+import os
+import sys
+import threading
 
 # Third-party
 import numpy as np
@@ -39,14 +43,132 @@ class Integrator(object):
             ws = np.zeros(return_shape, dtype=float)
 
         else:
-            if mmap.shape != return_shape:
-                raise ValueError("Shape of memory-mapped array doesn't match expected shape of "
-                                 "return array ({} vs {})".format(mmap.shape, return_shape))
-
-            if not mmap.flags.writeable:
-                raise TypeError("Memory-mapped array must be a writable mode, not '{}'"
-                                .format(mmap.mode))
-
+            _validate_output_array(mmap, return_shape)
             ws = mmap
 
         return w0, ws
+
+def _validate_output_array(arr, shape):
+    """ Check that a user-supplied output array -- e.g., a `numpy.memmap` or an
+        HDF5 dataset from `h5py` -- has the expected shape and can be written to.
+    """
+
+    if tuple(arr.shape) != tuple(shape):
+        raise ValueError("Shape of memory-mapped array doesn't match expected shape of "
+                         "return array ({} vs {})".format(arr.shape, shape))
+
+    if hasattr(arr, 'flags'):  # numpy array or memmap
+        if not arr.flags.writeable:
+            raise TypeError("Memory-mapped array must be a writable mode, not '{}'"
+                            .format(getattr(arr, 'mode', 'r')))
+
+    elif hasattr(arr, 'file'):  # h5py dataset
+        if arr.file.mode == 'r':
+            raise TypeError("HDF5 dataset must be in a file opened in a writable "
+                            "mode, not '{}'".format(arr.file.mode))
+
+def _flush_output_array(arr):
+    """ Flush any buffered writes to a memory-mapped array or HDF5 dataset to disk. """
+    if hasattr(arr, 'flush'):
+        arr.flush()
+    elif hasattr(arr, 'file'):
+        arr.file.flush()
+
+def _save_checkpoint(filename, **state):
+    """ Save the state of an integration to a ``.npz`` file. The file is
+        written under a temporary name first and then renamed, so an existing
+        checkpoint is never left half-written if the process is killed.
+    """
+    tmp_filename = "{0}.tmp".format(filename)
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **state)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+def _load_checkpoint(filename, **expected):
+    """ Load the state of an integration saved with `_save_checkpoint`. Returns
+        None if the file doesn't exist. The values in ``expected`` identify the
+        integration (e.g., initial conditions, time step, potential
+        parameters) and must match the values in the checkpoint.
+    """
+    if not os.path.exists(filename):
+        return None
+
+    f = np.load(filename)
+    try:
+        state = dict([(k, f[k]) for k in f.files])
+    finally:
+        f.close()
+
+    for k,v in expected.items():
+        if k not in state or not np.array_equal(state[k], np.asarray(v)):
+            raise ValueError("Checkpoint file '{0}' is for a different integration "
+                             "(mismatch in '{1}').".format(filename, k))
+
+    return state
+
+def _checkpoint_id(cpotential, **kwargs):
+    """ Values that identify an integration for `_load_checkpoint`. """
+    kwargs['potential'] = cpotential.__class__.__name__
+    kwargs['parameters'] = np.array(cpotential.__reduce__()[1], dtype=np.float64)
+    return kwargs
+
+def _get_rng_state():
+    """ State of the NumPy random number generator, as arrays that can be
+        saved with `_save_checkpoint`.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return dict(rng_keys=keys, rng_pos=pos, rng_has_gauss=has_gauss,
+                rng_cached_gaussian=cached_gaussian)
+
+def _set_rng_state(state):
+    """ Restore the state of the NumPy random number generator from a
+        checkpoint, and return it as from `_get_rng_state`.
+    """
+    np.random.set_state(('MT19937', state['rng_keys'], int(state['rng_pos']),
+                         int(state['rng_has_gauss']),
+                         float(state['rng_cached_gaussian'])))
+    return _get_rng_state()
+
+def _num_threads(nthreads, n):
+    """ Number of threads to split ``n`` orbits between: ``nthreads``, or the
+        number of CPUs if ``nthreads <= 0``, but at most one per orbit.
+    """
+    if nthreads <= 0:
+        nthreads = multiprocessing.cpu_count()
+    return max(min(nthreads, n), 1)
+
+def _run_threaded(worker, n, nthreads=1):
+    """ Split ``n`` orbits into ``_num_threads(nthreads, n)`` contiguous
+        blocks and call ``worker(b, i1, i2)`` for each block ``b`` of orbits
+        ``i1`` to ``i2``, in a separate thread if there is more than one
+        block. Returns a list of the return values of the calls, in the order
+        of the blocks. An exception raised by a worker is re-raised once all
+        threads are done.
+    """
+    nthreads = _num_threads(nthreads, n)
+    bounds = np.linspace(0, n, nthreads+1).astype(int)
+    results = [None]*nthreads
+    errors = [None]*nthreads
+
+    def run(b):
+        try:
+            results[b] = worker(b, bounds[b], bounds[b+1])
+        except:
+            errors[b] = sys.exc_info()
+
+    if nthreads == 1:
+        run(0)
+    else:
+        threads = [threading.Thread(target=run, args=(b,)) for b in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for exc_info in errors:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    return results
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+""" Continuous-time representation of orbits. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+
+__all__ = ["DenseOrbit"]
+
+class DenseOrbit(object):
+    r"""
+    A continuous-time representation of a set of orbits. Instead of storing
+    the phase-space coordinates at fixed times, this stores the coefficients
+    of the interpolating polynomials for every step of an adaptive
+    integration, so the orbits can be evaluated at any time within the
+    integration interval. Each orbit has its own steps, and the number of
+    steps (and so the memory usage) is set by the integrator tolerance
+    rather than by the number of times at which the orbit is needed.
+
+    These are usually created with
+    `~gary.integrate._dop853.dop853_dense_orbit`, which stores the 7th order
+    dense output polynomials of the DOP853 integrator, with the same
+    accuracy as the integration.
+
+    Parameters
+    ----------
+    t1 : numeric
+        Start time of the integration.
+    t2 : numeric
+        End time of the integration.
+    t_start : array_like
+        Start time of each step, shape ``(nsteps,)``.
+    h : array_like
+        Size of each step, shape ``(nsteps,)``.
+    coeffs : array_like
+        Polynomial coefficients for each step, shape ``(nsteps, ncoeff, ndim)``.
+    offsets : array_like
+        Index of the first step for each orbit, and the total number of
+        steps, shape ``(norbits+1,)``.
+
+    """
+    def __init__(self, t1, t2, t_start, h, coeffs, offsets):
+        self.t1 = float(t1)
+        self.t2 = float(t2)
+        self.t_start = np.ascontiguousarray(t_start, dtype=np.float64)
+        self.h = np.ascontiguousarray(h, dtype=np.float64)
+        self.coeffs = np.ascontiguousarray(coeffs, dtype=np.float64)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int_)
+
+        if np.any(np.diff(self.offsets) < 1):
+            raise ValueError("Every orbit must have at least one step.")
+
+    @property
+    def norbits(self):
+        return len(self.offsets) - 1
+
+    @property
+    def ndim(self):
+        return self.coeffs.shape[2]
+
+    @property
+    def nsteps(self):
+        """ Number of steps for each orbit. """
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        """ Memory used by the representation, in bytes. """
+        return (self.t_start.nbytes + self.h.nbytes +
+                self.coeffs.nbytes + self.offsets.nbytes)
+
+    def __len__(self):
+        return self.norbits
+
+    def __call__(self, t, orbits=None):
+        """
+        Evaluate the orbits at the given times.
+
+        Parameters
+        ----------
+        t : numeric, array_like
+            Times at which to evaluate the orbits, within the integration
+            interval.
+        orbits : int, array_like (optional)
+            Indices of the orbits to evaluate. Defaults to all orbits.
+
+        Returns
+        -------
+        w : :class:`numpy.ndarray`
+            The phase-space coordinates at each time, shape
+            ``(ntimes, norbits, ndim)``.
+        """
+        from ._dop853 import dense_orbit_eval
+
+        t = np.atleast_1d(np.array(t, dtype=np.float64)).ravel()
+
+        lo,hi = min(self.t1, self.t2), max(self.t1, self.t2)
+        if np.any(t < lo) or np.any(t > hi):
+            raise ValueError("Times must be within the integration interval "
+                             "[{0}, {1}].".format(lo, hi))
+
+        if orbits is None:
+            orbits = np.arange(self.norbits)
+        orbits = np.atleast_1d(np.array(orbits, dtype=np.int_)).ravel()
+        if np.any(orbits < 0) or np.any(orbits >= self.norbits):
+            raise IndexError("Orbit index out of range.")
+
+        return dense_orbit_eval(self.t_start, self.h, self.coeffs, self.offsets,
+                                t, orbits)
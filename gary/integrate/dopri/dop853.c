@@ -1,57 +1,49 @@
 #include <math.h>
 #include <stdio.h>
-#include <malloc.h>
+#include <stdlib.h>
 #include <limits.h>
 #include <memory.h>
 #include "dop853.h"
 
 
-static long      nfcn, nstep, naccpt, nrejct;
-static double    hout, xold, xout;
-static unsigned  nrds, *indir;
-static double    *yy1, *k1, *k2, *k3, *k4, *k5, *k6, *k7, *k8, *k9, *k10;
-static double    *rcont1, *rcont2, *rcont3, *rcont4;
-static double    *rcont5, *rcont6, *rcont7, *rcont8;
-
-
-long nfcnRead (void)
+long nfcnRead (Dop853Work *work)
 {
-  return nfcn;
+  return work->nfcn;
 
 } /* nfcnRead */
 
 
-long nstepRead (void)
+long nstepRead (Dop853Work *work)
 {
-  return nstep;
+  return work->nstep;
 
 } /* stepRead */
 
 
-long naccptRead (void)
+long naccptRead (Dop853Work *work)
 {
-  return naccpt;
+  return work->naccpt;
 
 } /* naccptRead */
 
 
-long nrejctRead (void)
+long nrejctRead (Dop853Work *work)
 {
-  return nrejct;
+  return work->nrejct;
 
 } /* nrejct */
 
 
-double hRead (void)
+double hRead (Dop853Work *work)
 {
-  return hout;
+  return work->hout;
 
 } /* hRead */
 
 
-double xRead (void)
+double xRead (Dop853Work *work)
 {
-  return xout;
+  return work->xout;
 
 } /* xRead */
 
@@ -154,7 +146,7 @@ static double hinit (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars,
 
 
 /* core integrator */
-static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+static int dopcor (Dop853Work *work, unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
        double x, double* y, double xend,
 		   double hmax, double h, double* rtoler, double* atoler,
 		   int itoler, FILE* fileout, SolTrait solout, int iout,
@@ -181,6 +173,12 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
   double   d51, d56, d57, d58, d59, d510, d511, d512, d513, d514, d515, d516;
   double   d61, d66, d67, d68, d69, d610, d611, d612, d613, d614, d615, d616;
   double   d71, d76, d77, d78, d79, d710, d711, d712, d713, d714, d715, d716;
+  double   *yy1 = work->yy1, *k1 = work->k1, *k2 = work->k2, *k3 = work->k3;
+  double   *k4 = work->k4, *k5 = work->k5, *k6 = work->k6, *k7 = work->k7;
+  double   *k8 = work->k8, *k9 = work->k9, *k10 = work->k10;
+  double   *rcont1 = work->rcont1, *rcont2 = work->rcont2, *rcont3 = work->rcont3;
+  double   *rcont4 = work->rcont4, *rcont5 = work->rcont5, *rcont6 = work->rcont6;
+  double   *rcont7 = work->rcont7, *rcont8 = work->rcont8;
 
   /* initialisations */
   switch (meth)
@@ -374,16 +372,16 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
   iord = 8;
   if (h == 0.0)
     h = hinit (n, fcn, gradfunc, gpars, norbits, x, y, posneg, k1, k2, k3, iord, hmax, atoler, rtoler, itoler);
-  nfcn += 2;
+  work->nfcn += 2;
   reject = 0;
-  xold = x;
+  work->xold = x;
 
   if (iout)
   {
     irtrn = 1;
-    hout = 1.0;
-    xout = x;
-    solout (naccpt+1, xold, x, y, n, &irtrn);
+    work->hout = 1.0;
+    work->xout = x;
+    solout (work, work->naccpt+1, work->xold, x, y, n, &irtrn);
     if (irtrn < 0)
     {
       if (fileout)
@@ -395,12 +393,12 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
   /* basic integration step */
   while (1)
   {
-    if (nstep > nmax)
+    if (work->nstep > nmax)
     {
       if (fileout)
 	fprintf (fileout, "Exit of dop853 at x = %.16e, more than nmax = %li are needed\r\n", x, nmax);
-      xout = x;
-      hout = h;
+      work->xout = x;
+      work->hout = h;
       return -2;
     }
 
@@ -408,8 +406,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
     {
       if (fileout)
 	fprintf (fileout, "Exit of dop853 at x = %.16e, step size too small h = %.16e\r\n", x, h);
-      xout = x;
-      hout = h;
+      work->xout = x;
+      work->hout = h;
       return -3;
     }
 
@@ -419,7 +417,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       last = 1;
     }
 
-    nstep++;
+    work->nstep++;
 
     /* the twelve stages */
     for (i = 0; i < n; i++)
@@ -462,7 +460,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			  a127*k7[i] + a128*k8[i] + a129*k9[i] +
 			  a1210*k10[i] + a1211*k2[i]);
     fcn (n, xph, yy1, k3, gradfunc, gpars, norbits);
-    nfcn += 11;
+    work->nfcn += 11;
     for (i = 0; i < n; i++)
     {
       k4[i] = b1*k1[i] + b6*k6[i] + b7*k7[i] + b8*k8[i] + b9*k9[i] +
@@ -515,12 +513,12 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* step accepted */
 
       facold = max_d (err, 1.0E-4);
-      naccpt++;
+      work->naccpt++;
       fcn (n, xph, k5, k4, gradfunc, gpars, norbits);
-      nfcn++;
+      work->nfcn++;
 
       /* stiffness detection */
-      if (!(naccpt % nstiff) || (iasti > 0))
+      if (!(work->naccpt % nstiff) || (iasti > 0))
       {
 	stnum = 0.0;
 	stden = 0.0;
@@ -542,8 +540,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 	      fprintf (fileout, "The problem seems to become stiff at x = %.16e\r\n", x);
 	    else
 	    {
-	      xout = x;
-	      hout = h;
+	      work->xout = x;
+	      work->hout = h;
 	      return -4;
 	    }
 	}
@@ -559,7 +557,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       if (iout == 2)
       {
 	/* save the first function evaluations */
-	if (nrds == n)
+	if (work->nrds == n)
 	  for (i = 0; i < n; i++)
 	  {
 	    rcont1[i] = y[i];
@@ -578,7 +576,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			d79*k9[i] + d710*k10[i] + d711*k2[i] + d712*k3[i];
 	  }
 	else
-	  for (j = 0; j < nrds; j++)
+	  for (j = 0; j < work->nrds; j++)
 	  {
 	    i = icont[j];
 	    rcont1[j] = y[i];
@@ -613,10 +611,10 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			      a169*k9[i] + a1613*k4[i] + a1614*k10[i] +
 			      a1615*k2[i]);
 	fcn (n, x+c16*h, yy1, k3, gradfunc, gpars, norbits);
-	nfcn += 3;
+	work->nfcn += 3;
 
 	/* final preparation */
-	if (nrds == n)
+	if (work->nrds == n)
 	  for (i = 0; i < n; i++)
 	  {
 	    rcont5[i] = h * (rcont5[i] + d413*k4[i] + d414*k10[i] +
@@ -629,7 +627,7 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 			     d715*k2[i] + d716*k3[i]);
 	  }
         else
-	  for (j = 0; j < nrds; j++)
+	  for (j = 0; j < work->nrds; j++)
 	  {
 	    i = icont[j];
 	    rcont5[j] = h * (rcont5[j] + d413*k4[i] + d414*k10[i] +
@@ -645,14 +643,14 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 
       memcpy (k1, k4, n * sizeof(double));
       memcpy (y, k5, n * sizeof(double));
-      xold = x;
+      work->xold = x;
       x = xph;
 
       if (iout)
       {
-	hout = h;
-	xout = x;
-	solout (naccpt+1, xold, x, y, n, &irtrn);
+	work->hout = h;
+	work->xout = x;
+	solout (work, work->naccpt+1, work->xold, x, y, n, &irtrn);
 	if (irtrn < 0)
 	{
 	  if (fileout)
@@ -664,8 +662,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* normal exit */
       if (last)
       {
-	hout=hnew;
-	xout = x;
+	work->hout=hnew;
+	work->xout = x;
 	return 1;
       }
 
@@ -681,8 +679,8 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
       /* step rejected */
       hnew = h / min_d (facc1, fac11/safe);
       reject = 1;
-      if (naccpt >= 1)
-	nrejct=nrejct + 1;
+      if (work->naccpt >= 1)
+	work->nrejct=work->nrejct + 1;
       last = 0;
     }
 
@@ -692,21 +690,123 @@ static int dopcor (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, un
 } /* dopcor */
 
 
+/* workspace allocation */
+Dop853Work *dop853_alloc (unsigned n, unsigned nrdens)
+{
+  Dop853Work *work;
+
+  if ((n == UINT_MAX) || (nrdens > n))
+    return NULL;
+
+  work = (Dop853Work*) calloc (1, sizeof(Dop853Work));
+  if (!work)
+    return NULL;
+
+  work->n = n;
+  work->nrdens = nrdens;
+
+  /* memory for the method */
+  work->yy1 = (double*) malloc (n*sizeof(double));
+  work->k1 = (double*) malloc (n*sizeof(double));
+  work->k2 = (double*) malloc (n*sizeof(double));
+  work->k3 = (double*) malloc (n*sizeof(double));
+  work->k4 = (double*) malloc (n*sizeof(double));
+  work->k5 = (double*) malloc (n*sizeof(double));
+  work->k6 = (double*) malloc (n*sizeof(double));
+  work->k7 = (double*) malloc (n*sizeof(double));
+  work->k8 = (double*) malloc (n*sizeof(double));
+  work->k9 = (double*) malloc (n*sizeof(double));
+  work->k10 = (double*) malloc (n*sizeof(double));
+
+  if (!work->yy1 || !work->k1 || !work->k2 || !work->k3 || !work->k4 || !work->k5 ||
+      !work->k6 || !work->k7 || !work->k8 || !work->k9 || !work->k10)
+  {
+    dop853_free (work);
+    return NULL;
+  }
+
+  /* memory for dense output */
+  if (nrdens)
+  {
+    work->rcont1 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont2 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont3 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont4 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont5 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont6 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont7 = (double*) malloc (nrdens*sizeof(double));
+    work->rcont8 = (double*) malloc (nrdens*sizeof(double));
+    if (nrdens < n)
+      work->indir = (unsigned*) malloc (n*sizeof(unsigned));
+
+    if (!work->rcont1 || !work->rcont2 || !work->rcont3 || !work->rcont4 ||
+        !work->rcont5 || !work->rcont6 || !work->rcont7 || !work->rcont8 ||
+        (!work->indir && (nrdens < n)))
+    {
+      dop853_free (work);
+      return NULL;
+    }
+  }
+
+  return work;
+
+} /* dop853_alloc */
+
+
+void dop853_free (Dop853Work *work)
+{
+  if (!work)
+    return;
+
+  free (work->k10);   /* free() is a no-op for NULL pointers */
+  free (work->k9);
+  free (work->k8);
+  free (work->k7);
+  free (work->k6);
+  free (work->k5);
+  free (work->k4);
+  free (work->k3);
+  free (work->k2);
+  free (work->k1);
+  free (work->yy1);
+  free (work->indir);
+  free (work->rcont8);
+  free (work->rcont7);
+  free (work->rcont6);
+  free (work->rcont5);
+  free (work->rcont4);
+  free (work->rcont3);
+  free (work->rcont2);
+  free (work->rcont1);
+  free (work);
+
+} /* dop853_free */
+
+
 /* front-end */
 int dop853
- (unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
+ (Dop853Work *work, unsigned n, FcnEqDiff fcn, GradFn gradfunc, double *gpars, unsigned norbits,
   double x, double* y, double xend, double* rtoler,
   double* atoler, int itoler, SolTrait solout, int iout, FILE* fileout, double uround,
   double safe, double fac1, double fac2, double beta, double hmax, double h,
   long nmax, int meth, long nstiff, unsigned nrdens, unsigned* icont, unsigned licont)
 {
-  int       arret, idid;
+  int       arret;
   unsigned  i;
 
   /* initialisations */
-  nfcn = nstep = naccpt = nrejct = arret = 0;
-  rcont1 = rcont2 = rcont3 = rcont4 = rcont5 = rcont6 = rcont7 = rcont8 = NULL;
-  indir = NULL;
+  arret = 0;
+
+  /* the workspace must have been allocated for (at least) this system */
+  if (!work)
+  {
+    if (fileout)
+      fprintf (fileout, "No workspace given, allocate one with dop853_alloc\r\n");
+    return -1;
+  }
+  work->nfcn = work->nstep = work->naccpt = work->nrejct = 0;
+  work->nrds = 0;
+  work->use_indir = 0;
 
   /* n, the dimension of the system */
   if (n == UINT_MAX)
@@ -715,6 +815,12 @@ int dop853
       fprintf (fileout, "System too big, max. n = %u\r\n", UINT_MAX-1);
     arret = 1;
   }
+  else if (n > work->n)
+  {
+    if (fileout)
+      fprintf (fileout, "Workspace too small, n = %u but workspace n = %u\r\n", n, work->n);
+    arret = 1;
+  }
 
   /* nmax, the maximal number of steps */
   if (!nmax)
@@ -759,32 +865,20 @@ int dop853
   }
   else if (nrdens)
   {
-    /* is there enough memory to allocate rcont12345678&indir ? */
-    rcont1 = (double*) malloc (nrdens*sizeof(double));
-    rcont2 = (double*) malloc (nrdens*sizeof(double));
-    rcont3 = (double*) malloc (nrdens*sizeof(double));
-    rcont4 = (double*) malloc (nrdens*sizeof(double));
-    rcont5 = (double*) malloc (nrdens*sizeof(double));
-    rcont6 = (double*) malloc (nrdens*sizeof(double));
-    rcont7 = (double*) malloc (nrdens*sizeof(double));
-    rcont8 = (double*) malloc (nrdens*sizeof(double));
-    if (nrdens < n)
-      indir = (unsigned*) malloc (n*sizeof(unsigned));
-
-    if (!rcont1 || !rcont2 || !rcont3 || !rcont4 || !rcont5 ||
-	!rcont6 || !rcont7 || !rcont8 || (!indir && (nrdens < n)))
+    /* is there enough memory in the workspace for rcont12345678&indir ? */
+    if ((nrdens > work->nrdens) || ((nrdens < n) && !work->indir))
     {
       if (fileout)
-	fprintf (fileout, "Not enough free memory for rcont12345678&indir\r\n");
+	fprintf (fileout, "Workspace has no memory for rcont12345678&indir, nrdens = %u\r\n", nrdens);
       arret = 1;
     }
 
     /* control of length of icont */
-    if (nrdens == n)
+    else if (nrdens == n)
     {
       if (icont && fileout)
 	fprintf (fileout, "Warning : when nrdens = n there is no need allocating memory for icont\r\n");
-      nrds = n;
+      work->nrds = n;
     }
     else if (licont < nrdens)
     {
@@ -796,11 +890,12 @@ int dop853
     {
       if ((iout < 2) && fileout)
 	fprintf (fileout, "Warning : put iout = 2 for dense output\r\n");
-      nrds = nrdens;
+      work->nrds = nrdens;
+      work->use_indir = 1;
       for (i = 0; i < n; i++)
-	indir[i] = UINT_MAX;
+	work->indir[i] = UINT_MAX;
       for (i = 0; i < nrdens; i++)
-	indir[icont[i]] = i;
+	work->indir[icont[i]] = i;
     }
   }
 
@@ -846,119 +941,32 @@ int dop853
   if (hmax == 0.0)
     hmax = xend - x;
 
-  /* is there enough free memory for the method ? */
-  yy1 = (double*) malloc (n*sizeof(double));
-  k1 = (double*) malloc (n*sizeof(double));
-  k2 = (double*) malloc (n*sizeof(double));
-  k3 = (double*) malloc (n*sizeof(double));
-  k4 = (double*) malloc (n*sizeof(double));
-  k5 = (double*) malloc (n*sizeof(double));
-  k6 = (double*) malloc (n*sizeof(double));
-  k7 = (double*) malloc (n*sizeof(double));
-  k8 = (double*) malloc (n*sizeof(double));
-  k9 = (double*) malloc (n*sizeof(double));
-  k10 = (double*) malloc (n*sizeof(double));
-
-  if (!yy1 || !k1 || !k2 || !k3 || !k4 || !k5 || !k6 || !k7 || !k8 || !k9 || !k10)
-  {
-    if (fileout)
-      fprintf (fileout, "Not enough free memory for the method\r\n");
-    arret = 1;
-  }
-
   /* when a failure has occured, we return -1 */
   if (arret)
-  {
-    if (k10)
-      free (k10);
-    if (k9)
-      free (k9);
-    if (k8)
-      free (k8);
-    if (k7)
-      free (k7);
-    if (k6)
-      free (k6);
-    if (k5)
-      free (k5);
-    if (k4)
-      free (k4);
-    if (k3)
-      free (k3);
-    if (k2)
-      free (k2);
-    if (k1)
-      free (k1);
-    if (yy1)
-      free (yy1);
-    if (indir)
-      free (indir);
-    if (rcont8)
-      free (rcont8);
-    if (rcont7)
-      free (rcont7);
-    if (rcont6)
-      free (rcont6);
-    if (rcont5)
-      free (rcont5);
-    if (rcont4)
-      free (rcont4);
-    if (rcont3)
-      free (rcont3);
-    if (rcont2)
-      free (rcont2);
-    if (rcont1)
-      free (rcont1);
-
     return -1;
-  }
   else
-  {
-    idid = dopcor (n, fcn, gradfunc, gpars, norbits, x, y, xend, hmax, h, rtoler, atoler, itoler, fileout,
-		   solout, iout, nmax, uround, meth, nstiff, safe, beta, fac1, fac2, icont);
-    free (k10);
-    free (k9);
-    free (k8);
-    free (k7);
-    free (k6);
-    free (k5);    /* reverse order freeing too increase chances */
-    free (k4);    /* of efficient dynamic memory managing       */
-    free (k3);
-    free (k2);
-    free (k1);
-    free (yy1);
-    if (indir)
-      free (indir);
-    if (rcont8)
-    {
-      free (rcont8);
-      free (rcont7);
-      free (rcont6);
-      free (rcont5);
-      free (rcont4);
-      free (rcont3);
-      free (rcont2);
-      free (rcont1);
-    }
-
-    return idid;
-  }
+    return dopcor (work, n, fcn, gradfunc, gpars, norbits, x, y, xend, hmax, h, rtoler, atoler,
+		   itoler, fileout, solout, iout, nmax, uround, meth, nstiff, safe, beta, fac1,
+		   fac2, icont);
 
 } /* dop853 */
 
 
 /* dense output function */
-double contd8 (unsigned ii, double x)
+double contd8 (Dop853Work *work, unsigned ii, double x)
 {
-  unsigned i, j;
+  unsigned i;
   double   s, s1;
+  double   *rcont1 = work->rcont1, *rcont2 = work->rcont2, *rcont3 = work->rcont3;
+  double   *rcont4 = work->rcont4, *rcont5 = work->rcont5, *rcont6 = work->rcont6;
+  double   *rcont7 = work->rcont7, *rcont8 = work->rcont8;
 
   i = UINT_MAX;
 
-  if (!indir)
+  if (!work->use_indir)
     i = ii;
   else
-    i = indir[ii];
+    i = work->indir[ii];
 
   if (i == UINT_MAX)
   {
@@ -966,7 +974,7 @@ double contd8 (unsigned ii, double x)
     return 0.0;
   }
 
-  s = (x - xold) / hout;
+  s = (x - work->xold) / work->hout;
   s1 = 1.0 - s;
 
   return rcont1[i]+s*(rcont2[i]+s1*(rcont3[i]+s*(rcont4[i]+s1*(rcont5[i]+
@@ -40,6 +40,11 @@ J.Colinge (COLINGE@DIVSUN.UNIGE.CH).
 INPUT PARAMETERS
 ----------------
 
+work     A workspace created by dop853_alloc (see Memory requirements below).
+	 The workspace holds all of the state of an integration, so the same
+	 workspace can be reused for many calls to dop853 but must not be
+	 shared by integrations running at the same time.
+
 n        Dimension of the system (n < UINT_MAX).
 
 fcn      A pointer the the function definig the differential equation, this
@@ -72,16 +77,18 @@ solout   A pointer to the output function called during integration.
 	 pass a pointer equal to NULL. solout must must have the following
 	 prototype
 
-	   solout (long nr, double xold, double x, double* y, unsigned n, int* irtrn)
+	   solout (Dop853Work *work, long nr, double xold, double x, double* y,
+		   unsigned n, int* irtrn)
 
 	 where y is the solution the at nr-th grid point x, xold is the
 	 previous grid point and irtrn serves to interrupt the integration
-	 (if set to a negative value).
+	 (if set to a negative value). Any extra data needed by solout can be
+	 attached to work->soldata.
 
 	 Continuous output : during the calls to solout, a continuous solution
 	 for the interval (xold,x) is available through the function
 
-	   contd8(i,s)
+	   contd8(work,i,s)
 
 	 which provides an approximation to the i-th component of the solution
 	 at the point s (s must lie in the interval (xold,x)).
@@ -144,15 +151,18 @@ nrdens   Number of components for which dense outpout is required, default 0.
 Memory requirements
 -------------------
 
-	 The function dop853 allocates dynamically 11*n doubles for the method
-	 stages, 8*nrdens doubles for the interpolation if dense output is
-	 performed and n unsigned if 0 < nrdens < n.
+	 The function dop853_alloc(n, nrdens) allocates dynamically 11*n doubles
+	 for the method stages, 8*nrdens doubles for the interpolation if dense
+	 output is performed and n unsigned if 0 < nrdens < n. It returns NULL
+	 if there is not enough free memory. The workspace can be used for any
+	 system with dimension <= n (and <= nrdens dense components) and must be
+	 released with dop853_free. dop853 itself allocates no memory.
 
 
 OUTPUT PARAMETERS
 -----------------
 
-y       numerical solution at x=xRead() (see below).
+y       numerical solution at x=xRead(work) (see below).
 
 dopri5 returns the following values
 
@@ -164,7 +174,8 @@ dopri5 returns the following values
 	-4 : the problem is probably stff (interrupted).
 
 
-Several functions provide access to different values :
+Several functions provide access to different values of the last call
+(all take the workspace as their only argument) :
 
 xRead   x value for which the solution has been computed (x=xend after
 	successful return).
@@ -184,12 +195,48 @@ nfcnRead    Number of function calls.
 #include <stdio.h>
 #include <limits.h>
 
+typedef struct Dop853Work Dop853Work;
+
 typedef void (*GradFn)(double *pars, double *q, double *grad);
-typedef void (*SolTrait)(long nr, double xold, double x, double* y, unsigned n, int* irtrn);
+typedef void (*SolTrait)(Dop853Work *work, long nr, double xold, double x, double* y, unsigned n, int* irtrn);
 typedef void (*FcnEqDiff)(unsigned n, double x, double *y, double *f, GradFn gradfunc, double *gpars, unsigned norbits);
 
+/* ADDED BY APW: all of the state that used to live in file-level static
+   variables is kept in a workspace, so that several integrations can run at
+   the same time (e.g., in different threads) and the memory for the method
+   can be allocated once and reused for many calls to dop853. */
+struct Dop853Work
+{
+  unsigned n;        /* dimension the workspace was allocated for */
+  unsigned nrdens;   /* number of dense output components allocated for */
+
+  /* statistical data of the last call */
+  long     nfcn, nstep, naccpt, nrejct;
+
+  /* state needed by the dense output function */
+  double   hout, xold, xout;
+  unsigned nrds, *indir;
+  int      use_indir;
+
+  /* memory for the method and for the dense output */
+  double   *yy1, *k1, *k2, *k3, *k4, *k5, *k6, *k7, *k8, *k9, *k10;
+  double   *rcont1, *rcont2, *rcont3, *rcont4;
+  double   *rcont5, *rcont6, *rcont7, *rcont8;
+
+  /* anything else solout needs -- never touched by the integrator */
+  void     *soldata;
+};
+
+extern Dop853Work *dop853_alloc
+ (unsigned n,      /* dimension of the largest system to be integrated */
+  unsigned nrdens  /* number of components for which dense outpout is required */
+ );
+
+extern void dop853_free (Dop853Work *work);
+
 extern int dop853
- (unsigned n,      /* dimension of the system <= UINT_MAX-1*/
+ (Dop853Work *work, /* workspace allocated with dop853_alloc */
+  unsigned n,      /* dimension of the system <= UINT_MAX-1*/
   FcnEqDiff fcn,   /* function computing the value of f(x,y) */
   GradFn gradfunc, /* ADDED BY ADRN: function to compute gradient */
   double *gpars,   /* ADDED BY ADRN: parameters for gradient function */
@@ -219,16 +266,17 @@ extern int dop853
  );
 
 extern double contd8
- (unsigned ii,     /* index of desired component */
+ (Dop853Work *work, /* workspace of the integration in progress */
+  unsigned ii,     /* index of desired component */
   double x         /* approximation at x */
  );
 
-extern long nfcnRead (void);   /* encapsulation of statistical data */
-extern long nstepRead (void);
-extern long naccptRead (void);
-extern long nrejctRead (void);
-extern double hRead (void);
-extern double xRead (void);
+extern long nfcnRead (Dop853Work *work);   /* encapsulation of statistical data */
+extern long nstepRead (Dop853Work *work);
+extern long naccptRead (Dop853Work *work);
+extern long nrejctRead (Dop853Work *work);
+extern double hRead (Dop853Work *work);
+extern double xRead (Dop853Work *work);
 
 /* ADDED BY APW */
 extern void Fwrapper (unsigned ndim, double t, double *w, double *f,
@@ -0,0 +1,158 @@
+# coding: utf-8
+
+""" Integrate orbits in parallel with a (multiprocessing or MPI) pool. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import logging
+
+# Third-party
+import numpy as np
+
+# Project
+from .core import _validate_output_array
+from .leapfrog import LeapfrogIntegrator
+from .timespec import _parse_time_specification
+from ..util import get_pool
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+__all__ = ["get_integration_pool", "pool_integrate_orbit"]
+
+# the potential in the current worker process, set once when the pool is created
+_worker_potential = None
+
+def _init_worker(potential):
+    global _worker_potential
+    _worker_potential = potential
+
+def _integrate_shard(args):
+    """ Integrate the orbits ``w0`` in the potential of the worker process.
+        If ``out`` is given, the orbits are written to columns ``i1:i2`` of
+        the memory-mapped file it describes and only the times are returned.
+    """
+    i1, i2, w0, out, Integrator, Integrator_kwargs, time_spec = args
+
+    if _worker_potential is None:
+        raise RuntimeError("No potential in this worker process -- the pool "
+                           "must be created with get_integration_pool().")
+
+    t,w = _worker_potential.integrate_orbit(w0, Integrator=Integrator,
+                                            Integrator_kwargs=Integrator_kwargs,
+                                            **time_spec)
+    if out is None:
+        return t, np.asarray(w)
+
+    filename, dtype, shape, offset = out
+    mmap = np.memmap(filename, dtype=dtype, mode='r+', shape=shape, offset=offset)
+    mmap[:,i1:i2] = w
+    mmap.flush()
+    del mmap
+    return t, None
+
+def _pool_size(pool):
+    if hasattr(pool, 'size'):  # MPIPool
+        return max(pool.size, 1)
+    return getattr(pool, '_processes', 1)
+
+def get_integration_pool(potential, mpi=False, threads=None):
+    """
+    Create a pool of worker processes (with `~gary.util.get_pool`) for
+    `pool_integrate_orbit`. The potential is sent to every worker exactly
+    once, when the pool is created, and is then used for all tasks.
+
+    With MPI, this has to be called by all processes: the worker processes
+    wait for tasks and exit when the pool is closed, so only the master
+    process returns from this function.
+
+    Parameters
+    ----------
+    potential : `~gary.potential.PotentialBase`
+    mpi : bool (optional)
+        Use an MPI pool.
+    threads : int (optional)
+        If not using MPI, the number of processes in a multiprocessing pool.
+        If None or 1, the orbits are integrated serially.
+    """
+    return get_pool(mpi=mpi, threads=threads,
+                    initializer=_init_worker, initargs=(potential,))
+
+def pool_integrate_orbit(w0, pool, Integrator=LeapfrogIntegrator,
+                         Integrator_kwargs=dict(), mmap=None, nchunks=None,
+                         **time_spec):
+    """
+    Integrate orbits from the initial conditions ``w0`` in the potential of
+    a pool created with `get_integration_pool`, by splitting the orbits into
+    chunks that are integrated in the worker processes with
+    `~gary.potential.PotentialBase.integrate_orbit`. The same script runs
+    serially, on the cores of a single machine, or on a cluster with MPI,
+    depending only on how the pool is created.
+
+    Parameters
+    ----------
+    w0 : array_like
+        Initial conditions, shape ``(norbits, ndim)``.
+    pool
+        Pool from `get_integration_pool`.
+    Integrator : class (optional)
+        Integrator class to use.
+    Integrator_kwargs : dict (optional)
+        Arguments passed to the integrator.
+    mmap : `numpy.memmap` (optional)
+        Output array with shape ``(ntimes, norbits, ndim)``. Each worker
+        writes its orbits directly to the file, so the orbits are never sent
+        back to the master process. The file has to be accessible to all
+        workers (e.g., on a shared file system when using MPI).
+    nchunks : int (optional)
+        Number of chunks to split the orbits into. Defaults to the number of
+        workers in the pool. Note that adaptive integrators choose the step
+        size for each chunk separately, so the orbits only agree with a
+        single call to ``integrate_orbit`` to within the tolerance.
+
+    Other Parameters
+    ----------------
+    (see `~gary.potential.PotentialBase.integrate_orbit`; ``dt='auto'`` is
+    not supported because all chunks must have the same output times.)
+
+    Returns
+    -------
+    t : :class:`numpy.ndarray`
+    w : :class:`numpy.ndarray`
+        The orbits, or ``mmap`` if given.
+    """
+    w0 = np.atleast_2d(np.asarray(w0, dtype=np.float64))
+    norbits, ndim = w0.shape
+
+    if time_spec.get('dt', None) == 'auto':
+        raise ValueError("dt='auto' is not supported for pool integration -- "
+                         "specify the time step.")
+    ntimes = len(_parse_time_specification(**time_spec))
+
+    if nchunks is None:
+        nchunks = _pool_size(pool)
+    nchunks = max(min(nchunks, norbits), 1)
+    bounds = np.linspace(0, norbits, nchunks+1).astype(int)
+
+    out = None
+    if mmap is not None:
+        if not isinstance(mmap, np.memmap) or mmap.filename is None:
+            raise TypeError("Output of a pool integration must be a numpy.memmap "
+                            "that is backed by a file.")
+        _validate_output_array(mmap, (ntimes,norbits,ndim))
+        mmap.flush()
+        out = (mmap.filename, mmap.dtype, mmap.shape, mmap.offset)
+
+    tasks = [(i1, i2, w0[i1:i2], out, Integrator, Integrator_kwargs, time_spec)
+             for i1,i2 in zip(bounds[:-1], bounds[1:])]
+    logger.debug("Integrating {0} orbits in {1} chunks".format(norbits, nchunks))
+    results = list(pool.map(_integrate_shard, tasks))
+
+    t = results[0][0]
+    if mmap is not None:
+        return t, mmap
+
+    return t, np.concatenate([res[1] for res in results], axis=1)
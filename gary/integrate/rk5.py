@@ -180,9 +180,6 @@ class RK5Integrator(Integrator):
         w0, ws = self._prepare_ws(w0, mmap, nsteps=nsteps)
         nparticles, ndim = w0.shape
 
-        # create the return arrays
-        ws = np.zeros((nsteps+1,) + w0.shape, dtype=float)
-
         # Set first step to the initial conditions
         ws[0] = w0
         w = w0.copy()
@@ -0,0 +1,455 @@
+# coding: utf-8
+
+""" A local service that integrates orbits for many clients in large batches. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+from collections import OrderedDict
+import functools
+import itertools
+import logging
+from multiprocessing.connection import Listener, Client
+import pickle
+import threading
+import time
+
+# Third-party
+import numpy as np
+from six.moves import queue
+
+# Project
+from .leapfrog import LeapfrogIntegrator
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+__all__ = ["OrbitFuture", "IntegrationService", "IntegrationServer",
+           "IntegrationClient"]
+
+class OrbitFuture(object):
+    """
+    The result of an integration request that will be available later, as
+    returned by `IntegrationService.submit` and `IntegrationClient.submit`.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        """ True if the orbits have been integrated (or the request failed). """
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the integration and return the times and orbits, ``(t, w)``,
+        in the same form as `~gary.potential.PotentialBase.integrate_orbit`.
+        If the integration failed, the exception is raised here.
+
+        Parameters
+        ----------
+        timeout : numeric (optional)
+            Maximum number of seconds to wait. A `RuntimeError` is raised if
+            the result isn't available by then.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError("Timed out waiting for the integration.")
+
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the integration and return the exception raised by it,
+            or None if it succeeded.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError("Timed out waiting for the integration.")
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """ Call ``fn(future)`` when the integration is done (immediately if
+            it already is), in the thread that completes the request.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception("Exception in callback of {0}".format(self))
+
+    def _set_result(self, result):
+        self._set(result, None)
+
+    def _set_exception(self, exception):
+        self._set(None, exception)
+
+class _Request(object):
+    """ A queued integration request. Requests with the same key (potential,
+        integrator, and time specification) can be integrated together.
+    """
+    def __init__(self, potential, w0, Integrator, Integrator_kwargs, time_spec):
+        self.w0 = np.atleast_2d(np.asarray(w0, dtype=np.float64))
+        if self.w0.ndim != 2:
+            raise ValueError("Initial conditions must have shape (norbits, ndim).")
+
+        if time_spec.get('dt', None) == 'auto':
+            raise ValueError("dt='auto' is not supported by the integration service -- "
+                             "specify the time step.")
+
+        self.potential = potential
+        self.Integrator = Integrator
+        self.Integrator_kwargs = dict(Integrator_kwargs)
+        self.time_spec = time_spec
+        self.future = OrbitFuture()
+
+        # equal potentials pickle to the same bytes, including potentials that
+        #   were sent over a connection by different clients
+        self.key = pickle.dumps((potential, Integrator,
+                                 sorted(self.Integrator_kwargs.items()),
+                                 sorted(time_spec.items()), self.w0.shape[1]),
+                                protocol=2)
+
+class IntegrationService(object):
+    """
+    Integrate orbits submitted from many threads in large batches. Requests
+    for the same potential, integrator, and time specification that arrive
+    within ``max_wait`` seconds of each other are stacked into a single call
+    to `~gary.potential.PotentialBase.integrate_orbit`, so that the per-call
+    overhead is paid once per batch instead of once per request. The
+    compiled integrators release the GIL, so clients keep running while a
+    batch is integrated in the service thread.
+
+    The service is used directly within a process (and is a stand-in for
+    `IntegrationClient` in tests, with the same ``submit`` and
+    ``integrate_orbit`` methods), or is shared between processes with
+    `IntegrationServer`.
+
+    Parameters
+    ----------
+    max_orbits : int (optional)
+        Stop collecting requests for a batch when it contains this many
+        orbits.
+    max_wait : numeric (optional)
+        Number of seconds to wait for more requests after the first request
+        of a batch arrives.
+
+    Attributes
+    ----------
+    nrequests : int
+        Number of requests that have been integrated.
+    nbatches : int
+        Number of calls to ``integrate_orbit``.
+    """
+    def __init__(self, max_orbits=16384, max_wait=0.01):
+        self.max_orbits = int(max_orbits)
+        self.max_wait = float(max_wait)
+        self.nrequests = 0
+        self.nbatches = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="IntegrationService")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, potential, w0, Integrator=LeapfrogIntegrator,
+               Integrator_kwargs=dict(), **time_spec):
+        """
+        Queue orbits to be integrated and return an `OrbitFuture` for the
+        result. The arguments are the same as for
+        `~gary.potential.PotentialBase.integrate_orbit`, except that the
+        time step can't be chosen automatically.
+
+        Parameters
+        ----------
+        potential : `~gary.potential.PotentialBase`
+        w0 : array_like
+            Initial conditions, shape ``(norbits, ndim)``.
+        Integrator : class (optional)
+            Integrator class to use.
+        Integrator_kwargs : dict (optional)
+            Arguments passed to the integrator.
+
+        Other Parameters
+        ----------------
+        (see `~gary.potential.PotentialBase.integrate_orbit`)
+        """
+        if self._closed:
+            raise RuntimeError("Integration service is closed.")
+
+        request = _Request(potential, w0, Integrator, Integrator_kwargs, time_spec)
+        self._queue.put(request)
+        return request.future
+
+    def integrate_orbit(self, potential, w0, Integrator=LeapfrogIntegrator,
+                        Integrator_kwargs=dict(), **time_spec):
+        """ Integrate orbits and wait for the result. Same arguments as
+            `submit`.
+        """
+        return self.submit(potential, w0, Integrator=Integrator,
+                           Integrator_kwargs=Integrator_kwargs, **time_spec).result()
+
+    def close(self):
+        """ Finish all queued requests and stop the service thread. """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            # collect more requests until the batch is full or the time is up
+            batch = [request]
+            norbits = len(request.w0)
+            deadline = time.time() + self.max_wait
+            while norbits < self.max_orbits:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    stop = True
+                    break
+
+                batch.append(request)
+                norbits += len(request.w0)
+
+            groups = OrderedDict()
+            for request in batch:
+                groups.setdefault(request.key, []).append(request)
+
+            for requests in groups.values():
+                self._integrate(requests)
+
+    def _integrate(self, requests):
+        """ Integrate a group of compatible requests with a single call. """
+        first = requests[0]
+        bounds = np.cumsum([0] + [len(r.w0) for r in requests])
+        logger.debug("Integrating {0} orbits from {1} requests"
+                     .format(bounds[-1], len(requests)))
+
+        try:
+            w0 = np.vstack([r.w0 for r in requests])
+            t,w = first.potential.integrate_orbit(w0, Integrator=first.Integrator,
+                                                  Integrator_kwargs=first.Integrator_kwargs,
+                                                  **first.time_spec)
+        except Exception as e:
+            for request in requests:
+                request.future._set_exception(e)
+            return
+
+        self.nbatches += 1
+        self.nrequests += len(requests)
+        w = np.asarray(w)
+        for request,i1,i2 in zip(requests, bounds[:-1], bounds[1:]):
+            request.future._set_result((np.array(t), w[:,i1:i2].copy()))
+
+class IntegrationServer(object):
+    """
+    Share an `IntegrationService` between processes on the same machine.
+    Clients connect with `IntegrationClient`, and their requests are
+    batched together with those from all other clients.
+
+    Parameters
+    ----------
+    address : str or tuple
+        Address to listen on -- a path for a Unix domain socket, or a tuple
+        ``(host, port)`` (see `multiprocessing.connection.Listener`).
+    authkey : str (optional)
+        Key that clients have to provide to connect. Note that requests are
+        pickled, so only trusted clients should be able to connect.
+    **kwargs
+        Passed to `IntegrationService`.
+    """
+    def __init__(self, address, authkey=None, **kwargs):
+        self.service = IntegrationService(**kwargs)
+        self._authkey = authkey
+        self._listener = Listener(address, authkey=authkey)
+        self._closed = False
+        self.address = self._listener.address
+
+    def serve_forever(self):
+        """ Accept connections until the server is closed, handling each
+            client in its own thread.
+        """
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                if self._closed:
+                    break
+                logger.exception("Failed to accept connection")
+                continue
+
+            if self._closed:
+                conn.close()
+                break
+
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+        self._listener.close()
+
+    def close(self):
+        """ Stop accepting connections and stop the service once all queued
+            requests are finished.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        # wake up serve_forever() if it is waiting for a connection
+        try:
+            Client(self.address, authkey=self._authkey).close()
+        except Exception:
+            self._listener.close()
+
+        self.service.close()
+
+    def _handle(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(request_id, future):
+            with send_lock:
+                try:
+                    conn.send((request_id, future._result, future._exception))
+                except (IOError, EOFError, OSError):
+                    pass
+
+        while True:
+            try:
+                request_id, potential, w0, kwargs = conn.recv()
+            except (IOError, EOFError, OSError):
+                break
+
+            try:
+                future = self.service.submit(potential, w0, **kwargs)
+            except Exception as e:
+                future = OrbitFuture()
+                future._set_exception(e)
+            future.add_done_callback(functools.partial(reply, request_id))
+
+        conn.close()
+
+class IntegrationClient(object):
+    """
+    Connection to an `IntegrationServer`. The methods are the same as those
+    of `IntegrationService`.
+
+    Parameters
+    ----------
+    address : str or tuple
+        Address of the server.
+    authkey : str (optional)
+        Key to authenticate with the server.
+    """
+    def __init__(self, address, authkey=None):
+        self._conn = Client(address, authkey=authkey)
+        self._futures = dict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+        self._thread = threading.Thread(target=self._receive, name="IntegrationClient")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, potential, w0, Integrator=LeapfrogIntegrator,
+               Integrator_kwargs=dict(), **time_spec):
+        """ Send orbits to the server to be integrated and return an
+            `OrbitFuture` for the result. See `IntegrationService.submit`.
+        """
+        future = OrbitFuture()
+        kwargs = dict(Integrator=Integrator, Integrator_kwargs=Integrator_kwargs)
+        kwargs.update(time_spec)
+
+        with self._lock:
+            if self._conn is None:
+                raise RuntimeError("Client is closed.")
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+            self._conn.send((request_id, potential, np.asarray(w0), kwargs))
+
+        return future
+
+    def integrate_orbit(self, potential, w0, Integrator=LeapfrogIntegrator,
+                        Integrator_kwargs=dict(), **time_spec):
+        """ Integrate orbits on the server and wait for the result. Same
+            arguments as `submit`.
+        """
+        return self.submit(potential, w0, Integrator=Integrator,
+                           Integrator_kwargs=Integrator_kwargs, **time_spec).result()
+
+    def close(self):
+        """ Close the connection. Requests that haven't finished fail. """
+        with self._lock:
+            if self._conn is None:
+                return
+            conn, self._conn = self._conn, None
+        conn.close()
+        self._fail_pending()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _receive(self):
+        conn = self._conn
+        while True:
+            try:
+                request_id, result, exception = conn.recv()
+            except Exception:
+                break
+
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is not None:
+                future._set(result, exception)
+
+        self._fail_pending()
+
+    def _fail_pending(self):
+        with self._lock:
+            futures, self._futures = self._futures, dict()
+        for future in futures.values():
+            future._set_exception(RuntimeError("Connection to the integration "
+                                               "server was closed."))
@@ -0,0 +1,178 @@
+# coding: utf-8
+
+""" Statistics and timing of integrations. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+from collections import OrderedDict
+import time
+
+# Third-party
+import numpy as np
+
+__all__ = ["IntegrationStats"]
+
+class IntegrationStats(object):
+    """
+    Statistics collected during a single integration. Pass an instance as
+    the ``stats`` argument of one of the compiled integration functions
+    (e.g., `~gary.integrate._dop853.dop853_integrate_potential` or
+    `~gary.integrate._leapfrog.cy_leapfrog_run`), or of
+    `~gary.potential.PotentialBase.integrate_orbit`, and it is reset and
+    filled in by the call, in the same way that events are.
+
+    The wall time is recorded separately for each phase of the integration:
+
+        - ``'integrate'``: stepping the orbits (in compiled code, without the
+          GIL).
+        - ``'output'``: writing chunks of output to a memory-mapped array or
+          HDF5 dataset and flushing them to disk.
+        - ``'checkpoint'``: saving checkpoint files.
+        - ``'events'``: collecting detected events.
+        - ``'cache'``: looking up and storing orbits in an
+          `~gary.integrate.OrbitCache`.
+
+    Parameters
+    ----------
+    hook : callable (optional)
+        A profiling hook that is called as ``hook(phase, seconds)`` at the
+        end of every timed phase, e.g., after every chunk of output is
+        written. This makes it possible to monitor where the time goes in a
+        long integration while it is still running.
+
+    Attributes
+    ----------
+    nfcn : int
+        Number of evaluations of the gradient of the potential, summed over
+        all orbits.
+    nstep : int
+        Number of steps attempted. Orbits that are advanced with a common
+        step are counted once per step.
+    naccpt : int
+        Number of accepted steps.
+    nrejct : int
+        Number of rejected steps.
+    h_min, h_max : float
+        Smallest and largest (absolute) accepted step size. Note that the
+        last step of an adaptive integration is usually shortened to end at
+        the final time.
+    energy_drift : :class:`numpy.ndarray`
+        Relative change of the energy of each orbit between the first and
+        last output time, or None if the energy can't be computed for the
+        potential. NaN for orbits that were stopped early.
+    timings : dict
+        Total wall time in seconds spent in each phase.
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        """ Set all counters back to zero and clear the timings. """
+        self.nfcn = 0
+        self.nstep = 0
+        self.naccpt = 0
+        self.nrejct = 0
+        self.h_min = np.inf
+        self.h_max = 0.
+        self.energy_drift = None
+        self.timings = OrderedDict()
+
+    @property
+    def wall_time(self):
+        """ Total wall time of all phases. """
+        return sum(self.timings.values())
+
+    def _add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.) + seconds
+        if self.hook is not None:
+            self.hook(phase, seconds)
+
+    def _add_steps(self, nfcn, nstep, naccpt, nrejct, h_min, h_max):
+        self.nfcn += int(nfcn)
+        self.nstep += int(nstep)
+        self.naccpt += int(naccpt)
+        self.nrejct += int(nrejct)
+        self.h_min = min(self.h_min, abs(h_min))
+        self.h_max = max(self.h_max, abs(h_max))
+
+    def _set_energy_drift(self, value, w_first, w_last):
+        """ Compute the relative energy change of each orbit from the
+            initial and final phase-space positions, given a function that
+            evaluates the potential at an array of positions.
+        """
+        w_first = np.atleast_2d(w_first)
+        w_last = np.atleast_2d(w_last)
+        ndim = w_first.shape[-1] // 2
+
+        def energy(w):
+            T = 0.5*np.sum(w[:,ndim:]**2, axis=-1)
+            return T + np.asarray(value(np.ascontiguousarray(w[:,:ndim])))
+
+        E0 = energy(w_first)
+        self.energy_drift = (energy(w_last) - E0) / np.abs(E0)
+
+    def __repr__(self):
+        return ("<IntegrationStats nfcn={0} nstep={1} naccpt={2} nrejct={3} "
+                "h_min={4:.3g} h_max={5:.3g} wall_time={6:.3g}s>"
+                .format(self.nfcn, self.nstep, self.naccpt, self.nrejct,
+                        self.h_min, self.h_max, self.wall_time))
+
+class _Phase(object):
+    """ Context manager that adds the wall time spent in a block to a phase
+        of an `IntegrationStats` instance. Does nothing if ``stats`` is None.
+        Time spent in nested phases that were timed separately (e.g., output
+        written from a callback inside the integration loop) can be
+        subtracted with `exclude`.
+    """
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+        self.seconds = 0.
+        self._excluded = 0.
+
+    def __enter__(self):
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self._t0 - self._excluded
+        self.seconds += seconds
+        if self.stats is not None:
+            self.stats._add_time(self.phase, seconds)
+        return False
+
+    def exclude(self, seconds):
+        self._excluded += seconds
+
+def _reset_stats(stats):
+    """ Validate the ``stats`` argument of an integration function and reset it. """
+    if stats is None:
+        return None
+
+    if not isinstance(stats, IntegrationStats):
+        raise TypeError("stats must be an IntegrationStats instance, not {0}"
+                        .format(type(stats).__name__))
+
+    stats.reset()
+    return stats
+
+def _record_energy_drift(stats, value, w):
+    """ Store the energy drift between the first and last row of the output
+        array ``w`` on ``stats``, unless it is None.
+    """
+    if stats is not None:
+        stats._set_energy_drift(value, w[0], w[w.shape[0]-1])
+
+def _fixed_step_stats(stats, value, nfcn, nsteps, dt, w):
+    """ Fill in the statistics of a fixed-step integration with ``nfcn``
+        force evaluations in ``nsteps`` steps of size ``dt``. The energy
+        drift is only computed if the potential function ``value`` is given.
+    """
+    if stats is not None:
+        stats._add_steps(nfcn, nsteps, nsteps, 0, dt, dt)
+        if value is not None:
+            _record_energy_drift(stats, value, w)
@@ -0,0 +1,173 @@
+# coding: utf-8
+
+""" Higher-order symplectic (composition) integration. """
+
+from __future__ import division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+
+# Project
+from .core import Integrator
+from .timespec import _parse_time_specification
+
+__all__ = ["SymplecticIntegrator"]
+
+def _compose_leapfrog(weights):
+    """ Drift and kick coefficients for a composition of drift-kick-drift
+        leapfrog steps with the given (symmetric) step size weights.
+    """
+    weights = list(weights)
+    drift = [weights[0]/2.]
+    for w1,w2 in zip(weights[:-1], weights[1:]):
+        drift.append((w1+w2)/2.)
+    drift.append(weights[-1]/2.)
+    return np.array(drift), np.array(weights)
+
+# Forest & Ruth (1990)
+_theta = 1. / (2. - 2.**(1/3.))
+
+# Yoshida (1990), solution A
+_yoshida6 = [0.784513610477560, 0.235573213359357, -1.17767998417887]
+_yoshida6 = _yoshida6 + [1 - 2*sum(_yoshida6)] + _yoshida6[::-1]
+
+# Omelyan, Mryglod & Folk (2002), position extended Forest-Ruth like
+_xi = 0.1786178958448091
+_lambda = -0.2123418310626054
+_chi = -0.06626458266981849
+
+# name : (drift coefficients, kick coefficients, order)
+SCHEMES = {
+    'leapfrog': _compose_leapfrog([1.]) + (2,),
+    'ruth4': _compose_leapfrog([_theta, 1-2*_theta, _theta]) + (4,),
+    'omelyan4': (np.array([_xi, _chi, 1-2*(_chi+_xi), _chi, _xi]),
+                 np.array([(1-2*_lambda)/2., _lambda, _lambda, (1-2*_lambda)/2.]),
+                 4),
+    'yoshida6': _compose_leapfrog(_yoshida6) + (6,),
+}
+
+def _get_scheme(scheme):
+    try:
+        return SCHEMES[scheme.lower()]
+    except KeyError:
+        raise ValueError("Unknown symplectic scheme '{0}' -- must be one of: {1}"
+                         .format(scheme, ", ".join(sorted(SCHEMES.keys()))))
+
+class SymplecticIntegrator(Integrator):
+    r"""
+    Initialize a symplectic integrator given a function for computing
+    accelerations. Each step is a sequence of drifts (position updates) and
+    kicks (velocity updates) with coefficients given by the chosen scheme,
+    so that, like the `LeapfrogIntegrator`, the phase-space volume and the
+    energy (to within a bounded error) are conserved. The higher-order
+    schemes need more acceleration evaluations per step, but allow for much
+    larger steps at fixed accuracy.
+
+    Available schemes:
+
+        - ``'leapfrog'``: 2nd order, 1 force evaluation per step.
+        - ``'ruth4'``: 4th order, Forest & Ruth (1990) / Yoshida (1990),
+          3 force evaluations per step.
+        - ``'omelyan4'``: 4th order, optimized scheme of Omelyan, Mryglod &
+          Folk (2002) with a ~100 times smaller error constant than
+          ``'ruth4'``, 4 force evaluations per step.
+        - ``'yoshida6'``: 6th order, Yoshida (1990) solution A, 7 force
+          evaluations per step.
+
+    Parameters
+    ----------
+    acceleration_func : func
+        A callable object that computes the acceleration at a point
+        in phase space.
+    func_args : tuple (optional)
+        Any extra arguments for the acceleration function.
+    scheme : str (optional)
+        Name of the composition scheme (see above).
+
+    """
+    def __init__(self, acceleration_func, func_args=(), scheme='ruth4'):
+        if not hasattr(acceleration_func, '__call__'):
+            raise ValueError("acceleration_func must be a callable object, "
+                             "e.g. a function, that evaluates the acceleration "
+                             "at a given position.")
+
+        self.acceleration = acceleration_func
+        self._func_args = func_args
+        self.scheme = scheme
+        self._drift, self._kick, self.order = _get_scheme(scheme)
+
+    def step(self, t, x, v, dt):
+        """
+        Step forward the positions and velocities by the given timestep.
+
+        Parameters
+        ----------
+        dt : numeric
+            The timestep to move forward.
+        """
+
+        for c,d in zip(self._drift[:-1], self._kick):
+            x = x + c*dt*v
+            t = t + c*dt
+            v = v + d*dt*self.acceleration(t, x, *self._func_args)
+        x = x + self._drift[-1]*dt*v
+
+        return x, v
+
+    def run(self, w0, mmap=None, **time_spec):
+        """
+        Run the integrator starting at the given coordinates and momenta
+        (velocities) and a time specification. The initial conditions
+        `w0` should have shape `(nparticles, 2*ndim)`. See
+        `LeapfrogIntegrator.run()` for more information.
+
+        Parameters
+        ==========
+        w0 : array_like
+            Initial conditions
+        mmap : None, array_like (optional)
+            Option to write integration output to a memory-mapped array so the memory
+            usage doesn't explode. Must pass in a memory-mapped array, e.g., from
+            `numpy.memmap`.
+
+        Other Parameters
+        ================
+        dt, nsteps[, t1] : (numeric, int[, numeric])
+            A fixed timestep dt and a number of steps to run for.
+        dt, t1, t2 : (numeric, numeric, numeric)
+            A fixed timestep dt, an initial time, and a final time.
+        t : array_like
+            An array of times (dt = t[1] - t[0])
+
+        Returns
+        =======
+        times : array_like
+            An array of times.
+        w : array_like
+            The array of positions and momenta (velocities) at each time in
+            the time array. This array has shape `(Ntimes,Norbits,Ndim)`.
+
+        """
+
+        # generate the array of times
+        times = _parse_time_specification(**time_spec)
+        nsteps = len(times) - 1
+        dt = times[1] - times[0]
+
+        w0, ws = self._prepare_ws(w0, mmap, nsteps)
+
+        if (self.ndim % 2) != 0:
+            raise ValueError("Dimensionality must be even.")
+
+        x = w0[:,:self.ndim_xv]
+        v = w0[:,self.ndim_xv:]
+
+        ws[0] = w0
+        for ii in range(1,nsteps+1):
+            x, v = self.step(times[ii-1], x, v, dt)
+            ws[ii,:,:self.ndim_xv] = x
+            ws[ii,:,self.ndim_xv:] = v
+
+        return times, ws
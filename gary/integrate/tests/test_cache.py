@@ -0,0 +1,116 @@
+# coding: utf-8
+"""
+    Test the on-disk orbit cache.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .. import DOPRI853Integrator, LeapfrogIntegrator, IntegrationStats
+from ..cache import OrbitCache
+from ...potential import HernquistPotential, CompositePotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(5., 15., size=(4,3)),
+                np.random.normal(0., 0.1, size=(4,3))))
+
+@pytest.fixture
+def tmpdir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+def test_key(tmpdir):
+    cache = OrbitCache(tmpdir)
+
+    key = cache.key(pot, w0, LeapfrogIntegrator, time_spec=dict(dt=0.5, nsteps=100))
+    assert key == cache.key(HernquistPotential(m=1E11, c=0.5, units=galactic), w0.tolist(),
+                            LeapfrogIntegrator, time_spec=dict(nsteps=np.int64(100), dt=0.5))
+
+    others = [cache.key(HernquistPotential(m=1E11, c=0.6, units=galactic), w0,
+                        LeapfrogIntegrator, time_spec=dict(dt=0.5, nsteps=100)),
+              cache.key(pot, w0 + 1E-15, LeapfrogIntegrator, time_spec=dict(dt=0.5, nsteps=100)),
+              cache.key(pot, w0, DOPRI853Integrator, time_spec=dict(dt=0.5, nsteps=100)),
+              cache.key(pot, w0, LeapfrogIntegrator, dict(adaptive=True),
+                        time_spec=dict(dt=0.5, nsteps=100)),
+              cache.key(pot, w0, LeapfrogIntegrator, time_spec=dict(dt=0.5, nsteps=101)),
+              cache.key(CompositePotential(halo=pot), w0, LeapfrogIntegrator,
+                        time_spec=dict(dt=0.5, nsteps=100))]
+    assert len(set(others + [key])) == len(others) + 1
+
+def test_full_output(tmpdir):
+    cache = OrbitCache(tmpdir)
+    with pytest.raises(ValueError) as excinfo:
+        pot.integrate_orbit(w0, dt=0.5, nsteps=20, cache=cache,
+                            Integrator_kwargs=dict(adaptive=True, full_output=True))
+    assert 'full_output' in str(excinfo.value)
+
+def test_integrate_orbit(tmpdir):
+    cache = OrbitCache(tmpdir)
+    t,w = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=100)
+
+    stats = IntegrationStats()
+    t1,w1 = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=100,
+                                cache=cache, stats=stats)
+    assert cache.misses == 1 and len(cache) == 1
+    assert stats.nfcn > 0
+    np.testing.assert_array_equal(w1, w)
+
+    t2,w2 = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=100,
+                                cache=cache, stats=stats)
+    assert cache.hits == 1 and len(cache) == 1
+    assert stats.nfcn == 0 and 'cache' in stats.timings
+    assert isinstance(w2, np.memmap)
+    np.testing.assert_array_equal(t2, t)
+    np.testing.assert_array_equal(w2, w)
+
+    # modifying the returned orbits doesn't change the cache
+    w2[:] = 0.
+    t3,w3 = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=100,
+                                cache=cache)
+    np.testing.assert_array_equal(w3, w)
+
+    # different time specification
+    pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=50, cache=cache)
+    assert cache.misses == 2 and len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+
+def test_eviction(tmpdir):
+    # room for two entries
+    t,w = pot.integrate_orbit(w0, dt=0.5, nsteps=100)
+    nbytes = t.nbytes + w.nbytes + 256
+    cache = OrbitCache(tmpdir, max_size=int(2.5*nbytes))
+
+    keys = []
+    for i in range(3):
+        keys.append(cache.key(pot, w0, LeapfrogIntegrator, time_spec=dict(i=i)))
+        cache.put(keys[-1], t, w)
+        if i == 1:
+            # use the first entry again, so the second one is evicted
+            assert cache.get(keys[0]) is not None
+
+        assert cache.size <= cache.max_size
+
+    assert keys[0] in cache
+    assert keys[1] not in cache
+    assert keys[2] in cache
+
+    # too large to cache at all
+    cache = OrbitCache(tmpdir, max_size=100)
+    cache.put(keys[1], t, w)
+    assert keys[1] not in cache
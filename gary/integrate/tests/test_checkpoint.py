@@ -0,0 +1,127 @@
+# coding: utf-8
+"""
+    Test checkpointing and restarting the Cython integrators.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .. import _leapfrog, _dop853
+from ..core import _save_checkpoint
+from ...potential import HernquistPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+w0 = np.array([[10.,0.,0., 0.,0.15,0.02],
+               [5.,0.,0., 0.,0.2,0.]])
+
+class Preempted(Exception):
+    pass
+
+def preempt_after(monkeypatch, module, nsaves):
+    """ Kill the integration after the checkpoint has been saved ``nsaves`` times. """
+    calls = [0]
+    def save(*args, **kwargs):
+        _save_checkpoint(*args, **kwargs)
+        calls[0] += 1
+        if calls[0] == nsaves:
+            raise Preempted()
+    monkeypatch.setattr(module, '_save_checkpoint', save)
+
+def new_mmap(path, shape):
+    return np.memmap(path, mode='w+', dtype=np.float64, shape=shape)
+
+@pytest.fixture
+def tmpdir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+def test_leapfrog(tmpdir, monkeypatch):
+    nsteps = 1000
+    shape = (nsteps+1,) + w0.shape
+    ckpt = os.path.join(tmpdir, "leapfrog.npz")
+
+    t,w = _leapfrog.cy_leapfrog_run(pot.c_instance, w0, 0.1, nsteps, 0.)
+
+    preempt_after(monkeypatch, _leapfrog, 3)
+    mmap = new_mmap(os.path.join(tmpdir, "leapfrog.mmap"), shape)
+    with pytest.raises(Preempted):
+        _leapfrog.cy_leapfrog_run(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                  mmap=mmap, chunksize=64, checkpoint=ckpt)
+    assert np.all(mmap[64*3+1:] == 0)
+    monkeypatch.undo()
+
+    # restart
+    t2,w2 = _leapfrog.cy_leapfrog_run(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                      mmap=mmap, chunksize=64, checkpoint=ckpt)
+    np.testing.assert_array_equal(np.asarray(w2), w)
+
+    # checkpoint is for a different integration
+    with pytest.raises(ValueError):
+        _leapfrog.cy_leapfrog_run(pot.c_instance, w0, 0.2, nsteps, 0.,
+                                  mmap=mmap, chunksize=64, checkpoint=ckpt)
+
+    with pytest.raises(ValueError):
+        _leapfrog.cy_leapfrog_run(pot.c_instance, w0, 0.1, nsteps, 0., checkpoint=ckpt)
+
+def test_dop853(tmpdir, monkeypatch):
+    nsteps = 1000
+    shape = (nsteps,) + w0.shape
+
+    # uninterrupted, but with checkpoints
+    mmap1 = new_mmap(os.path.join(tmpdir, "dop853_1.mmap"), shape)
+    _dop853.dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-10, 1E-10, 0,
+                                       mmap=mmap1, chunksize=100,
+                                       checkpoint=os.path.join(tmpdir, "dop853_1.npz"))
+
+    # same as without checkpoints, to within the tolerance
+    t,w = _dop853.dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                             1E-10, 1E-10, 0)
+    np.testing.assert_allclose(np.asarray(mmap1), w, atol=1E-7)
+
+    ckpt = os.path.join(tmpdir, "dop853_2.npz")
+    mmap2 = new_mmap(os.path.join(tmpdir, "dop853_2.mmap"), shape)
+    preempt_after(monkeypatch, _dop853, 4)
+    with pytest.raises(Preempted):
+        _dop853.dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-10, 1E-10, 0,
+                                           mmap=mmap2, chunksize=100, checkpoint=ckpt)
+    monkeypatch.undo()
+
+    _dop853.dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-10, 1E-10, 0,
+                                       mmap=mmap2, chunksize=100, checkpoint=ckpt)
+    np.testing.assert_array_equal(np.asarray(mmap2), np.asarray(mmap1))
+
+def test_lyapunov(tmpdir, monkeypatch):
+    w0 = np.array([5.,0.,0., 0.,0.2,0.05])
+    args = (pot.c_instance, w0, 0.1, 5000, 0., 1E-8, 1E-8, 1E-5, 10, 4)
+    ckpt = os.path.join(tmpdir, "lyapunov.npz")
+
+    np.random.seed(42)
+    t,w,l = _dop853.dop853_lyapunov(*args)
+    after = np.random.uniform()
+
+    np.random.seed(42)
+    preempt_after(monkeypatch, _dop853, 2)
+    with pytest.raises(Preempted):
+        _dop853.dop853_lyapunov(*args, checkpoint=ckpt, checkpoint_every=100)
+    monkeypatch.undo()
+
+    # offsets are drawn again, but the random state is restored
+    np.random.seed(1)
+    t2,w2,l2 = _dop853.dop853_lyapunov(*args, checkpoint=ckpt, checkpoint_every=100)
+    np.testing.assert_array_equal(t2, t)
+    np.testing.assert_array_equal(w2, w)
+    np.testing.assert_array_equal(l2, l)
+    assert np.random.uniform() == after
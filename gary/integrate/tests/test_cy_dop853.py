@@ -9,10 +9,13 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 import os
+import shutil
+import tempfile
 import time
 
 # Third-party
 import numpy as np
+import pytest
 import matplotlib.pyplot as plt
 
 # Project
@@ -21,7 +24,9 @@ from ... import integrate as gi
 from ... import dynamics as gd
 from ..dopri853 import DOPRI853Integrator
 from ...units import galactic
-from ..dopri.wrap_dop853 import dop853_integrate_potential, dop853_lyapunov
+from .._dop853 import (dop853_integrate_potential, dop853_integrate_potential_parallel,
+                       dop853_integrate_potential_independent, dop853_lyapunov,
+                       dop853_variational, dop853_integrate_windows)
 plot_path = "plots/tests/integrate"
 if not os.path.exists(plot_path):
     os.makedirs(plot_path)
@@ -49,7 +54,7 @@ def test_derp():
         w0 = np.array([[1.,2.1,0., 0.,0.5,0.]]*norbits)
         t1 = time.time()
         # t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, 10000, 0., 1E-8, 1E-8)
-        t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-8, 1E-8)
+        t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-8, 1E-8, 0)
         times.append(time.time()-t1)
         print("cy: {0:.2f}".format(times[-1]))
 
@@ -79,6 +84,157 @@ def test_derp():
     # plt.plot(w[:,0],w[:,1],marker=None)
     # plt.show()
 
+def test_mmap():
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.],
+                   [5.,0.,0., 0.,0.2,0.]])
+    nsteps = 1000
+
+    t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0., 1E-8, 1E-8, 0)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "orbits.mmap"), mode='w+',
+                         dtype=np.float64, shape=(nsteps,) + w0.shape)
+        mmap_t,mmap_w = dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                                   1E-8, 1E-8, 0, mmap=mmap, chunksize=64)
+        assert mmap_w is mmap
+        np.testing.assert_allclose(np.array(mmap_w), w)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_dense_output():
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.],
+                   [5.,0.,0., 0.,0.2,0.]])
+    nsteps = 1000
+
+    t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, nsteps, 10., 1E-12, 1E-12, 0)
+    np.testing.assert_allclose(t, 10. + 0.1*np.arange(nsteps))
+    np.testing.assert_allclose(w[0], w0)
+
+    py_t,py_w = pot.integrate_orbit(w0, t=t, Integrator=DOPRI853Integrator,
+                                    Integrator_kwargs=dict(atol=1E-12, rtol=1E-12),
+                                    cython_if_possible=False)
+    np.testing.assert_allclose(w, py_w, atol=1E-8)
+
+def test_parallel():
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.],
+                   [5.,0.,0., 0.,0.2,0.],
+                   [2.,0.,0.5, 0.,0.3,0.1]])
+    nsteps = 1000
+
+    # one orbit per thread, so the step size control matches the serial runs
+    t,w = dop853_integrate_potential_parallel(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                              1E-8, 1E-8, 0, nthreads=len(w0))
+    assert w.shape == (nsteps,) + w0.shape
+
+    for i in range(len(w0)):
+        serial_t,serial_w = dop853_integrate_potential(pot.c_instance, w0[i:i+1], 0.1,
+                                                       nsteps, 0., 1E-8, 1E-8, 0)
+        np.testing.assert_allclose(serial_t, t)
+        np.testing.assert_allclose(serial_w[:,0], w[:,i])
+
+    # fewer threads than orbits
+    t,w = dop853_integrate_potential_parallel(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                              1E-8, 1E-8, 0, nthreads=2)
+    assert np.all(np.isfinite(w))
+
+def test_independent():
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.],
+                   [5.,0.,0., 0.,0.2,0.],
+                   [20.,0.,0., 0.,0.05,0.],
+                   [1.,0.,0., 0.,1E-7,0.]]) # plunges through the center
+    nsteps = 1000
+
+    for nthreads in [1,2]:
+        t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                                            1E-8, 1E-8, 500, nthreads=nthreads)
+        assert w.shape == (nsteps,) + w0.shape
+        np.testing.assert_equal(status, [1,1,1,-2])
+        assert np.all(np.isfinite(w[:,:3]))
+        assert np.all(np.isnan(w[-1,3]))
+
+        # each orbit matches a serial integration of that orbit alone
+        for i in range(3):
+            serial_t,serial_w = dop853_integrate_potential(pot.c_instance, w0[i:i+1], 0.1,
+                                                           nsteps, 0., 1E-8, 1E-8, 500)
+            np.testing.assert_allclose(serial_w[:,0], w[:,i])
+
+    # per-orbit tolerances
+    atol = np.array([1E-8, 1E-8, 1E-4, 1E-8])
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, nsteps, 0.,
+                                                        atol, 1E-8, 500)
+    serial_t,serial_w = dop853_integrate_potential(pot.c_instance, w0[2:3], 0.1,
+                                                   nsteps, 0., 1E-4, 1E-8, 500)
+    np.testing.assert_allclose(serial_w[:,0], w[:,2])
+
+def test_windows():
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.],
+                   [5.,0.,0., 0.,0.2,0.],
+                   [20.,0.,0., 0.,0.05,0.],
+                   [10.,0.,0., 0.,0.1,0.]])
+    t = 0.1*np.arange(1000)
+    t_start = np.array([0., 10.25, 30., 99.9])
+    t_end = np.array([99.9, 50., 60.05, 99.9])
+
+    # with a common window, the same as the independent integration
+    t_ind,w_ind,status_ind = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1,
+                                                                    1000, 0., 1E-8, 1E-8, 0)
+    win_t,win_w,status = dop853_integrate_windows(pot.c_instance, w0, t, 0., 99.9,
+                                                  1E-8, 1E-8, 0)
+    np.testing.assert_array_equal(win_w, w_ind)
+
+    for nthreads in [1,2]:
+        win_t,win_w,status = dop853_integrate_windows(pot.c_instance, w0, t, t_start, t_end,
+                                                      1E-11, 1E-11, 0, nthreads=nthreads)
+        np.testing.assert_equal(status, 1)
+
+        for i in range(len(w0)):
+            ix = (t > t_start[i] - 1E-8) & (t < t_end[i] + 1E-8)
+            assert np.all(np.isnan(win_w[~ix,i]))
+
+            if ix.sum() > 1:
+                n = int(round((t_end[i]-t_start[i])/1E-3))
+                serial_t,serial_w = dop853_integrate_potential(pot.c_instance, w0[i:i+1], 1E-3,
+                                                               n+1, t_start[i], 1E-11, 1E-11, 0)
+                for k in range(6):
+                    np.testing.assert_allclose(win_w[ix,i,k],
+                                               np.interp(t[ix], serial_t, serial_w[:,0,k]),
+                                               atol=1E-5)
+            else:
+                np.testing.assert_array_equal(win_w[ix,i], w0[i:i+1])
+
+    # through integrate_orbit
+    orbit_t,orbit_w = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator,
+                                          Integrator_kwargs=dict(atol=1E-11, rtol=1E-11),
+                                          dt=0.1, nsteps=999, t_start=t_start, t_end=t_end)
+    np.testing.assert_allclose(orbit_w, win_w, rtol=1E-9)
+
+def test_threadsafe():
+    import threading
+
+    pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[1.,2.1,0., 0.,0.5,0.]])
+    t,w = dop853_integrate_potential(pot.c_instance, w0, 0.1, 1000, 0., 1E-8, 1E-8, 0)
+
+    results = [None]*4
+    def worker(i):
+        results[i] = dop853_integrate_potential(pot.c_instance, w0, 0.1, 1000, 0.,
+                                                1E-8, 1E-8, 0)[1]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for res in results:
+        np.testing.assert_allclose(res, w)
+
 def test_lyapunov():
     pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
     w0 = np.array([5.,0.,0., 0.,0.2,0.])
@@ -99,3 +255,135 @@ def test_lyapunov():
     # plt.plot(w[:,0], w[:,1], marker=None)
     plt.loglog(l, marker=None)
     plt.show()
+
+def test_variational():
+    regular_pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    regular_w0 = np.array([5.,0.,0., 0.,0.2,0.05])
+
+    # box orbit in a triaxial potential with a small core, no analytic Hessian
+    chaotic_pot = gp.LogarithmicPotential(v_c=0.2, r_h=0.1, q1=1., q2=0.8, q3=0.6,
+                                          units=galactic)
+    chaotic_w0 = np.array([1.,1.5,2., 0.,0.,0.])
+
+    nsteps = 20000
+    t,w,l = dop853_variational(regular_pot.c_instance, regular_w0, 1., nsteps, 0.,
+                               1E-10, 1E-10)
+    assert l.shape == (nsteps+1,6)
+    np.testing.assert_allclose(l[0], 0.)
+
+    # orbit is the same as without the tangent vectors
+    t2,w2 = dop853_integrate_potential(regular_pot.c_instance, regular_w0[None],
+                                       1., nsteps+1, 0., 1E-10, 1E-10, 0)
+    np.testing.assert_allclose(t, t2)
+    np.testing.assert_allclose(w[:1000], w2[:1000,0], atol=1E-5)
+
+    # phase-space volume is conserved, exponents come in +/- pairs
+    np.testing.assert_allclose(l[-1].sum(), 0., atol=1E-8)
+    regular_max = l[-1].max()
+
+    t,w,l = dop853_variational(chaotic_pot.c_instance, chaotic_w0, 1., nsteps, 0.,
+                               1E-10, 1E-10)
+    np.testing.assert_allclose(l[-1].sum(), 0., atol=1E-8)
+    np.testing.assert_allclose(l[-1], -l[-1,::-1], atol=1E-4)
+    assert np.all(np.diff(l[-1]) <= 0)
+    assert l[-1,0] > 5*regular_max
+
+    # maximal exponent only, re-orthonormalization interval doesn't matter
+    t,w1,l1 = dop853_variational(chaotic_pot.c_instance, chaotic_w0, 1., 2000, 0.,
+                                 1E-10, 1E-10, nvecs=1, nsteps_per_reorth=1)
+    t,w2,l2 = dop853_variational(chaotic_pot.c_instance, chaotic_w0, 1., 2000, 0.,
+                                 1E-10, 1E-10, nvecs=1, nsteps_per_reorth=20)
+    assert l1.shape == (2001,1)
+    np.testing.assert_allclose(l1[-1], l2[-1], rtol=1E-2)
+
+def test_lyapunov_spectrum():
+    pot = gp.LogarithmicPotential(v_c=0.2, r_h=0.1, q1=1., q2=0.8, q3=0.6,
+                                  units=galactic)
+    w0 = np.array([1.,1.5,2., 0.,0.,0.])
+    nsteps = 200
+
+    # Python driver, with the variational equations
+    def F(t,w):
+        x = np.ascontiguousarray(w[:,:3])
+        dx = w[:,6:9]
+        hess = pot.hessian(x)
+        return np.hstack((w[:,3:6], -pot.gradient(x),
+                          w[:,9:], -np.einsum('nij,nj->ni', hess, dx)))
+    integrator = DOPRI853Integrator(F)
+
+    # same initial deviation vectors for both drivers
+    np.random.seed(42)
+    vecs = np.random.normal(0., 1., size=(6,6))
+    py_lyap,py_t,py_w = gd.lyapunov_spectrum(w0, integrator, dt=1., nsteps=nsteps,
+                                             deviation_vecs=vecs)
+
+    lyap,t,w = gd.fast_lyapunov_spectrum(w0, pot, dt=1., nsteps=nsteps,
+                                         deviation_vecs=vecs/np.linalg.norm(vecs, axis=1)[:,None])
+    assert lyap.shape == py_lyap.shape
+    np.testing.assert_allclose(t, py_t)
+    np.testing.assert_allclose(w, py_w, atol=1E-5)
+    np.testing.assert_allclose(lyap.sum(axis=1), 0., atol=1E-8)
+
+    # the largest exponent agrees to much better than 1 part in 10^5 (~1E-6
+    # in practice); the smaller ones are more sensitive to how often and how
+    # accurately the vectors are re-orthonormalized, so don't compare those
+    np.testing.assert_allclose(lyap[-1,0], py_lyap[-1,0], rtol=1E-5)
+
+    # different re-orthonormalization intervals
+    lyap1,t,w = gd.fast_lyapunov_spectrum(w0, pot, dt=1., nsteps=nsteps,
+                                          nsteps_per_reorth=1)
+    lyap2,t,w = gd.fast_lyapunov_spectrum(w0, pot, dt=1., nsteps=nsteps,
+                                          nsteps_per_reorth=50)
+    np.testing.assert_allclose(lyap1, lyap2, rtol=1E-3, atol=1E-8)
+
+def test_chaos_indicators():
+    pot = gp.LogarithmicPotential(v_c=0.2, r_h=0.1, q1=1., q2=0.8, q3=0.6,
+                                  units=galactic)
+    w0 = np.array([[1.,1.5,2., 0.,0.,0.],  # chaotic
+                   [5.,0.,0., 0.,0.2,0.05]]) # regular
+    nsteps = 5000
+
+    megno,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'megno')
+    np.testing.assert_equal(status, [0,0])
+    np.testing.assert_allclose(t, nsteps)
+    assert megno[0] > 4.
+    assert abs(megno[1] - 2.) < 0.5
+
+    fli,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'fli')
+    assert fli[0] > fli[1] + 3.
+
+    sali,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'sali')
+    assert sali[0] < sali[1] / 5.
+
+    gali,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'gali', k=3)
+    assert gali[0] < gali[1] / 10.
+
+    # time series, split between threads
+    megno_t,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'megno',
+                                               time_series=True, nthreads=2)
+    assert megno_t.shape == (nsteps+1,2)
+    np.testing.assert_allclose(t, np.arange(nsteps+1.))
+    np.testing.assert_allclose(megno_t[-1], megno)
+
+    # stop chaotic orbits early
+    megno_t,t,status = gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'megno',
+                                               time_series=True, chaotic=4.)
+    np.testing.assert_equal(status, [1,0])
+    assert np.isnan(megno_t[-1,0])
+    ix = np.isfinite(megno_t[:,0])
+    assert megno_t[ix,0][-1] > 4.
+    assert np.all(megno_t[ix,0][:-1] <= 4.)
+
+    # orbits in a spherical potential are regular
+    sph_pot = gp.HernquistPotential(m=1E11, c=0.5, units=galactic)
+    sph_w0 = np.array([[5.,0.,0., 0.,0.2,0.05],
+                       [3.,1.,0., 0.05,0.1,0.1]])
+    megno,t,status = gd.fast_chaos_indicator(sph_w0, sph_pot, 1., nsteps, 'megno',
+                                             regular=2.5, min_steps=500)
+    np.testing.assert_equal(status, [2,2])
+    assert np.all(t < nsteps)
+
+    with pytest.raises(ValueError):
+        gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'derp')
+    with pytest.raises(ValueError):
+        gd.fast_chaos_indicator(w0, pot, 1., nsteps, 'gali', k=7)
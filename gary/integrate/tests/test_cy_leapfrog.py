@@ -9,15 +9,22 @@ __author__ = "adrn <adrn@astro.columbia.edu>"
 
 # Standard library
 import os
+import shutil
+import tempfile
 import time
 
 # Third-party
 import numpy as np
 import matplotlib.pyplot as plt
+import pytest
 
 # Project
-from .._leapfrog import cy_leapfrog_run
-from ...potential import HernquistPotential
+from .._leapfrog import (cy_leapfrog_run, cy_adaptive_leapfrog_run, py_leapfrog_run,
+                         cy_leapfrog_run_windows, cy_leapfrog_run_meridional)
+from .._dop853 import dop853_integrate_potential
+from ..stats import IntegrationStats
+from ...potential import (HernquistPotential, KuzminPotential, MiyamotoNagaiPotential,
+                          LeeSutoTriaxialNFWPotential, CompositePotential, KeplerPotential)
 from ...units import galactic
 
 plot_path = "plots/tests/integrate"
@@ -37,6 +44,54 @@ def test_py_compare():
 
     np.testing.assert_allclose(cy_w[-1], py_w[-1])
 
+def test_mmap():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[0.,1.,0.,0.2,0.,0.],
+                   [1.,0.,0.,0.,0.2,0.]])
+    nsteps = 1000
+    t,w = cy_leapfrog_run(p.c_instance, w0, 0.1, nsteps, 0.)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "orbits.mmap"), mode='w+',
+                         dtype=np.float64, shape=(nsteps+1,) + w0.shape)
+
+        # chunk size doesn't evenly divide the number of steps
+        mmap_t,mmap_w = cy_leapfrog_run(p.c_instance, w0, 0.1, nsteps, 0.,
+                                        mmap=mmap, chunksize=64)
+        assert mmap_w is mmap
+        np.testing.assert_allclose(mmap_t, t)
+        np.testing.assert_allclose(np.array(mmap_w), w)
+
+        # also via integrate_orbit
+        mmap[:] = 0.
+        p.integrate_orbit(w0, dt=0.1, nsteps=nsteps, mmap=mmap)
+        np.testing.assert_allclose(np.array(mmap), w)
+
+        with pytest.raises(ValueError):
+            cy_leapfrog_run(p.c_instance, w0, 0.1, nsteps+1, 0., mmap=mmap)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_hdf5():
+    h5py = pytest.importorskip("h5py")
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    w0 = np.array([[0.,1.,0.,0.2,0.,0.],
+                   [1.,0.,0.,0.,0.2,0.]])
+    nsteps = 1000
+    t,w = cy_leapfrog_run(p.c_instance, w0, 0.1, nsteps, 0.)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with h5py.File(os.path.join(tmpdir, "orbits.hdf5"), 'w') as f:
+            dset = f.create_dataset("w", shape=(nsteps+1,) + w0.shape, dtype=np.float64)
+            cy_leapfrog_run(p.c_instance, w0, 0.1, nsteps, 0., mmap=dset, chunksize=100)
+            np.testing.assert_allclose(dset[:], w)
+    finally:
+        shutil.rmtree(tmpdir)
+
 def test_scaling():
     p = HernquistPotential(m=1E11, c=0.5, units=galactic)
 
@@ -72,3 +127,198 @@ def test_scaling():
     plt.xlim(95,10100)
     plt.tight_layout()
     plt.savefig(os.path.join(plot_path, "cy-scaling.png"))
+
+def test_adaptive():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[20.,0.,0., 0.,0.02,0.]]) # very eccentric orbit
+    nsteps = 5000
+
+    t,ref = dop853_integrate_potential(p.c_instance, w0, 1., nsteps+1, 0., 1E-13, 1E-13, 0)
+    t,w,info = cy_adaptive_leapfrog_run(p.c_instance, w0, 1., nsteps, 0.,
+                                        eta=0.02, full_output=True)
+    np.testing.assert_allclose(t, np.arange(nsteps+1.))
+    np.testing.assert_allclose(w[0], w0)
+    adaptive_err = np.abs(w[-1] - ref[-1]).max()
+
+    # fixed step size leapfrog with the same number of force evaluations
+    nfev = info['nfev'][0]
+    fixed_t,fixed_w = cy_leapfrog_run(p.c_instance, w0, float(nsteps)/nfev, nfev, 0.)
+    fixed_err = np.abs(fixed_w[-1] - ref[-1]).max()
+    assert adaptive_err < fixed_err / 10.
+
+    # no secular drift in energy
+    E = p.total_energy(np.ascontiguousarray(w[:,0,:3]), w[:,0,3:])
+    dE = np.abs((E - E[0]) / E[0])
+    assert dE.max() < 1E-2
+    assert dE[-500:].mean() < 1E-3
+
+    # integrating backwards recovers the initial conditions (not exactly,
+    #   because the output times are interpolated between steps)
+    w1 = np.ascontiguousarray(w[-1])
+    back_t,back_w = cy_adaptive_leapfrog_run(p.c_instance, w1, -1., nsteps, t[-1], eta=0.02)
+    assert np.abs(back_w[-1] - w0).max() < 1E-3
+
+    # from integrate_orbit
+    orbit_t,orbit_w = p.integrate_orbit(w0, dt=1., nsteps=nsteps,
+                                        Integrator_kwargs=dict(adaptive=True, eta=0.02))
+    np.testing.assert_allclose(orbit_w, w)
+
+    with pytest.raises(ValueError):
+        cy_adaptive_leapfrog_run(p.c_instance, w0, 1., nsteps, 0., eta=0.)
+
+    with pytest.raises(ValueError):
+        cy_adaptive_leapfrog_run(p.c_instance, w0, 1., nsteps, 0., maxiter=0)
+
+def test_adaptive_maxiter():
+    # the output is at the right times even when the step size symmetrization
+    #   doesn't converge
+    p = KeplerPotential(m=1E11, units=galactic)
+    w0 = np.array([[10.,0.,0., 0.,0.05,0.]])
+    nsteps = 4000
+
+    t,ref = dop853_integrate_potential(p.c_instance, w0, 0.5, nsteps+1, 0., 1E-13, 1E-13, 0)
+    t,w = cy_adaptive_leapfrog_run(p.c_instance, w0, 0.5, nsteps, 0., maxiter=2)
+    assert np.abs(w[...,:3] - ref[...,:3]).max() < 1E-2
+
+    # without the symmetrization the energy drifts, so only compare the
+    #   first orbit
+    t,w = cy_adaptive_leapfrog_run(p.c_instance, w0, 0.5, nsteps, 0., maxiter=1)
+    assert np.abs(w[:200,:,:3] - ref[:200,:,:3]).max() < 1E-2
+
+def test_py_potential():
+    p = KuzminPotential(m=1E11, a=0.5, units=galactic)
+    w0 = np.array([[1.,0.,0.2, 0.,0.2,0.05],
+                   [2.,0.5,0., 0.,0.15,0.]])
+    nsteps = 1000
+
+    ncalls = [0]
+    def gradient(x):
+        ncalls[0] += 1
+        return p.gradient(x)
+
+    t,w = py_leapfrog_run(gradient, w0, 0.1, nsteps, 0.)
+    assert ncalls[0] == nsteps + 1
+
+    py_t,py_w = p.integrate_orbit(w0, dt=0.1, nsteps=nsteps, cython_if_possible=False)
+    np.testing.assert_allclose(t, py_t)
+    np.testing.assert_allclose(w, py_w, rtol=1E-10, atol=1E-10)
+
+    # integrate_orbit uses the compiled loop for Python potentials
+    orbit_t,orbit_w = p.integrate_orbit(w0, dt=0.1, nsteps=nsteps)
+    np.testing.assert_allclose(orbit_w, w)
+
+    # backwards
+    back_t,back_w = py_leapfrog_run(p.gradient, np.ascontiguousarray(w[-1]),
+                                    -0.1, nsteps, t[-1])
+    np.testing.assert_allclose(back_w[-1], w0, atol=1E-8)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "orbits.mmap"), mode='w+',
+                         dtype=np.float64, shape=(nsteps+1,) + w0.shape)
+        mmap_t,mmap_w = py_leapfrog_run(p.gradient, w0, 0.1, nsteps, 0.,
+                                        mmap=mmap, chunksize=64)
+        assert mmap_w is mmap
+        np.testing.assert_allclose(np.asarray(mmap_w), w)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_windows():
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+    np.random.seed(42)
+    w0 = np.hstack((np.random.uniform(5., 15., size=(5,3)),
+                    np.random.normal(0., 0.1, size=(5,3))))
+    t = 0.5*np.arange(101)
+    t_start = np.array([0., 5., 10.5, 50., 3.])
+    t_end = np.array([50., 40., 50., 50., 3.])
+
+    # orbits that start on the grid match separate calls to cy_leapfrog_run
+    for nthreads in [1,2]:
+        win_t,win_w = cy_leapfrog_run_windows(p.c_instance, w0, t, t_start, t_end,
+                                              nthreads=nthreads)
+        assert win_w.shape == (len(t),) + w0.shape
+
+        for i in range(len(w0)):
+            j1 = int(t_start[i]/0.5)
+            j2 = int(t_end[i]/0.5)
+            orbit_t,orbit_w = cy_leapfrog_run(p.c_instance, w0[i:i+1].copy(), 0.5,
+                                              j2-j1, t_start[i])
+            np.testing.assert_array_equal(win_w[j1:j2+1,i], orbit_w[:,0])
+            assert np.all(np.isnan(win_w[:j1,i]))
+            assert np.all(np.isnan(win_w[j2+1:,i]))
+
+    # per-orbit step sizes, with output interpolated between steps
+    dt = np.array([0.01, 0.02, 0.005, 0.01, 0.01])
+    t_start = t_start + 0.25
+    t_end = np.maximum(t_end, t_start)
+    win_t,win_w = cy_leapfrog_run_windows(p.c_instance, w0, t, t_start, t_end, dt=dt)
+    for i in range(3):
+        nsteps = int(round((t_end[i] - t_start[i]) / dt[i]))
+        orbit_t,orbit_w = cy_leapfrog_run(p.c_instance, w0[i:i+1].copy(), dt[i],
+                                          nsteps, t_start[i])
+        ix = (t >= t_start[i]) & (t <= t_end[i])
+        for k in range(6):
+            np.testing.assert_allclose(win_w[ix,i,k], np.interp(t[ix], orbit_t, orbit_w[:,0,k]),
+                                       atol=1E-5)
+
+    # backwards
+    win_t,win_w = cy_leapfrog_run_windows(p.c_instance, w0, t[::-1], 50., 0.)
+    orbit_t,orbit_w = cy_leapfrog_run(p.c_instance, w0, -0.5, 100, 50.)
+    np.testing.assert_array_equal(win_w, orbit_w)
+
+    # through integrate_orbit
+    orbit_t,orbit_w = p.integrate_orbit(w0, dt=0.5, nsteps=100, t_start=[0.,5.,10.,20.,25.],
+                                        t_end=30.)
+    assert np.all(np.isnan(orbit_w[t > 30.]))
+
+    with pytest.raises(ValueError):
+        cy_leapfrog_run_windows(p.c_instance, w0, t, 10., 5.)
+
+def test_meridional():
+    p = MiyamotoNagaiPotential(m=6E10, a=3., b=0.28, units=galactic)
+    assert p.axisymmetric
+
+    w0 = np.array([[8., 0., 0.1, 0.01, 0.2, 0.02],
+                   [5., 3., -0.5, -0.05, 0.15, 0.03],
+                   [0., 0., 1., 0., 0., 0.]])  # on the axis
+
+    # agrees with the Cartesian integration for a small step
+    t,w = cy_leapfrog_run(p.c_instance, w0, 0.01, 20000, 0.)
+    for nthreads in [1,2]:
+        t_m,w_m = cy_leapfrog_run_meridional(p.c_instance, w0, 0.01, 20000, 0.,
+                                             nthreads=nthreads)
+        np.testing.assert_allclose(t_m, t)
+        np.testing.assert_allclose(w_m, w, atol=1E-3)
+
+    # conserves L_z exactly
+    Lz = w_m[...,0]*w_m[...,4] - w_m[...,1]*w_m[...,3]
+    np.testing.assert_allclose(Lz, np.repeat(Lz[0:1], len(Lz), axis=0), rtol=1E-12, atol=1E-14)
+
+    # without the azimuth
+    stats = IntegrationStats()
+    t_rz,w_rz = cy_leapfrog_run_meridional(p.c_instance, w0, 0.01, 20000, 0.,
+                                           cartesian=False, stats=stats)
+    assert w_rz.shape == (20001,3,4)
+    np.testing.assert_allclose(w_rz[...,0], np.sqrt(w_m[...,0]**2 + w_m[...,1]**2), atol=1E-10)
+    np.testing.assert_array_equal(w_rz[...,1], w_m[...,2])
+    assert np.all(np.abs(stats.energy_drift) < 1E-6)
+    assert stats.nfcn == 3*20001
+
+    # through integrate_orbit
+    orbit_t,orbit_w = p.integrate_orbit(w0, dt=0.01, nsteps=20000, meridional=True)
+    np.testing.assert_array_equal(orbit_w, w_m)
+    orbit_t,orbit_w = p.integrate_orbit(w0, dt=0.01, nsteps=20000, meridional='Rz')
+    np.testing.assert_array_equal(orbit_w, w_rz)
+
+    # composites of axisymmetric potentials are axisymmetric
+    assert CompositePotential(disk=p, bulge=HernquistPotential(m=1E10, c=0.5,
+                                                               units=galactic)).axisymmetric
+
+    triaxial = LeeSutoTriaxialNFWPotential(v_c=0.2, r_s=20., a=1., b=0.9, c=0.8, units=galactic)
+    assert not triaxial.axisymmetric
+    with pytest.raises(ValueError):
+        triaxial.integrate_orbit(w0, dt=0.01, nsteps=10, meridional=True)
+
+    with pytest.raises(ValueError):
+        p.integrate_orbit(w0, dt=0.01, nsteps=10, meridional='xyz')
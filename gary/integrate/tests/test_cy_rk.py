@@ -0,0 +1,67 @@
+# coding: utf-8
+"""
+    Test the Cython Runge-Kutta integrators.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .._rk import cy_rk_run
+from .._dop853 import dop853_integrate_potential
+from ..rk5 import RK5Integrator
+from ...potential import HernquistPotential
+from ...units import galactic
+
+p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+w0 = np.array([[5.,0.,0., 0.,0.2,0.05],
+               [1.,0.5,0., 0.,0.3,0.]])
+
+def test_py_compare():
+    cy_t,cy_w = p.integrate_orbit(w0, dt=0.5, nsteps=1000, Integrator=RK5Integrator)
+    py_t,py_w = p.integrate_orbit(w0, dt=0.5, nsteps=1000, Integrator=RK5Integrator,
+                                  cython_if_possible=False)
+
+    np.testing.assert_allclose(cy_t, py_t)
+    np.testing.assert_allclose(cy_w, py_w, atol=1E-10)
+
+@pytest.mark.parametrize("order", [4,5])
+def test_order(order):
+    T = 200.
+    t,ref = dop853_integrate_potential(p.c_instance, w0[:1], T, 2, 0., 1E-14, 1E-14, 0)
+
+    errs = []
+    for dt in [0.5, 0.25]:
+        t,w = cy_rk_run(p.c_instance, w0[:1], dt, int(T/dt), 0., order=order)
+        errs.append(np.abs(w[-1]-ref[-1]).max())
+
+    assert np.log2(errs[0]/errs[1]) > order - 0.3
+
+def test_mmap():
+    nsteps = 1000
+    t,w = cy_rk_run(p.c_instance, w0, 0.5, nsteps, 0., order=4)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "orbits.mmap"), mode='w+',
+                         dtype=np.float64, shape=(nsteps+1,) + w0.shape)
+        mmap_t,mmap_w = cy_rk_run(p.c_instance, w0, 0.5, nsteps, 0., order=4,
+                                  mmap=mmap, chunksize=64)
+        assert mmap_w is mmap
+        np.testing.assert_allclose(np.array(mmap_w), w)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_bad_order():
+    with pytest.raises(ValueError):
+        cy_rk_run(p.c_instance, w0, 0.5, 10, 0., order=3)
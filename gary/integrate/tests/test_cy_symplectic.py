@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+    Test the Cython symplectic integrators.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .._symplectic import cy_symplectic_run
+from .._dop853 import dop853_integrate_potential
+from ..symplectic import SymplecticIntegrator, SCHEMES
+from ...potential import HernquistPotential
+from ...units import galactic
+
+p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+w0 = np.array([[5.,0.,0., 0.,0.2,0.05],
+               [1.,0.5,0., 0.,0.3,0.]])
+
+@pytest.mark.parametrize("scheme", sorted(SCHEMES.keys()))
+def test_order(scheme):
+    T = 200.
+    t,ref = dop853_integrate_potential(p.c_instance, w0[:1], T, 2, 0., 1E-14, 1E-14, 0)
+
+    errs = []
+    for dt in [1., 0.5]:
+        t,w = cy_symplectic_run(p.c_instance, w0[:1], dt, int(T/dt), 0., scheme=scheme)
+        errs.append(np.abs(w[-1]-ref[-1]).max())
+
+    order = SCHEMES[scheme][2]
+    np.testing.assert_allclose(np.log2(errs[0]/errs[1]), order, atol=0.1)
+
+@pytest.mark.parametrize("scheme", sorted(SCHEMES.keys()))
+def test_py_compare(scheme):
+    cy_t,cy_w = p.integrate_orbit(w0, dt=0.5, nsteps=1000, Integrator=SymplecticIntegrator,
+                                  Integrator_kwargs=dict(scheme=scheme))
+    py_t,py_w = p.integrate_orbit(w0, dt=0.5, nsteps=1000, Integrator=SymplecticIntegrator,
+                                  Integrator_kwargs=dict(scheme=scheme),
+                                  cython_if_possible=False)
+
+    np.testing.assert_allclose(cy_t, py_t)
+    np.testing.assert_allclose(cy_w, py_w, atol=1E-10)
+
+def test_energy():
+    # 4th order with a 5x larger step conserves energy better than leapfrog
+    t,w = cy_symplectic_run(p.c_instance, w0, 0.1, 10000, 0., scheme='leapfrog')
+    E = p.total_energy(w[:,0,:3], w[:,0,3:])
+    lf_dE = np.abs((E[1:] - E[0]) / E[0]).max()
+
+    t,w = cy_symplectic_run(p.c_instance, w0, 0.5, 2000, 0., scheme='omelyan4')
+    E = p.total_energy(w[:,0,:3], w[:,0,3:])
+    dE = np.abs((E[1:] - E[0]) / E[0]).max()
+    assert dE < lf_dE
+
+def test_backward():
+    t,w = cy_symplectic_run(p.c_instance, w0, 0.5, 1000, 0., scheme='ruth4')
+    w1 = np.ascontiguousarray(w[-1])
+    bt,bw = cy_symplectic_run(p.c_instance, w1, -0.5, 1000, t[-1], scheme='ruth4')
+    np.testing.assert_allclose(bt[::-1], t)
+    np.testing.assert_allclose(bw[-1], w0, atol=1E-8)
+
+def test_mmap():
+    nsteps = 1000
+    t,w = cy_symplectic_run(p.c_instance, w0, 0.5, nsteps, 0.)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mmap = np.memmap(os.path.join(tmpdir, "orbits.mmap"), mode='w+',
+                         dtype=np.float64, shape=(nsteps+1,) + w0.shape)
+        mmap_t,mmap_w = cy_symplectic_run(p.c_instance, w0, 0.5, nsteps, 0.,
+                                          mmap=mmap, chunksize=64)
+        assert mmap_w is mmap
+        np.testing.assert_allclose(np.array(mmap_w), w)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_bad_scheme():
+    with pytest.raises(ValueError):
+        cy_symplectic_run(p.c_instance, w0, 0.5, 10, 0., scheme='derp')
+
+    with pytest.raises(ValueError):
+        SymplecticIntegrator(lambda t,x: -x, scheme='derp')
@@ -0,0 +1,68 @@
+# coding: utf-8
+"""
+    Test the continuous-time orbit representation.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from ..denseorbit import DenseOrbit
+from .._dop853 import dop853_dense_orbit, dop853_integrate_potential
+from ...potential import HernquistPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(5., 15., size=(32,3)),
+                np.random.normal(0., 0.1, size=(32,3))))
+
+def test_dense_orbit():
+    orbit = dop853_dense_orbit(pot.c_instance, w0, 0., 500., 1E-10, 1E-10)
+    assert isinstance(orbit, DenseOrbit)
+    assert len(orbit) == len(w0)
+    assert np.all(orbit.nsteps > 0)
+
+    t,w = dop853_integrate_potential(pot.c_instance, w0, 0.25, 2001, 0., 1E-13, 1E-13, 0)
+    dense_w = orbit(t)
+    assert dense_w.shape == w.shape
+    np.testing.assert_allclose(dense_w, w, atol=1E-5)
+    np.testing.assert_allclose(orbit(0.)[0], w0)
+
+    # much smaller than the orbits at the output times
+    assert orbit.nbytes < w.nbytes / 2
+
+    # unsorted times, subset of orbits
+    tt = np.random.uniform(0., 500., size=128)
+    np.testing.assert_allclose(orbit(tt, orbits=[3,7]), orbit(tt)[:,[3,7]])
+
+    # split between threads
+    orbit2 = dop853_dense_orbit(pot.c_instance, w0, 0., 500., 1E-10, 1E-10, nthreads=3)
+    np.testing.assert_array_equal(orbit2.offsets, orbit.offsets)
+    np.testing.assert_array_equal(orbit2(tt), orbit(tt))
+
+    with pytest.raises(ValueError):
+        orbit([-1., 10.])
+    with pytest.raises(IndexError):
+        orbit(10., orbits=32)
+
+def test_backwards():
+    orbit = dop853_dense_orbit(pot.c_instance, w0[:4], 0., -100., 1E-10, 1E-10)
+    t,w = dop853_integrate_potential(pot.c_instance, w0[:4], -0.5, 201, 0., 1E-13, 1E-13, 0)
+    np.testing.assert_allclose(orbit(t), w, atol=1E-6)
+
+def test_tolerance():
+    # size of the representation is set by the tolerance
+    orbit1 = dop853_dense_orbit(pot.c_instance, w0, 0., 500., 1E-6, 1E-6)
+    orbit2 = dop853_dense_orbit(pot.c_instance, w0, 0., 500., 1E-12, 1E-12)
+    assert orbit1.nbytes < orbit2.nbytes
+
+    t = np.linspace(0., 500., 1024)
+    w = orbit2(t)
+    assert np.abs(orbit1(t) - w).max() > np.abs(orbit2(t) - w).max()
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+    Test event detection in the Cython integrators.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .._dop853 import dop853_integrate_potential_independent
+from .._leapfrog import cy_leapfrog_run
+from .._events import (Event, Pericenter, Apocenter, PlaneCrossing,
+                       EscapeRadius, TargetTime, FunctionEvent)
+from ...potential import HernquistPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+w0 = np.array([[10.,0.,0., 0.,0.15,0.02],
+               [5.,0.,0., 0.,0.2,0.]])
+
+def _r(w):
+    return np.sqrt(np.sum(w[...,:3]**2, axis=-1))
+
+def test_peri_apo():
+    peri,apo = Pericenter(), Apocenter()
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 5000, 0.,
+                                                        1E-10, 1E-10, 0, events=[peri,apo])
+    np.testing.assert_equal(status, [1,1])
+
+    for i in range(len(w0)):
+        r = _r(w[:,i])
+        ix = peri.orbit == i
+        assert ix.sum() > 0
+        assert np.all(np.diff(peri.t[ix]) > 0)
+        np.testing.assert_allclose(_r(peri.w[ix]), r.min(), rtol=1E-6)
+        np.testing.assert_allclose(_r(apo.w[apo.orbit == i]), r.max(), rtol=1E-6)
+
+        # radial velocity is zero at the events
+        np.testing.assert_allclose(np.sum(peri.w[ix,:3]*peri.w[ix,3:], axis=-1), 0., atol=1E-8)
+
+    # leapfrog finds the same events
+    lf_peri,lf_apo = Pericenter(), Apocenter()
+    t,w = cy_leapfrog_run(pot.c_instance, w0, 0.1, 4999, 0., events=[lf_peri,lf_apo])
+    np.testing.assert_equal(lf_peri.orbit, peri.orbit)
+    np.testing.assert_allclose(lf_peri.t, peri.t, atol=1E-3)
+    np.testing.assert_allclose(lf_apo.t, apo.t, atol=1E-3)
+
+def test_plane_crossing():
+    z = PlaneCrossing()
+    z_up = PlaneCrossing(direction=1)
+    func = FunctionEvent(lambda t,w: w[2])
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 2000, 0.,
+                                                        1E-10, 1E-10, 0, events=[z,z_up,func])
+    assert len(z.t) > 0
+    assert np.all(z.orbit == 0)
+    np.testing.assert_allclose(z.w[:,2], 0., atol=1E-10)
+    assert np.all(z_up.w[:,5] > 0)
+    assert len(z_up.t) in [len(z.t)//2, len(z.t)//2 + 1]
+    np.testing.assert_allclose(func.t, z.t)
+
+def test_function_event_raises():
+    # exceptions in user-supplied event functions stop the integration
+    def bad(t, w):
+        if t > 10.:
+            raise RuntimeError("bad event")
+        return w[2]
+
+    with pytest.raises(RuntimeError):
+        cy_leapfrog_run(pot.c_instance, w0, 0.1, 2000, 0., events=[FunctionEvent(bad)])
+
+    with pytest.raises(RuntimeError):
+        dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 2000, 0.,
+                                               1E-10, 1E-10, 0, nthreads=2,
+                                               events=[PlaneCrossing(), FunctionEvent(bad)])
+
+def test_terminal():
+    esc = EscapeRadius(7.)
+    end = TargetTime(150.5)
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 2000, 0.,
+                                                        1E-10, 1E-10, 0, nthreads=2,
+                                                        events=[esc,end])
+    np.testing.assert_equal(status, [2,2])
+    np.testing.assert_allclose(end.t, 150.5)
+    np.testing.assert_equal(end.orbit, [1])
+    assert np.all(np.isnan(w[t > 150.5,1]))
+    assert np.all(np.isfinite(w[t < 150.5,1]))
+
+    # orbit 0 starts outside of the escape radius, so it is only stopped when
+    #   it crosses it on the way out
+    np.testing.assert_equal(esc.orbit, [0])
+    np.testing.assert_allclose(_r(esc.w), 7.)
+    assert np.all(np.isnan(w[t > esc.t[0],0]))
+    assert esc.t[0] < 150.5
+
+    lf_esc = EscapeRadius(7.)
+    t,w = cy_leapfrog_run(pot.c_instance, w0, 0.1, 2000, 0., events=[lf_esc])
+    np.testing.assert_equal(lf_esc.orbit, [0])
+    np.testing.assert_allclose(lf_esc.t, esc.t, atol=1E-3)
+    assert np.all(np.isnan(w[t > lf_esc.t[0],0]))
+    assert np.all(np.isfinite(w[:,1]))
+
+def test_base_event():
+    with pytest.raises(TypeError):
+        dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 10, 0.,
+                                               1E-10, 1E-10, 0, events=[Event()])
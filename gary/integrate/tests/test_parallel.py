@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+    Test integrating orbits with a pool of worker processes.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .. import DOPRI853Integrator
+from ..core import _run_threaded
+from ..parallel import get_integration_pool, pool_integrate_orbit
+from ...potential import HernquistPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(5., 15., size=(10,3)),
+                np.random.normal(0., 0.1, size=(10,3))))
+
+@pytest.fixture
+def tmpdir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+@pytest.mark.parametrize("threads", [None, 2])
+def test_pool(threads):
+    t,w = pot.integrate_orbit(w0, dt=0.5, nsteps=1000)
+
+    pool = get_integration_pool(pot, threads=threads)
+    try:
+        pool_t,pool_w = pool_integrate_orbit(w0, pool, dt=0.5, nsteps=1000, nchunks=3)
+    finally:
+        pool.close()
+
+    np.testing.assert_allclose(pool_t, t)
+    np.testing.assert_array_equal(pool_w, w)
+
+def test_mmap(tmpdir):
+    t,w = pot.integrate_orbit(w0, Integrator=DOPRI853Integrator, dt=0.5, nsteps=200)
+
+    mmap = np.memmap(os.path.join(tmpdir, "w.mmap"), mode='w+', dtype=np.float64,
+                     shape=w.shape)
+    pool = get_integration_pool(pot, threads=2)
+    try:
+        pool_t,pool_w = pool_integrate_orbit(w0, pool, Integrator=DOPRI853Integrator,
+                                             mmap=mmap, dt=0.5, nsteps=200)
+    finally:
+        pool.close()
+
+    # the adaptive step size is chosen per chunk of orbits
+    assert pool_w is mmap
+    np.testing.assert_allclose(np.asarray(mmap), w, rtol=1E-5)
+
+    bad_mmap = np.memmap(os.path.join(tmpdir, "bad.mmap"), mode='w+', dtype=np.float64,
+                         shape=(10,) + w0.shape)
+    with pytest.raises(ValueError):
+        pool_integrate_orbit(w0, get_integration_pool(pot), mmap=bad_mmap, dt=0.5, nsteps=200)
+
+    with pytest.raises(TypeError):
+        pool_integrate_orbit(w0, get_integration_pool(pot), mmap=np.zeros(w.shape),
+                             dt=0.5, nsteps=200)
+
+def test_run_threaded():
+    # the blocks cover all orbits, in order, with at most one thread per orbit
+    for n,nthreads in [(10,1), (10,3), (10,0), (2,4), (0,2)]:
+        res = _run_threaded(lambda b,i1,i2: (b,i1,i2), n, nthreads)
+        assert [r[0] for r in res] == list(range(len(res)))
+        assert res[0][1] == 0 and res[-1][2] == n
+        for r1,r2 in zip(res[:-1], res[1:]):
+            assert r1[2] == r2[1]
+        assert len(res) <= max(n, 1)
+
+    # exceptions in the threads are re-raised
+    def worker(b, i1, i2):
+        if b == 1:
+            raise RuntimeError("Bad worker!")
+
+    with pytest.raises(RuntimeError):
+        _run_threaded(worker, 10, 2)
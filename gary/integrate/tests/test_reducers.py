@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+    Test the per-orbit reducers in the Cython integrators.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .._dop853 import dop853_integrate_potential_independent, dop853_reduce
+from .._leapfrog import cy_leapfrog_run, cy_leapfrog_reduce
+from .._reducers import (Reducer, PeriApo, ZMax, EnergyError,
+                         MeanAngularMomentum, Circulation, FunctionReducer)
+from ...dynamics import classify_orbit
+from ...potential import MiyamotoNagaiPotential, HernquistPotential
+from ...units import galactic
+
+pot = MiyamotoNagaiPotential(m=1E11, a=3., b=0.3, units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(2., 10., size=(16,3)),
+                np.random.normal(0., 0.15, size=(16,3))))
+
+def check_reducers(t, w, reducers):
+    peri, zmax, energy, meanL, circ = reducers
+
+    r = np.sqrt(np.sum(w[...,:3]**2, axis=-1))
+    np.testing.assert_allclose(peri.pericenter, r.min(axis=0))
+    np.testing.assert_allclose(peri.apocenter, r.max(axis=0))
+    np.testing.assert_allclose(peri.eccentricity,
+                               (r.max(axis=0) - r.min(axis=0)) / (r.max(axis=0) + r.min(axis=0)))
+    np.testing.assert_allclose(zmax.zmax, np.abs(w[...,2]).max(axis=0))
+
+    pot_val = pot.value(w[...,:3].reshape(-1,3)).reshape(w.shape[:2])
+    E = 0.5*np.sum(w[...,3:]**2, axis=-1) + pot_val
+    dE = (E - E[0]) / np.abs(E[0])
+    np.testing.assert_allclose(energy.E0, E[0])
+    np.testing.assert_allclose(energy.min_error, dE.min(axis=0), atol=1E-15)
+    np.testing.assert_allclose(energy.max_error, dE.max(axis=0), atol=1E-15)
+
+    L = np.cross(w[...,:3], w[...,3:])
+    np.testing.assert_allclose(meanL.L, np.trapz(L, t, axis=0) / (t[-1] - t[0]), atol=1E-12)
+
+    np.testing.assert_equal(circ.circulation, classify_orbit(w))
+
+def test_leapfrog():
+    reducers = [PeriApo(), ZMax(), EnergyError(), MeanAngularMomentum(), Circulation()]
+    t,w = cy_leapfrog_run(pot.c_instance, w0, 0.5, 2000, 0.)
+    cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 2000, 0., reducers)
+    check_reducers(t, w, reducers)
+
+    # same results when split between threads
+    reducers2 = [PeriApo(), ZMax(), EnergyError(), MeanAngularMomentum(), Circulation()]
+    cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 2000, 0., reducers2, nthreads=3)
+    np.testing.assert_equal(reducers2[0].pericenter, reducers[0].pericenter)
+    np.testing.assert_equal(reducers2[3].L, reducers[3].L)
+
+def test_dop853():
+    reducers = [PeriApo(), ZMax(), EnergyError(), MeanAngularMomentum(), Circulation()]
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.5, 2001, 0.,
+                                                        1E-10, 1E-10, 0)
+    status = dop853_reduce(pot.c_instance, w0, 0.5, 2001, 0., 1E-10, 1E-10, 0,
+                           reducers, nthreads=2)
+    np.testing.assert_equal(status, 1)
+    check_reducers(t, w, reducers)
+    assert np.all(np.abs(reducers[2].max_error) < 1E-6)
+
+def test_function_reducer():
+    # a user-supplied reducer in Python: the largest speed and the time at
+    #   which it is reached
+    def update(acc, t, w):
+        v = np.sqrt(np.sum(w[3:]**2))
+        if v > acc[0]:
+            acc[0] = v
+            acc[1] = t
+
+    # the time-averaged radius, with a separate init function
+    def init(acc, t, w):
+        acc[0] = t
+        acc[1] = 0.
+
+    def mean_r(acc, t, w):
+        acc[1] += np.sqrt(np.sum(w[:3]**2))
+
+    vmax = FunctionReducer(update, nacc=2, initial=-1.)
+    rmean = FunctionReducer(mean_r, nacc=2, init=init)
+    peri = PeriApo()
+    t,w = cy_leapfrog_run(pot.c_instance, w0, 0.5, 200, 0.)
+    cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 200, 0., [vmax, peri, rmean], nthreads=2)
+
+    v = np.sqrt(np.sum(w[...,3:]**2, axis=-1))
+    r = np.sqrt(np.sum(w[...,:3]**2, axis=-1))
+    assert vmax.result.shape == (len(w0), 2)
+    np.testing.assert_allclose(vmax.result[:,0], v.max(axis=0))
+    np.testing.assert_allclose(vmax.result[:,1], t[v.argmax(axis=0)])
+    np.testing.assert_allclose(rmean.result[:,1] / 200., r[1:].mean(axis=0))
+    np.testing.assert_allclose(peri.pericenter, r.min(axis=0))
+
+    # the orbits are not affected by changing the phase-space position
+    def clobber(acc, t, w):
+        w[:] = 0.
+    cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 200, 0., [FunctionReducer(clobber), peri])
+    np.testing.assert_allclose(peri.pericenter, r.min(axis=0))
+
+    t,w,status = dop853_integrate_potential_independent(pot.c_instance, w0, 0.5, 201, 0.,
+                                                        1E-10, 1E-10, 0)
+    reducer = FunctionReducer(update, nacc=2, initial=-1.)
+    dop853_reduce(pot.c_instance, w0, 0.5, 201, 0., 1E-10, 1E-10, 0, [reducer])
+    np.testing.assert_allclose(reducer.result[:,0], np.sqrt(np.sum(w[...,3:]**2, axis=-1)).max(axis=0))
+
+    with pytest.raises(ValueError):
+        FunctionReducer(update, nacc=0)
+
+def test_function_reducer_raises():
+    # exceptions in the functions stop the integration and are re-raised
+    def update(acc, t, w):
+        if t > 10.:
+            raise RuntimeError("Bad reducer!")
+        acc[0] += 1.
+
+    for nthreads in [1, 2]:
+        reducer = FunctionReducer(update)
+        with pytest.raises(RuntimeError):
+            cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 200, 0., [reducer, PeriApo()],
+                               nthreads=nthreads)
+        assert reducer.result is None
+
+        reducer = FunctionReducer(update)
+        with pytest.raises(RuntimeError):
+            dop853_reduce(pot.c_instance, w0, 0.5, 201, 0., 1E-10, 1E-10, 0, [reducer],
+                          nthreads=nthreads)
+        assert reducer.result is None
+
+    def init(acc, t, w):
+        raise ValueError("Bad init!")
+
+    with pytest.raises(ValueError):
+        cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 10, 0.,
+                           [FunctionReducer(update, init=init)])
+
+def test_validate():
+    with pytest.raises(ValueError):
+        cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 10, 0., [])
+
+    with pytest.raises(TypeError):
+        cy_leapfrog_reduce(pot.c_instance, w0, 0.5, 10, 0., [Reducer()])
+
+    # reducers that need a 3D orbit
+    pot2d = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0_2d = np.ascontiguousarray(w0[:,[0,1,3,4]])
+    with pytest.raises(ValueError):
+        cy_leapfrog_reduce(pot2d.c_instance, w0_2d, 0.5, 10, 0., [ZMax()])
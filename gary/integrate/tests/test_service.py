@@ -0,0 +1,108 @@
+# coding: utf-8
+"""
+    Test the batching integration service.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Standard library
+import os
+import shutil
+import tempfile
+import threading
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from .. import DOPRI853Integrator
+from ..service import IntegrationService, IntegrationServer, IntegrationClient
+from ...potential import HernquistPotential, IsochronePotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+
+np.random.seed(42)
+w0 = np.hstack((np.random.uniform(5., 15., size=(16,3)),
+                np.random.normal(0., 0.1, size=(16,3))))
+
+def test_batching():
+    t,w = pot.integrate_orbit(w0, dt=0.5, nsteps=1000)
+
+    # the batch is integrated as soon as it contains all 16 orbits
+    with IntegrationService(max_orbits=16, max_wait=60.) as service:
+        futures = [service.submit(pot, w0[i:i+4], dt=0.5, nsteps=1000)
+                   for i in range(0,len(w0),4)]
+        results = [f.result() for f in futures]
+
+        assert service.nbatches == 1
+        assert service.nrequests == 4
+
+    for i,(ti,wi) in enumerate(results):
+        np.testing.assert_allclose(ti, t)
+        np.testing.assert_array_equal(wi, w[:,4*i:4*i+4])
+
+def test_grouping():
+    pot2 = IsochronePotential(m=1E11, b=1., units=galactic)
+
+    with IntegrationService(max_orbits=20, max_wait=60.) as service:
+        f1 = service.submit(pot, w0[:4], dt=0.5, nsteps=100)
+        f2 = service.submit(pot2, w0[:4], dt=0.5, nsteps=100)
+        f3 = service.submit(HernquistPotential(m=1E11, c=0.5, units=galactic), w0[4:8],
+                            dt=0.5, nsteps=100)
+        f4 = service.submit(pot, w0[:4], Integrator=DOPRI853Integrator, dt=0.5, nsteps=100)
+        f5 = service.submit(pot, w0[:4], dt=0.5, nsteps=200)
+        for f in [f1,f2,f3,f4,f5]:
+            f.result()
+
+        # f1 and f3 are integrated together
+        assert service.nbatches == 4
+
+    np.testing.assert_array_equal(f2.result()[1], pot2.integrate_orbit(w0[:4], dt=0.5, nsteps=100)[1])
+    assert f5.result()[1].shape == (201,4,6)
+
+    with pytest.raises(RuntimeError):
+        service.submit(pot, w0, dt=0.5, nsteps=100)
+
+def test_errors():
+    with IntegrationService(max_wait=0.) as service:
+        with pytest.raises(ValueError):
+            service.submit(pot, w0, dt='auto', t2=100.)
+
+        future = service.submit(pot, w0, Integrator=DOPRI853Integrator,
+                                Integrator_kwargs=dict(atol=1E-9, nmax=1),
+                                dt=0.5, nsteps=100)
+        assert isinstance(future.exception(), RuntimeError)
+
+def test_server():
+    t,w = pot.integrate_orbit(w0, dt=0.5, nsteps=100)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        server = IntegrationServer(str(os.path.join(tmpdir, "socket")), authkey=b"gary",
+                                   max_orbits=16, max_wait=60.)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        clients = [IntegrationClient(server.address, authkey=b"gary") for i in range(2)]
+        futures = [c.submit(pot, w0[8*i:8*i+8], dt=0.5, nsteps=100)
+                   for i,c in enumerate(clients)]
+        for i,f in enumerate(futures):
+            np.testing.assert_array_equal(f.result()[1], w[:,8*i:8*i+8])
+
+        # errors are raised in the client
+        with pytest.raises(ValueError):
+            clients[0].integrate_orbit(pot, w0, dt='auto', t2=100.)
+
+        for c in clients:
+            c.close()
+        server.close()
+        thread.join()
+
+        assert server.service.nbatches == 1
+
+    finally:
+        shutil.rmtree(tmpdir)
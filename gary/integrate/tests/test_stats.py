@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+    Test the integration statistics and profiling hooks.
+"""
+
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+__author__ = "adrn <adrn@astro.columbia.edu>"
+
+# Third-party
+import numpy as np
+import pytest
+
+# Project
+from ..stats import IntegrationStats
+from .. import RK5Integrator
+from .._dop853 import (dop853_integrate_potential, dop853_integrate_potential_parallel,
+                       dop853_integrate_potential_independent)
+from .._leapfrog import cy_leapfrog_run, py_leapfrog_run
+from .._rk import cy_rk_run
+from .._symplectic import cy_symplectic_run
+from ...potential import HernquistPotential
+from ...units import galactic
+
+pot = HernquistPotential(m=1E11, c=0.5, units=galactic)
+w0 = np.array([[10.,0.,0., 0.,0.15,0.02],
+               [5.,0.,0., 0.,0.2,0.]])
+
+def test_dop853():
+    phases = []
+    stats = IntegrationStats(hook=lambda phase,seconds: phases.append(phase))
+    dop853_integrate_potential(pot.c_instance, w0, 0.1, 2000, 0., 1E-10, 1E-10, 0,
+                               stats=stats)
+
+    assert stats.nstep == stats.naccpt + stats.nrejct
+    assert stats.naccpt > 0
+    assert stats.nfcn >= len(w0) * 12 * stats.naccpt
+    assert 0 < stats.h_min <= stats.h_max
+    assert stats.energy_drift.shape == (len(w0),)
+    assert np.all(np.abs(stats.energy_drift) < 1E-7)
+    assert list(stats.timings.keys()) == ['integrate']
+    assert phases == ['integrate']
+
+    # statistics are for a single call
+    nfcn = stats.nfcn
+    dop853_integrate_potential(pot.c_instance, w0, 0.1, 2000, 0., 1E-10, 1E-10, 0,
+                               stats=stats)
+    assert stats.nfcn == nfcn
+
+    for func in [dop853_integrate_potential_parallel,
+                 dop853_integrate_potential_independent]:
+        func(pot.c_instance, w0, 0.1, 2000, 0., 1E-10, 1E-10, 0, nthreads=2,
+             stats=stats)
+        assert stats.nstep == stats.naccpt + stats.nrejct
+        assert stats.nfcn > 0
+
+    # each orbit is integrated separately, so the counts don't depend on how
+    #   the orbits are split between threads
+    stats2 = IntegrationStats()
+    dop853_integrate_potential_independent(pot.c_instance, w0, 0.1, 2000, 0.,
+                                           1E-10, 1E-10, 0, nthreads=1, stats=stats2)
+    assert stats2.nfcn == stats.nfcn
+    assert stats2.naccpt == stats.naccpt
+
+def test_output_phase(tmpdir):
+    phases = []
+    stats = IntegrationStats(hook=lambda phase,seconds: phases.append(phase))
+    mmap = np.memmap(str(tmpdir.join("w.dat")), mode='w+', dtype=np.float64,
+                     shape=(2000,2,6))
+    dop853_integrate_potential(pot.c_instance, w0, 0.1, 2000, 0., 1E-10, 1E-10, 0,
+                               mmap=mmap, chunksize=100, stats=stats)
+    assert phases.count('output') == 20
+    assert set(stats.timings.keys()) == set(['integrate', 'output'])
+
+    stats2 = IntegrationStats()
+    dop853_integrate_potential(pot.c_instance, w0, 0.1, 2000, 0., 1E-10, 1E-10, 0,
+                               stats=stats2)
+    np.testing.assert_allclose(stats2.energy_drift, stats.energy_drift)
+    assert stats2.nfcn == stats.nfcn
+
+def test_fixed_step():
+    nsteps = 1000
+    stats = IntegrationStats()
+
+    cy_leapfrog_run(pot.c_instance, w0, 0.1, nsteps, 0., stats=stats)
+    assert stats.nfcn == len(w0)*(nsteps+1)
+    assert stats.nstep == stats.naccpt == nsteps
+    assert stats.nrejct == 0
+    assert stats.h_min == stats.h_max == 0.1
+    leapfrog_drift = np.abs(stats.energy_drift)
+
+    py_leapfrog_run(pot.gradient, w0, 0.1, nsteps, 0., stats=stats)
+    assert stats.nfcn == len(w0)*(nsteps+1)
+    assert stats.energy_drift is None
+
+    cy_rk_run(pot.c_instance, w0, 0.1, nsteps, 0., order=4, stats=stats)
+    assert stats.nfcn == len(w0)*nsteps*4
+    assert np.all(np.abs(stats.energy_drift) < leapfrog_drift)
+
+    cy_symplectic_run(pot.c_instance, w0, 0.1, nsteps, 0., scheme='ruth4', stats=stats)
+    assert stats.nfcn == len(w0)*nsteps*3
+
+def test_integrate_orbit():
+    stats = IntegrationStats()
+    pot.integrate_orbit(w0, dt=0.1, nsteps=100, stats=stats)
+    assert stats.nfcn == len(w0)*101
+
+    # no compiled integrator, only the time and energy are recorded
+    pot.integrate_orbit(w0, Integrator=RK5Integrator, cython_if_possible=False,
+                        dt=0.1, nsteps=100, stats=stats)
+    assert stats.nfcn == 0
+    assert stats.timings['integrate'] > 0
+    assert np.all(np.abs(stats.energy_drift) < 1E-8)
+
+def test_full_output():
+    # extra outputs of the integrator are passed through
+    stats = IntegrationStats()
+    t,w,info = pot.integrate_orbit(w0, dt=0.5, nsteps=20, stats=stats,
+                                   Integrator_kwargs=dict(adaptive=True, full_output=True))
+    assert w.shape == (21,) + w0.shape
+    assert info['nfev'].shape == (len(w0),)
+    assert np.all(np.abs(stats.energy_drift) < 1E-3)
+
+def test_bad_stats():
+    with pytest.raises(TypeError):
+        cy_leapfrog_run(pot.c_instance, w0, 0.1, 10, 0., stats=dict())
@@ -19,13 +19,15 @@ from astropy.constants import G
 
 # Project
 from ..leapfrog import LeapfrogIntegrator
+from ..symplectic import SymplecticIntegrator
 from .helpers import plot
 
 plot_path = "plots/tests/integrate"
 if not os.path.exists(plot_path):
     os.makedirs(plot_path)
 
-@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator), ])
+@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator),
+                                               ('symplectic',SymplecticIntegrator)])
 def test_forward(name, Integrator):
     T = 10.
     acceleration = lambda t,q: -(2*np.pi/T)**2*q
@@ -39,7 +41,8 @@ def test_forward(name, Integrator):
     fig = plot(ts, ws)
     fig.savefig(os.path.join(plot_path,"forward_{0}.png".format(name)))
 
-@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator), ])
+@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator),
+                                               ('symplectic',SymplecticIntegrator)])
 def test_backward(name, Integrator):
     T = 10.
     acceleration = lambda t,q: -(2*np.pi/T)**2*q
@@ -53,7 +56,8 @@ def test_backward(name, Integrator):
     fig = plot(ts, ws)
     fig.savefig(os.path.join(plot_path,"backward_{0}.png".format(name)))
 
-@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator), ])
+@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator),
+                                               ('symplectic',SymplecticIntegrator)])
 def test_harmonic_oscillator(name, Integrator):
     T = 10.
     acceleration = lambda t,q: -(2*np.pi/T)**2*q
@@ -66,7 +70,8 @@ def test_harmonic_oscillator(name, Integrator):
     fig = plot(ts, ws)
     fig.savefig(os.path.join(plot_path,"harmonic_osc_{0}.png".format(name)))
 
-@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator), ])
+@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator),
+                                               ('symplectic',SymplecticIntegrator)])
 def test_point_mass(name, Integrator):
     GM = (G * (1.*u.M_sun)).decompose([u.au,u.M_sun,u.year,u.radian]).value
 
@@ -84,7 +89,8 @@ def test_point_mass(name, Integrator):
     fig = plot(ts, ws)
     fig.savefig(os.path.join(plot_path,"point_mass_{0}.png".format(name)))
 
-@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator), ])
+@pytest.mark.parametrize(("name","Integrator"), [('leapfrog',LeapfrogIntegrator),
+                                               ('symplectic',SymplecticIntegrator)])
 def test_memmap(name, Integrator):
 
     dt = 0.1
@@ -27,6 +27,25 @@ void kepler_gradient(double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void kepler_hessian(double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+    */
+    double R, fac1, fac2;
+    int i, j;
+    R = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    fac1 = pars[0] * pars[1] / (R*R*R);
+    fac2 = -3. * fac1 / (R*R);
+
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            hess[3*i+j] = fac2*r[i]*r[j];
+        }
+        hess[3*i+i] += fac1;
+    }
+}
+
 /* ---------------------------------------------------------------------------
     Isochrone potential
 */
@@ -49,7 +68,7 @@ void isochrone_gradient(double *pars, double *r, double *grad) {
     */
     double sqrtR2b, fac, denom;
     sqrtR2b = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2] + pars[2]*pars[2]);
-    denom = (sqrtR2b + pars[2]*pars[2]);
+    denom = (sqrtR2b + pars[2]);
     fac = pars[0] * pars[1] / (denom * denom * sqrtR2b);
 
     grad[0] = fac*r[0];
@@ -86,6 +105,27 @@ void hernquist_gradient(double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void hernquist_hessian(double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - c (length scale)
+    */
+    double R, Rc, fac1, fac2;
+    int i, j;
+    R = sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2]);
+    Rc = R + pars[2];
+    fac1 = pars[0] * pars[1] / (Rc * Rc * R);
+    fac2 = -(2. * pars[0] * pars[1] / (Rc * Rc * Rc) + fac1) / (R*R);
+
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            hess[3*i+j] = fac2*r[i]*r[j];
+        }
+        hess[3*i+i] += fac1;
+    }
+}
+
 /* ---------------------------------------------------------------------------
     Plummer sphere
 */
@@ -114,6 +154,26 @@ void plummer_gradient(double *pars, double *r, double *grad) {
     grad[2] = fac*r[2];
 }
 
+void plummer_hessian(double *pars, double *r, double *hess) {
+    /*  pars:
+            - G (Gravitational constant)
+            - m (mass scale)
+            - b (length scale)
+    */
+    double R2b, fac1, fac2;
+    int i, j;
+    R2b = r[0]*r[0] + r[1]*r[1] + r[2]*r[2] + pars[2]*pars[2];
+    fac1 = pars[0] * pars[1] / sqrt(R2b) / R2b;
+    fac2 = -3. * fac1 / R2b;
+
+    for (i=0; i<3; i++) {
+        for (j=0; j<3; j++) {
+            hess[3*i+j] = fac2*r[i]*r[j];
+        }
+        hess[3*i+i] += fac1;
+    }
+}
+
 /* ---------------------------------------------------------------------------
     Jaffe sphere
 */
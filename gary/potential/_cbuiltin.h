@@ -1,14 +1,17 @@
 extern double kepler_value(double *pars, double *q);
 extern void kepler_gradient(double *pars, double *q, double *grad);
+extern void kepler_hessian(double *pars, double *q, double *hess);
 
 extern double isochrone_value(double *pars, double *q);
 extern void isochrone_gradient(double *pars, double *q, double *grad);
 
 extern double hernquist_value(double *pars, double *q);
 extern void hernquist_gradient(double *pars, double *q, double *grad);
+extern void hernquist_hessian(double *pars, double *q, double *hess);
 
 extern double plummer_value(double *pars, double *q);
 extern void plummer_gradient(double *pars, double *q, double *grad);
+extern void plummer_hessian(double *pars, double *q, double *hess);
 
 extern double jaffe_value(double *pars, double *q);
 extern void jaffe_gradient(double *pars, double *q, double *grad);
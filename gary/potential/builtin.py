@@ -81,6 +81,24 @@ class HarmonicOscillatorPotential(PotentialBase):
         from ..dynamics.analyticactionangle import harmonic_oscillator_aa_to_xv
         return harmonic_oscillator_aa_to_xv(actions, angles, self)
 
+    def analytic_orbit(self, w0, t, t0=None):
+        """
+        Compute orbits in this potential analytically, at any output times
+        and without a time step. See
+        `~gary.dynamics.analyticactionangle.harmonic_oscillator_orbit`.
+
+        Parameters
+        ----------
+        w0 : array_like
+            Phase-space positions at time ``t0``, shape ``(norbits,2*ndim)``.
+        t : array_like
+            Output times.
+        t0 : numeric (optional)
+            Time of the initial conditions. Defaults to the first output time.
+        """
+        from ..dynamics.analyticactionangle import harmonic_oscillator_orbit
+        return harmonic_oscillator_orbit(w0, t, self, t0=t0)
+
 class KuzminPotential(PotentialBase):
     r"""
     The Kuzmin flattened disk potential.
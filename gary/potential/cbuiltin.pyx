@@ -42,15 +42,18 @@ cdef extern from "math.h":
 cdef extern from "_cbuiltin.h":
     double kepler_value(double *pars, double *q) nogil
     void kepler_gradient(double *pars, double *q, double *grad) nogil
+    void kepler_hessian(double *pars, double *q, double *hess) nogil
 
     double isochrone_value(double *pars, double *q) nogil
     void isochrone_gradient(double *pars, double *q, double *grad) nogil
 
     double hernquist_value(double *pars, double *q) nogil
     void hernquist_gradient(double *pars, double *q, double *grad) nogil
+    void hernquist_hessian(double *pars, double *q, double *hess) nogil
 
     double plummer_value(double *pars, double *q) nogil
     void plummer_gradient(double *pars, double *q, double *grad) nogil
+    void plummer_hessian(double *pars, double *q, double *hess) nogil
 
     double jaffe_value(double *pars, double *q) nogil
     void jaffe_gradient(double *pars, double *q, double *grad) nogil
@@ -86,6 +89,7 @@ cdef class _KeplerPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &kepler_value
         self.c_gradient = &kepler_gradient
+        self.c_hessian = &kepler_hessian
 
 class KeplerPotential(CPotentialBase):
     r"""
@@ -106,12 +110,32 @@ class KeplerPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, units):
         self.units = units
         self.G = G.decompose(units).value
         self.parameters = dict(m=m)
         self.c_instance = _KeplerPotential(G=self.G, **self.parameters)
 
+    def analytic_orbit(self, w0, t, t0=None):
+        """
+        Compute orbits in this potential analytically, at any output times
+        and without a time step. See
+        `~gary.dynamics.analyticactionangle.kepler_orbit`.
+
+        Parameters
+        ----------
+        w0 : array_like
+            Phase-space positions at time ``t0``, shape ``(norbits,6)``.
+        t : array_like
+            Output times.
+        t0 : numeric (optional)
+            Time of the initial conditions. Defaults to the first output time.
+        """
+        from ..dynamics.analyticactionangle import kepler_orbit
+        return kepler_orbit(w0, t, self, t0=t0)
+
 # ============================================================================
 #    Isochrone potential
 #
@@ -144,6 +168,8 @@ class IsochronePotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, b, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -189,6 +215,24 @@ class IsochronePotential(CPotentialBase):
         from ..dynamics.analyticactionangle import isochrone_aa_to_xv
         return isochrone_aa_to_xv(actions, angles, self)
 
+    def analytic_orbit(self, w0, t, t0=None):
+        """
+        Compute orbits in this potential analytically, at any output times
+        and without a time step. See
+        `~gary.dynamics.analyticactionangle.isochrone_orbit`.
+
+        Parameters
+        ----------
+        w0 : array_like
+            Phase-space positions at time ``t0``, shape ``(norbits,6)``.
+        t : array_like
+            Output times.
+        t0 : numeric (optional)
+            Time of the initial conditions. Defaults to the first output time.
+        """
+        from ..dynamics.analyticactionangle import isochrone_orbit
+        return isochrone_orbit(w0, t, self, t0=t0)
+
 # ============================================================================
 #    Hernquist Spheroid potential from Hernquist 1990
 #    http://adsabs.harvard.edu/abs/1990ApJ...356..359H
@@ -200,6 +244,7 @@ cdef class _HernquistPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &hernquist_value
         self.c_gradient = &hernquist_gradient
+        self.c_hessian = &hernquist_hessian
 
 class HernquistPotential(CPotentialBase):
     r"""
@@ -222,6 +267,8 @@ class HernquistPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, c, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -238,6 +285,7 @@ cdef class _PlummerPotential(_CPotential):
         self._parameters = &(self._parvec)[0]
         self.c_value = &plummer_value
         self.c_gradient = &plummer_gradient
+        self.c_hessian = &plummer_hessian
 
 class PlummerPotential(CPotentialBase):
     r"""
@@ -260,6 +308,8 @@ class PlummerPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, b, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -298,6 +348,8 @@ class JaffePotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, c, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -340,6 +392,8 @@ class MiyamotoNagaiPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m, a, b, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -380,6 +434,8 @@ class StonePotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, m_tot, r_c, r_t, units):
         self.units = units
         self.G = G.decompose(units).value
@@ -419,6 +475,8 @@ class SphericalNFWPotential(CPotentialBase):
         length, mass, time, and angle units.
 
     """
+    axisymmetric = True
+
     def __init__(self, v_c, r_s, units):
         self.units = units
         self.G = G.decompose(units).value
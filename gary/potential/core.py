@@ -62,6 +62,10 @@ class PotentialBase(object):
 
     """
 
+    # potentials that are symmetric about the z axis set this to True, so
+    #   that orbits can be integrated in the meridional plane
+    axisymmetric = False
+
     def __init__(self, units=None):
         if units is not None and not isinstance(units, UnitSystem):
             units = UnitSystem(*units)
@@ -285,18 +289,65 @@ class PotentialBase(object):
 
     def integrate_orbit(self, w0, Integrator=LeapfrogIntegrator,
                         Integrator_kwargs=dict(), cython_if_possible=True,
+                        mmap=None, energy_tol=1E-6, stats=None, cache=None,
+                        t_start=None, t_end=None, meridional=False, analytic=False,
                         **time_spec):
         """
         Integrate an orbit in the current potential using the integrator class
         provided. Uses same time specification as `Integrator.run()` -- see
         the documentation for `gary.integrate` for more information.
 
+        For the fixed-step integrators, the time step can also be chosen
+        automatically by passing ``dt='auto'`` along with the initial and
+        final times, ``t1`` and ``t2``. The step is then the smallest of the
+        steps estimated for each orbit with `estimate_dt` to keep the
+        relative energy error below ``energy_tol``.
+
         Parameters
         ----------
         w0 : array_like
             Initial conditions.
         Integrator : class
             Integrator class to use.
+        mmap : None, array_like (optional)
+            Option to write integration output directly to a memory-mapped
+            array (e.g., from `numpy.memmap`) or an HDF5 dataset (e.g., from
+            `h5py`) so that the memory usage doesn't explode. Must have shape
+            `(ntimes, norbits, ndim)`.
+        energy_tol : numeric (optional)
+            Target relative energy error when ``dt='auto'``.
+        stats : `~gary.integrate.IntegrationStats` (optional)
+            Collect statistics (number of force evaluations and steps, energy
+            drift, and timings) of the integration in this object. For
+            integrators without a compiled implementation, only the total
+            time and the energy drift are recorded.
+        cache : `~gary.integrate.OrbitCache` (optional)
+            Look up the orbits in this on-disk cache before integrating, and
+            store them in it afterwards. Cached orbits are returned as
+            memory-mapped arrays.
+        t_start, t_end : numeric, array_like (optional)
+            Start and end time of each orbit, to integrate orbits that start
+            (and end) at different times in a single call. Orbit ``i``
+            starts from ``w0[i]`` at ``t_start[i]``, and the output is NaN at
+            times outside of its window. Only supported by the leapfrog and
+            DOP853 integrators for potentials with a C implementation.
+        meridional : bool, str (optional)
+            For potentials that declare that they are ``axisymmetric``,
+            integrate the orbits in the meridional plane, :math:`(R,z)`,
+            using the conservation of :math:`L_z` (see
+            `~gary.integrate._leapfrog.cy_leapfrog_run_meridional`). If True
+            or ``'cartesian'``, the azimuth is reconstructed and the orbits
+            are returned in Cartesian coordinates as usual. If ``'Rz'``, the
+            orbits are returned as :math:`(R, z, v_R, v_z)`. Only supported
+            by the leapfrog integrator for potentials with a C
+            implementation.
+        analytic : bool (optional)
+            For integrable potentials with an ``analytic_orbit`` method
+            (e.g., the Kepler, Isochrone, and Harmonic Oscillator
+            potentials), compute the orbits analytically instead of
+            integrating them. The result is exact to round-off, and the cost
+            only depends on the number of output times (the output times
+            don't need to be evenly spaced). The integrator is not used.
 
         Other Parameters
         ----------------
@@ -304,6 +355,51 @@ class PotentialBase(object):
 
         """
 
+        if cache is not None:
+            if t_start is not None:
+                time_spec['t_start'] = t_start
+            if t_end is not None:
+                time_spec['t_end'] = t_end
+            if meridional:
+                time_spec['meridional'] = meridional
+            if analytic:
+                time_spec['analytic'] = analytic
+            return self._cached_integrate(cache, w0, Integrator, Integrator_kwargs,
+                                          cython_if_possible, mmap, energy_tol,
+                                          stats, time_spec)
+
+        if analytic:
+            if t_start is not None or t_end is not None or meridional:
+                raise ValueError("Analytic orbits don't support per-orbit start and end "
+                                 "times or meridional-plane integration.")
+            return self._integrate_analytic(w0, mmap, stats, time_spec)
+
+        if isinstance(time_spec.get('dt', None), six.string_types):
+            if time_spec['dt'] != 'auto' or 't2' not in time_spec:
+                raise ValueError("To choose the time step automatically, pass dt='auto' "
+                                 "along with t2 (and optionally t1).")
+
+            t1 = time_spec.get('t1', 0.)
+            t2 = time_spec['t2']
+            dt = self.estimate_dt(w0, energy_tol=energy_tol, Integrator=Integrator,
+                                  Integrator_kwargs=Integrator_kwargs,
+                                  cython_if_possible=cython_if_possible).min()
+            nsteps = max(int(np.ceil(abs(t2 - t1) / dt)), 1)
+            time_spec = dict(t=np.linspace(t1, t2, nsteps+1))
+
+        if meridional:
+            if t_start is not None or t_end is not None:
+                raise ValueError("Per-orbit start and end times are not supported for "
+                                 "meridional-plane integration.")
+            return self._integrate_meridional(w0, Integrator, Integrator_kwargs,
+                                              cython_if_possible, mmap, stats,
+                                              meridional, time_spec)
+
+        if t_start is not None or t_end is not None:
+            return self._integrate_windows(w0, Integrator, Integrator_kwargs,
+                                           cython_if_possible, mmap, stats,
+                                           t_start, t_end, time_spec)
+
         if Integrator == LeapfrogIntegrator:
             if hasattr(self, 'c_instance') and cython_if_possible:
                 from ..integrate._leapfrog import cy_leapfrog_run
@@ -316,11 +412,75 @@ class PotentialBase(object):
                 t1 = times[0]
 
                 w0 = np.ascontiguousarray(np.atleast_2d(w0))
-                return cy_leapfrog_run(self.c_instance, w0, dt, nsteps, t1)
+                if Integrator_kwargs.get('adaptive', False):
+                    from ..integrate._leapfrog import cy_adaptive_leapfrog_run
+                    if mmap is not None:
+                        raise ValueError("Adaptive leapfrog integration doesn't support "
+                                         "output to a memory-mapped array.")
+                    kwargs = dict([(k,v) for k,v in Integrator_kwargs.items() if k != 'adaptive'])
+                    return self._timed_integrate(stats, cy_adaptive_leapfrog_run,
+                                                 self.c_instance, w0, dt, nsteps, t1, **kwargs)
+
+                return cy_leapfrog_run(self.c_instance, w0, dt, nsteps, t1, mmap=mmap,
+                                       stats=stats)
+
+            elif Integrator_kwargs.get('adaptive', False):
+                raise ValueError("Adaptive leapfrog integration is only available for "
+                                 "potentials with a C implementation.")
+
+            elif cython_if_possible:
+                from ..integrate._leapfrog import py_leapfrog_run
+                from ..integrate.timespec import _parse_time_specification
+
+                # compiled loop with one call to the Python gradient per step
+                times = _parse_time_specification(**time_spec)
+                nsteps = len(times) - 1
+                dt = times[1] - times[0]
+                t1 = times[0]
+
+                w0 = np.array(np.atleast_2d(w0), dtype=np.float64)
+                t,w = py_leapfrog_run(self.gradient, w0, dt, nsteps, t1, mmap=mmap,
+                                      stats=stats)
+                if stats is not None:
+                    stats._set_energy_drift(self.value, w[0], w[-1])
+                return t,w
+
+            else:
+                acc = lambda t,w: self.acceleration(w)
+
+        elif Integrator == SymplecticIntegrator:
+            if hasattr(self, 'c_instance') and cython_if_possible:
+                from ..integrate._symplectic import cy_symplectic_run
+                from ..integrate.timespec import _parse_time_specification
+
+                # use fast integrator
+                times = _parse_time_specification(**time_spec)
+                nsteps = len(times) - 1
+                dt = times[1] - times[0]
+                t1 = times[0]
+
+                w0 = np.ascontiguousarray(np.atleast_2d(w0))
+                return cy_symplectic_run(self.c_instance, w0, dt, nsteps, t1,
+                                         scheme=Integrator_kwargs.get('scheme', 'ruth4'),
+                                         mmap=mmap, stats=stats)
 
             else:
                 acc = lambda t,w: self.acceleration(w)
 
+        elif Integrator == RK5Integrator and hasattr(self, 'c_instance') and cython_if_possible:
+            from ..integrate._rk import cy_rk_run
+            from ..integrate.timespec import _parse_time_specification
+
+            # use fast integrator
+            times = _parse_time_specification(**time_spec)
+            nsteps = len(times) - 1
+            dt = times[1] - times[0]
+            t1 = times[0]
+
+            w0 = np.ascontiguousarray(np.atleast_2d(w0))
+            return cy_rk_run(self.c_instance, w0, dt, nsteps, t1, order=5, mmap=mmap,
+                             stats=stats)
+
         elif Integrator == DOPRI853Integrator and hasattr(self, 'c_instance') and cython_if_possible:
             # TODO: use dop853_integrate_potential
             from ..integrate.timespec import _parse_time_specification
@@ -332,13 +492,330 @@ class PotentialBase(object):
                                               t[1]-t[0], len(t), t[0],
                                               Integrator_kwargs.get('atol', 1E-9),
                                               Integrator_kwargs.get('rtol', 1E-9),
-                                              Integrator_kwargs.get('nmax', 0))
+                                              Integrator_kwargs.get('nmax', 0),
+                                              mmap=mmap, stats=stats)
 
         else:
             acc = lambda t,w: np.hstack((w[...,3:],self.acceleration(w[...,:3])))
 
+        if mmap is not None:
+            time_spec['mmap'] = mmap
+
         integrator = Integrator(acc, **Integrator_kwargs)
-        return integrator.run(w0, **time_spec)
+        return self._timed_integrate(stats, integrator.run, w0, **time_spec)
+
+    def _timed_integrate(self, stats, run, *args, **kwargs):
+        """ Call an integration function that doesn't collect statistics itself,
+            and record its total time and the energy drift in ``stats``. The
+            result of ``run`` is returned unchanged -- the times and orbits
+            are its first two elements.
+        """
+        from ..integrate.stats import _Phase, _reset_stats
+
+        stats = _reset_stats(stats)
+        with _Phase(stats, 'integrate'):
+            res = run(*args, **kwargs)
+
+        if stats is not None:
+            w = res[1]
+            stats._set_energy_drift(self.value, w[0], w[-1])
+
+        return res
+
+    def _integrate_windows(self, w0, Integrator, Integrator_kwargs, cython_if_possible,
+                           mmap, stats, t_start, t_end, time_spec):
+        """ `integrate_orbit` with a separate integration window for each orbit. """
+        from ..integrate.timespec import _parse_time_specification
+
+        if (not hasattr(self, 'c_instance') or not cython_if_possible or
+                Integrator not in (LeapfrogIntegrator, DOPRI853Integrator) or
+                Integrator_kwargs.get('adaptive', False)):
+            raise ValueError("Per-orbit start and end times are only supported by the "
+                             "leapfrog and DOP853 integrators for potentials with a C "
+                             "implementation.")
+
+        if mmap is not None:
+            raise ValueError("Per-orbit start and end times don't support output to "
+                             "a memory-mapped array.")
+
+        times = _parse_time_specification(**time_spec)
+        if t_start is None:
+            t_start = times[0]
+        if t_end is None:
+            t_end = times[-1]
+
+        w0 = np.ascontiguousarray(np.atleast_2d(w0), dtype=np.float64)
+        if Integrator == LeapfrogIntegrator:
+            from ..integrate._leapfrog import cy_leapfrog_run_windows
+            return self._timed_integrate(stats, cy_leapfrog_run_windows, self.c_instance,
+                                         w0, times, t_start, t_end)
+
+        from ..integrate._dop853 import dop853_integrate_windows, STATUS_MESSAGES
+        t,w,status = dop853_integrate_windows(self.c_instance, w0, times, t_start, t_end,
+                                              Integrator_kwargs.get('atol', 1E-9),
+                                              Integrator_kwargs.get('rtol', 1E-9),
+                                              Integrator_kwargs.get('nmax', 0),
+                                              stats=stats)
+        if np.any(status < 0):
+            raise RuntimeError(STATUS_MESSAGES[status[status < 0][0]])
+
+        return t,w
+
+    def _integrate_meridional(self, w0, Integrator, Integrator_kwargs, cython_if_possible,
+                              mmap, stats, meridional, time_spec):
+        """ `integrate_orbit` in the meridional plane of an axisymmetric potential. """
+        from ..integrate.timespec import _parse_time_specification
+
+        if meridional not in (True, 'cartesian', 'Rz'):
+            raise ValueError("meridional must be True, 'cartesian', or 'Rz', not {0!r}."
+                             .format(meridional))
+
+        if not self.axisymmetric:
+            raise ValueError("Meridional-plane integration requires an axisymmetric "
+                             "potential.")
+
+        if (not hasattr(self, 'c_instance') or not cython_if_possible or
+                Integrator != LeapfrogIntegrator or
+                Integrator_kwargs.get('adaptive', False)):
+            raise ValueError("Meridional-plane integration is only supported by the "
+                             "leapfrog integrator for potentials with a C implementation.")
+
+        if mmap is not None:
+            raise ValueError("Meridional-plane integration doesn't support output to "
+                             "a memory-mapped array.")
+
+        from ..integrate._leapfrog import cy_leapfrog_run_meridional
+
+        times = _parse_time_specification(**time_spec)
+        nsteps = len(times) - 1
+        dt = times[1] - times[0]
+        t1 = times[0]
+
+        w0 = np.ascontiguousarray(np.atleast_2d(w0), dtype=np.float64)
+        return cy_leapfrog_run_meridional(self.c_instance, w0, dt, nsteps, t1,
+                                          cartesian=(meridional != 'Rz'), stats=stats)
+
+    def _integrate_analytic(self, w0, mmap, stats, time_spec, chunksize=1024):
+        """ `integrate_orbit` with the analytic solution of an integrable potential. """
+        from ..integrate.core import _validate_output_array, _flush_output_array
+        from ..integrate.timespec import _parse_time_specification
+
+        if not hasattr(self, 'analytic_orbit'):
+            raise ValueError("Orbits in a {0} have no analytic solution."
+                             .format(self.__class__.__name__))
+
+        if time_spec.get('dt', None) == 'auto':
+            raise ValueError("Analytic orbits don't need a time step -- specify the "
+                             "output times.")
+
+        times = _parse_time_specification(**time_spec)
+        w0 = np.atleast_2d(np.asarray(w0, dtype=np.float64))
+
+        def run():
+            if mmap is None:
+                return times, self.analytic_orbit(w0, times)
+
+            # compute the orbits in chunks of output times, so that only one
+            #   chunk is ever held in memory
+            _validate_output_array(mmap, (len(times),) + w0.shape)
+            for j in range(0, len(times), chunksize):
+                mmap[j:j+chunksize] = self.analytic_orbit(w0, times[j:j+chunksize],
+                                                          t0=times[0])
+            _flush_output_array(mmap)
+            return times, mmap
+
+        return self._timed_integrate(stats, run)
+
+    def _cached_integrate(self, cache, w0, Integrator, Integrator_kwargs,
+                          cython_if_possible, mmap, energy_tol, stats, time_spec):
+        """ `integrate_orbit` with the result looked up in, or stored in, an
+            `~gary.integrate.OrbitCache`. The time spent reading and writing
+            the cache is recorded as the ``'cache'`` phase of ``stats``.
+        """
+        from ..integrate.core import _validate_output_array, _flush_output_array
+        from ..integrate.stats import _Phase, _reset_stats
+
+        if Integrator_kwargs.get('full_output', False):
+            raise ValueError("The orbit cache only stores the times and orbits, so it "
+                             "can't be used with full_output=True.")
+
+        key = cache.key(self, w0, Integrator, Integrator_kwargs,
+                        cython_if_possible=cython_if_possible,
+                        energy_tol=energy_tol, time_spec=time_spec)
+
+        with _Phase(None, 'cache') as lookup:
+            res = cache.get(key)
+
+        if res is not None:
+            stats = _reset_stats(stats)
+            with _Phase(stats, 'cache'):
+                t,w = res
+                if mmap is not None:
+                    _validate_output_array(mmap, w.shape)
+                    mmap[...] = w
+                    _flush_output_array(mmap)
+                    w = mmap
+            if stats is not None:
+                stats._add_time('cache', lookup.seconds)
+            return t,w
+
+        t,w = self.integrate_orbit(w0, Integrator=Integrator,
+                                   Integrator_kwargs=Integrator_kwargs,
+                                   cython_if_possible=cython_if_possible, mmap=mmap,
+                                   energy_tol=energy_tol, stats=stats, **time_spec)
+
+        with _Phase(stats, 'cache'):
+            cache.put(key, t, w)
+        if stats is not None:
+            stats._add_time('cache', lookup.seconds)
+
+        return t,w
+
+    def estimate_dt(self, w0, energy_tol=1E-6, Integrator=LeapfrogIntegrator,
+                    Integrator_kwargs=dict(), cython_if_possible=True,
+                    nperiods=2., maxiter=5):
+        """
+        Estimate the largest time step for each orbit that keeps the relative
+        energy error of a fixed-step integrator below ``energy_tol``.
+
+        A first guess is 1/100 of the local dynamical time,
+        :math:`2\pi\sqrt{r/|a|}`, at the initial conditions. The orbits are
+        then integrated for ``nperiods`` dynamical times (a short pilot
+        integration, vectorized over orbits), and each step is rescaled by
+        the ratio of the target and measured energy errors, using the order
+        of the integrator, until the estimate converges. Note that for the
+        non-symplectic integrators (e.g., `~gary.integrate.RK5Integrator`),
+        the energy error grows with time, so the error of a long integration
+        will be larger than the error of the pilot integration.
+
+        Parameters
+        ----------
+        w0 : array_like
+            Initial conditions.
+        energy_tol : numeric (optional)
+            Target maximum relative energy error.
+        Integrator : class (optional)
+            Fixed-step integrator class --
+            `~gary.integrate.LeapfrogIntegrator`,
+            `~gary.integrate.SymplecticIntegrator`, or
+            `~gary.integrate.RK5Integrator`.
+        Integrator_kwargs : dict (optional)
+        cython_if_possible : bool (optional)
+        nperiods : numeric (optional)
+            Length of the pilot integration in units of the dynamical time.
+        maxiter : int (optional)
+            Maximum number of pilot integrations per orbit. In each
+            iteration, the orbits that haven't converged yet are integrated
+            in a few vectorized calls to `integrate_orbit`, one per group of
+            orbits with similar trial steps and pilot times.
+
+        Returns
+        -------
+        dt : :class:`numpy.ndarray`
+            The estimated time step for each orbit.
+
+        """
+        if Integrator == LeapfrogIntegrator:
+            order = 2
+        elif Integrator == SymplecticIntegrator:
+            from ..integrate.symplectic import _get_scheme
+            order = _get_scheme(Integrator_kwargs.get('scheme', 'ruth4'))[2]
+        elif Integrator == RK5Integrator:
+            order = 5
+        else:
+            raise ValueError("Time step estimation is only supported for the fixed-step "
+                             "integrators, not {0}".format(Integrator.__name__))
+
+        w0 = np.array(np.atleast_2d(w0), dtype=float)
+        norbits,ndim = w0.shape
+        ndim = ndim // 2
+
+        r = np.sqrt(np.sum(w0[:,:ndim]**2, axis=-1))
+        acc = np.sqrt(np.sum(np.atleast_2d(self.acceleration(w0[:,:ndim]))**2, axis=-1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_dyn = 2*np.pi*np.sqrt(r / acc)
+
+        if not np.all(np.isfinite(t_dyn) & (t_dyn > 0)):
+            raise ValueError("Can't estimate the dynamical time for orbits starting at "
+                             "the origin or where the acceleration vanishes.")
+
+        # orbits with similar trial steps and pilot times (within ~10%) are
+        #   integrated together in one call, with the smallest of their steps
+        #   and for the longest of their pilot times -- the energy error of
+        #   each orbit is measured over its own pilot time, and its step
+        #   rescaled from the common trial step. Groups (and long pilot
+        #   integrations) are split so that the output of a single call has at
+        #   most max_points phase-space points.
+        max_points = 2**18
+        T = nperiods * t_dyn
+        dts = t_dyn / 100.
+        converged = np.zeros(norbits, dtype=bool)
+        for it in range(maxiter):
+            ix = np.where(~converged)[0]
+            key1 = np.floor(8*np.log2(dts[ix])).astype(int)
+            key2 = np.floor(8*np.log2(T[ix] / dts[ix])).astype(int)
+            key = (key1 - key1.min()) * (key2.max() - key2.min() + 1) + key2 - key2.min()
+            for k in np.unique(key):
+                jx = ix[key == k]
+                dt = dts[jx].min()
+                nsteps = max(int(np.ceil(T[jx].max() / dt)), 1)
+                chunk = max(max_points // (nsteps+1), 1)
+                err = np.concatenate([self._pilot_energy_error(w0[jx[i:i+chunk]], dt, nsteps,
+                                                               T[jx[i:i+chunk]], Integrator,
+                                                               Integrator_kwargs,
+                                                               cython_if_possible, max_points)
+                                      for i in range(0, len(jx), chunk)])
+
+                # error scales as dt^order -- the 0.8 is a safety factor
+                with np.errstate(invalid='ignore'):
+                    new_dt = 0.8 * dt * (energy_tol / np.maximum(err, 1E-16))**(1./order)
+                new_dt = np.minimum(new_dt, 10*dt)
+                finite = np.isfinite(new_dt)
+                new_dt[~finite] = dt / 10.
+                converged[jx] = finite & (0.5 < (new_dt / dt)) & ((new_dt / dt) < 2.)
+                dts[jx] = new_dt
+
+            if converged.all():
+                break
+
+        return dts
+
+    def _pilot_energy_error(self, w0, dt, nsteps, T, Integrator, Integrator_kwargs,
+                            cython_if_possible, max_points):
+        """
+        Integrate the orbits ``w0`` together and return the maximum relative
+        energy error of each orbit within its own pilot time ``T`` (NaN if
+        the integration diverged). Long integrations are split into segments
+        with at most ``max_points`` phase-space points of output.
+        """
+        ndim = w0.shape[1] // 2
+        norbits = w0.shape[0]
+        seg_nsteps = max(max_points // norbits - 1, 1)
+
+        E0 = self.total_energy(np.ascontiguousarray(w0[:,:ndim]), w0[:,ndim:])
+        err = np.zeros(norbits)
+        j = 0
+        while j < nsteps:
+            n = min(seg_nsteps, nsteps - j)
+            t,w = self.integrate_orbit(w0, dt=dt, nsteps=n, t1=j*dt, Integrator=Integrator,
+                                       Integrator_kwargs=Integrator_kwargs,
+                                       cython_if_possible=cython_if_possible)
+
+            x = np.ascontiguousarray(w[1:,:,:ndim].reshape(-1,ndim))
+            v = w[1:,:,ndim:].reshape(-1,ndim)
+            E = self.total_energy(x, v).reshape(n,norbits)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dE = np.abs((E - E0) / E0)
+
+            # always keep the first step
+            step = j + 1 + np.arange(n)
+            dE[(step[:,None] > 1) & (step[:,None]*abs(dt) > T[None])] = 0.
+            err = np.maximum(err, dE.max(axis=0))
+
+            w0 = np.ascontiguousarray(w[-1])
+            j += n
+
+        return err
 
     def total_energy(self, x, v):
         """
@@ -428,6 +905,10 @@ class CompositePotential(PotentialBase, dict):
     def units(self):  # read-only
         return self._units
 
+    @property
+    def axisymmetric(self):
+        return len(self) > 0 and all(p.axisymmetric for p in self.values())
+
     @property
     def parameters(self):
         params = dict()
@@ -1,10 +1,14 @@
 ctypedef double (*valuefunc)(double *pars, double *q) nogil
 ctypedef void (*gradientfunc)(double *pars, double *q, double *grad) nogil
+ctypedef void (*hessianfunc)(double *pars, double *q, double *hess) nogil
+
+cdef void c_hessian_fd(gradientfunc gradient, double *pars, double *q, double *hess) nogil
 
 cdef class _CPotential:
     cdef double *_parameters
     cdef valuefunc c_value
     cdef gradientfunc c_gradient
+    cdef hessianfunc c_hessian # optional, finite differences of the gradient if NULL
     cdef double[::1] _parvec # need to maintain a reference to parameter array
 
     cpdef value(self, double[:,::1] q)
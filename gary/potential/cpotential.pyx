@@ -22,6 +22,47 @@ from .core import PotentialBase, CompositePotential
 cdef extern from "math.h":
     double sqrt(double x) nogil
     double fabs(double x) nogil
+    double cbrt(double x) nogil
+
+cdef void c_hessian_fd(gradientfunc gradient, double *pars, double *q, double *hess) nogil:
+    """ Hessian of the potential at the (3D) position ``q`` from central
+        finite differences of the gradient. The result is symmetrized.
+    """
+    cdef:
+        int i,j
+        double h, tmp
+        double r = sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2])
+        double qh[3]
+        double grad1[3]
+        double grad2[3]
+
+    # step size that balances truncation and round-off error
+    if r == 0.:
+        r = 1.
+    h = cbrt(2.2E-16) * r
+
+    for j in range(3):
+        qh[j] = q[j]
+
+    for j in range(3):
+        for i in range(3):
+            grad1[i] = 0.
+            grad2[i] = 0.
+
+        qh[j] = q[j] + h
+        gradient(pars, qh, grad1)
+        qh[j] = q[j] - h
+        gradient(pars, qh, grad2)
+        qh[j] = q[j]
+
+        for i in range(3):
+            hess[3*i+j] = (grad1[i] - grad2[i]) / (2.*h)
+
+    for i in range(3):
+        for j in range(i+1,3):
+            tmp = 0.5 * (hess[3*i+j] + hess[3*j+i])
+            hess[3*i+j] = tmp
+            hess[3*j+i] = tmp
 
 class CPotentialBase(PotentialBase):
     """
@@ -175,10 +216,10 @@ cdef class _CPotential:
         return np.array(hess)
 
     cdef public void _hessian(self, double *w, double *hess) nogil:
-        cdef int i,j
-        for i in range(3):
-            for j in range(3):
-                hess[3*i+j] = 0.
+        if self.c_hessian != NULL:
+            self.c_hessian(self._parameters, w, hess)
+        else:
+            c_hessian_fd(self.c_gradient, self._parameters, w, hess)
 
     # -------------------------------------------------------------
     cpdef mass_enclosed(self, double[:,::1] q, double G):
@@ -143,6 +143,35 @@ class PotentialTestBase(object):
 
         p.value(np.array([[100,0,0.]]))
 
+    def test_gradient(self):
+        r = np.random.uniform(1., 10., size=(16,3))
+        grad = self.potential.gradient(r)
+        assert grad.shape == (16,3)
+
+        # compare to finite differences of the potential
+        h = 1E-5
+        for k in range(3):
+            dr = np.zeros(3)
+            dr[k] = h
+            dval = (self.potential.value(r+dr) - self.potential.value(r-dr)) / (2*h)
+            np.testing.assert_allclose(grad[:,k], dval, rtol=1E-5,
+                                       atol=1E-5*np.abs(grad).max())
+
+    def test_hessian(self):
+        r = np.random.uniform(1., 10., size=(16,3))
+        hess = self.potential.hessian(r)
+        assert hess.shape == (16,3,3)
+        np.testing.assert_allclose(hess, hess.transpose(0,2,1))
+
+        # compare to finite differences of the gradient
+        h = 1E-5
+        for k in range(3):
+            dr = np.zeros(3)
+            dr[k] = h
+            dgrad = (self.potential.gradient(r+dr) - self.potential.gradient(r-dr)) / (2*h)
+            np.testing.assert_allclose(hess[:,:,k], dgrad, rtol=1E-5,
+                                       atol=1E-5*np.abs(hess).max())
+
     def test_mass_enclosed(self):
         r = np.linspace(1., 400, 100)
         R = np.zeros((len(r),3))
@@ -173,6 +202,15 @@ class TestIsochrone(PotentialTestBase):
         self.w0 = [1.,0.,0.,0.,2*np.pi,0.]
         super(TestIsochrone,self).setup()
 
+class TestIsochroneLargeCore(PotentialTestBase):
+    # the gradient used to only be right for b=1
+    units = solarsystem
+
+    def setup(self):
+        self.potential = IsochronePotential(units=self.units, m=1., b=2.)
+        self.w0 = [1.,0.,0.,0.,2*np.pi,0.]
+        super(TestIsochroneLargeCore,self).setup()
+
 class TestHernquist(PotentialTestBase):
     def setup(self):
         self.potential = HernquistPotential(units=self.units,
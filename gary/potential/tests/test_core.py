@@ -117,3 +117,59 @@ def test_composite():
     assert u.au in p.units
     assert u.yr in p.units
     assert u.Msun in p.units
+
+@pytest.mark.parametrize("scheme", [None, 'ruth4'])
+def test_estimate_dt(scheme):
+    from ..cbuiltin import HernquistPotential
+    from ...integrate import LeapfrogIntegrator, SymplecticIntegrator, DOPRI853Integrator
+    from ...units import galactic
+
+    if scheme is None:
+        Integrator,kwargs = LeapfrogIntegrator, dict()
+    else:
+        Integrator,kwargs = SymplecticIntegrator, dict(scheme=scheme)
+
+    p = HernquistPotential(m=1E11, c=0.5, units=galactic)
+    w0 = np.array([[20.,0.,0., 0.,0.05,0.],
+                   [5.,0.,0., 0.,0.2,0.05]])
+
+    dts = p.estimate_dt(w0, energy_tol=1E-5, Integrator=Integrator, Integrator_kwargs=kwargs)
+    assert dts.shape == (2,)
+    assert dts[0] < dts[1] # eccentric orbit needs a smaller step
+
+    for i in range(len(w0)):
+        t,w = p.integrate_orbit(w0[i], dt=dts[i], t1=0., t2=2000.,
+                                Integrator=Integrator, Integrator_kwargs=kwargs)
+        E = p.total_energy(np.ascontiguousarray(w[:,0,:3]), w[:,0,3:])
+        dE = np.abs((E - E[0]) / E[0]).max()
+        assert 1E-6 < dE < 1E-5 # close to, but below the target error
+
+    # the pilot integrations are vectorized over orbits
+    np.random.seed(42)
+    many_w0 = w0[1] * np.random.uniform(0.99, 1.01, size=(100,6))
+    ncalls = [0]
+    integrate_orbit = p.integrate_orbit
+    def counting_integrate_orbit(*args, **kwargs):
+        ncalls[0] += 1
+        return integrate_orbit(*args, **kwargs)
+    p.integrate_orbit = counting_integrate_orbit
+    many_dts = p.estimate_dt(many_w0, energy_tol=1E-5, Integrator=Integrator,
+                             Integrator_kwargs=kwargs)
+    del p.integrate_orbit
+    assert ncalls[0] < 20
+    np.testing.assert_allclose(many_dts[:3],
+                               [p.estimate_dt(w, energy_tol=1E-5, Integrator=Integrator,
+                                              Integrator_kwargs=kwargs)[0]
+                                for w in many_w0[:3]], rtol=1E-3)
+
+    # automatic time step from integrate_orbit
+    t,w = p.integrate_orbit(w0, dt='auto', t1=0., t2=100., energy_tol=1E-5,
+                            Integrator=Integrator, Integrator_kwargs=kwargs)
+    np.testing.assert_allclose(t[-1], 100.)
+    assert (t[1] - t[0]) <= dts.min()
+
+    with pytest.raises(ValueError):
+        p.integrate_orbit(w0, dt='auto', nsteps=100)
+
+    with pytest.raises(ValueError):
+        p.estimate_dt(w0, Integrator=DOPRI853Integrator)
@@ -28,7 +28,7 @@ class SerialPool(object):
     def map(self, *args, **kwargs):
         return map(*args, **kwargs)
 
-def get_pool(mpi=False, threads=None):
+def get_pool(mpi=False, threads=None, initializer=None, initargs=()):
     """ Get a pool object to pass to emcee for parallel processing.
         If mpi is False and threads is None, pool is None.
 
@@ -39,11 +39,20 @@ def get_pool(mpi=False, threads=None):
         threads : int (optional)
             If mpi is False and threads is specified, use a Python
             multiprocessing pool with the specified number of threads.
+        initializer : callable (optional)
+            Called as ``initializer(*initargs)`` once in every worker process
+            when the pool is created, e.g., to set up data that is shared by
+            all tasks. With MPI, it is called on every process (including
+            the master) before the workers start waiting for tasks.
+        initargs : tuple (optional)
     """
 
     if mpi:
         from emcee.utils import MPIPool
 
+        if initializer is not None:
+            initializer(*initargs)
+
         # Initialize the MPI pool
         pool = MPIPool()
 
@@ -56,10 +65,13 @@ def get_pool(mpi=False, threads=None):
     elif threads > 1:
         logger.debug("Running with multiprocessing on {} cores..."
                      .format(threads))
-        pool = multiprocessing.Pool(threads)
+        pool = multiprocessing.Pool(threads, initializer=initializer,
+                                    initargs=initargs)
 
     else:
         logger.debug("Running serial...")
+        if initializer is not None:
+            initializer(*initargs)
         pool = SerialPool()
 
     return pool